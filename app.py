@@ -19,8 +19,12 @@ import vm_controller
 import storage_controller
 import smart_manager
 import system_monitor
+import fleet_collector
 import corsair_commander
 import backup_controller as _bc
+import ingest
+import metrics
+import retention
 # Load environment variables from .env file if python-dotenv is available
 try:
     from dotenv import load_dotenv
@@ -210,6 +214,7 @@ addon_mgr.load_addons()
 # Runs at module import time so both Gunicorn workers and direct python3
 # invocations initialise the database before any request is handled.
 with app.app_context():
+    metrics.configure(os.path.join(DATA_DIR, "metrics"))   # before the pollers start
     user_management.init_user_db()
     if user_management.migrate_env_user_to_db():
         print(f"INFO: Migrated env-var user '{USERNAME}' to database.")
@@ -220,10 +225,12 @@ with app.app_context():
     smart_manager.start_polling()
     system_monitor.init_db(DATA_DIR)
     system_monitor.start_polling()
+    fleet_collector.start_polling(DATA_DIR)
     corsair_commander.init_db(DATA_DIR)
     corsair_commander.start_polling()
     _bc.init_db(DATA_DIR)
     _bc.start_all_polling()
+    retention.start()
 
 # Template function for HTML extensions
 @app.context_processor
@@ -339,6 +346,19 @@ def normalize_host(data):
         defaults["tags"] = [t.strip() for t in defaults["tags"].split(",") if t.strip()]
     return defaults
 
+_HOST_UPDATES = metrics.gauge("fleetpilot_host_pending_updates",
+                              "Pending package updates recorded for the host", ("host", "kind"))
+
+
+def _publish_host_metrics(hosts):
+    """Mirror the pending/security update lists of hosts.json into /metrics."""
+    series = []
+    for name, h in hosts.items():
+        series.append(({"host": name, "kind": "all"}, len(h.get("pending_updates") or [])))
+        series.append(({"host": name, "kind": "security"}, len(h.get("security_updates") or [])))
+    _HOST_UPDATES.replace(series)
+
+
 def load_hosts():
     cached = cache_get('hosts')
     if cached is not None:
@@ -350,12 +370,14 @@ def load_hosts():
     except Exception:
         data = {}
     cache_set('hosts', data, ttl=15)
+    _publish_host_metrics(data)
     return data
 
 def save_hosts(hosts):
     with open(os.path.join(DATA_DIR, "hosts.json"), "w") as f:
         json.dump(hosts, f, indent=2)
     cache_invalidate('hosts')
+    _cmk_cache.invalidate()
 
 def get_local_public_key():
     """
@@ -1146,8 +1168,21 @@ def validate_route(device):
     except ValueError as e:
         flash(f'Invalid device name: {e}')
         return redirect(url_for('disks_index'))
-    blocks, bad = disktool_core.validate_blocks(device)
-    return render_template('disks/validate.html', device=device, blocks=blocks, bad_blocks=bad)
+    mode = request.args.get('mode', 'sample')
+    if mode not in ('sample', 'full'):
+        mode = 'sample'
+    op_id = disktool_core.start_validate(device, mode)
+    return redirect(url_for('task_status', op_id=op_id))
+
+@app.route("/disks/validate/report/<int:op_id>")
+@login_required
+def validate_report(op_id):
+    result = disktool_core.get_task_result(op_id)
+    if result is None:
+        flash(f'No scan result for task {op_id}')
+        return redirect(url_for('disk_history'))
+    status, _progress = disktool_core.get_task_status(op_id)
+    return render_template('disks/validate.html', op_id=op_id, status=status, result=result)
 
 @app.route("/disks/history")
 @login_required
@@ -1199,7 +1234,10 @@ def import_smart():
 @login_required
 def task_status_api(op_id):
     status, progress = disktool_core.get_task_status(op_id)
-    return jsonify(status=status, progress=progress)
+    result = disktool_core.get_task_result(op_id)
+    if result and 'regions' in result:
+        result = {k: v for k, v in result.items() if k not in ('regions', 'bad_blocks')}
+    return jsonify(status=status, progress=progress, result=result)
 
 @app.route("/disks/task/status/<int:op_id>")
 @login_required
@@ -2335,21 +2373,12 @@ def vm_detail(ep_id):
     if not ep:
         flash("Endpoint not found.", "error")
         return redirect("/vm")
-    vms = []
-    jobs = []
-    nodes = []
-    error = None
-    try:
-        if ep["platform"] == "proxmox":
-            client = vm_controller.connect(ep_id)
-            nodes = client.get_nodes()
-            vms = client.get_vms()
-        elif ep["platform"] == "veeam":
-            jobs = vm_controller.get_all_jobs(ep_id)
-    except Exception as exc:
-        error = str(exc)
-    return render_template("vm/detail.html",
-                           ep=ep, vms=vms, jobs=jobs, nodes=nodes, error=error)
+    cache = vm_controller.inventory
+    snap = cache.refresh(ep_id, wait=10) if request.args.get("refresh") else cache.get(ep_id)
+    data = snap["data"] or {}
+    return render_template("vm/detail.html", ep=ep,
+                           vms=data.get("vms", []), jobs=data.get("jobs", []),
+                           nodes=data.get("nodes", []), error=snap["error"], snap=snap)
 
 
 @app.route("/vm/<int:ep_id>/action", methods=["POST"])
@@ -2388,10 +2417,12 @@ def veeam_start_job(ep_id, job_id):
 def vm_disks(ep_id):
     """Show physical disks on a Proxmox node."""
     node = request.args.get("node", "")
-    disks = []
-    error = None
+    cache = vm_controller.node_disks
+    key = (ep_id, node)
+    snap = cache.refresh(key, wait=10) if request.args.get("refresh") else cache.get(key)
+    disks = snap["data"] or []
+    error = snap["error"]
     try:
-        disks = vm_controller.get_proxmox_disks(ep_id, node)
         # Register disks in SMART manager
         for d in disks:
             dev = d.get("dev", d.get("devpath", "")).lstrip("/dev/")
@@ -2406,7 +2437,8 @@ def vm_disks(ep_id):
                 )
     except Exception as exc:
         error = str(exc)
-    return render_template("vm/disks.html", ep_id=ep_id, node=node, disks=disks, error=error)
+    return render_template("vm/disks.html", ep_id=ep_id, node=node, disks=disks,
+                           error=error, snap=snap)
 
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -2419,7 +2451,8 @@ def storage_index():
     """Storage Controller — overview of all NAS endpoints."""
     endpoints = storage_controller.list_endpoints()
     events = storage_controller.get_events(limit=20)
-    return render_template("storage/index.html", endpoints=endpoints, events=events)
+    return render_template("storage/index.html", endpoints=endpoints, events=events,
+                           live=storage_controller.get_live_status())
 
 
 @app.route("/storage/add", methods=["GET", "POST"])
@@ -2438,6 +2471,7 @@ def storage_add():
                 api_key=request.form["api_key"],
                 verify_ssl=bool(request.form.get("verify_ssl")),
                 notes=request.form.get("notes", ""),
+                live_updates=bool(request.form.get("live_updates")),
             )
             flash("Storage endpoint added successfully.", "success")
         except Exception as exc:
@@ -2468,10 +2502,11 @@ def storage_test(ep_id):
 @login_required
 def storage_detail(ep_id):
     """Show full overview for one storage endpoint."""
-    overview = {}
-    error = None
+    cache = storage_controller.overview_cache
+    snap = cache.refresh(ep_id, wait=10) if request.args.get("refresh") else cache.get(ep_id)
+    overview = snap["data"] or {}
+    error = snap["error"]
     try:
-        overview = storage_controller.get_storage_overview(ep_id)
         # Register disks in SMART manager
         for d in overview.get("disks", []):
             smart_manager.register_disk(
@@ -2484,8 +2519,8 @@ def storage_detail(ep_id):
             )
     except Exception as exc:
         error = str(exc)
-        overview = {"error": error}
-    return render_template("storage/detail.html", ep_id=ep_id, overview=overview, error=error)
+    return render_template("storage/detail.html", ep_id=ep_id, overview=overview,
+                           error=error, snap=snap)
 
 
 @app.route("/storage/<int:ep_id>/poll", methods=["POST"])
@@ -2496,6 +2531,7 @@ def storage_poll(ep_id):
         return json.dumps({"ok": False, "error": "Permission denied"}), 403, {"Content-Type": "application/json"}
     try:
         storage_controller.poll_and_log_disks(ep_id)
+        storage_controller.overview_cache.refresh(ep_id)
         return json.dumps({"ok": True, "message": "Poll complete"}), 200, {"Content-Type": "application/json"}
     except Exception as exc:
         return json.dumps({"ok": False, "error": str(exc)}), 500, {"Content-Type": "application/json"}
@@ -2548,9 +2584,7 @@ def smart_poll_now():
         for ep in vm_controller.list_endpoints():
             if ep.get("platform") == "proxmox" and ep.get("enabled", 1):
                 try:
-                    client = vm_controller.connect(ep["id"])
-                    for node in client.get_nodes():
-                        smart_manager.collect_proxmox_disks(ep["id"], node["node"])
+                    smart_manager.collect_proxmox_endpoint(ep["id"])
                 except Exception as exc:
                     errors.append(f"Proxmox {ep['name']}: {exc}")
     except Exception as exc:
@@ -2566,6 +2600,7 @@ def smart_poll_now():
     except Exception as exc:
         errors.append(f"Storage: {exc}")
 
+    ingest.flush()      # show what was just collected, not the previous batch
     all_disks = smart_manager.get_all_disks()
     msg = f"Full SMART import complete — {len(all_disks)} disk(s) in registry."
     if errors:
@@ -2688,8 +2723,10 @@ def _get_or_create_cmk_token() -> str:
 
 
 def _check_cmk_token():
-    """Validate the X-FleetPilot-Token header or query param."""
+    """Validate the X-FleetPilot-Token header, a Bearer token or the query param."""
+    auth = request.headers.get("Authorization", "")
     token = (request.headers.get("X-FleetPilot-Token")
+             or (auth[7:].strip() if auth.startswith("Bearer ") else "")
              or request.args.get("token", ""))
     expected = _get_or_create_cmk_token()
     return token == expected
@@ -2714,19 +2751,32 @@ def api_checkmk_token_info():
     })
 
 
+def _cmk_response(payload):
+    """Serve a precomputed CheckMK payload, answering 304 when unchanged."""
+    from flask import Response
+    resp = Response(payload["body"], 200, content_type=payload["content_type"])
+    resp.set_etag(payload["etag"])
+    resp.last_modified = payload["last_modified"]
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp.make_conditional(request)
+
+
+_cmk_cache = _cmk.AgentCache(
+    load_hosts,
+    smart_manager=smart_manager,
+    vm_controller=vm_controller,
+    storage_controller=storage_controller,
+    watch=[os.path.join(DATA_DIR, "hosts.json"), smart_manager.DB_FILE,
+           vm_controller.DB_FILE, storage_controller.DB_FILE],
+)
+
+
 @app.route("/api/checkmk/agent")
 def api_checkmk_agent():
     """CheckMK datasource program endpoint — returns <<<local>>> section."""
     if not _check_cmk_token():
         return "Unauthorized", 401
-    hosts = load_hosts()
-    output = _cmk.build_agent_output(
-        hosts,
-        smart_manager=smart_manager,
-        vm_controller=vm_controller,
-        storage_controller=storage_controller,
-    )
-    return output, 200, {"Content-Type": "text/plain; charset=utf-8"}
+    return _cmk_response(_cmk_cache.agent())
 
 
 @app.route("/api/checkmk/host/<host_name>")
@@ -2734,13 +2784,18 @@ def api_checkmk_host(host_name):
     """CheckMK piggyback data for a specific host."""
     if not _check_cmk_token():
         return "Unauthorized", 401
-    hosts = load_hosts()
-    if host_name not in hosts:
+    payload = _cmk_cache.host(host_name)
+    if payload is None:
         return f"Host '{host_name}' not found", 404
-    output = _cmk.build_host_piggyback(
-        host_name, hosts[host_name], smart_manager=smart_manager
-    )
-    return output, 200, {"Content-Type": "text/plain; charset=utf-8"}
+    return _cmk_response(payload)
+
+
+@app.route("/api/checkmk/piggyback")
+def api_checkmk_piggyback():
+    """CheckMK piggyback data for every configured host in one response."""
+    if not _check_cmk_token():
+        return "Unauthorized", 401
+    return _cmk_response(_cmk_cache.piggyback())
 
 
 @app.route("/api/checkmk/hosts")
@@ -2770,14 +2825,20 @@ def api_checkmk_status():
                 "Find your token at /checkmk."
             )
         }), 401
-    hosts = load_hosts()
-    data = _cmk.build_status_json(
-        hosts,
-        smart_manager=smart_manager,
-        vm_controller=vm_controller,
-        storage_controller=storage_controller,
-    )
-    return jsonify(data)
+    return _cmk_response(_cmk_cache.status())
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """OpenMetrics exposition of the in-memory metric registry.
+
+    Uses the CheckMK API token; in Prometheus set ``authorization:
+    credentials: <token>`` (sent as ``Authorization: Bearer <token>``).
+    """
+    if not _check_cmk_token():
+        return "Unauthorized", 401
+    load_hosts()        # refreshes the host gauges when the 15 s cache expired
+    return metrics.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
 
 
 @app.route("/checkmk")
@@ -2792,13 +2853,7 @@ def checkmk_dashboard():
     script_piggyback = _cmk.PIGGYBACK_SCRIPT_TEMPLATE.format(
         base_url=base_url, api_token=token
     )
-    hosts = load_hosts()
-    status = _cmk.build_status_json(
-        hosts,
-        smart_manager=smart_manager,
-        vm_controller=vm_controller,
-        storage_controller=storage_controller,
-    )
+    status = _cmk_cache.status()["data"]
     return render_template(
         "checkmk/index.html",
         token=token,
@@ -2933,6 +2988,34 @@ def api_monitor_log():
     return jsonify(system_monitor.get_log(page=page, per_page=per_page))
 
 
+@app.route('/api/monitor/fleet')
+@login_required
+def api_monitor_fleet():
+    """Return the latest collected sample and poll status for every managed host."""
+    status = fleet_collector.get_status()
+    return jsonify({
+        'cycle': status['cycle'],
+        'status': status['hosts'],
+        'latest': system_monitor.get_fleet_latest(),
+    })
+
+
+@app.route('/api/monitor/fleet/<host_name>/history')
+@login_required
+def api_monitor_fleet_history(host_name):
+    """Return metric history for one managed host for the last N hours."""
+    hours = min(int(request.args.get('hours', 24)), 168)  # max 7 days
+    limit = min(int(request.args.get('limit', 1440)), 10080)
+    return jsonify(system_monitor.get_fleet_history(host_name, hours=hours, limit=limit))
+
+
+@app.route('/api/monitor/ingest')
+@login_required
+def api_monitor_ingest():
+    """Return write-behind queue depth, throughput and flush latency per database."""
+    return jsonify(ingest.stats())
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # Corsair Commander Pro Routes
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -2942,7 +3025,7 @@ def api_monitor_log():
 def commander_index():
     """Corsair Commander Pro overview page."""
     devices = corsair_commander.list_devices()
-    all_latest = corsair_commander.get_all_latest()
+    all_latest = corsair_commander.get_all_latest(devices, with_raw=False)
     return render_template('commander/index.html',
                            devices=devices,
                            all_latest=all_latest)
@@ -3033,6 +3116,8 @@ def commander_edit(dev_id):
         ssh_key = request.form.get('ssh_key', '').strip()
         if ssh_key:
             fields['ssh_key'] = ssh_key
+        interval = request.form.get('poll_interval', '').strip()
+        fields['poll_interval'] = max(2, min(int(interval), 3600)) if interval.isdigit() else None
 
         corsair_commander.update_device(dev_id, **fields)
         flash('Device updated.', 'success')
@@ -3062,6 +3147,7 @@ def commander_refresh(dev_id):
     if status.get('ok'):
         from corsair_commander import _save_sample
         _save_sample(dev_id, status)
+        ingest.flush()
     return redirect(url_for('commander_detail', dev_id=dev_id))
 
 
@@ -3156,13 +3242,23 @@ with app.app_context():
         import logging as _logging
         _logging.getLogger(__name__).warning("fan_controller init failed: %s", _fc_init_err)
 
+import fan_curve
+
+with app.app_context():
+    try:
+        fan_curve.init_db(DATA_DIR)
+        fan_curve.start()
+    except Exception as _curve_init_err:
+        import logging as _logging
+        _logging.getLogger(__name__).warning("fan_curve init failed: %s", _curve_init_err)
+
 
 @app.route('/fans')
 @login_required
 def fc_index():
     """Fan Controller overview page."""
     devices = _fc.list_devices()
-    latest_map = {d['id']: _fc.get_latest(d['id']) for d in devices}
+    latest_map = _fc.get_latest_map([d['id'] for d in devices], with_raw=False)
     return render_template('fans/index.html',
                            devices=devices,
                            latest_map=latest_map,
@@ -3203,9 +3299,18 @@ def fc_add():
         flash(f'Device "{name}" added successfully.', 'success')
         return redirect(url_for('fc_detail', dev_id=dev_id))
 
+    # Pre-fill the connection fields, e.g. from a batch-detect result link
+    prefill = {
+        'host': request.args.get('host', '').strip(),
+        'port': request.args.get('port', '22').strip() or '22',
+        'username': request.args.get('username', 'root').strip() or 'root',
+        'ssh_key': request.args.get('ssh_key', '').strip(),
+        'detect': bool(request.args.get('detect')),
+    }
     return render_template('fans/add.html',
                            controller_types=_fc.CONTROLLER_TYPES,
-                           csrf_token_value=csrf_token_value)
+                           csrf_token_value=csrf_token_value,
+                           prefill=prefill)
 
 
 @app.route('/fans/<int:dev_id>')
@@ -3249,6 +3354,9 @@ def fc_edit(dev_id):
             fields['port'] = int(fields['port'] or 22)
         if 'enabled' in fields:
             fields['enabled'] = 1 if fields['enabled'] == '1' else 0
+        if 'poll_interval' in request.form:
+            interval = request.form.get('poll_interval', '').strip()
+            fields['poll_interval'] = max(2, min(int(interval), 3600)) if interval.isdigit() else None
 
         extra = {}
         for key in ['match_str', 'ipmi_host', 'ipmi_user', 'ipmi_pass', 'vendor', 'zone']:
@@ -3265,6 +3373,7 @@ def fc_edit(dev_id):
 
     return render_template('fans/edit.html',
                            dev=dev,
+                           default_poll_interval=_fc.default_poll_interval(dev['controller_type']),
                            controller_types=_fc.CONTROLLER_TYPES,
                            csrf_token_value=csrf_token_value)
 
@@ -3290,6 +3399,7 @@ def fc_refresh(dev_id):
         return jsonify({'ok': False, 'error': 'Device not found'}), 404
     status = _fc.fetch_status(dev)
     _fc._store_sample(dev_id, status)
+    ingest.flush()
     return jsonify(status)
 
 
@@ -3393,6 +3503,72 @@ def api_fc_types():
     return jsonify(_fc.CONTROLLER_TYPES)
 
 
+# ── Fan Curves (closed-loop control) ──────────────────────────────────────────
+
+_CURVE_MODULES = {'fans': 'fan_controller', 'commander': 'corsair_commander'}
+
+
+@app.route('/api/<kind>/<int:dev_id>/curves', methods=['GET', 'POST'])
+@login_required
+@_csrf.exempt
+def api_fan_curves(kind, dev_id):
+    """List or add temperature → duty curves for a fan / Commander device."""
+    module = _CURVE_MODULES.get(kind)
+    if not module:
+        return jsonify({'ok': False, 'error': 'Unknown device type'}), 404
+    if request.method == 'GET':
+        return jsonify(fan_curve.list_curves(module, dev_id))
+
+    data = request.get_json(silent=True) or {}
+    get_device = _fc.get_device if module == 'fan_controller' else corsair_commander.get_device
+    if not get_device(dev_id):
+        return jsonify({'ok': False, 'error': 'Device not found'}), 404
+    try:
+        curve_id = fan_curve.add_curve(
+            module, dev_id,
+            channel=sanitize_input(str(data.get('channel', '0')), max_len=64),
+            points=data.get('points'),
+            sensor=sanitize_input(str(data.get('sensor', '')), max_len=128),
+            hysteresis=float(data.get('hysteresis', 2.0)),
+            rate_limit=float(data.get('rate_limit', 20.0)),
+            min_delta=float(data.get('min_delta', 2.0)),
+            interval=int(data.get('interval', 3)),
+            failsafe_pct=float(data.get('failsafe_pct', 100.0)),
+            enabled=bool(data.get('enabled', True)),
+        )
+    except (TypeError, ValueError, IndexError) as exc:
+        return jsonify({'ok': False, 'error': f'Invalid curve: {exc}'}), 400
+    return jsonify({'ok': True, 'id': curve_id})
+
+
+@app.route('/api/fan-curves/<int:curve_id>', methods=['GET', 'POST', 'DELETE'])
+@login_required
+@_csrf.exempt
+def api_fan_curve(curve_id):
+    """Read, update or delete a single fan curve."""
+    curve = fan_curve.get_curve(curve_id)
+    if not curve:
+        return jsonify({'ok': False, 'error': 'Curve not found'}), 404
+    if request.method == 'GET':
+        return jsonify(curve)
+    if request.method == 'DELETE':
+        fan_curve.delete_curve(curve_id)
+        return jsonify({'ok': True})
+    data = request.get_json(silent=True) or {}
+    try:
+        fan_curve.update_curve(curve_id, **data)
+    except (TypeError, ValueError, IndexError) as exc:
+        return jsonify({'ok': False, 'error': f'Invalid curve: {exc}'}), 400
+    return jsonify({'ok': True})
+
+
+@app.route('/api/fan-curves/status')
+@login_required
+def api_fan_curve_status():
+    """Controller state of every active curve and per-device loop timing."""
+    return jsonify(fan_curve.get_status())
+
+
 # ── Fan Controller Auto-Detect ────────────────────────────────────────────────
 
 @app.route('/fans/detect')
@@ -3423,6 +3599,56 @@ def fc_detect():
     return jsonify(result)
 
 
+_FC_DETECT_BATCH_MAX = 256
+
+
+@app.route('/fans/detect/batch', methods=['POST'])
+@login_required
+@_csrf.exempt
+def fc_detect_batch():
+    """
+    Auto-detect fan controllers on many hosts concurrently.
+    JSON body: {"hosts": ["10.0.0.5", "node2:2222", {"host": ..., "port": ...}],
+                "port": 22, "username": "root", "password": "", "ssh_key": ""}
+    Top-level credentials are the defaults for every host.
+    Returns {"ok": true, "results": [detect result, ...]} in input order.
+    """
+    data = request.get_json(silent=True) or {}
+    hosts = data.get('hosts') or []
+    if isinstance(hosts, str):
+        hosts = hosts.split()
+    defaults = {
+        'port': int(data.get('port') or 22),
+        'username': str(data.get('username') or 'root').strip(),
+        'password': str(data.get('password') or ''),
+        'ssh_key': str(data.get('ssh_key') or '').strip(),
+    }
+    targets = []
+    for entry in hosts:
+        target = dict(defaults)
+        if isinstance(entry, dict):
+            target.update({k: v for k, v in entry.items() if k in defaults or k == 'host'})
+        else:
+            host, _, port = str(entry).strip().partition(':')
+            target['host'] = host
+            if port.isdigit():
+                target['port'] = int(port)
+        target['host'] = sanitize_input(str(target.get('host') or ''), max_len=253)
+        if target['host']:
+            targets.append(target)
+    if not targets:
+        return jsonify({'ok': False, 'error': 'hosts list required'}), 400
+    if len(targets) > _FC_DETECT_BATCH_MAX:
+        return jsonify({'ok': False,
+                        'error': f'At most {_FC_DETECT_BATCH_MAX} hosts per batch'}), 400
+
+    results = _fc.detect_many(targets)
+    for target, result in zip(targets, results):
+        result['port'] = target['port']
+        result['username'] = target['username']
+    return jsonify({'ok': True, 'results': results})
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # BACKUP CONTROLLER ROUTES
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -3457,7 +3683,10 @@ def backup_add():
         api_token = request.form.get("api_token", "").strip()
         ssh_key = request.form.get("ssh_key", "").strip()
         verify_ssl = bool(request.form.get("verify_ssl"))
+        use_sudo = bool(request.form.get("use_sudo"))
         notes = request.form.get("notes", "").strip()
+        interval = request.form.get("poll_interval", "").strip()
+        poll_interval = max(30, min(int(interval), 86400)) if interval.isdigit() else None
         if not name or not host:
             flash("Name and host are required.", "danger")
             return render_template("backup/add.html",
@@ -3466,7 +3695,8 @@ def backup_add():
         try:
             new_id = _bc.add_server(name, server_type, host, port, protocol,
                                     username, password, api_token, ssh_key,
-                                    verify_ssl, notes)
+                                    verify_ssl=verify_ssl, use_sudo=use_sudo, notes=notes,
+                                    poll_interval=poll_interval)
             _bc.start_polling(new_id)
             flash(f"Backup server '{name}' added.", "success")
             return redirect(url_for("backup_detail", server_id=new_id))
@@ -3479,6 +3709,7 @@ def backup_add():
         csrf_val = ""
     return render_template("backup/add.html",
                            server_types=_bc.SERVER_TYPES,
+                           default_poll_interval=_bc.POLL_INTERVAL,
                            csrf_token_value=csrf_val)
 
 
@@ -3521,6 +3752,9 @@ def backup_edit(server_id):
             "notes": request.form.get("notes", "").strip(),
             "verify_ssl": int(bool(request.form.get("verify_ssl"))),
         }
+        if "poll_interval" in request.form:
+            interval = request.form.get("poll_interval", "").strip()
+            updates["poll_interval"] = max(30, min(int(interval), 86400)) if interval.isdigit() else None
         pw = request.form.get("password", "").strip()
         if pw:
             updates["password"] = pw
@@ -3541,6 +3775,7 @@ def backup_edit(server_id):
     return render_template("backup/edit.html",
                            srv=srv,
                            server_types=_bc.SERVER_TYPES,
+                           default_poll_interval=_bc.POLL_INTERVAL,
                            csrf_token_value=csrf_val)
 
 
@@ -3558,9 +3793,17 @@ def backup_delete(server_id):
 @_csrf.exempt
 def backup_refresh(server_id):
     result = _bc.poll_server(server_id)
+    ingest.flush()
     return jsonify(result)
 
 
+@app.route("/api/backup/poll-status")
+@login_required
+def backup_poll_status():
+    """Scheduler state per server: interval, failures, last error, next poll."""
+    return jsonify({str(k): v for k, v in _bc.get_poll_status().items()})
+
+
 @app.route("/backup/<int:server_id>/test")
 @login_required
 @_csrf.exempt
@@ -0,0 +1,142 @@
+"""
+auth_cache.py — FleetPilot shared credential and HTTP session cache
+
+Pollers used to log in to PBS, Duplicati, UrBackup, Proxmox VE and Veeam on
+every poll or page view, paying an auth round trip plus a TLS handshake
+each time.  This module keeps:
+
+  • credentials — tickets, cookies and bearer tokens — until shortly before
+    they expire.  A credential is renewed once it enters the last `margin`
+    fraction of its lifetime; if renewal fails while the old credential is
+    still valid, the old one keeps being used.
+  • one keep-alive requests.Session per endpoint so repeat calls reuse the
+    pooled TCP/TLS connection.
+
+Keys come from make_key(); they include a digest of the secret, so editing an
+endpoint's password or token naturally misses the cache.
+
+Usage:
+    key = auth_cache.make_key("pbs", host, port, user, password)
+    ticket = auth_cache.get(key, lambda: _login(...), ttl=7200)
+    ...
+    auth_cache.invalidate(key)    # after a 401, then retry once
+"""
+import hashlib
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MARGIN = 0.25      # renew during the last quarter of the lifetime
+_POOL_SIZE = 4             # keep-alive connections per endpoint session
+
+# key -> {"value", "expires", "renew_at"}
+_entries: Dict[Hashable, Dict] = {}
+_key_locks: Dict[Hashable, threading.Lock] = {}
+# key -> requests.Session
+_sessions: Dict[Hashable, Any] = {}
+_lock = threading.Lock()
+_stats = {"hits": 0, "logins": 0, "renew_failures": 0}
+
+
+def make_key(kind: str, host: str, port, username: str = "", secret: str = "") -> tuple:
+    digest = hashlib.sha256((secret or "").encode()).hexdigest()[:16]
+    return (kind, str(host).lower(), int(port or 0), username or "", digest)
+
+
+def _key_lock(key) -> threading.Lock:
+    with _lock:
+        lk = _key_locks.get(key)
+        if lk is None:
+            lk = _key_locks[key] = threading.Lock()
+        return lk
+
+
+def get(key: Hashable, login: Callable[[], Any], ttl: float,
+        margin: float = DEFAULT_MARGIN) -> Any:
+    """
+    Return the cached credential for key, calling login() when it is missing
+    or due for renewal.  login() returns the credential, (credential,
+    lifetime_seconds) to override ttl, or None on failure (not cached).
+    Concurrent callers for the same key wait for a single login.
+    """
+    now = time.monotonic()
+    entry = _entries.get(key)
+    if entry and now < entry["renew_at"]:
+        _stats["hits"] += 1
+        return entry["value"]
+
+    with _key_lock(key):
+        now = time.monotonic()
+        entry = _entries.get(key)
+        if entry and now < entry["renew_at"]:
+            _stats["hits"] += 1
+            return entry["value"]
+        try:
+            result = login()
+        except Exception as exc:
+            result = None
+            logger.debug("auth_cache: login for %s failed: %s", key[:3], exc)
+            if not (entry and now < entry["expires"]):
+                raise
+        _stats["logins"] += 1
+        if result is None:
+            if entry and now < entry["expires"]:
+                _stats["renew_failures"] += 1
+                return entry["value"]          # renewal failed; old one still valid
+            return None
+        value, lifetime = result if isinstance(result, tuple) else (result, ttl)
+        lifetime = max(1.0, float(lifetime or ttl))
+        _entries[key] = {
+            "value": value,
+            "expires": now + lifetime,
+            "renew_at": now + lifetime * (1 - margin),
+        }
+        return value
+
+
+def invalidate(key: Hashable):
+    """Forget a credential, e.g. after the server answered 401."""
+    _entries.pop(key, None)
+
+
+def session(key: Hashable, verify: bool = False):
+    """Keep-alive requests.Session shared by every call to the same endpoint."""
+    with _lock:
+        sess = _sessions.get(key)
+        if sess is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            sess = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=_POOL_SIZE)
+            sess.mount("http://", adapter)
+            sess.mount("https://", adapter)
+            _sessions[key] = sess
+        sess.verify = verify
+        return sess
+
+
+def drop(key: Hashable):
+    """Forget the credential and close the pooled session for key."""
+    invalidate(key)
+    with _lock:
+        sess = _sessions.pop(key, None)
+    if sess is not None:
+        try:
+            sess.close()
+        except Exception:
+            pass
+
+
+def clear():
+    for key in list(_sessions):
+        drop(key)
+    _entries.clear()
+
+
+def stats() -> Dict:
+    now = time.monotonic()
+    return dict(_stats, credentials=sum(1 for e in list(_entries.values()) if e["expires"] > now),
+                sessions=len(_sessions))
@@ -33,6 +33,13 @@ from typing import Any, Dict, List, Optional, Tuple
 import requests
 import urllib3
 
+import auth_cache
+import db_pool
+import fanout
+import ingest
+import metrics
+from poll_scheduler import PollScheduler
+
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 logger = logging.getLogger(__name__)
@@ -165,14 +172,14 @@ def _ssh_run(host: str, port: int, username: str, password: str,
 # ── Database ──────────────────────────────────────────────────────────────────
 
 _DB_PATH: Optional[Path] = None
-_db_lock = threading.Lock()
+_db_lock = threading.Lock()    # schema setup only; everything else relies on SQLite locking
 
 
 def init_db(data_dir: str) -> None:
     global _DB_PATH
     _DB_PATH = Path(data_dir) / "backup_controller.db"
     with _db_lock:
-        conn = sqlite3.connect(str(_DB_PATH))
+        conn = _db()
         c = conn.cursor()
         c.executescript("""
             CREATE TABLE IF NOT EXISTS backup_servers (
@@ -247,43 +254,74 @@ def init_db(data_dir: str) -> None:
             conn.commit()
         except Exception:
             pass
+        # Migration: per-server poll interval (NULL = POLL_INTERVAL)
+        try:
+            conn.execute("ALTER TABLE backup_servers ADD COLUMN poll_interval INTEGER")
+            conn.execute("INSERT OR IGNORE INTO _bc_migrations VALUES ('add_poll_interval')")
+            conn.commit()
+        except Exception:
+            pass
+        # Migration: natural keys for diff-based job/snapshot upserts
+        if not conn.execute("SELECT 1 FROM _bc_migrations WHERE name='unique_job_keys'").fetchone():
+            conn.executescript("""
+                UPDATE backup_jobs SET job_id='' WHERE job_id IS NULL;
+                UPDATE backup_snapshots SET repo=COALESCE(repo, ''),
+                    snapshot_id=COALESCE(snapshot_id, ''), timestamp=COALESCE(timestamp, '');
+                DELETE FROM backup_jobs WHERE id NOT IN
+                    (SELECT MAX(id) FROM backup_jobs GROUP BY server_id, job_id);
+                DELETE FROM backup_snapshots WHERE id NOT IN
+                    (SELECT MAX(id) FROM backup_snapshots
+                     GROUP BY server_id, repo, snapshot_id, timestamp);
+                INSERT OR IGNORE INTO _bc_migrations VALUES ('unique_job_keys');
+            """)
+        conn.executescript("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_backup_jobs_key
+                ON backup_jobs(server_id, job_id);
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_backup_snapshots_key
+                ON backup_snapshots(server_id, repo, snapshot_id, timestamp);
+            CREATE INDEX IF NOT EXISTS idx_backup_history_server_ts
+                ON backup_history(server_id, ts);
+        """)
+        conn.commit()
         conn.close()
+    ingest.register("backup_poll", _DB_PATH, _write_polls)
+    ingest.register("backup_status", _DB_PATH, _write_statuses)
 
 
 def _db() -> sqlite3.Connection:
-    conn = sqlite3.connect(str(_DB_PATH))
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db_pool.connect(_DB_PATH)
 
 # ── CRUD ──────────────────────────────────────────────────────────────────────
 
 def add_server(name: str, server_type: str, host: str, port: int,
                protocol: str, username: str = "", password: str = "",
                api_token: str = "", ssh_key: str = "",
-               verify_ssl: bool = False, use_sudo: bool = False, notes: str = "") -> int:
-    with _db_lock:
-        conn = _db()
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO backup_servers
-              (name, server_type, host, port, protocol, username, password,
-               api_token, ssh_key, verify_ssl, use_sudo, notes)
-            VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
-        """, (name, server_type, host, port, protocol,
-              username,
-              _encrypt(password) if password else "",
-              _encrypt(api_token) if api_token else "",
-              _encrypt(ssh_key) if ssh_key else "",
-              int(verify_ssl), int(use_sudo), notes))
-        conn.commit()
-        new_id = c.lastrowid
-        conn.close()
+               verify_ssl: bool = False, use_sudo: bool = False, notes: str = "",
+               poll_interval: Optional[int] = None) -> int:
+    conn = _db()
+    c = conn.cursor()
+    c.execute("""
+        INSERT INTO backup_servers
+          (name, server_type, host, port, protocol, username, password,
+           api_token, ssh_key, verify_ssl, use_sudo, notes, poll_interval)
+        VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
+    """, (name, server_type, host, port, protocol,
+          username,
+          _encrypt(password) if password else "",
+          _encrypt(api_token) if api_token else "",
+          _encrypt(ssh_key) if ssh_key else "",
+          int(verify_ssl), int(use_sudo), notes, poll_interval))
+    conn.commit()
+    new_id = c.lastrowid
+    conn.close()
+    reload_polling()
     return new_id
 
 
 def update_server(server_id: int, **kwargs) -> None:
     allowed = {"name", "server_type", "host", "port", "protocol", "username",
-               "password", "api_token", "ssh_key", "verify_ssl", "use_sudo", "notes", "enabled"}
+               "password", "api_token", "ssh_key", "verify_ssl", "use_sudo", "notes", "enabled",
+               "poll_interval"}
     updates = {k: v for k, v in kwargs.items() if k in allowed}
     if "password" in updates and updates["password"]:
         updates["password"] = _encrypt(updates["password"])
@@ -293,21 +331,35 @@ def update_server(server_id: int, **kwargs) -> None:
         updates["ssh_key"] = _encrypt(updates["ssh_key"])
     if not updates:
         return
+    _drop_auth(server_id)
     set_clause = ", ".join(f"{k}=?" for k in updates)
     values = list(updates.values()) + [server_id]
-    with _db_lock:
-        conn = _db()
-        conn.execute(f"UPDATE backup_servers SET {set_clause} WHERE id=?", values)
-        conn.commit()
-        conn.close()
+    conn = _db()
+    conn.execute(f"UPDATE backup_servers SET {set_clause} WHERE id=?", values)
+    conn.commit()
+    conn.close()
+    reload_polling()
 
 
 def delete_server(server_id: int) -> None:
-    with _db_lock:
-        conn = _db()
-        conn.execute("DELETE FROM backup_servers WHERE id=?", (server_id,))
-        conn.commit()
-        conn.close()
+    if _scheduler:
+        _scheduler.remove(server_id)
+    ingest.flush()                  # queued results must not outlive the server
+    BACKUP_UP.remove(server_id=server_id)
+    BACKUP_JOBS.remove(server_id=server_id)
+    _drop_auth(server_id)
+    conn = _db()
+    conn.execute("DELETE FROM backup_servers WHERE id=?", (server_id,))
+    conn.commit()
+    conn.close()
+    reload_polling()
+
+
+def _drop_auth(server_id: int) -> None:
+    """Close the cached session/credential of a server that is changing."""
+    srv = get_server(server_id)
+    if srv:
+        auth_cache.drop(_auth_key(srv))
 
 
 def get_server(server_id: int) -> Optional[Dict]:
@@ -358,56 +410,105 @@ def get_snapshots(server_id: int, limit: int = 50) -> List[Dict]:
 
 
 def get_history(server_id: int, hours: int = 24) -> List[Dict]:
+    # History only records state changes, so include the last row before the
+    # window as the state the window starts in
     conn = _db()
     rows = conn.execute(
-        """SELECT * FROM backup_history WHERE server_id=?
+        """SELECT * FROM (
+               SELECT * FROM backup_history WHERE server_id=?
+               AND ts < datetime('now', ?) ORDER BY ts DESC, id DESC LIMIT 1)
+           UNION ALL
+           SELECT * FROM backup_history WHERE server_id=?
            AND ts >= datetime('now', ?)
-           ORDER BY ts ASC""",
-        (server_id, f"-{hours} hours")
+           ORDER BY ts ASC, id ASC""",
+        (server_id, f"-{hours} hours", server_id, f"-{hours} hours")
     ).fetchall()
     conn.close()
     return [dict(r) for r in rows]
 
 # ── Polling ───────────────────────────────────────────────────────────────────
 
-_poll_threads: Dict[int, threading.Thread] = {}
-_poll_stop: Dict[int, threading.Event] = {}
-POLL_INTERVAL = 120  # seconds
+POLL_INTERVAL = 120  # seconds, default when backup_servers.poll_interval is NULL
+_POLL_WORKERS = 8    # concurrent server polls
+_POLL_TIMEOUT = 300  # a poll running longer than this is abandoned as failed
+_POLL_STAGGER = 30   # spread the first polls after startup over this many seconds
+_MAX_BACKOFF = 1800  # cap for failing servers
+_scheduler: Optional[PollScheduler] = None
+
+BACKUP_UP = metrics.gauge("fleetpilot_backup_server_up",
+                          "1 if the last poll of the backup server succeeded",
+                          ("server_id", "server", "type"))
+BACKUP_JOBS = metrics.gauge("fleetpilot_backup_jobs",
+                            "Backup jobs by last status", ("server_id", "status"))
+
+
+def poll_interval_for(srv: Dict) -> int:
+    """Seconds between polls: per-server override or POLL_INTERVAL."""
+    if srv.get("poll_interval"):
+        return int(srv["poll_interval"])
+    return POLL_INTERVAL
+
+
+def _load_poll_targets() -> Dict[int, tuple]:
+    """All enabled servers in one query; poll_server() re-reads credentials."""
+    conn = _db()
+    rows = conn.execute(
+        "SELECT id, poll_interval FROM backup_servers WHERE enabled=1").fetchall()
+    conn.close()
+    ids = [row["id"] for row in rows]
+    BACKUP_UP.retain("server_id", ids)         # also servers deleted in another worker
+    BACKUP_JOBS.retain("server_id", ids)
+    return {row["id"]: (row["id"], poll_interval_for(dict(row))) for row in rows}
+
+
+def _poll_target(server_id: int) -> bool:
+    return bool(poll_server(server_id).get("ok"))
+
+
+def reload_polling() -> None:
+    """
+    Pick up added/changed/removed servers within a second, also from a
+    Gunicorn worker whose scheduler is a copy (see PollScheduler share_dir).
+    """
+    if _scheduler:
+        _scheduler.reload()
 
 
 def start_polling(server_id: int) -> None:
-    if server_id in _poll_threads and _poll_threads[server_id].is_alive():
+    """Make sure server_id is scheduled and poll it as soon as a worker is free."""
+    if not _scheduler:
         return
-    stop_ev = threading.Event()
-    _poll_stop[server_id] = stop_ev
-    t = threading.Thread(target=_poll_loop, args=(server_id, stop_ev), daemon=True)
-    _poll_threads[server_id] = t
-    t.start()
+    srv = get_server(server_id)
+    if srv and srv.get("enabled"):
+        _scheduler.upsert(server_id, server_id, poll_interval_for(srv))
+        _scheduler.trigger(server_id)
 
 
 def stop_polling(server_id: int) -> None:
-    if server_id in _poll_stop:
-        _poll_stop[server_id].set()
+    """Unschedule server_id; it returns on the next reload if still enabled."""
+    if _scheduler:
+        _scheduler.remove(server_id)
 
 
 def start_all_polling() -> None:
-    if _DB_PATH is None:
+    global _scheduler
+    if _DB_PATH is None or (_scheduler and _scheduler.running):
         return
-    conn = _db()
-    rows = conn.execute("SELECT id FROM backup_servers WHERE enabled=1").fetchall()
-    conn.close()
-    for row in rows:
-        start_polling(row["id"])
+    _scheduler = PollScheduler("backup_poll", _poll_target, loader=_load_poll_targets,
+                               max_workers=_POLL_WORKERS, timeout=_POLL_TIMEOUT,
+                               max_backoff=_MAX_BACKOFF, stagger=_POLL_STAGGER,
+                               share_dir=_DB_PATH.parent)
+    _scheduler.start()
+    logger.info("[backup] polling started (%d workers, per-server intervals)", _POLL_WORKERS)
 
 
-def _poll_loop(server_id: int, stop_ev: threading.Event) -> None:
-    time.sleep(5)
-    while not stop_ev.is_set():
-        try:
-            poll_server(server_id)
-        except Exception as e:
-            logger.warning(f"[backup] poll error server {server_id}: {e}")
-        stop_ev.wait(POLL_INTERVAL)
+def stop_all_polling() -> None:
+    if _scheduler:
+        _scheduler.stop()
+
+
+def get_poll_status() -> Dict[int, Dict]:
+    return _scheduler.status() if _scheduler else {}
 
 
 def poll_server(server_id: int) -> Dict:
@@ -439,22 +540,118 @@ def poll_server(server_id: int) -> Dict:
 
     # Update last_poll and last_status
     status_str = "ok" if result.get("ok") else "error"
-    with _db_lock:
-        conn = _db()
-        conn.execute(
-            "UPDATE backup_servers SET last_poll=datetime('now'), last_status=? WHERE id=?",
-            (status_str, server_id)
-        )
-        conn.commit()
-        conn.close()
+    ingest.put("backup_status", (server_id, status_str))
+    BACKUP_UP.replace([({"server": srv.get("name", ""), "type": stype},
+                        1 if result.get("ok") else 0)], server_id=server_id)
 
     return result
 
+# ── Poll result storage ───────────────────────────────────────────────────────
+
+_JOB_KEY = ("job_id",)
+_JOB_COLS = ("job_name", "job_type", "status", "last_run", "next_run", "duration_s",
+             "size_bytes", "files_count", "error_msg", "raw_json")
+_SNAPSHOT_KEY = ("repo", "snapshot_id", "timestamp")
+_SNAPSHOT_COLS = ("hostname", "size_bytes", "tags", "raw_json")
+
+
+def _sync_rows(conn: sqlite3.Connection, table: str, server_id: int,
+               key_cols: Tuple[str, ...], cols: Tuple[str, ...], rows: List[Dict]) -> int:
+    """
+    Make the server's rows in table equal to rows, keyed by key_cols.
+    Unchanged rows are left alone (keeping their id and updated_at), changed
+    or new ones are upserted and vanished ones deleted.  Returns rows touched.
+    """
+    names = key_cols + cols
+    existing = {
+        tuple(r[:len(key_cols)]): tuple(r[len(key_cols):])
+        for r in conn.execute(f"SELECT {', '.join(names)} FROM {table} WHERE server_id=?",
+                              (server_id,))
+    }
+    wanted: Dict[tuple, tuple] = {}
+    for row in rows:
+        key = tuple("" if row.get(k) is None else str(row[k]) for k in key_cols)
+        wanted[key] = tuple(row.get(c) for c in cols)
+
+    upserts = [(server_id,) + k + v for k, v in wanted.items() if existing.get(k) != v]
+    stale = [(server_id,) + k for k in existing if k not in wanted]
+    if upserts:
+        conn.executemany(
+            f"INSERT INTO {table} (server_id, {', '.join(names)}) "
+            f"VALUES ({', '.join('?' * (len(names) + 1))}) "
+            f"ON CONFLICT(server_id, {', '.join(key_cols)}) DO UPDATE SET "
+            + ", ".join(f"{c}=excluded.{c}" for c in cols)
+            + ", updated_at=datetime('now')",
+            upserts)
+    if stale:
+        conn.executemany(
+            f"DELETE FROM {table} WHERE server_id=? AND "
+            + " AND ".join(f"{k}=?" for k in key_cols),
+            stale)
+    return len(upserts) + len(stale)
+
+
+def _store_poll(server_id: int, jobs_ok: int, jobs_warn: int, jobs_error: int,
+                jobs: Optional[List[Dict]] = None,
+                snapshots: Optional[List[Dict]] = None) -> None:
+    """
+    Queue one poll's result for the ingest writer.  jobs/snapshots of None
+    leave that table untouched (the server type does not report it).
+    """
+    counts = (jobs_ok, jobs_warn, jobs_error, jobs_ok + jobs_warn + jobs_error)
+    ingest.put("backup_poll", (server_id, counts, jobs, snapshots))
+    BACKUP_JOBS.replace([({"status": "ok"}, jobs_ok), ({"status": "warning"}, jobs_warn),
+                         ({"status": "error"}, jobs_error)], server_id=server_id)
+
+
+def _write_polls(conn: sqlite3.Connection, items: List[tuple]) -> None:
+    """ingest writer: apply poll results; history rows only when counts changed."""
+    for server_id, counts, jobs, snapshots in items:
+        if jobs is not None:
+            _sync_rows(conn, "backup_jobs", server_id, _JOB_KEY, _JOB_COLS, jobs)
+        if snapshots is not None:
+            _sync_rows(conn, "backup_snapshots", server_id,
+                       _SNAPSHOT_KEY, _SNAPSHOT_COLS, snapshots)
+        last = conn.execute(
+            """SELECT jobs_ok, jobs_warn, jobs_error, jobs_total FROM backup_history
+               WHERE server_id=? ORDER BY ts DESC, id DESC LIMIT 1""",
+            (server_id,)).fetchone()
+        if last is None or tuple(last) != counts:
+            conn.execute("""
+                INSERT INTO backup_history
+                  (server_id, jobs_ok, jobs_warn, jobs_error, jobs_total)
+                VALUES (?,?,?,?,?)
+            """, (server_id,) + counts)
+
+
+def _write_statuses(conn: sqlite3.Connection, items: List[tuple]) -> None:
+    conn.executemany(
+        "UPDATE backup_servers SET last_poll=datetime('now'), last_status=? WHERE id=?",
+        [(status_str, server_id) for server_id, status_str in items])
+
 # ── PBS ───────────────────────────────────────────────────────────────────────
 
-def _pbs_session(srv: Dict) -> requests.Session:
-    sess = requests.Session()
-    sess.verify = bool(srv.get("verify_ssl"))
+# Credential lifetimes for auth_cache (renewed during the last quarter)
+_PBS_TICKET_TTL = 7200         # PBS tickets are valid for 2 h
+_DUPLICATI_TOKEN_TTL = 600
+_URBACKUP_SESSION_TTL = 900
+
+
+def _auth_key(srv: Dict) -> tuple:
+    return auth_cache.make_key(srv["server_type"], srv["host"], srv["port"],
+                               srv.get("username", ""),
+                               srv.get("api_token") or srv.get("password") or "")
+
+
+def _pbs_session(srv: Dict, fresh: bool = False) -> requests.Session:
+    """
+    Keep-alive session for a PBS server.  Password logins reuse the cached
+    ticket; fresh=True forces a new login (e.g. after a 401).
+    """
+    key = _auth_key(srv)
+    if fresh:
+        auth_cache.invalidate(key)
+    sess = auth_cache.session(key, verify=bool(srv.get("verify_ssl")))
     token = srv.get("api_token", "")
     if token:
         # Format: USER@REALM!TOKENID=SECRET
@@ -466,134 +663,129 @@ def _pbs_session(srv: Dict) -> requests.Session:
     elif srv.get("username") and srv.get("password"):
         # Password auth — get ticket
         base = f"{srv['protocol']}://{srv['host']}:{srv['port']}"
-        try:
+
+        def _login():
             r = sess.post(f"{base}/api2/json/access/ticket",
                           data={"username": srv["username"], "password": srv["password"]},
                           timeout=10)
-            if r.ok:
-                data = r.json().get("data", {})
-                sess.headers["CSRFPreventionToken"] = data.get("CSRFPreventionToken", "")
-                sess.cookies.set("PBSAuthCookie", data.get("ticket", ""))
+            if not r.ok:
+                return None
+            return r.json().get("data") or None
+
+        try:
+            data = auth_cache.get(key, _login, ttl=_PBS_TICKET_TTL)
         except Exception:
-            pass
+            data = None
+        if data:
+            sess.headers["CSRFPreventionToken"] = data.get("CSRFPreventionToken", "")
+            sess.cookies.set("PBSAuthCookie", data.get("ticket", ""))
     return sess
 
 
-def _poll_pbs(srv: Dict) -> Dict:
-    base = f"{srv['protocol']}://{srv['host']}:{srv['port']}/api2/json"
-    sess = _pbs_session(srv)
-    jobs_ok = jobs_warn = jobs_error = 0
+_PBS_DEADLINE = 30             # whole fan-out of one PBS poll
 
-    # Get datastores
-    try:
-        r = sess.get(f"{base}/nodes/localhost/storage", timeout=15)
-        datastores = r.json().get("data", []) if r.ok else []
-    except Exception:
-        datastores = []
 
-    # Get tasks (recent backup tasks)
-    try:
-        r = sess.get(f"{base}/nodes/localhost/tasks",
-                     params={"limit": 50, "typefilter": "backup"},
-                     timeout=15)
-        tasks = r.json().get("data", []) if r.ok else []
-    except Exception:
-        tasks = []
+def _pbs_get(sess: requests.Session, url: str, params: Dict = None):
+    """Call for fanout.gather: PBS data list, [] on error, None on 401."""
+    def call():
+        r = sess.get(url, params=params, timeout=15)
+        if r.status_code == 401:
+            return None
+        return r.json().get("data", []) if r.ok else []
+    return call
+
+
+def _pbs_gather(srv: Dict, calls: Dict[str, Tuple[str, Optional[Dict]]]) -> Dict[str, List]:
+    """
+    Fetch several PBS endpoints concurrently.  If a cached ticket is rejected
+    the whole batch is repeated once with a fresh login.
+    """
+    defaults = {name: [] for name in calls}
+    for fresh in (False, True):
+        sess = _pbs_session(srv, fresh=fresh)
+        results, _ = fanout.gather(
+            {name: _pbs_get(sess, url, params) for name, (url, params) in calls.items()},
+            deadline=_PBS_DEADLINE, defaults=defaults)
+        if srv.get("api_token") or all(v is not None for v in results.values()):
+            break
+    return {name: v or [] for name, v in results.items()}
 
-    # Get backup jobs config
-    try:
-        r = sess.get(f"{base}/config/sync", timeout=15)
-        sync_jobs = r.json().get("data", []) if r.ok else []
-    except Exception:
-        sync_jobs = []
 
-    # Get backup schedules
-    try:
-        r = sess.get(f"{base}/config/backup", timeout=15)
-        backup_jobs_cfg = r.json().get("data", []) if r.ok else []
-    except Exception:
-        backup_jobs_cfg = []
+def _poll_pbs(srv: Dict) -> Dict:
+    base = f"{srv['protocol']}://{srv['host']}:{srv['port']}/api2/json"
+    jobs_ok = jobs_warn = jobs_error = 0
 
-    # Store jobs from tasks
-    with _db_lock:
-        conn = _db()
-        conn.execute("DELETE FROM backup_jobs WHERE server_id=?", (srv["id"],))
-        for task in tasks[:30]:
-            status = task.get("status", "")
-            if status == "OK":
-                jobs_ok += 1
-                st = "ok"
-            elif "error" in status.lower() or "failed" in status.lower():
-                jobs_error += 1
-                st = "error"
-            else:
-                jobs_warn += 1
-                st = "warning"
-            conn.execute("""
-                INSERT INTO backup_jobs
-                  (server_id, job_id, job_name, job_type, status, last_run,
-                   duration_s, error_msg, raw_json)
-                VALUES (?,?,?,?,?,?,?,?,?)
-            """, (
-                srv["id"],
-                task.get("upid", ""),
-                task.get("id", task.get("upid", "")[:20]),
-                task.get("type", "backup"),
-                st,
-                _epoch_to_iso(task.get("starttime")),
-                task.get("duration"),
-                task.get("status") if st != "ok" else None,
-                json.dumps(task),
-            ))
-
-        # Store snapshots from datastores
-        conn.execute("DELETE FROM backup_snapshots WHERE server_id=?", (srv["id"],))
-        for ds in datastores:
-            ds_id = ds.get("storage", "")
-            try:
-                r2 = sess.get(f"{base}/nodes/localhost/storage/{ds_id}/snapshots",
-                              timeout=15)
-                snaps = r2.json().get("data", []) if r2.ok else []
-                for snap in snaps[:20]:
-                    conn.execute("""
-                        INSERT INTO backup_snapshots
-                          (server_id, repo, snapshot_id, hostname, timestamp,
-                           size_bytes, tags, raw_json)
-                        VALUES (?,?,?,?,?,?,?,?)
-                    """, (
-                        srv["id"], ds_id,
-                        snap.get("backup-id", ""),
-                        snap.get("backup-id", ""),
-                        _epoch_to_iso(snap.get("backup-time")),
-                        snap.get("size"),
-                        snap.get("backup-type", ""),
-                        json.dumps(snap),
-                    ))
-            except Exception:
-                pass
-
-        # History
-        conn.execute("""
-            INSERT INTO backup_history
-              (server_id, jobs_ok, jobs_warn, jobs_error, jobs_total)
-            VALUES (?,?,?,?,?)
-        """, (srv["id"], jobs_ok, jobs_warn, jobs_error, jobs_ok + jobs_warn + jobs_error))
-        conn.commit()
-        conn.close()
+    # Datastores, recent backup tasks and job config in one round
+    data = _pbs_gather(srv, {
+        "datastores": (f"{base}/nodes/localhost/storage", None),
+        "tasks": (f"{base}/nodes/localhost/tasks", {"limit": 50, "typefilter": "backup"}),
+        "sync_jobs": (f"{base}/config/sync", None),
+        "backup_jobs_cfg": (f"{base}/config/backup", None),
+    })
+    datastores, tasks = data["datastores"], data["tasks"]
+
+    # Snapshots of every datastore, also concurrently
+    snapshots = _pbs_gather(srv, {
+        ds.get("storage", ""): (f"{base}/nodes/localhost/storage/{ds.get('storage', '')}/snapshots", None)
+        for ds in datastores
+    }) if datastores else {}
+
+    jobs = []
+    for task in tasks[:30]:
+        status = task.get("status", "")
+        if status == "OK":
+            jobs_ok += 1
+            st = "ok"
+        elif "error" in status.lower() or "failed" in status.lower():
+            jobs_error += 1
+            st = "error"
+        else:
+            jobs_warn += 1
+            st = "warning"
+        jobs.append({
+            "job_id": task.get("upid", ""),
+            "job_name": task.get("id", task.get("upid", "")[:20]),
+            "job_type": task.get("type", "backup"),
+            "status": st,
+            "last_run": _epoch_to_iso(task.get("starttime")),
+            "duration_s": task.get("duration"),
+            "error_msg": task.get("status") if st != "ok" else None,
+            "raw_json": json.dumps(task),
+        })
+
+    snaps_out = [{
+        "repo": ds_id,
+        "snapshot_id": snap.get("backup-id", ""),
+        "hostname": snap.get("backup-id", ""),
+        "timestamp": _epoch_to_iso(snap.get("backup-time")),
+        "size_bytes": snap.get("size"),
+        "tags": snap.get("backup-type", ""),
+        "raw_json": json.dumps(snap),
+    } for ds_id, snaps in snapshots.items() for snap in snaps[:20]]
+
+    _store_poll(srv["id"], jobs_ok, jobs_warn, jobs_error, jobs=jobs, snapshots=snaps_out)
 
     return {"ok": True, "jobs_ok": jobs_ok, "jobs_warn": jobs_warn, "jobs_error": jobs_error}
 
 # ── Duplicati ─────────────────────────────────────────────────────────────────
 
-def _duplicati_auth(srv: Dict) -> Optional[str]:
-    """Get a Duplicati auth token. Returns token string or None."""
+def _duplicati_auth(srv: Dict, fresh: bool = False) -> Optional[str]:
+    """Get a Duplicati auth token (cached). Returns token string or None."""
+    if not srv.get("password"):
+        return None
+    key = _auth_key(srv)
+    if fresh:
+        auth_cache.invalidate(key)
+    return auth_cache.get(key, lambda: _duplicati_login(srv), ttl=_DUPLICATI_TOKEN_TTL)
+
+
+def _duplicati_login(srv: Dict) -> Optional[str]:
     base = f"{srv['protocol']}://{srv['host']}:{srv['port']}"
     password = srv.get("password", "")
-    if not password:
-        return None
+    sess = auth_cache.session(_auth_key(srv))
     try:
         # Get nonce
-        r = requests.get(f"{base}/api/v1/auth/issignin", timeout=10, verify=False)
+        r = sess.get(f"{base}/api/v1/auth/issignin", timeout=10)
         if not r.ok:
             return None
         nonce_data = r.json()
@@ -607,9 +799,8 @@ def _duplicati_auth(srv: Dict) -> Optional[str]:
         nonced = nonce_bytes + base64.b64decode(pwd_hash)
         final_hash = base64.b64encode(hashlib.sha256(nonced).digest()).decode()
         # Sign in
-        r2 = requests.post(f"{base}/api/v1/auth/signin",
-                           json={"Password": final_hash},
-                           timeout=10, verify=False)
+        r2 = sess.post(f"{base}/api/v1/auth/signin",
+                       json={"Password": final_hash}, timeout=10)
         if r2.ok:
             return r2.json().get("Token")
     except Exception as e:
@@ -619,6 +810,7 @@ def _duplicati_auth(srv: Dict) -> Optional[str]:
 
 def _poll_duplicati(srv: Dict) -> Dict:
     base = f"{srv['protocol']}://{srv['host']}:{srv['port']}"
+    sess = auth_cache.session(_auth_key(srv))
     token = srv.get("api_token") or _duplicati_auth(srv)
     headers = {}
     if token:
@@ -627,57 +819,47 @@ def _poll_duplicati(srv: Dict) -> Dict:
     jobs_ok = jobs_warn = jobs_error = 0
 
     try:
-        r = requests.get(f"{base}/api/v1/backups",
-                         headers=headers, timeout=15, verify=False)
+        r = sess.get(f"{base}/api/v1/backups", headers=headers, timeout=15)
+        if r.status_code == 401 and not srv.get("api_token") and token:
+            token = _duplicati_auth(srv, fresh=True)  # cached token expired early
+            headers["Authorization"] = f"Bearer {token}"
+            r = sess.get(f"{base}/api/v1/backups", headers=headers, timeout=15)
         backups = r.json() if r.ok else []
     except Exception as e:
         return {"ok": False, "error": str(e)}
 
-    with _db_lock:
-        conn = _db()
-        conn.execute("DELETE FROM backup_jobs WHERE server_id=?", (srv["id"],))
-        for bk in backups:
-            bk_id = str(bk.get("Backup", {}).get("ID", ""))
-            bk_name = bk.get("Backup", {}).get("Name", "")
-            last_result = bk.get("Backup", {}).get("Metadata", {}).get("LastBackupDate", "")
-            last_duration = bk.get("Backup", {}).get("Metadata", {}).get("LastBackupDuration", "")
-            last_size = bk.get("Backup", {}).get("Metadata", {}).get("SourceFilesSize", 0)
-            last_files = bk.get("Backup", {}).get("Metadata", {}).get("SourceFilesCount", 0)
-
-            # Get last result
-            try:
-                r2 = requests.get(f"{base}/api/v1/backup/{bk_id}/filesets",
-                                  headers=headers, timeout=10, verify=False)
-                filesets = r2.json() if r2.ok else []
-                last_status = "ok" if filesets else "warning"
-                if last_status == "ok":
-                    jobs_ok += 1
-                else:
-                    jobs_warn += 1
-            except Exception:
-                last_status = "unknown"
+    jobs = []
+    for bk in backups:
+        bk_id = str(bk.get("Backup", {}).get("ID", ""))
+        bk_name = bk.get("Backup", {}).get("Name", "")
+        last_result = bk.get("Backup", {}).get("Metadata", {}).get("LastBackupDate", "")
+        last_duration = bk.get("Backup", {}).get("Metadata", {}).get("LastBackupDuration", "")
+        last_size = bk.get("Backup", {}).get("Metadata", {}).get("SourceFilesSize", 0)
+        last_files = bk.get("Backup", {}).get("Metadata", {}).get("SourceFilesCount", 0)
+
+        # Get last result
+        try:
+            r2 = sess.get(f"{base}/api/v1/backup/{bk_id}/filesets",
+                          headers=headers, timeout=10)
+            filesets = r2.json() if r2.ok else []
+            last_status = "ok" if filesets else "warning"
+            if last_status == "ok":
+                jobs_ok += 1
+            else:
                 jobs_warn += 1
+        except Exception:
+            last_status = "unknown"
+            jobs_warn += 1
 
-            conn.execute("""
-                INSERT INTO backup_jobs
-                  (server_id, job_id, job_name, job_type, status, last_run,
-                   duration_s, size_bytes, files_count, raw_json)
-                VALUES (?,?,?,?,?,?,?,?,?,?)
-            """, (
-                srv["id"], bk_id, bk_name, "backup",
-                last_status, last_result,
-                _duration_to_seconds(last_duration),
-                last_size, last_files,
-                json.dumps(bk),
-            ))
-
-        conn.execute("""
-            INSERT INTO backup_history
-              (server_id, jobs_ok, jobs_warn, jobs_error, jobs_total)
-            VALUES (?,?,?,?,?)
-        """, (srv["id"], jobs_ok, jobs_warn, jobs_error, jobs_ok + jobs_warn + jobs_error))
-        conn.commit()
-        conn.close()
+        jobs.append({
+            "job_id": bk_id, "job_name": bk_name, "job_type": "backup",
+            "status": last_status, "last_run": last_result,
+            "duration_s": _duration_to_seconds(last_duration),
+            "size_bytes": last_size, "files_count": last_files,
+            "raw_json": json.dumps(bk),
+        })
+
+    _store_poll(srv["id"], jobs_ok, jobs_warn, jobs_error, jobs=jobs)
 
     return {"ok": True, "jobs_ok": jobs_ok, "jobs_warn": jobs_warn, "jobs_error": jobs_error}
 
@@ -690,8 +872,8 @@ def trigger_duplicati_backup(srv: Dict, backup_id: str) -> Dict:
     if token:
         headers["Authorization"] = f"Bearer {token}"
     try:
-        r = requests.post(f"{base}/api/v1/backup/{backup_id}/run",
-                          headers=headers, timeout=15, verify=False)
+        r = auth_cache.session(_auth_key(srv)).post(
+            f"{base}/api/v1/backup/{backup_id}/run", headers=headers, timeout=15)
         return {"ok": r.ok, "status_code": r.status_code, "message": r.text[:200]}
     except Exception as e:
         return {"ok": False, "error": str(e)}
@@ -715,41 +897,28 @@ def _poll_restic(srv: Dict) -> Dict:
     except Exception as e:
         return {"ok": False, "error": str(e)}
 
-    with _db_lock:
-        conn = _db()
-        conn.execute("DELETE FROM backup_snapshots WHERE server_id=?", (srv["id"],))
-        for repo in repos:
-            repo_name = repo if isinstance(repo, str) else repo.get("name", "")
-            try:
-                r2 = requests.get(f"{base}/{repo_name}/snapshots/",
-                                  auth=auth, timeout=15, verify=False)
-                snaps = r2.json() if r2.ok else []
-                jobs_ok += 1
-                for snap in snaps[-10:]:
-                    conn.execute("""
-                        INSERT INTO backup_snapshots
-                          (server_id, repo, snapshot_id, hostname, timestamp,
-                           size_bytes, tags, raw_json)
-                        VALUES (?,?,?,?,?,?,?,?)
-                    """, (
-                        srv["id"], repo_name,
-                        snap.get("id", "")[:16],
-                        snap.get("hostname", ""),
-                        snap.get("time", ""),
-                        None,
-                        ",".join(snap.get("tags", [])) if snap.get("tags") else "",
-                        json.dumps(snap),
-                    ))
-            except Exception:
-                jobs_warn += 1
+    snapshots = []
+    for repo in repos:
+        repo_name = repo if isinstance(repo, str) else repo.get("name", "")
+        try:
+            r2 = requests.get(f"{base}/{repo_name}/snapshots/",
+                              auth=auth, timeout=15, verify=False)
+            snaps = r2.json() if r2.ok else []
+            jobs_ok += 1
+            for snap in snaps[-10:]:
+                snapshots.append({
+                    "repo": repo_name,
+                    "snapshot_id": snap.get("id", "")[:16],
+                    "hostname": snap.get("hostname", ""),
+                    "timestamp": snap.get("time", ""),
+                    "size_bytes": None,
+                    "tags": ",".join(snap.get("tags", [])) if snap.get("tags") else "",
+                    "raw_json": json.dumps(snap),
+                })
+        except Exception:
+            jobs_warn += 1
 
-        conn.execute("""
-            INSERT INTO backup_history
-              (server_id, jobs_ok, jobs_warn, jobs_error, jobs_total)
-            VALUES (?,?,?,?,?)
-        """, (srv["id"], jobs_ok, jobs_warn, 0, jobs_ok + jobs_warn))
-        conn.commit()
-        conn.close()
+    _store_poll(srv["id"], jobs_ok, jobs_warn, 0, snapshots=snapshots)
 
     return {"ok": True, "repos": len(repos), "jobs_ok": jobs_ok}
 
@@ -772,67 +941,61 @@ def _poll_borgwarehouse(srv: Dict) -> Dict:
     jobs_ok = jobs_warn = jobs_error = 0
     now_ts = int(time.time())
 
-    with _db_lock:
-        conn = _db()
-        conn.execute("DELETE FROM backup_jobs WHERE server_id=?", (srv["id"],))
-        conn.execute("DELETE FROM backup_snapshots WHERE server_id=?", (srv["id"],))
-        for repo in repos:
-            alias = repo.get("alias", repo.get("repositoryName", ""))
-            last_save = repo.get("lastSave", 0)
-            alert_threshold = repo.get("alert", 0)
-            storage_used = repo.get("storageUsed", 0)
-            storage_size = repo.get("storageSize", 0)
-
-            # Determine status
-            if alert_threshold and last_save:
-                age = now_ts - last_save
-                if age > alert_threshold:
-                    st = "warning"
-                    jobs_warn += 1
-                else:
-                    st = "ok"
-                    jobs_ok += 1
-            elif last_save:
-                st = "ok"
-                jobs_ok += 1
-            else:
+    jobs = []
+    for repo in repos:
+        alias = repo.get("alias", repo.get("repositoryName", ""))
+        last_save = repo.get("lastSave", 0)
+        alert_threshold = repo.get("alert", 0)
+        storage_used = repo.get("storageUsed", 0)
+        storage_size = repo.get("storageSize", 0)
+
+        # Determine status
+        if alert_threshold and last_save:
+            age = now_ts - last_save
+            if age > alert_threshold:
                 st = "warning"
                 jobs_warn += 1
+            else:
+                st = "ok"
+                jobs_ok += 1
+        elif last_save:
+            st = "ok"
+            jobs_ok += 1
+        else:
+            st = "warning"
+            jobs_warn += 1
 
-            conn.execute("""
-                INSERT INTO backup_jobs
-                  (server_id, job_id, job_name, job_type, status, last_run,
-                   size_bytes, raw_json)
-                VALUES (?,?,?,?,?,?,?,?)
-            """, (
-                srv["id"],
-                repo.get("repositoryName", ""),
-                alias, "borg",
-                st,
-                _epoch_to_iso(last_save) if last_save else None,
-                storage_used,
-                json.dumps(repo),
-            ))
-
-        conn.execute("""
-            INSERT INTO backup_history
-              (server_id, jobs_ok, jobs_warn, jobs_error, jobs_total)
-            VALUES (?,?,?,?,?)
-        """, (srv["id"], jobs_ok, jobs_warn, jobs_error, jobs_ok + jobs_warn + jobs_error))
-        conn.commit()
-        conn.close()
+        jobs.append({
+            "job_id": repo.get("repositoryName", ""),
+            "job_name": alias, "job_type": "borg",
+            "status": st,
+            "last_run": _epoch_to_iso(last_save) if last_save else None,
+            "size_bytes": storage_used,
+            "raw_json": json.dumps(repo),
+        })
+
+    _store_poll(srv["id"], jobs_ok, jobs_warn, jobs_error, jobs=jobs, snapshots=[])
 
     return {"ok": True, "repos": len(repos), "jobs_ok": jobs_ok, "jobs_warn": jobs_warn}
 
 # ── UrBackup ──────────────────────────────────────────────────────────────────
 
-def _urbackup_login(srv: Dict) -> Optional[str]:
+def _urbackup_login(srv: Dict, fresh: bool = False) -> Optional[str]:
+    """UrBackup session id (cached until it is close to timing out)."""
+    key = _auth_key(srv)
+    if fresh:
+        auth_cache.invalidate(key)
+    return auth_cache.get(key, lambda: _urbackup_signin(srv), ttl=_URBACKUP_SESSION_TTL)
+
+
+def _urbackup_signin(srv: Dict) -> Optional[str]:
     base = f"{srv['protocol']}://{srv['host']}:{srv['port']}"
     try:
-        r = requests.get(f"{base}/x?a=login",
-                         params={"username": srv.get("username", "admin"),
-                                 "password": srv.get("password", "")},
-                         timeout=10, verify=False)
+        r = auth_cache.session(_auth_key(srv)).get(
+            f"{base}/x?a=login",
+            params={"username": srv.get("username", "admin"),
+                    "password": srv.get("password", "")},
+            timeout=10)
         if r.ok:
             data = r.json()
             if data.get("success"):
@@ -844,6 +1007,7 @@ def _urbackup_login(srv: Dict) -> Optional[str]:
 
 def _poll_urbackup(srv: Dict) -> Dict:
     base = f"{srv['protocol']}://{srv['host']}:{srv['port']}"
+    sess = auth_cache.session(_auth_key(srv))
     session = _urbackup_login(srv)
     params = {}
     if session:
@@ -852,7 +1016,12 @@ def _poll_urbackup(srv: Dict) -> Dict:
     jobs_ok = jobs_warn = jobs_error = 0
 
     try:
-        r = requests.get(f"{base}/x", params={**params, "a": "status"}, timeout=15, verify=False)
+        r = sess.get(f"{base}/x", params={**params, "a": "status"}, timeout=15)
+        if session and (r.status_code in (401, 403) or (r.ok and "clients" not in r.json())):
+            # Session timed out on the server before our TTL did
+            session = _urbackup_login(srv, fresh=True)
+            params["ses"] = session
+            r = sess.get(f"{base}/x", params={**params, "a": "status"}, timeout=15)
         if not r.ok:
             return {"ok": False, "error": f"HTTP {r.status_code}"}
         data = r.json()
@@ -860,55 +1029,41 @@ def _poll_urbackup(srv: Dict) -> Dict:
     except Exception as e:
         return {"ok": False, "error": str(e)}
 
-    with _db_lock:
-        conn = _db()
-        conn.execute("DELETE FROM backup_jobs WHERE server_id=?", (srv["id"],))
-        for client in clients:
-            cname = client.get("name", "")
-            last_filebackup = client.get("lastbackup", 0)
-            last_imagebackup = client.get("lastbackup_image", 0)
-            file_ok = client.get("file_ok", False)
-            image_ok = client.get("image_ok", False)
-
-            # File backup job
-            if last_filebackup:
-                st = "ok" if file_ok else "warning"
-                if st == "ok":
-                    jobs_ok += 1
-                else:
-                    jobs_warn += 1
-                conn.execute("""
-                    INSERT INTO backup_jobs
-                      (server_id, job_id, job_name, job_type, status, last_run, raw_json)
-                    VALUES (?,?,?,?,?,?,?)
-                """, (
-                    srv["id"], f"{cname}_file", f"{cname} (file)", "file",
-                    st, _epoch_to_iso(last_filebackup), json.dumps(client),
-                ))
-
-            # Image backup job
-            if last_imagebackup:
-                st = "ok" if image_ok else "warning"
-                if st == "ok":
-                    jobs_ok += 1
-                else:
-                    jobs_warn += 1
-                conn.execute("""
-                    INSERT INTO backup_jobs
-                      (server_id, job_id, job_name, job_type, status, last_run, raw_json)
-                    VALUES (?,?,?,?,?,?,?)
-                """, (
-                    srv["id"], f"{cname}_image", f"{cname} (image)", "image",
-                    st, _epoch_to_iso(last_imagebackup), json.dumps(client),
-                ))
-
-        conn.execute("""
-            INSERT INTO backup_history
-              (server_id, jobs_ok, jobs_warn, jobs_error, jobs_total)
-            VALUES (?,?,?,?,?)
-        """, (srv["id"], jobs_ok, jobs_warn, jobs_error, jobs_ok + jobs_warn + jobs_error))
-        conn.commit()
-        conn.close()
+    jobs = []
+    for client in clients:
+        cname = client.get("name", "")
+        last_filebackup = client.get("lastbackup", 0)
+        last_imagebackup = client.get("lastbackup_image", 0)
+        file_ok = client.get("file_ok", False)
+        image_ok = client.get("image_ok", False)
+
+        # File backup job
+        if last_filebackup:
+            st = "ok" if file_ok else "warning"
+            if st == "ok":
+                jobs_ok += 1
+            else:
+                jobs_warn += 1
+            jobs.append({
+                "job_id": f"{cname}_file", "job_name": f"{cname} (file)", "job_type": "file",
+                "status": st, "last_run": _epoch_to_iso(last_filebackup),
+                "raw_json": json.dumps(client),
+            })
+
+        # Image backup job
+        if last_imagebackup:
+            st = "ok" if image_ok else "warning"
+            if st == "ok":
+                jobs_ok += 1
+            else:
+                jobs_warn += 1
+            jobs.append({
+                "job_id": f"{cname}_image", "job_name": f"{cname} (image)", "job_type": "image",
+                "status": st, "last_run": _epoch_to_iso(last_imagebackup),
+                "raw_json": json.dumps(client),
+            })
+
+    _store_poll(srv["id"], jobs_ok, jobs_warn, jobs_error, jobs=jobs)
 
     return {"ok": True, "clients": len(clients), "jobs_ok": jobs_ok, "jobs_warn": jobs_warn}
 
@@ -945,39 +1100,25 @@ def _poll_bacula(srv: Dict) -> Dict:
             if len(parts) >= 6 and parts[0].isdigit():
                 job_rows.append(parts)
 
-    with _db_lock:
-        conn = _db()
-        conn.execute("DELETE FROM backup_jobs WHERE server_id=?", (srv["id"],))
-        for row in job_rows[:30]:
-            try:
-                job_id = row[0]
-                job_name = row[1] if len(row) > 1 else ""
-                start_time = row[3] if len(row) > 3 else ""
-                job_status_raw = row[5] if len(row) > 5 else ""
-                if job_status_raw in ("T", "R"):
-                    st = "ok"
-                    jobs_ok += 1
-                elif job_status_raw in ("W",):
-                    st = "warning"
-                    jobs_warn += 1
-                else:
-                    st = "error"
-                    jobs_error += 1
-                conn.execute("""
-                    INSERT INTO backup_jobs
-                      (server_id, job_id, job_name, job_type, status, last_run, raw_json)
-                    VALUES (?,?,?,?,?,?,?)
-                """, (srv["id"], job_id, job_name, "bacula", st, start_time, json.dumps(row)))
-            except Exception:
-                pass
-
-        conn.execute("""
-            INSERT INTO backup_history
-              (server_id, jobs_ok, jobs_warn, jobs_error, jobs_total)
-            VALUES (?,?,?,?,?)
-        """, (srv["id"], jobs_ok, jobs_warn, jobs_error, jobs_ok + jobs_warn + jobs_error))
-        conn.commit()
-        conn.close()
+    jobs = []
+    for row in job_rows[:30]:
+        job_id = row[0]
+        job_name = row[1] if len(row) > 1 else ""
+        start_time = row[3] if len(row) > 3 else ""
+        job_status_raw = row[5] if len(row) > 5 else ""
+        if job_status_raw in ("T", "R"):
+            st = "ok"
+            jobs_ok += 1
+        elif job_status_raw in ("W",):
+            st = "warning"
+            jobs_warn += 1
+        else:
+            st = "error"
+            jobs_error += 1
+        jobs.append({"job_id": job_id, "job_name": job_name, "job_type": "bacula",
+                     "status": st, "last_run": start_time, "raw_json": json.dumps(row)})
+
+    _store_poll(srv["id"], jobs_ok, jobs_warn, jobs_error, jobs=jobs)
 
     return {"ok": True, "jobs_ok": jobs_ok, "jobs_warn": jobs_warn, "jobs_error": jobs_error}
 
@@ -996,25 +1137,13 @@ def _poll_ssh_generic(srv: Dict) -> Dict:
         srv.get("password", ""), srv.get("ssh_key", ""), cmd, timeout=30
     )
 
-    with _db_lock:
-        conn = _db()
-        conn.execute("DELETE FROM backup_jobs WHERE server_id=?", (srv["id"],))
-        conn.execute("""
-            INSERT INTO backup_jobs
-              (server_id, job_id, job_name, job_type, status, last_run, raw_json)
-            VALUES (?,?,?,?,?,datetime('now'),?)
-        """, (
-            srv["id"], "ssh_status", "SSH Status Check", "ssh",
-            "ok" if rc == 0 else "warning",
-            json.dumps({"stdout": out[:2000], "stderr": err[:500], "rc": rc}),
-        ))
-        conn.execute("""
-            INSERT INTO backup_history
-              (server_id, jobs_ok, jobs_warn, jobs_error, jobs_total)
-            VALUES (?,?,?,?,?)
-        """, (srv["id"], 1 if rc == 0 else 0, 0 if rc == 0 else 1, 0, 1))
-        conn.commit()
-        conn.close()
+    jobs = [{
+        "job_id": "ssh_status", "job_name": "SSH Status Check", "job_type": "ssh",
+        "status": "ok" if rc == 0 else "warning",
+        "last_run": _epoch_to_iso(time.time()),
+        "raw_json": json.dumps({"stdout": out[:2000], "stderr": err[:500], "rc": rc}),
+    }]
+    _store_poll(srv["id"], 1 if rc == 0 else 0, 0 if rc == 0 else 1, 0, jobs=jobs)
 
     return {"ok": rc == 0, "output": out[:1000]}
 
@@ -1038,7 +1167,7 @@ def test_connection(server_id: int) -> Dict:
             base = f"{srv['protocol']}://{srv['host']}:{srv['port']}"
             if stype == "pbs":
                 url = f"{base}/api2/json/version"
-                sess = _pbs_session(srv)
+                sess = _pbs_session(srv, fresh=True)
                 r = sess.get(url, timeout=10)
             elif stype == "duplicati":
                 url = f"{base}/api/v1/serverstate"
@@ -6,9 +6,14 @@ Provides:
   1. /api/checkmk/agent          — Full agent-style output (<<<local>>> section)
                                    Drop this URL as a "datasource program" in CheckMK.
   2. /api/checkmk/host/<name>    — Per-host local-check output for piggyback data.
+     /api/checkmk/piggyback      — The piggyback sections of every host at once.
   3. /checkmk/local_check        — Downloadable shell script for CheckMK agents.
   4. /checkmk/status             — Human-readable JSON summary for CheckMK REST API.
 
+The payloads are produced by an AgentCache builder thread whenever the files
+behind them change and are served from memory with an ETag / Last-Modified,
+so an unchanged scrape costs a stat() and a 304.
+
 CheckMK local-check output format (one line per service):
   <state> "<Service Name>" <perfdata|-> <summary text>
 
@@ -19,12 +24,17 @@ Author: FleetPilot
 """
 
 from __future__ import annotations
+import hashlib
 import json
+import logging
 import os
+import threading
 import time
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
 
 # ─── helpers ──────────────────────────────────────────────────────────────────
 
@@ -309,11 +319,35 @@ def build_agent_output(hosts: dict, smart_manager=None,
     return "\n".join(lines) + "\n"
 
 
+def index_disks_by_host(raw_disks) -> Dict[str, list]:
+    """
+    Group get_all_disks() output by host in one pass.  A disk is listed under
+    its source_host and, if different, its source — the two fields the
+    per-host filter used to match on.
+    """
+    if isinstance(raw_disks, dict):
+        disks = raw_disks.items()
+    elif isinstance(raw_disks, list):
+        disks = ((d.get("device", str(i)), d) for i, d in enumerate(raw_disks))
+    else:
+        disks = ()
+    index: Dict[str, list] = {}
+    for disk_id, disk in disks:
+        keys = {disk.get("source_host"), disk.get("source")}
+        for key in keys:
+            if key:
+                index.setdefault(key, []).append((disk_id, disk))
+    return index
+
+
 def build_host_piggyback(host_name: str, host_data: dict,
-                         smart_manager=None) -> str:
+                         smart_manager=None, disks: Optional[list] = None) -> str:
     """
     Build piggyback output for a specific host.
     Format: <<<piggyback>>> section with host-specific checks.
+
+    disks is this host's entry from index_disks_by_host(); without it the
+    whole registry is read from smart_manager and filtered.
     """
     ip = host_data.get("host", host_name)
     lines = [
@@ -344,54 +378,58 @@ def build_host_piggyback(host_name: str, host_data: dict,
                            f"{total} updates ({sec_count} security)" if total else "Up to date"))
 
     # SMART disks for this host
-    if smart_manager:
+    if disks is None and smart_manager:
         try:
-            raw_disks = smart_manager.get_all_disks()
-            if isinstance(raw_disks, dict):
-                all_disks = raw_disks
-            elif isinstance(raw_disks, list):
-                all_disks = {d.get("device", str(i)): d for i, d in enumerate(raw_disks)}
-            else:
-                all_disks = {}
-            host_disks = {k: v for k, v in all_disks.items()
-                          if v.get("source_host") == host_name or v.get("source") == host_name}
-            for disk_id, disk in host_disks.items():
-                device = disk.get("device", disk_id)
-                health = disk.get("health", "UNKNOWN")
-                temp = disk.get("temperature")
-                reallocated = disk.get("reallocated_sectors", 0) or 0
-                pending = disk.get("pending_sectors", 0) or 0
-
-                if health in ("FAILED", "CRITICAL"):
-                    ds = 2
-                elif health == "WARNING":
-                    ds = 1
-                elif health == "GOOD":
-                    ds = 0
-                else:
-                    ds = 3
-
-                perf_parts = []
-                if temp is not None:
-                    perf_parts.append(f"temperature={temp};45;55;0;70")
-                perf_parts.append(f"reallocated={reallocated};1;5;0")
-                perf_parts.append(f"pending={pending};1;5;0")
-                perf = "|".join(perf_parts) if perf_parts else "-"
-
-                summary_parts = [f"Health: {health}"]
-                if temp:
-                    summary_parts.append(f"{temp}°C")
-                if reallocated:
-                    summary_parts.append(f"Reallocated: {reallocated}")
-                lines.append(_fmt_line(ds, f"FleetPilot Disk {device}",
-                                       perf, " | ".join(summary_parts)))
+            disks = index_disks_by_host(smart_manager.get_all_disks()).get(host_name, [])
         except Exception:
-            pass
+            disks = []
+    for disk_id, disk in disks or []:
+        device = disk.get("device", disk_id)
+        health = disk.get("health", "UNKNOWN")
+        temp = disk.get("temperature")
+        reallocated = disk.get("reallocated_sectors", 0) or 0
+        pending = disk.get("pending_sectors", 0) or 0
+
+        if health in ("FAILED", "CRITICAL"):
+            ds = 2
+        elif health == "WARNING":
+            ds = 1
+        elif health == "GOOD":
+            ds = 0
+        else:
+            ds = 3
+
+        perf_parts = []
+        if temp is not None:
+            perf_parts.append(f"temperature={temp};45;55;0;70")
+        perf_parts.append(f"reallocated={reallocated};1;5;0")
+        perf_parts.append(f"pending={pending};1;5;0")
+        perf = "|".join(perf_parts) if perf_parts else "-"
+
+        summary_parts = [f"Health: {health}"]
+        if temp:
+            summary_parts.append(f"{temp}°C")
+        if reallocated:
+            summary_parts.append(f"Reallocated: {reallocated}")
+        lines.append(_fmt_line(ds, f"FleetPilot Disk {device}",
+                               perf, " | ".join(summary_parts)))
 
     lines.append("<<<<>>>>")  # End of piggyback section
     return "\n".join(lines) + "\n"
 
 
+def build_all_piggyback(hosts: dict, smart_manager=None) -> Dict[str, str]:
+    """Piggyback sections for every host, reading the disk registry once."""
+    index: Dict[str, list] = {}
+    if smart_manager:
+        try:
+            index = index_disks_by_host(smart_manager.get_all_disks())
+        except Exception:
+            index = {}
+    return {name: build_host_piggyback(name, hdata, disks=index.get(name, []))
+            for name, hdata in hosts.items()}
+
+
 def build_status_json(hosts: dict, smart_manager=None,
                       vm_controller=None, storage_controller=None) -> dict:
     """
@@ -512,6 +550,158 @@ def build_status_json(hosts: dict, smart_manager=None,
     }
 
 
+# ─── precomputed payloads ─────────────────────────────────────────────────────
+
+CHECK_INTERVAL = 5      # seconds between fingerprint checks of the watched files
+HEARTBEAT = 300         # rebuild at least this often (ages in the self-check)
+
+
+def _payload(body: bytes, digest_src: bytes, content_type: str,
+             previous: Optional[Dict], data: Any = None) -> Dict:
+    """
+    Wrap a built body.  If its digest matches the previous payload the old
+    one is kept, so ETag and Last-Modified only move when the content does.
+    """
+    etag = hashlib.sha1(digest_src).hexdigest()[:20]
+    if previous is not None and previous["etag"] == etag:
+        return previous
+    return {"body": body, "etag": etag, "last_modified": time.time(),
+            "content_type": content_type, "data": data}
+
+
+class AgentCache:
+    """
+    Keeps the agent, status and per-host piggyback payloads in memory.
+
+    A daemon thread stats the watched files (hosts.json and the controller
+    databases, including their -wal files) every CHECK_INTERVAL seconds and
+    rebuilds only when their fingerprint changed, invalidate() was called or
+    HEARTBEAT has passed.  The thread starts on the first read.
+    """
+
+    def __init__(self, load_hosts: Callable[[], dict], smart_manager=None,
+                 vm_controller=None, storage_controller=None,
+                 watch: Iterable = (), check_interval: float = CHECK_INTERVAL,
+                 heartbeat: float = HEARTBEAT):
+        self._load_hosts = load_hosts
+        self._modules = {"smart_manager": smart_manager,
+                         "vm_controller": vm_controller,
+                         "storage_controller": storage_controller}
+        self._watch = [str(p) for p in watch]
+        self._check_interval = check_interval
+        self._heartbeat = heartbeat
+        self._payloads: Dict[str, Any] = {}
+        self._fingerprint = None
+        self._built_at = 0.0
+        self._build_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._dirty = False
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.builds = 0
+
+    def _stat_fingerprint(self) -> tuple:
+        fp = []
+        for path in self._watch:
+            for p in (path, path + "-wal"):
+                try:
+                    st = os.stat(p)
+                    fp.append((p, st.st_mtime_ns, st.st_size))
+                except OSError:
+                    fp.append((p, None, None))
+        return tuple(fp)
+
+    def rebuild(self):
+        """Build every payload now (on the caller's thread)."""
+        with self._build_lock:
+            self._dirty = False
+            fingerprint = self._stat_fingerprint()
+            hosts = self._load_hosts()
+            old = self._payloads
+
+            agent = build_agent_output(hosts, **self._modules).encode("utf-8")
+            status = build_status_json(hosts, **self._modules)
+            stable = {k: v for k, v in status.items() if k != "generated_at"}
+            sections = build_all_piggyback(hosts, self._modules["smart_manager"])
+            host_payloads = {}
+            for name, text in sections.items():
+                text = text.encode("utf-8")
+                host_payloads[name] = _payload(text, text, "text/plain; charset=utf-8",
+                                               old.get("hosts", {}).get(name))
+            bulk = b"".join(p["body"] for p in host_payloads.values())
+
+            self._payloads = {
+                "agent": _payload(agent, agent, "text/plain; charset=utf-8", old.get("agent")),
+                "status": _payload(json.dumps(status, default=str).encode("utf-8"),
+                                   json.dumps(stable, sort_keys=True, default=str).encode("utf-8"),
+                                   "application/json", old.get("status"), data=status),
+                "hosts": host_payloads,
+                "piggyback": _payload(bulk, bulk, "text/plain; charset=utf-8",
+                                      old.get("piggyback")),
+            }
+            self._fingerprint = fingerprint
+            self._built_at = time.monotonic()
+            self.builds += 1
+
+    def invalidate(self):
+        """Ask the builder for a rebuild, e.g. after hosts.json was saved."""
+        self._dirty = True
+        self._wake.set()
+
+    def _stale(self) -> bool:
+        return (self._dirty
+                or time.monotonic() - self._built_at >= self._heartbeat
+                or self._stat_fingerprint() != self._fingerprint)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self._check_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                if self._stale():
+                    self.rebuild()
+            except Exception:
+                logger.exception("CheckMK payload rebuild failed")
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                                            name="checkmk-builder")
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _get(self, kind: str):
+        if not self._payloads:
+            self.rebuild()
+            self.start()
+        return self._payloads[kind]
+
+    def agent(self) -> Dict:
+        """The <<<local>>> agent payload: {"body", "etag", "last_modified", ...}."""
+        return self._get("agent")
+
+    def status(self) -> Dict:
+        """The status JSON payload; payload["data"] is the decoded dict."""
+        return self._get("status")
+
+    def piggyback(self) -> Dict:
+        """Piggyback sections for every configured host in one payload."""
+        return self._get("piggyback")
+
+    def host(self, host_name: str) -> Optional[Dict]:
+        """Piggyback payload for one host, or None if it is not configured."""
+        return self._get("hosts").get(host_name)
+
+
 # ─── CheckMK local-check shell script generator ───────────────────────────────
 
 LOCAL_CHECK_SCRIPT_TEMPLATE = """\
@@ -552,18 +742,8 @@ FLEETPILOT_URL="{base_url}"
 FLEETPILOT_TOKEN="{api_token}"
 TIMEOUT=10
 
-# Fetch all host names
-HOSTS=$(curl -sf --max-time "$TIMEOUT" \\
+# One request returns the <<<<host>>>> sections of every host
+curl -sf --max-time "$TIMEOUT" \\
   -H "X-FleetPilot-Token: $FLEETPILOT_TOKEN" \\
-  "$FLEETPILOT_URL/api/checkmk/hosts" 2>/dev/null | python3 -c "
-import sys,json
-data=json.load(sys.stdin)
-print(' '.join(h['name'] for h in data.get('hosts',[])))
-" 2>/dev/null)
-
-for HOST in $HOSTS; do
-  curl -sf --max-time "$TIMEOUT" \\
-    -H "X-FleetPilot-Token: $FLEETPILOT_TOKEN" \\
-    "$FLEETPILOT_URL/api/checkmk/host/$HOST" 2>/dev/null
-done
+  "$FLEETPILOT_URL/api/checkmk/piggyback" 2>/dev/null
 """
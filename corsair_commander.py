@@ -19,12 +19,15 @@ import json
 import logging
 import os
 import re
-import sqlite3
-import threading
 import time
 from pathlib import Path
 from typing import Dict, List, Optional
 
+import db_pool
+import ssh_pool
+from poll_scheduler import PollScheduler
+from sample_store import SampleStore
+
 logger = logging.getLogger(__name__)
 
 # ── Encryption helpers (same pattern as vm_controller) ───────────────────────
@@ -46,17 +49,18 @@ except Exception:
 
 # ── Module state ─────────────────────────────────────────────────────────────
 _DB_FILE: Optional[Path] = None
-_poll_thread: Optional[threading.Thread] = None
-_poll_running = False
-_POLL_INTERVAL = 30   # seconds between status polls
+_scheduler: Optional[PollScheduler] = None
+_POLL_INTERVAL = 30   # default seconds between status polls (cc_devices.poll_interval overrides)
+_POLL_WORKERS = 4
+_POLL_TIMEOUT = 120
 _RETENTION_DAYS = 30
 
+_samples = SampleStore("cc", lambda: _get_db(), raw_default=[])
+
 # ── Database ─────────────────────────────────────────────────────────────────
 
 def _get_db():
-    conn = sqlite3.connect(str(_DB_FILE), timeout=10)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db_pool.connect(_DB_FILE)
 
 
 def init_db(data_dir: str):
@@ -80,14 +84,6 @@ def init_db(data_dir: str):
             added_ts    TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
         CREATE TABLE IF NOT EXISTS _cc_migrations(name TEXT PRIMARY KEY);
-        CREATE TABLE IF NOT EXISTS cc_samples (
-            id          INTEGER PRIMARY KEY AUTOINCREMENT,
-            device_id   INTEGER NOT NULL,
-            ts          INTEGER NOT NULL,
-            status_json TEXT NOT NULL,
-            FOREIGN KEY(device_id) REFERENCES cc_devices(id) ON DELETE CASCADE
-        );
-        CREATE INDEX IF NOT EXISTS idx_cc_samples_ts ON cc_samples(device_id, ts);
         """)
     # Run migrations
     with _get_db() as db:
@@ -96,6 +92,13 @@ def init_db(data_dir: str):
             db.execute("INSERT OR IGNORE INTO _cc_migrations VALUES ('add_use_sudo')")
         except Exception:
             pass
+        try:
+            db.execute("ALTER TABLE cc_devices ADD COLUMN poll_interval INTEGER")
+            db.execute("INSERT OR IGNORE INTO _cc_migrations VALUES ('add_poll_interval')")
+        except Exception:
+            pass
+    _samples.init_schema(_DB_FILE, _RETENTION_DAYS)
+    _samples.migrate_json_samples("cc_samples")
     logger.info("corsair_commander DB initialised at %s", _DB_FILE)
 
 
@@ -112,7 +115,9 @@ def add_device(name: str, host: str, port: int = 22, username: str = "root",
             (name, host, port, username, _encrypt(password), ssh_key,
              match_str, 1 if use_direct else 0, 1 if use_sudo else 0, notes)
         )
-        return cur.lastrowid
+        dev_id = cur.lastrowid
+    reload_polling()
+    return dev_id
 
 
 def list_devices() -> List[Dict]:
@@ -135,6 +140,10 @@ def get_device(dev_id: int) -> Optional[Dict]:
         ).fetchone()
     if not row:
         return None
+    return _row_to_device(row)
+
+
+def _row_to_device(row) -> Dict:
     d = dict(row)
     try:
         d["password_plain"] = _decrypt(d["password"])
@@ -145,49 +154,59 @@ def get_device(dev_id: int) -> Optional[Dict]:
 
 def update_device(dev_id: int, **kwargs) -> bool:
     allowed = {"name","host","port","username","password","ssh_key",
-               "match_str","use_direct","use_sudo","enabled","notes"}
+               "match_str","use_direct","use_sudo","enabled","notes","poll_interval"}
     fields = {k: v for k, v in kwargs.items() if k in allowed}
     if "password" in fields:
         fields["password"] = _encrypt(fields["password"])
     if not fields:
         return False
+    if fields.keys() & {"host", "port", "username", "password", "ssh_key"}:
+        _drop_session(dev_id)
     set_clause = ", ".join(f"{k}=?" for k in fields)
     with _get_db() as db:
         db.execute(
             f"UPDATE cc_devices SET {set_clause} WHERE id=?",
             list(fields.values()) + [dev_id]
         )
+    reload_polling()
     return True
 
 
 def delete_device(dev_id: int):
+    _drop_session(dev_id)
     with _get_db() as db:
         db.execute("DELETE FROM cc_devices WHERE id=?", (dev_id,))
+    _samples.forget_device(dev_id)
+    reload_polling()
 
 
 # ── SSH helpers ───────────────────────────────────────────────────────────────
 
 def _ssh_connect(dev: Dict):
-    """Open a paramiko SSH connection to the device's host."""
-    import paramiko
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    kwargs = dict(
-        hostname=dev["host"],
+    """
+    Return a pooled SSH session to the device's host.  The session is shared
+    with other pollers of the same host/user, is kept alive between cycles and
+    reconnects on its own; close() only releases it back to the pool.
+    """
+    pw = dev.get("password_plain") or dev.get("password", "")
+    return ssh_pool.Session(
+        dev["host"],
         port=dev.get("port", 22),
         username=dev.get("username", "root"),
+        password=pw,
+        key_path=dev.get("ssh_key", ""),
         timeout=15,
     )
-    pw = dev.get("password_plain") or dev.get("password", "")
-    key_path = dev.get("ssh_key", "")
-    if key_path and Path(key_path).exists():
-        kwargs["key_filename"] = key_path
-    elif pw:
-        kwargs["password"] = pw
-        kwargs["look_for_keys"] = False
-        kwargs["allow_agent"] = False
-    ssh.connect(**kwargs)
-    return ssh
+
+
+def _drop_session(dev_id: int):
+    """Forget the pooled session of a device whose connection details changed."""
+    with _get_db() as db:
+        row = db.execute(
+            "SELECT host, port, username FROM cc_devices WHERE id=?", (dev_id,)
+        ).fetchone()
+    if row:
+        ssh_pool.discard(row["host"], row["port"] or 22, row["username"])
 
 
 def _run_remote(ssh, cmd: str, timeout: int = 30) -> tuple:
@@ -222,9 +241,11 @@ def _parse_liquidctl_json(raw: str) -> List[Dict]:
         return []
 
 
-def fetch_status(dev: Dict) -> Dict:
+def fetch_status(dev: Dict, initialize: bool = True) -> Dict:
     """
     Connect to the remote host and run `liquidctl status --json`.
+    initialize=False skips `liquidctl initialize` (used by fan_curve's
+    control loop, which reads status every few seconds).
     Returns a structured dict:
     {
       "ok": bool,
@@ -252,8 +273,9 @@ def fetch_status(dev: Dict) -> Dict:
         ssh = _ssh_connect(dev)
 
         # 1. Initialize (needed after boot / resume)
-        init_cmd = _liquidctl_cmd(dev, "initialize")
-        _run_remote(ssh, init_cmd, timeout=20)
+        if initialize:
+            init_cmd = _liquidctl_cmd(dev, "initialize")
+            _run_remote(ssh, init_cmd, timeout=20)
 
         # 2. Status
         status_cmd = _liquidctl_cmd(dev, "status")
@@ -422,107 +444,82 @@ def test_connection(dev_id: int) -> Dict:
 # ── Background polling ────────────────────────────────────────────────────────
 
 def _save_sample(device_id: int, status: Dict):
-    with _get_db() as db:
-        db.execute(
-            "INSERT INTO cc_samples(device_id, ts, status_json) VALUES (?,?,?)",
-            (device_id, status["ts"], json.dumps(status))
-        )
+    _samples.enqueue(device_id, status)
 
 
-def _purge_old():
-    cutoff = int(time.time()) - _RETENTION_DAYS * 86400
+def _load_poll_targets() -> Dict[int, tuple]:
+    """All enabled devices in one query, decrypted once per reload."""
     with _get_db() as db:
-        db.execute("DELETE FROM cc_samples WHERE ts < ?", (cutoff,))
+        rows = db.execute("SELECT * FROM cc_devices WHERE enabled=1").fetchall()
+    return {row["id"]: (_row_to_device(row), row["poll_interval"] or _POLL_INTERVAL)
+            for row in rows}
 
 
-def _poll_loop():
-    global _poll_running
-    while _poll_running:
-        try:
-            with _get_db() as db:
-                devices = db.execute(
-                    "SELECT * FROM cc_devices WHERE enabled=1"
-                ).fetchall()
-            for row in devices:
-                dev = dict(row)
-                try:
-                    dev["password_plain"] = _decrypt(dev["password"])
-                except Exception:
-                    dev["password_plain"] = ""
-                status = fetch_status(dev)
-                _save_sample(dev["id"], status)
-            _purge_old()
-        except Exception as exc:
-            logger.warning("[corsair_commander] poll loop error: %s", exc)
-        time.sleep(_POLL_INTERVAL)
+def _poll_device(dev: Dict) -> bool:
+    status = fetch_status(dev)
+    _save_sample(dev["id"], status)
+    return bool(status.get("ok"))
+
+
+def reload_polling():
+    """
+    Pick up added/changed/removed devices within a second, also from a
+    Gunicorn worker whose scheduler is a copy (see PollScheduler share_dir).
+    """
+    if _scheduler:
+        _scheduler.reload()
+
+
+def get_poll_status() -> Dict[int, Dict]:
+    return _scheduler.status() if _scheduler else {}
 
 
 def start_polling():
-    global _poll_thread, _poll_running
-    if _poll_thread and _poll_thread.is_alive():
+    global _scheduler
+    if _scheduler and _scheduler.running:
         return
-    _poll_running = True
-    _poll_thread = threading.Thread(
-        target=_poll_loop, daemon=True, name="corsair-commander-poll"
-    )
-    _poll_thread.start()
-    logger.info("corsair_commander polling started (interval=%ds)", _POLL_INTERVAL)
+    _scheduler = PollScheduler("corsair-commander-poll", _poll_device,
+                               loader=_load_poll_targets,
+                               max_workers=_POLL_WORKERS, timeout=_POLL_TIMEOUT,
+                               share_dir=_DB_FILE.parent if _DB_FILE else None)
+    _scheduler.start()
+    logger.info("corsair_commander polling started (default interval=%ds)", _POLL_INTERVAL)
 
 
 def stop_polling():
-    global _poll_running
-    _poll_running = False
+    if _scheduler:
+        _scheduler.stop()
 
 
 # ── Query API ─────────────────────────────────────────────────────────────────
 
 def get_latest(device_id: int) -> Optional[Dict]:
     """Return the most recent sample for a device."""
-    with _get_db() as db:
-        row = db.execute(
-            "SELECT * FROM cc_samples WHERE device_id=? ORDER BY ts DESC LIMIT 1",
-            (device_id,)
-        ).fetchone()
-    if not row:
+    status = _samples.get_latest(device_id)
+    if status is None:
         return None
-    d = dict(row)
-    try:
-        d["status"] = json.loads(d.pop("status_json"))
-    except Exception:
-        d["status"] = {}
-    return d
+    return {"device_id": device_id, "ts": status["ts"], "status": status}
 
 
 def get_history(device_id: int, hours: int = 24, limit: int = 1440) -> List[Dict]:
-    """Return up to `limit` samples from the last `hours` hours."""
+    """Return up to `limit` samples from the last `hours` hours (without raw output)."""
     since = int(time.time()) - hours * 3600
-    with _get_db() as db:
-        rows = db.execute(
-            "SELECT * FROM cc_samples WHERE device_id=? AND ts>=? "
-            "ORDER BY ts ASC LIMIT ?",
-            (device_id, since, limit)
-        ).fetchall()
-    result = []
-    for r in rows:
-        d = dict(r)
-        try:
-            d["status"] = json.loads(d.pop("status_json"))
-        except Exception:
-            d["status"] = {}
-        result.append(d)
-    return result
+    return [{"device_id": device_id, "ts": status["ts"], "status": status}
+            for status in _samples.get_history(device_id, since, limit)]
 
 
-def get_all_latest() -> List[Dict]:
+def get_all_latest(devices: List[Dict] = None, with_raw: bool = True) -> List[Dict]:
     """Return the latest sample for every enabled device."""
-    devices = list_devices()
+    if devices is None:
+        devices = list_devices()
+    devices = [dev for dev in devices if dev.get("enabled")]
+    latest = _samples.get_latest_many([dev["id"] for dev in devices], with_raw=with_raw)
     result = []
     for dev in devices:
-        if not dev.get("enabled"):
-            continue
-        latest = get_latest(dev["id"])
+        status = latest.get(dev["id"])
         result.append({
             "device": dev,
-            "latest": latest,
+            "latest": {"device_id": dev["id"], "ts": status["ts"], "status": status}
+                      if status else None,
         })
     return result
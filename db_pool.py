@@ -0,0 +1,155 @@
+"""
+db_pool.py — FleetPilot shared SQLite connection layer
+
+Every module used to open a fresh sqlite3 connection per call, so each page
+view and poll paid for opening the file, re-reading the schema and
+re-preparing statements, and readers and writers blocked each other under
+the default rollback journal.
+
+connect(path) hands out one connection per (thread, database file) and keeps
+it for the life of the thread:
+
+  • journal_mode=WAL — readers never wait for a writer, and a writer never
+    waits for readers
+  • auto_vacuum=INCREMENTAL for newly created databases, so retention can
+    return freed pages without a full VACUUM
+  • synchronous=NORMAL — safe with WAL, avoids an fsync per commit
+  • larger page cache and memory-mapped reads
+  • a busy timeout, so concurrent writers queue instead of failing with
+    "database is locked"
+  • sqlite3's per-connection statement cache, which now survives between
+    calls because the connection does
+
+Callers keep their existing patterns.  `with conn:` commits or rolls back
+as before, and close() rolls back anything uncommitted (exactly what closing
+a throwaway connection used to do) but leaves the connection open for the
+next call on the same thread.  A database file that was deleted or replaced
+is noticed and reopened.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import weakref
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30        # seconds to wait for another writer's lock
+_CACHE_KIB = 8192           # page cache per connection
+_MMAP_BYTES = 64 << 20      # memory-mapped read window
+_CACHED_STATEMENTS = 256    # prepared statements kept per connection
+
+_local = threading.local()
+_all = weakref.WeakSet()    # open pooled connections, for stats()
+_all_lock = threading.Lock()
+_generation = 0             # bumped by close_all(); older connections are reopened
+_stats = {"opened": 0, "reused": 0, "reopened": 0}
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() returns it to its thread's pool."""
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def really_close(self):
+        super().close()
+
+
+def _file_id(path: str):
+    if path == ":memory:":
+        return None
+    try:
+        st = os.stat(path)
+        return (st.st_dev, st.st_ino)
+    except OSError:
+        return None
+
+
+def _open(path: str, timeout: float) -> PooledConnection:
+    conn = sqlite3.connect(path, timeout=timeout, factory=PooledConnection,
+                           cached_statements=_CACHED_STATEMENTS)
+    conn.execute(f"PRAGMA busy_timeout={int(timeout * 1000)}")
+    if path != ":memory:":
+        # Only takes effect on a database without tables, i.e. one being
+        # created; existing files keep their mode (see retention.convert).
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.OperationalError as e:     # e.g. another process holds a lock
+            logger.debug("db_pool: could not enable WAL on %s: %s", path, e)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{_CACHE_KIB}")
+    conn.execute(f"PRAGMA mmap_size={_MMAP_BYTES}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    with _all_lock:
+        _all.add(conn)
+    _stats["opened"] += 1
+    return conn
+
+
+def connect(path, timeout: float = DEFAULT_TIMEOUT,
+            row_factory=sqlite3.Row) -> PooledConnection:
+    """This thread's connection to path, opened and tuned on first use."""
+    path = str(path)
+    conns: Dict[str, tuple] = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    entry = conns.get(path)
+    if entry is not None:
+        conn, file_id, generation = entry
+        if generation == _generation and _file_id(path) == file_id:
+            _stats["reused"] += 1
+            conn.row_factory = row_factory
+            return conn
+        # Deleted or replaced underneath us (tests, restore), or close_all()
+        _stats["reopened"] += 1
+        _discard(conn)
+    conn = _open(path, timeout)
+    conn.row_factory = row_factory
+    conns[path] = (conn, _file_id(path), _generation)
+    return conn
+
+
+def _discard(conn: PooledConnection):
+    with _all_lock:
+        _all.discard(conn)
+    try:
+        conn.really_close()
+    except Exception:
+        pass
+
+
+def close_thread():
+    """Close the calling thread's connections (e.g. before a worker exits)."""
+    for conn, _, _ in (getattr(_local, "conns", None) or {}).values():
+        _discard(conn)
+    _local.conns = {}
+
+
+def close_all():
+    """
+    Retire every pooled connection, e.g. before replacing a database file.
+    sqlite3 connections can only be closed by their own thread, so each
+    thread closes and reopens its connection on its next connect().
+    """
+    global _generation
+    with _all_lock:
+        _generation += 1
+    close_thread()
+
+
+def stats() -> Dict:
+    with _all_lock:
+        return dict(_stats, open=len(_all))
+
+
+def _after_fork():
+    # Counters start from zero in a forked child; metrics adds up the processes
+    for k in _stats:
+        _stats[k] = 0
+
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -1,7 +1,10 @@
-import os, json, csv, sqlite3, subprocess, threading, re
+import os, json, csv, subprocess, threading, re
 from datetime import datetime
 from pathlib import Path
 
+import db_pool
+import surface_scan
+
 # Globale Pfade und Variablen
 DB_FILE = Path(__file__).with_suffix('.db')
 UPLOAD_DIR = Path(__file__).parent / 'uploads'
@@ -24,9 +27,7 @@ def sanitize_device_name(device):
 
 def get_db():
     """Stellt eine DB-Verbindung her und liefert das Connection-Objekt zurück."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db_pool.connect(DB_FILE)
 
 def init_db():
     """Initialisiert die SQLite-Datenbank und erforderliche Tabellen, falls noch nicht vorhanden."""
@@ -72,6 +73,13 @@ def init_db():
                 db.execute("ALTER TABLE disks ADD COLUMN serial TEXT")
             except Exception:
                 pass
+        # Ergebnis (JSON) z.B. eines Oberflächen-Scans
+        op_cols = {c[1] for c in db.execute("PRAGMA table_info(operations)")}
+        if 'result' not in op_cols:
+            try:
+                db.execute("ALTER TABLE operations ADD COLUMN result TEXT")
+            except Exception:
+                pass
 
 def run(cmd):
     """Führt einen Shell-Befehl aus und gibt den gesamten Output zurück."""
@@ -174,14 +182,16 @@ def log_op(device, action):
                          (device, action, 'RUNNING'))
         return cur.lastrowid
 
-def update_op(op_id, status=None, progress=None):
-    """Aktualisiert Status/Progress eines laufenden Operations-Eintrags."""
+def update_op(op_id, status=None, progress=None, result=None):
+    """Aktualisiert Status/Progress (und optional das JSON-Ergebnis) eines Operations-Eintrags."""
     sets = []
     vals = []
     if status:
         sets.append('status=?'); vals.append(status)
     if progress is not None:
         sets.append('progress=?'); vals.append(progress)
+    if result is not None:
+        sets.append('result=?'); vals.append(json.dumps(result))
     if not sets:
         return  # nichts zu updaten
     vals.append(op_id)
@@ -229,37 +239,53 @@ def view_smart(device):
                    (device, None, temp, health))
     return out
 
-def validate_blocks(device):
-    """Prüft die ersten Blöcke eines Geräts mit direkten Leseversuchen und markiert fehlerhafte Blöcke."""
+def validate_blocks(device, mode='sample', op_id=None, path=None):
+    """
+    Oberflächen-Scan eines Geräts im Prozess (siehe surface_scan): große,
+    ausgerichtete Lesezugriffe statt eines dd-Prozesses pro 4-KiB-Block.
+    mode 'full' liest die gesamte Oberfläche, 'sample' verteilte Stichproben.
+    Mit op_id wird der Fortschritt in operations geschrieben und stop_task()
+    beachtet.  Gibt das Ergebnis-Dict zurück (bad_blocks in 4-KiB-Blöcken).
+    """
     device = sanitize_device_name(device)
-    # Versuche, die ersten N Blöcke (z.B. 256) zu lesen und sammle fehlerhafte Indices
-    max_blocks = 256
-    bad_blocks = []
-    blocks = []
-    # Bestimme Gerätgröße in Bytes
+    path = path or f'/dev/{device}'
+
+    def progress(fraction, result):
+        update_op(op_id, progress=int(fraction * 100), result=result)
+
+    def should_stop():
+        return get_task_status(op_id)[0] == 'STOPPED'
+
+    result = surface_scan.scan(path, mode=mode,
+                               progress=progress if op_id else None,
+                               should_stop=should_stop if op_id else None)
+    if op_id:
+        if result['stopped']:
+            update_op(op_id, result=result)         # Status bleibt STOPPED
+        else:
+            update_op(op_id, status='FAIL' if result['bad_blocks'] else 'OK',
+                      progress=100, result=result)
+    return result
+
+def validate_worker(device, mode, op_id, path=None):
+    """Führt validate_blocks im Hintergrund-Thread aus."""
     try:
-        size_out = run(['blockdev', '--getsize64', f'/dev/{device}']).strip()
-        size = int(size_out)
-    except Exception:
-        size = None
-    if size:
-        count = size // 4096
-        blocks = list(range(min(count, max_blocks)))
-    else:
-        blocks = list(range(max_blocks))
-
-    for b in blocks:
-        # Lese einen Block an Position b (offset = b*4096) mittels dd with count=1
-        offset = b * 4096
-        try:
-            # dd will return non-zero on read errors; capture output
-            res = subprocess.run(['dd', 'if=' + f'/dev/{device}', 'bs=4096', 'count=1', 'skip=' + str(b)],
-                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            if res.returncode != 0:
-                bad_blocks.append(b)
-        except Exception:
-            bad_blocks.append(b)
-    return blocks, bad_blocks
+        validate_blocks(device, mode, op_id, path)
+    except Exception as e:
+        update_op(op_id, status='FAIL', result={'error': str(e)})
+
+def start_validate(device, mode='sample'):
+    """Startet einen Oberflächen-Scan für device und gibt die Operations-ID zurück."""
+    device = sanitize_device_name(device)
+    if mode not in surface_scan.MODES:
+        raise ValueError("Invalid scan mode")
+    op_id = log_op(device, f'VALIDATE_{mode.upper()}')
+    threading.Thread(target=validate_worker, args=(device, mode, op_id), daemon=True).start()
+    return op_id
+
+def get_task_result(op_id):
+    row = get_db().execute("SELECT result FROM operations WHERE id=?", (op_id,)).fetchone()
+    return json.loads(row['result']) if row and row['result'] else None
 
 # --- Hilfsfunktionen für UI/DB-Abfragen (für Flask-Routen) ---
 def _parse_df_usage():
@@ -28,12 +28,17 @@ import json
 import logging
 import os
 import re
-import sqlite3
-import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
+import db_pool
+import metrics
+import ssh_pool
+from poll_scheduler import PollScheduler
+from sample_store import SampleStore
+
 logger = logging.getLogger(__name__)
 
 # ── Encryption helpers ────────────────────────────────────────────────────────
@@ -104,19 +109,37 @@ CONTROLLER_TYPES = {
     },
 }
 
+# Default seconds between polls per controller type (fc_devices.poll_interval
+# overrides).  Local sysfs reads are cheap; BMCs answer `ipmitool sdr` slowly.
+DEFAULT_POLL_INTERVALS = {
+    "pwm_sysfs":  5,
+    "lm_sensors": 15,
+    "nbfc":       15,
+    "liquidctl":  15,
+    "ipmi":       60,
+}
+
 # ── Module state ──────────────────────────────────────────────────────────────
 _DB_FILE: Optional[Path] = None
-_poll_thread: Optional[threading.Thread] = None
-_poll_running = False
-_POLL_INTERVAL = 30
+_scheduler: Optional[PollScheduler] = None
+_POLL_INTERVAL = 30       # fallback for unknown controller types
+_POLL_WORKERS = 8
+_POLL_TIMEOUT = 120
 _RETENTION_DAYS = 30
 
+_samples = SampleStore(
+    "fc", lambda: _get_db(),
+    kinds=("temperatures", "fans", "voltages", "pwm_nodes"),
+    key_fields={"pwm_nodes": "path"},
+)
+
+FAN_RPM = metrics.gauge("fleetpilot_fan_rpm", "Fan speed from the last poll",
+                        ("device_id", "device", "fan"))
+
 # ── Database ──────────────────────────────────────────────────────────────────
 
 def _get_db():
-    conn = sqlite3.connect(str(_DB_FILE), timeout=10)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db_pool.connect(_DB_FILE)
 
 
 def init_db(data_dir: str):
@@ -141,14 +164,6 @@ def init_db(data_dir: str):
         );
         -- Migration: add use_sudo if missing
         CREATE TABLE IF NOT EXISTS _fc_migrations(name TEXT PRIMARY KEY);
-        CREATE TABLE IF NOT EXISTS fc_samples (
-            id          INTEGER PRIMARY KEY AUTOINCREMENT,
-            device_id   INTEGER NOT NULL,
-            ts          INTEGER NOT NULL,
-            status_json TEXT NOT NULL,
-            FOREIGN KEY(device_id) REFERENCES fc_devices(id) ON DELETE CASCADE
-        );
-        CREATE INDEX IF NOT EXISTS idx_fc_samples_ts ON fc_samples(device_id, ts);
         """)
     # Run migrations
     with _get_db() as db:
@@ -157,6 +172,13 @@ def init_db(data_dir: str):
             db.execute("INSERT OR IGNORE INTO _fc_migrations VALUES ('add_use_sudo')")
         except Exception:
             pass
+        try:
+            db.execute("ALTER TABLE fc_devices ADD COLUMN poll_interval INTEGER")
+            db.execute("INSERT OR IGNORE INTO _fc_migrations VALUES ('add_poll_interval')")
+        except Exception:
+            pass
+    _samples.init_schema(_DB_FILE, _RETENTION_DAYS)
+    _samples.migrate_json_samples("fc_samples")
     logger.info("fan_controller DB initialised at %s", _DB_FILE)
 
 
@@ -173,7 +195,9 @@ def add_device(name: str, controller_type: str, host: str, port: int = 22,
             (name, controller_type, host, port, username,
              _encrypt(password), ssh_key, extra, 1 if use_sudo else 0, notes)
         )
-        return cur.lastrowid
+        dev_id = cur.lastrowid
+    reload_polling()
+    return dev_id
 
 
 def list_devices() -> List[Dict]:
@@ -201,6 +225,10 @@ def get_device(dev_id: int) -> Optional[Dict]:
         ).fetchone()
     if not row:
         return None
+    return _row_to_device(row)
+
+
+def _row_to_device(row) -> Dict:
     d = dict(row)
     try:
         d["password_plain"] = _decrypt(d["password"])
@@ -214,9 +242,21 @@ def get_device(dev_id: int) -> Optional[Dict]:
     return d
 
 
+def default_poll_interval(controller_type: str) -> int:
+    return DEFAULT_POLL_INTERVALS.get(controller_type, _POLL_INTERVAL)
+
+
+def poll_interval_for(dev: Dict) -> int:
+    """Seconds between status polls: per-device override or the type default."""
+    if dev.get("poll_interval"):
+        return int(dev["poll_interval"])
+    return default_poll_interval(dev.get("controller_type"))
+
+
 def update_device(dev_id: int, **kwargs) -> bool:
     allowed = {"name", "controller_type", "host", "port", "username",
-               "password", "ssh_key", "extra_config", "use_sudo", "enabled", "notes"}
+               "password", "ssh_key", "extra_config", "use_sudo", "enabled", "notes",
+               "poll_interval"}
     fields = {k: v for k, v in kwargs.items() if k in allowed}
     if "password" in fields:
         fields["password"] = _encrypt(fields["password"])
@@ -224,42 +264,54 @@ def update_device(dev_id: int, **kwargs) -> bool:
         fields["extra_config"] = json.dumps(fields["extra_config"])
     if not fields:
         return False
+    if fields.keys() & {"host", "port", "username", "password", "ssh_key"}:
+        _drop_session(dev_id)
     set_clause = ", ".join(f"{k}=?" for k in fields)
     with _get_db() as db:
         db.execute(
             f"UPDATE fc_devices SET {set_clause} WHERE id=?",
             list(fields.values()) + [dev_id]
         )
+    reload_polling()
     return True
 
 
 def delete_device(dev_id: int):
+    _drop_session(dev_id)
     with _get_db() as db:
         db.execute("DELETE FROM fc_devices WHERE id=?", (dev_id,))
+    _samples.forget_device(dev_id)
+    FAN_RPM.remove(device_id=dev_id)
+    reload_polling()
 
 
 # ── SSH helpers ───────────────────────────────────────────────────────────────
 
 def _ssh_connect(dev: Dict):
-    import paramiko
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    kwargs = dict(
-        hostname=dev["host"],
+    """
+    Return a pooled SSH session to the device's host.  The session is shared
+    with other pollers of the same host/user, is kept alive between cycles and
+    reconnects on its own; close() only releases it back to the pool.
+    """
+    pw = dev.get("password_plain") or dev.get("password", "")
+    return ssh_pool.Session(
+        dev["host"],
         port=dev.get("port", 22),
         username=dev.get("username", "root"),
+        password=pw,
+        key_path=dev.get("ssh_key", ""),
         timeout=15,
     )
-    pw = dev.get("password_plain") or dev.get("password", "")
-    key_path = dev.get("ssh_key", "")
-    if key_path and Path(key_path).exists():
-        kwargs["key_filename"] = key_path
-    elif pw:
-        kwargs["password"] = pw
-        kwargs["look_for_keys"] = False
-        kwargs["allow_agent"] = False
-    ssh.connect(**kwargs)
-    return ssh
+
+
+def _drop_session(dev_id: int):
+    """Forget the pooled session of a device whose connection details changed."""
+    with _get_db() as db:
+        row = db.execute(
+            "SELECT host, port, username FROM fc_devices WHERE id=?", (dev_id,)
+        ).fetchone()
+    if row:
+        ssh_pool.discard(row["host"], row["port"] or 22, row["username"])
 
 
 def _run_remote(ssh, cmd: str, timeout: int = 60) -> Tuple[str, str, int]:
@@ -1127,86 +1179,317 @@ def test_connection(dev_id: int) -> Dict:
 
 def _store_sample(dev_id: int, status: Dict):
     try:
-        with _get_db() as db:
-            db.execute(
-                "INSERT INTO fc_samples(device_id, ts, status_json) VALUES (?,?,?)",
-                (dev_id, status["ts"], json.dumps(status))
-            )
-            # Purge old samples
-            cutoff = int(time.time()) - _RETENTION_DAYS * 86400
-            db.execute(
-                "DELETE FROM fc_samples WHERE device_id=? AND ts<?",
-                (dev_id, cutoff)
-            )
+        _samples.enqueue(dev_id, status)
     except Exception as exc:
         logger.warning("[fan_controller] store_sample error: %s", exc)
 
 
 def get_latest(dev_id: int) -> Optional[Dict]:
     try:
-        with _get_db() as db:
-            row = db.execute(
-                "SELECT status_json FROM fc_samples WHERE device_id=? ORDER BY ts DESC LIMIT 1",
-                (dev_id,)
-            ).fetchone()
-        return json.loads(row[0]) if row else None
+        return _samples.get_latest(dev_id)
     except Exception:
         return None
 
 
+def get_latest_map(dev_ids: List[int], with_raw: bool = True) -> Dict[int, Optional[Dict]]:
+    """Latest status for several devices at once ({dev_id: status or None})."""
+    try:
+        latest = _samples.get_latest_many(dev_ids, with_raw=with_raw)
+    except Exception:
+        latest = {}
+    return {dev_id: latest.get(dev_id) for dev_id in dev_ids}
+
+
 def get_history(dev_id: int, hours: int = 24) -> List[Dict]:
+    """Status dicts for the last `hours` hours (without the raw output)."""
     try:
         cutoff = int(time.time()) - hours * 3600
-        with _get_db() as db:
-            rows = db.execute(
-                "SELECT status_json FROM fc_samples WHERE device_id=? AND ts>? ORDER BY ts ASC",
-                (dev_id, cutoff)
-            ).fetchall()
-        return [json.loads(r[0]) for r in rows]
+        return _samples.get_history(dev_id, cutoff + 1)
     except Exception:
         return []
 
 
-def _poll_all():
-    global _poll_running
-    while _poll_running:
-        try:
-            devices = list_devices()
-            for d in devices:
-                if not d.get("enabled"):
-                    continue
-                full_dev = get_device(d["id"])
-                if not full_dev:
-                    continue
-                status = fetch_status(full_dev)
-                _store_sample(d["id"], status)
-        except Exception as exc:
-            logger.warning("[fan_controller] poll_all error: %s", exc)
-        time.sleep(_POLL_INTERVAL)
+def _load_poll_targets() -> Dict[int, tuple]:
+    """All enabled devices in one query, decrypted once per reload."""
+    with _get_db() as db:
+        rows = db.execute("SELECT * FROM fc_devices WHERE enabled=1").fetchall()
+    targets = {}
+    for row in rows:
+        dev = _row_to_device(row)
+        targets[dev["id"]] = (dev, poll_interval_for(dev))
+    FAN_RPM.retain("device_id", targets)       # also devices deleted in another worker
+    return targets
+
+
+def _poll_device(dev: Dict) -> bool:
+    status = fetch_status(dev)
+    _store_sample(dev["id"], status)
+    FAN_RPM.replace([({"fan": f.get("label", "?"), "device": dev.get("name", "")}, f.get("rpm"))
+                     for f in status.get("fans") or []], device_id=dev["id"])
+    return bool(status.get("ok"))
+
+
+def reload_polling():
+    """
+    Pick up added/changed/removed devices within a second, also from a
+    Gunicorn worker whose scheduler is a copy (see PollScheduler share_dir).
+    """
+    if _scheduler:
+        _scheduler.reload()
+
+
+def get_poll_status() -> Dict[int, Dict]:
+    return _scheduler.status() if _scheduler else {}
 
 
 def start_polling():
-    global _poll_thread, _poll_running
-    if _poll_thread and _poll_thread.is_alive():
+    global _scheduler
+    if _scheduler and _scheduler.running:
         return
-    _poll_running = True
-    _poll_thread = threading.Thread(target=_poll_all, daemon=True, name="fc_poll")
-    _poll_thread.start()
-    logger.info("[fan_controller] polling started (interval=%ds)", _POLL_INTERVAL)
+    _scheduler = PollScheduler("fc_poll", _poll_device, loader=_load_poll_targets,
+                               max_workers=_POLL_WORKERS, timeout=_POLL_TIMEOUT,
+                               share_dir=_DB_FILE.parent if _DB_FILE else None)
+    _scheduler.start()
+    logger.info("[fan_controller] polling started (%d workers, per-device intervals)",
+                _POLL_WORKERS)
 
 
 def stop_polling():
-    global _poll_running
-    _poll_running = False
+    if _scheduler:
+        _scheduler.stop()
 
 
 # ── Auto-Detect ───────────────────────────────────────────────────────────────
 
+_DETECT_TIMEOUT = 60     # whole probe, including slow `ipmitool sdr`
+_DETECT_WORKERS = 16     # concurrent hosts in detect_many()
+
+# Every check runs in ONE remote command; sections are delimited by "@@name".
+# Tool sections are only emitted when the tool is installed.
+DETECT_SCRIPT = r"""
+t() { if command -v timeout >/dev/null 2>&1; then timeout "$@"; else shift; "$@"; fi; }
+echo @@hostname; hostname 2>/dev/null
+echo @@os; grep -m1 '^PRETTY_NAME=' /etc/os-release 2>/dev/null
+echo @@power; ls /sys/class/power_supply/ 2>/dev/null
+echo @@chassis; cat /sys/class/dmi/id/chassis_type 2>/dev/null
+echo @@vendor; cat /sys/class/dmi/id/sys_vendor 2>/dev/null
+echo @@hwmon
+for d in /sys/class/hwmon/hwmon*; do
+  [ -d "$d" ] || continue
+  pwms=""; for p in "$d"/pwm[0-9]; do [ -e "$p" ] && pwms="$pwms ${p##*/}"; done
+  fans=""; for f in "$d"/fan[0-9]_input; do [ -e "$f" ] && fans="$fans $(basename "$f" _input)=$(cat "$f" 2>/dev/null)"; done
+  temps=$(ls "$d"/temp*_input 2>/dev/null | wc -l)
+  echo "$d|$(cat "$d/name" 2>/dev/null)|$pwms|$fans|$temps"
+done
+if command -v liquidctl >/dev/null 2>&1; then
+  echo @@liquidctl; liquidctl --version 2>&1 | head -1
+  echo @@liquidctl_list; t 15 liquidctl list --json 2>/dev/null || t 15 liquidctl list 2>&1 | head -20
+fi
+if command -v sensors >/dev/null 2>&1; then
+  echo @@sensors; sensors --version 2>&1 | head -1
+  echo @@sensors_out; t 10 sensors 2>/dev/null | head -30
+fi
+if command -v ipmitool >/dev/null 2>&1; then
+  echo @@ipmi; ipmitool -V 2>&1 | head -1
+  echo @@ipmi_fans; t 20 ipmitool sdr type Fan 2>&1 | head -10
+fi
+if command -v nbfc >/dev/null 2>&1; then
+  echo @@nbfc; nbfc --version 2>&1 | head -1
+  echo @@nbfc_status; t 10 nbfc status -a 2>&1 | head -20
+fi
+echo @@end
+"""
+
+
+def _split_sections(output: str) -> Dict[str, List[str]]:
+    """"@@name" delimited probe output → {name: lines}, bodies kept verbatim."""
+    sections: Dict[str, List[str]] = {}
+    current = None
+    for line in output.splitlines():
+        if line.startswith("@@"):
+            current = line[2:].strip()
+            sections[current] = []
+        elif current is not None:
+            sections[current].append(line)
+    return sections
+
+
+def _suggestion(ctype: str, confidence: str, reason: str, detected: str = "",
+                extra: Dict = None, **more) -> Dict:
+    s = {
+        "controller_type": ctype,
+        "label": CONTROLLER_TYPES[ctype]["label"],
+        "icon": CONTROLLER_TYPES[ctype]["icon"],
+        "confidence": confidence,
+        "reason": reason,
+        "detected_devices": detected,
+        "extra_config": extra or {},
+    }
+    s.update(more)
+    return s
+
+
+def _parse_hwmon(lines: List[str]) -> List[Dict]:
+    """hwmon lines "path|name| pwm1 pwm2| fan1=1200|temps" → channel dicts."""
+    chips = []
+    for line in lines:
+        parts = line.split("|")
+        if len(parts) < 5:
+            continue
+        path, name, pwms, fans, temps = parts[:5]
+        rpm = {}
+        for item in fans.split():
+            key, _, value = item.partition("=")
+            try:
+                rpm[key] = int(value)
+            except ValueError:
+                rpm[key] = None
+        chips.append({
+            "path": path,
+            "name": name,
+            "pwm": [f"{path}/{p}" for p in pwms.split()],
+            "fans": rpm,
+            "temps": int(temps) if temps.strip().isdigit() else 0,
+        })
+    return chips
+
+
+def parse_detect_output(host: str, output: str) -> Dict:
+    """
+    Turn the sectioned DETECT_SCRIPT output into the detect_controllers()
+    result: system info, hwmon channels and ranked suggestions.
+    """
+    sec = _split_sections(output)
+    text = lambda name, limit=None: "\n".join(sec.get(name, [])[:limit]).strip()
+
+    result = {
+        "ok": False,
+        "error": None,
+        "host": host,
+        "os": "",
+        "hostname": text("hostname", 1),
+        "is_laptop": False,
+        "hwmon": _parse_hwmon(sec.get("hwmon", [])),
+        "suggestions": [],
+    }
+    if "end" not in sec:
+        result["error"] = "Detection probe did not complete"
+        return result
+
+    result["os"] = text("os", 1).replace("PRETTY_NAME=", "").strip("\"'") or "Linux"
+    if any(re.search(r"BAT|battery", l, re.IGNORECASE) for l in sec.get("power", [])):
+        result["is_laptop"] = True
+    # Chassis types 8-11 and 14 are laptops/notebooks
+    if text("chassis", 1) in ("8", "9", "10", "11", "14"):
+        result["is_laptop"] = True
+
+    pwm_chips = [c for c in result["hwmon"] if c["pwm"]]
+    pwm_paths = [p for c in pwm_chips for p in c["pwm"]]
+    suggestions = []
+
+    # 1. liquidctl
+    if "liquidctl" in sec:
+        lc_ver = text("liquidctl", 1)
+        lc_list = text("liquidctl_list")
+        devices_found = []
+        try:
+            devs = json.loads(lc_list)
+            if isinstance(devs, list):
+                devices_found = [d.get("description", d.get("device", "")) for d in devs]
+        except (json.JSONDecodeError, TypeError):
+            devices_found = [l.strip() for l in lc_list.splitlines() if "Device" in l or "#" in l]
+
+        if devices_found:
+            match_str = ""
+            for d in devices_found:
+                for keyword in ["Commander", "Smart Device", "Kraken", "Quadro", "Octo", "HUE"]:
+                    if keyword.lower() in d.lower():
+                        match_str = keyword
+                        break
+                if match_str:
+                    break
+            suggestions.append(_suggestion(
+                "liquidctl", "high",
+                f"liquidctl {lc_ver} found with {len(devices_found)} device(s)",
+                "\n".join(devices_found[:5]), {"match_str": match_str, "use_direct": False}))
+        else:
+            suggestions.append(_suggestion(
+                "liquidctl", "medium",
+                f"liquidctl {lc_ver} installed but no devices listed "
+                f"(may need --direct-access or udev rules)",
+                lc_list[:300], {"match_str": "", "use_direct": True}))
+
+    # 2. lm-sensors
+    if "sensors" in sec:
+        sensors_out = text("sensors_out")
+        fan_count = len(re.findall(r"RPM", sensors_out, re.IGNORECASE))
+        temp_count = len(re.findall(r"°C", sensors_out))
+        suggestions.append(_suggestion(
+            "lm_sensors", "high" if (fan_count > 0 or pwm_paths) else "medium",
+            f"lm-sensors installed: {temp_count} temp sensor(s), {fan_count} fan(s), "
+            f"{len(pwm_paths)} PWM channel(s)",
+            sensors_out[:400], channels=pwm_paths))
+
+    # 3. PWM sysfs (always check)
+    if pwm_chips:
+        suggestions.append(_suggestion(
+            "pwm_sysfs", "high",
+            "Direct PWM sysfs nodes found (no extra tool needed)",
+            "\n".join(f"{c['name']}: {len(c['pwm'])} PWM channel(s)" for c in pwm_chips)[:300],
+            channels=pwm_paths))
+
+    # 4. IPMI
+    if "ipmi" in sec:
+        ipmi_fans = text("ipmi_fans", 10)
+        fan_count_ipmi = len([l for l in ipmi_fans.splitlines() if "|" in l])
+        dmi_vendor = text("vendor", 1).lower()
+        vendor = "generic"
+        if "dell" in dmi_vendor:
+            vendor = "dell"
+        elif "hp" in dmi_vendor or "hewlett" in dmi_vendor:
+            vendor = "hp"
+        elif "supermicro" in dmi_vendor:
+            vendor = "supermicro"
+        suggestions.append(_suggestion(
+            "ipmi", "high" if fan_count_ipmi > 0 else "medium",
+            f"ipmitool found ({vendor} vendor), {fan_count_ipmi} fan sensor(s) via IPMI",
+            ipmi_fans[:300],
+            {"ipmi_host": "localhost", "ipmi_user": "ADMIN", "ipmi_pass": "", "vendor": vendor}))
+
+    # 5. nbfc (laptops)
+    if "nbfc" in sec or result["is_laptop"]:
+        installed = "nbfc" in sec
+        nbfc_status = text("nbfc_status")
+        reason = (
+            f"nbfc-linux installed, {len([l for l in nbfc_status.splitlines() if 'Fan' in l])} fan(s) detected"
+            if installed
+            else "Laptop detected but nbfc-linux not installed — install from https://github.com/nbfc-linux/nbfc-linux"
+        )
+        suggestions.append(_suggestion(
+            "nbfc", "high" if installed else "low", reason,
+            nbfc_status[:300] if installed else ""))
+
+    # ── If nothing found, suggest based on OS/hardware ────────────────────────
+    if not suggestions:
+        suggestions.append(_suggestion(
+            "lm_sensors", "low",
+            "No fan control tools detected. Install lm-sensors for basic fan monitoring."))
+
+    # ── Sort: high > medium > low (stable, so liquidctl stays first on ties) ──
+    order = {"high": 0, "medium": 1, "low": 2}
+    suggestions.sort(key=lambda s: order.get(s["confidence"], 3))
+
+    result["suggestions"] = suggestions
+    result["ok"] = True
+    return result
+
+
 def detect_controllers(host: str, port: int = 22, username: str = "root",
                        password: str = "", ssh_key: str = "") -> Dict:
     """
     Connect to a remote host via SSH and detect which fan controller tools
-    are available. Returns a ranked list of suggestions with detected devices.
+    are available.  All checks run as one probe script (DETECT_SCRIPT) in a
+    single round trip.
 
     Returns:
         {
@@ -1216,6 +1499,7 @@ def detect_controllers(host: str, port: int = 22, username: str = "root",
           "os": str,
           "hostname": str,
           "is_laptop": bool,
+          "hwmon": [{"path", "name", "pwm": [paths], "fans": {fanN: rpm}, "temps": int}],
           "suggestions": [
               {
                 "controller_type": str,
@@ -1225,6 +1509,7 @@ def detect_controllers(host: str, port: int = 22, username: str = "root",
                 "reason": str,
                 "detected_devices": str,
                 "extra_config": dict,
+                "channels": [pwm paths]          (lm_sensors / pwm_sysfs only)
               },
               ...
           ]
@@ -1238,197 +1523,15 @@ def detect_controllers(host: str, port: int = 22, username: str = "root",
         "ssh_key": ssh_key,
     }
 
-    result = {
-        "ok": False,
-        "error": None,
-        "host": host,
-        "os": "",
-        "hostname": "",
-        "is_laptop": False,
-        "suggestions": [],
-    }
-
     ssh = None
     try:
         ssh = _ssh_connect(dev)
-
-        def _r(cmd, timeout=10):
-            out, err, code = _run_remote(ssh, cmd, timeout=timeout)
-            return (out or "").strip(), (err or "").strip(), code
-
-        # ── Gather system info ────────────────────────────────────────────────
-        hostname_out, _, _ = _r("hostname 2>/dev/null")
-        result["hostname"] = hostname_out
-
-        os_out, _, _ = _r("cat /etc/os-release 2>/dev/null | grep -E '^PRETTY_NAME=' | head -1")
-        result["os"] = os_out.replace('PRETTY_NAME=', '').strip('"\'') or "Linux"
-
-        # Detect if laptop (battery present)
-        bat_out, _, bat_code = _r("ls /sys/class/power_supply/ 2>/dev/null | grep -iE 'BAT|battery'")
-        result["is_laptop"] = (bat_code == 0 and bool(bat_out))
-
-        # Detect chassis type via DMI
-        chassis_out, _, _ = _r("cat /sys/class/dmi/id/chassis_type 2>/dev/null")
-        chassis_type = chassis_out.strip()
-        # Chassis types 8-11 are laptops/notebooks
-        if chassis_type in ("8", "9", "10", "11", "14"):
-            result["is_laptop"] = True
-
-        # ── Check each tool ───────────────────────────────────────────────────
-        suggestions = []
-
-        # 1. liquidctl
-        lc_ver, _, lc_code = _r("liquidctl --version 2>&1 | head -1")
-        if lc_code == 0 and lc_ver:
-            lc_list, _, _ = _r("liquidctl list --json 2>/dev/null || liquidctl list 2>&1 | head -20", timeout=15)
-            # Parse device names from JSON or text
-            devices_found = []
-            try:
-                devs = json.loads(lc_list)
-                if isinstance(devs, list):
-                    devices_found = [d.get("description", d.get("device", "")) for d in devs]
-            except (json.JSONDecodeError, TypeError):
-                for line in lc_list.splitlines():
-                    if "Device" in line or "#" in line:
-                        devices_found.append(line.strip())
-
-            if devices_found:
-                # Determine best match string
-                match_str = ""
-                for d in devices_found:
-                    for keyword in ["Commander", "Smart Device", "Kraken", "Quadro", "Octo", "HUE"]:
-                        if keyword.lower() in d.lower():
-                            match_str = keyword
-                            break
-                    if match_str:
-                        break
-
-                suggestions.append({
-                    "controller_type": "liquidctl",
-                    "label": CONTROLLER_TYPES["liquidctl"]["label"],
-                    "icon": CONTROLLER_TYPES["liquidctl"]["icon"],
-                    "confidence": "high",
-                    "reason": f"liquidctl {lc_ver} found with {len(devices_found)} device(s)",
-                    "detected_devices": "\n".join(devices_found[:5]),
-                    "extra_config": {"match_str": match_str, "use_direct": False},
-                })
-            else:
-                suggestions.append({
-                    "controller_type": "liquidctl",
-                    "label": CONTROLLER_TYPES["liquidctl"]["label"],
-                    "icon": CONTROLLER_TYPES["liquidctl"]["icon"],
-                    "confidence": "medium",
-                    "reason": f"liquidctl {lc_ver} installed but no devices listed (may need --direct-access or udev rules)",
-                    "detected_devices": lc_list[:300],
-                    "extra_config": {"match_str": "", "use_direct": True},
-                })
-
-        # 2. lm-sensors
-        sensors_ver, _, sensors_code = _r("sensors --version 2>&1 | head -1")
-        if sensors_code == 0:
-            sensors_out, _, _ = _r("sensors 2>/dev/null | head -30")
-            fan_count = len(re.findall(r"RPM", sensors_out, re.IGNORECASE))
-            temp_count = len(re.findall(r"°C", sensors_out))
-            pwm_out, _, _ = _r("ls /sys/class/hwmon/hwmon*/pwm[0-9] 2>/dev/null | wc -l")
-            pwm_count = int(pwm_out.strip() or "0")
-
-            suggestions.append({
-                "controller_type": "lm_sensors",
-                "label": CONTROLLER_TYPES["lm_sensors"]["label"],
-                "icon": CONTROLLER_TYPES["lm_sensors"]["icon"],
-                "confidence": "high" if (fan_count > 0 or pwm_count > 0) else "medium",
-                "reason": f"lm-sensors installed: {temp_count} temp sensor(s), {fan_count} fan(s), {pwm_count} PWM channel(s)",
-                "detected_devices": sensors_out[:400],
-                "extra_config": {},
-            })
-
-        # 3. PWM sysfs (always check)
-        pwm_nodes_out, _, _ = _r(
-            "for h in /sys/class/hwmon/hwmon*; do "
-            "name=$(cat $h/name 2>/dev/null); "
-            "pwms=$(ls $h/pwm[0-9] 2>/dev/null | wc -l); "
-            "[ \"$pwms\" -gt 0 ] && echo \"$name: $pwms PWM channel(s)\"; "
-            "done 2>/dev/null"
-        )
-        if pwm_nodes_out:
-            suggestions.append({
-                "controller_type": "pwm_sysfs",
-                "label": CONTROLLER_TYPES["pwm_sysfs"]["label"],
-                "icon": CONTROLLER_TYPES["pwm_sysfs"]["icon"],
-                "confidence": "high",
-                "reason": "Direct PWM sysfs nodes found (no extra tool needed)",
-                "detected_devices": pwm_nodes_out[:300],
-                "extra_config": {},
-            })
-
-        # 4. IPMI
-        ipmi_ver, _, ipmi_code = _r("ipmitool -V 2>&1 | head -1")
-        if ipmi_code == 0:
-            ipmi_fans, _, _ = _r("ipmitool sdr type Fan 2>&1 | head -10", timeout=20)
-            fan_count_ipmi = len([l for l in ipmi_fans.splitlines() if "|" in l])
-            # Detect vendor
-            dmi_vendor, _, _ = _r("cat /sys/class/dmi/id/sys_vendor 2>/dev/null")
-            vendor = "generic"
-            if "dell" in dmi_vendor.lower():
-                vendor = "dell"
-            elif "hp" in dmi_vendor.lower() or "hewlett" in dmi_vendor.lower():
-                vendor = "hp"
-            elif "supermicro" in dmi_vendor.lower():
-                vendor = "supermicro"
-
-            suggestions.append({
-                "controller_type": "ipmi",
-                "label": CONTROLLER_TYPES["ipmi"]["label"],
-                "icon": CONTROLLER_TYPES["ipmi"]["icon"],
-                "confidence": "high" if fan_count_ipmi > 0 else "medium",
-                "reason": f"ipmitool found ({vendor} vendor), {fan_count_ipmi} fan sensor(s) via IPMI",
-                "detected_devices": ipmi_fans[:300],
-                "extra_config": {"ipmi_host": "localhost", "ipmi_user": "ADMIN", "ipmi_pass": "", "vendor": vendor},
-            })
-
-        # 5. nbfc (laptops)
-        nbfc_ver, _, nbfc_code = _r("nbfc status --version 2>&1 | head -1 || nbfc --version 2>&1 | head -1")
-        if nbfc_code == 0 or result["is_laptop"]:
-            nbfc_status, _, _ = _r("nbfc status -a 2>&1 | head -20")
-            confidence = "high" if nbfc_code == 0 else "low"
-            reason = (
-                f"nbfc-linux installed, {len([l for l in nbfc_status.splitlines() if 'Fan' in l])} fan(s) detected"
-                if nbfc_code == 0
-                else "Laptop detected but nbfc-linux not installed — install from https://github.com/nbfc-linux/nbfc-linux"
-            )
-            suggestions.append({
-                "controller_type": "nbfc",
-                "label": CONTROLLER_TYPES["nbfc"]["label"],
-                "icon": CONTROLLER_TYPES["nbfc"]["icon"],
-                "confidence": confidence,
-                "reason": reason,
-                "detected_devices": nbfc_status[:300] if nbfc_code == 0 else "",
-                "extra_config": {},
-            })
-
-        # ── If nothing found, suggest based on OS/hardware ────────────────────
-        if not suggestions:
-            # Always suggest lm_sensors for Linux
-            suggestions.append({
-                "controller_type": "lm_sensors",
-                "label": CONTROLLER_TYPES["lm_sensors"]["label"],
-                "icon": CONTROLLER_TYPES["lm_sensors"]["icon"],
-                "confidence": "low",
-                "reason": "No fan control tools detected. Install lm-sensors for basic fan monitoring.",
-                "detected_devices": "",
-                "extra_config": {},
-            })
-
-        # ── Sort: high > medium > low, then liquidctl first if present ────────
-        order = {"high": 0, "medium": 1, "low": 2}
-        suggestions.sort(key=lambda s: order.get(s["confidence"], 3))
-
-        result["suggestions"] = suggestions
-        result["ok"] = True
-
+        out, _, _ = _run_remote(ssh, DETECT_SCRIPT, timeout=_DETECT_TIMEOUT)
+        return parse_detect_output(host, out)
     except Exception as exc:
-        result["error"] = str(exc)
         logger.warning("[fan_controller] detect_controllers error for %s: %s", host, exc)
+        return {"ok": False, "error": str(exc), "host": host, "os": "", "hostname": "",
+                "is_laptop": False, "hwmon": [], "suggestions": []}
     finally:
         if ssh:
             try:
@@ -1436,4 +1539,24 @@ def detect_controllers(host: str, port: int = 22, username: str = "root",
             except Exception:
                 pass
 
-    return result
+
+def detect_many(targets: List[Dict], max_workers: int = _DETECT_WORKERS) -> List[Dict]:
+    """
+    Run detect_controllers() for many hosts concurrently.
+    targets: [{"host", "port", "username", "password", "ssh_key"}, ...];
+    results come back in the same order.
+    """
+    def _one(t):
+        return detect_controllers(
+            host=t["host"],
+            port=int(t.get("port") or 22),
+            username=t.get("username") or "root",
+            password=t.get("password") or "",
+            ssh_key=t.get("ssh_key") or "",
+        )
+
+    if not targets:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(targets)),
+                            thread_name_prefix="fc_detect") as pool:
+        return list(pool.map(_one, targets))
@@ -0,0 +1,489 @@
+"""
+fan_curve.py — FleetPilot closed-loop fan curve engine
+
+Drives fans from temperatures instead of manual slider changes.  A curve maps
+one temperature sensor of a device to the duty of one fan channel:
+
+    points       [[30, 20], [50, 40], [70, 80], [80, 100]]   (°C, duty %)
+    hysteresis   °C the temperature must fall before the duty follows it down
+    rate_limit   max duty change in %/s (0 = unlimited)
+    min_delta    only write when the duty moved at least this many %
+    interval     seconds between control ticks for the device
+
+Every device with enabled curves gets one control target on a PollScheduler.
+Each tick reads temperatures once over the device's pooled SSH session (see
+ssh_pool) and evaluates all of that device's curves.  A fan command is sent
+only when the output crosses min_delta, so a steady system generates read
+traffic only.  If the curve's sensor is missing for several ticks in a row,
+the fan is driven to failsafe_pct.
+
+Supported devices: fan_controller (all controller types) and
+corsair_commander.
+
+The engine runs in the process that called start() (the Gunicorn master
+under preload_app).  It keeps the per-curve state in fan_curve.curves.json
+next to the scheduler's fan_curve.status.json, and get_status() in a worker
+reads it from there.
+
+Database: DATA_DIR/fan_curve.db
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import corsair_commander
+import db_pool
+import fan_controller
+from poll_scheduler import PollScheduler
+
+logger = logging.getLogger(__name__)
+
+MODULES = ("fan_controller", "corsair_commander")
+
+_DB_FILE: Optional[Path] = None
+_scheduler: Optional[PollScheduler] = None
+_MAX_BACKOFF = 30        # an unreachable device is retried at least this often
+_MISSED_READS = 3        # ticks without a sensor value before failsafe
+
+# curve id -> CurveState
+_states: Dict[int, "CurveState"] = {}
+_states_lock = threading.Lock()
+_publish_lock = threading.Lock()
+_published: Optional[tuple] = None      # (path, text) this process last wrote
+
+
+# ── Database ──────────────────────────────────────────────────────────────────
+
+def _get_db():
+    return db_pool.connect(_DB_FILE)
+
+
+def init_db(data_dir: str):
+    global _DB_FILE
+    _DB_FILE = Path(data_dir) / "fan_curve.db"
+    with _get_db() as db:
+        db.executescript("""
+        CREATE TABLE IF NOT EXISTS fan_curves (
+            id           INTEGER PRIMARY KEY AUTOINCREMENT,
+            module       TEXT NOT NULL,
+            device_id    INTEGER NOT NULL,
+            channel      TEXT NOT NULL,
+            sensor       TEXT NOT NULL DEFAULT '',
+            points_json  TEXT NOT NULL,
+            hysteresis   REAL NOT NULL DEFAULT 2.0,
+            rate_limit   REAL NOT NULL DEFAULT 20.0,
+            min_delta    REAL NOT NULL DEFAULT 2.0,
+            interval     INTEGER NOT NULL DEFAULT 3,
+            failsafe_pct REAL NOT NULL DEFAULT 100.0,
+            enabled      INTEGER DEFAULT 1,
+            added_ts     TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(module, device_id, channel)
+        );
+        """)
+    logger.info("fan_curve DB initialised at %s", _DB_FILE)
+
+
+# ── Curve math ────────────────────────────────────────────────────────────────
+
+def normalize_points(points) -> List[List[float]]:
+    """Validate [[temp, duty], ...] and return it sorted by temperature."""
+    if isinstance(points, str):
+        points = json.loads(points)
+    cleaned = []
+    for p in points or []:
+        temp, duty = float(p[0]), float(p[1])
+        if not 0 <= duty <= 100:
+            raise ValueError(f"Duty {duty} outside 0-100 %")
+        cleaned.append([temp, duty])
+    if len(cleaned) < 2:
+        raise ValueError("A fan curve needs at least two points")
+    cleaned.sort(key=lambda p: p[0])
+    return cleaned
+
+
+def evaluate(points: Sequence[Sequence[float]], temp: float) -> float:
+    """Piecewise-linear interpolation, clamped to the first/last point."""
+    if temp <= points[0][0]:
+        return points[0][1]
+    for (t0, d0), (t1, d1) in zip(points, points[1:]):
+        if temp <= t1:
+            if t1 == t0:
+                return d1
+            return d0 + (d1 - d0) * (temp - t0) / (t1 - t0)
+    return points[-1][1]
+
+
+def normalize_settings(fields: Dict) -> Dict:
+    """Coerce and range-check the numeric/flag curve settings present in fields."""
+    out = dict(fields)
+    for key in ("hysteresis", "rate_limit", "min_delta", "failsafe_pct"):
+        if key in out:
+            value = float(out[key])
+            if not value >= 0:                          # also rejects NaN
+                raise ValueError(f"{key} must be >= 0")
+            out[key] = value
+    if "failsafe_pct" in out and out["failsafe_pct"] > 100:
+        raise ValueError("failsafe_pct outside 0-100 %")
+    if "interval" in out:
+        out["interval"] = max(1, int(out["interval"]))
+    if "enabled" in out:
+        out["enabled"] = 1 if out["enabled"] else 0
+    for key in ("channel", "sensor"):
+        if key in out:
+            out[key] = str(out[key])
+    return out
+
+
+def _settings_key(curve: Dict) -> tuple:
+    return (json.dumps(curve["points"]), curve.get("hysteresis"), curve.get("rate_limit"),
+            curve.get("min_delta"), curve.get("failsafe_pct"))
+
+
+class CurveState:
+    """Per-curve controller state: hysteresis, rate limiting and write gating."""
+
+    def __init__(self, curve: Dict):
+        self.configure(curve)
+        self.eff_temp: Optional[float] = None
+        self.output: Optional[float] = None
+        self.written: Optional[float] = None
+        self.last_ts: Optional[float] = None
+        self.missed = 0
+
+    def configure(self, curve: Dict):
+        self.key = _settings_key(curve)
+        self.points = normalize_points(curve["points"])
+        self.hysteresis = max(0.0, float(curve.get("hysteresis", 2.0)))
+        self.rate_limit = max(0.0, float(curve.get("rate_limit", 20.0)))
+        self.min_delta = max(0.0, float(curve.get("min_delta", 2.0)))
+        self.failsafe = float(curve.get("failsafe_pct", 100.0))
+        duties = [p[1] for p in self.points]
+        self.bounds = (min(duties), max(duties))
+
+    def step(self, temp: float, now: float) -> Optional[float]:
+        """Feed one reading; returns the duty to write, or None to leave the fan alone."""
+        self.missed = 0
+        if self.eff_temp is None or temp >= self.eff_temp:
+            self.eff_temp = temp
+        elif temp <= self.eff_temp - self.hysteresis:
+            self.eff_temp = temp + self.hysteresis
+        desired = evaluate(self.points, self.eff_temp)
+
+        if self.output is None or self.last_ts is None:
+            self.output = desired
+        else:
+            change = desired - self.output
+            if self.rate_limit:
+                limit = self.rate_limit * max(0.0, now - self.last_ts)
+                change = max(-limit, min(limit, change))
+            self.output += change
+        self.last_ts = now
+        return self._gate(desired)
+
+    def miss(self, now: float) -> Optional[float]:
+        """No reading for this tick; after a few misses drive to failsafe."""
+        self.missed += 1
+        if self.missed < _MISSED_READS:
+            return None
+        self.output = self.failsafe
+        self.last_ts = now
+        return self._gate(self.failsafe)
+
+    def _gate(self, desired: float) -> Optional[float]:
+        if self.written is None:
+            return self.output
+        if abs(self.output - self.written) >= self.min_delta:
+            return self.output
+        # Always land exactly on the curve's end points / failsafe
+        if self.output == desired and self.output != self.written and \
+                (desired in self.bounds or desired == self.failsafe):
+            return self.output
+        return None
+
+    def committed(self, duty: float):
+        self.written = duty
+
+
+# ── Curve CRUD ────────────────────────────────────────────────────────────────
+
+_FIELDS = ("channel", "sensor", "hysteresis", "rate_limit", "min_delta",
+           "interval", "failsafe_pct", "enabled")
+
+
+def _row_to_curve(row) -> Dict:
+    d = dict(row)
+    try:
+        d["points"] = json.loads(d.pop("points_json"))
+    except Exception:
+        d["points"] = []
+    return d
+
+
+def add_curve(module: str, device_id: int, channel: str, points, sensor: str = "",
+              hysteresis: float = 2.0, rate_limit: float = 20.0, min_delta: float = 2.0,
+              interval: int = 3, failsafe_pct: float = 100.0, enabled: bool = True) -> int:
+    if module not in MODULES:
+        raise ValueError(f"Unknown module: {module}")
+    pts = normalize_points(points)
+    f = normalize_settings(dict(channel=channel, sensor=sensor, hysteresis=hysteresis,
+                                rate_limit=rate_limit, min_delta=min_delta, interval=interval,
+                                failsafe_pct=failsafe_pct, enabled=enabled))
+    try:
+        with _get_db() as db:
+            cur = db.execute(
+                "INSERT INTO fan_curves(module,device_id,channel,sensor,points_json,hysteresis,"
+                "rate_limit,min_delta,interval,failsafe_pct,enabled) VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                (module, device_id, f["channel"], f["sensor"], json.dumps(pts), f["hysteresis"],
+                 f["rate_limit"], f["min_delta"], f["interval"], f["failsafe_pct"], f["enabled"])
+            )
+            curve_id = cur.lastrowid
+    except sqlite3.IntegrityError:
+        raise ValueError(f"Channel {channel} already has a curve")
+    reload()
+    return curve_id
+
+
+def list_curves(module: str = None, device_id: int = None) -> List[Dict]:
+    sql, params = "SELECT * FROM fan_curves WHERE 1=1", []
+    if module:
+        sql += " AND module=?"
+        params.append(module)
+    if device_id is not None:
+        sql += " AND device_id=?"
+        params.append(device_id)
+    with _get_db() as db:
+        rows = db.execute(sql + " ORDER BY device_id, channel", params).fetchall()
+    return [_row_to_curve(r) for r in rows]
+
+
+def get_curve(curve_id: int) -> Optional[Dict]:
+    with _get_db() as db:
+        row = db.execute("SELECT * FROM fan_curves WHERE id=?", (curve_id,)).fetchone()
+    return _row_to_curve(row) if row else None
+
+
+def update_curve(curve_id: int, **kwargs) -> bool:
+    """
+    Update the given fields.  The control loop picks the change up on its next
+    reload; _state_for() reconfigures the running controller state in place.
+    """
+    fields = normalize_settings({k: v for k, v in kwargs.items() if k in _FIELDS})
+    if "points" in kwargs:
+        fields["points_json"] = json.dumps(normalize_points(kwargs["points"]))
+    if not fields:
+        return False
+    set_clause = ", ".join(f"{k}=?" for k in fields)
+    with _get_db() as db:
+        db.execute(f"UPDATE fan_curves SET {set_clause} WHERE id=?",
+                   list(fields.values()) + [curve_id])
+    reload()
+    return True
+
+
+def delete_curve(curve_id: int):
+    with _get_db() as db:
+        db.execute("DELETE FROM fan_curves WHERE id=?", (curve_id,))
+    with _states_lock:
+        _states.pop(curve_id, None)
+    reload()
+
+
+# ── Device adapters ───────────────────────────────────────────────────────────
+
+def _read_fan_controller(dev: Dict) -> Dict[str, float]:
+    status = fan_controller.fetch_status(dev)
+    if not status.get("ok"):
+        raise RuntimeError(status.get("error") or "status read failed")
+    return {t["label"]: t["value"] for t in status.get("temperatures", [])
+            if isinstance(t.get("value"), (int, float))}
+
+
+def _read_commander(dev: Dict) -> Dict[str, float]:
+    status = corsair_commander.fetch_status(dev, initialize=False)
+    if not status.get("ok"):
+        raise RuntimeError(status.get("error") or "status read failed")
+    return {t["label"]: t["value"] for t in status.get("temperatures", [])
+            if isinstance(t.get("value"), (int, float))}
+
+
+_ADAPTERS = {
+    "fan_controller": {
+        "get_device": fan_controller.get_device,
+        "read": _read_fan_controller,
+        "write": lambda dev, channel, duty: fan_controller.set_fan_speed(dev, channel, duty),
+    },
+    "corsair_commander": {
+        "get_device": corsair_commander.get_device,
+        "read": _read_commander,
+        "write": lambda dev, channel, duty: corsair_commander.set_fan_speed(dev, channel, duty),
+    },
+}
+
+
+def pick_sensor(temps: Dict[str, float], sensor: str) -> Optional[float]:
+    """Exact label, else case-insensitive substring, else hottest if sensor is empty."""
+    if not temps:
+        return None
+    if not sensor:
+        return max(temps.values())
+    if sensor in temps:
+        return temps[sensor]
+    needle = sensor.lower()
+    matches = [v for k, v in temps.items() if needle in k.lower()]
+    return max(matches) if matches else None
+
+
+# ── Control loop ──────────────────────────────────────────────────────────────
+
+def _load_targets() -> Dict[tuple, tuple]:
+    """One target per device that has enabled curves; devices decrypted once per reload."""
+    with _get_db() as db:
+        rows = db.execute("SELECT * FROM fan_curves WHERE enabled=1").fetchall()
+    by_device: Dict[tuple, List[Dict]] = {}
+    for row in rows:
+        if row["module"] in _ADAPTERS:
+            by_device.setdefault((row["module"], row["device_id"]), []).append(_row_to_curve(row))
+    targets = {}
+    for key, curves in by_device.items():
+        dev = _ADAPTERS[key[0]]["get_device"](key[1])
+        if not dev or not dev.get("enabled", 1):
+            continue
+        interval = min(c["interval"] for c in curves)
+        targets[key] = ({"module": key[0], "dev": dev, "curves": curves}, interval)
+    # Forget controller state of curves that were deleted or disabled
+    active = {c["id"] for target, _ in targets.values() for c in target["curves"]}
+    with _states_lock:
+        for curve_id in [cid for cid in _states if cid not in active]:
+            del _states[curve_id]
+    _publish_states()
+    return targets
+
+
+def _state_for(curve: Dict) -> CurveState:
+    """The curve's controller state, reconfigured if its settings changed since."""
+    with _states_lock:
+        st = _states.get(curve["id"])
+        if st is None:
+            st = _states[curve["id"]] = CurveState(curve)
+        elif st.key != _settings_key(curve):
+            st.configure(curve)
+        return st
+
+
+def _control_tick(target: Dict) -> bool:
+    adapter = _ADAPTERS[target["module"]]
+    dev = target["dev"]
+    now = time.monotonic()
+    try:
+        temps = adapter["read"](dev)
+    except Exception as exc:
+        logger.debug("[fan_curve] read failed for %s: %s", dev.get("name"), exc)
+        temps = None
+    for curve in target["curves"]:
+        st = _state_for(curve)
+        temp = pick_sensor(temps, curve.get("sensor", "")) if temps else None
+        duty = st.step(temp, now) if temp is not None else st.miss(now)
+        if duty is None:
+            continue
+        duty = round(duty)
+        result = adapter["write"](dev, curve["channel"], duty)
+        if result.get("ok"):
+            st.committed(duty)
+            logger.info("[fan_curve] %s %s → %d%% (%.1f°C)", dev.get("name"),
+                        curve["channel"], duty, temp if temp is not None else float("nan"))
+        else:
+            logger.warning("[fan_curve] write to %s %s failed: %s", dev.get("name"),
+                           curve["channel"], result.get("message"))
+    _publish_states()
+    return temps is not None
+
+
+def reload():
+    if _scheduler:
+        _scheduler.reload()
+
+
+def _curve_states() -> Dict[int, Dict]:
+    with _states_lock:
+        return {
+            cid: {"temp": st.eff_temp, "output": st.output, "written": st.written,
+                  "missed": st.missed}
+            for cid, st in _states.items()
+        }
+
+
+def _states_file() -> Optional[Path]:
+    return _DB_FILE.parent / "fan_curve.curves.json" if _DB_FILE else None
+
+
+def _publish_states():
+    """Write the curve states for get_status() in other processes, if they changed."""
+    global _published
+    path = _states_file()
+    if path is None:
+        return
+    with _publish_lock:
+        text = json.dumps(_curve_states())
+        if (path, text) == _published:
+            return
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            tmp.write_text(text)
+            os.replace(tmp, path)
+            _published = (path, text)
+        except OSError as exc:
+            logger.warning("[fan_curve] could not write %s: %s", path, exc)
+
+
+def _read_states() -> Dict[int, Dict]:
+    path = _states_file()
+    try:
+        data = json.loads(path.read_text()) if path else {}
+    except (OSError, ValueError):
+        return {}
+    return {int(cid): st for cid, st in data.items()}
+
+
+def get_status() -> Dict:
+    """Controller state per curve plus per-device scheduler status."""
+    if _scheduler and _scheduler._remote:
+        curves = _read_states()             # the engine runs in the Gunicorn master
+    else:
+        curves = _curve_states()
+    devices = {}
+    if _scheduler:
+        devices = {f"{k[0]}:{k[1]}": v for k, v in _scheduler.status().items()}
+    return {"curves": curves, "devices": devices}
+
+
+def start():
+    global _scheduler
+    if _scheduler and _scheduler.running:
+        return
+    _scheduler = PollScheduler("fan_curve", _control_tick, loader=_load_targets,
+                               max_workers=8, timeout=30, max_backoff=_MAX_BACKOFF,
+                               reload_interval=60, jitter=0,
+                               share_dir=_DB_FILE.parent if _DB_FILE else None)
+    _scheduler.start()
+    logger.info("fan_curve engine started")
+
+
+def stop():
+    if _scheduler:
+        _scheduler.stop()
+
+
+def _after_fork():
+    global _states_lock, _publish_lock, _published
+    _states_lock = threading.Lock()
+    _publish_lock = threading.Lock()
+    _published = None
+    _states.clear()                 # the engine and its state stay with the parent
+
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,63 @@
+"""
+fanout.py — FleetPilot deadline-bounded parallel calls
+
+Page loads and polls that need several independent API calls (TrueNAS
+pools + disks + datasets + shares + alerts, PBS datastores + tasks + job
+config, ...) used to issue them one after another, so latency was the sum of
+all calls.  gather() runs them on short-lived threads and waits for all of
+them up to a single deadline:
+
+    results, errors = fanout.gather({
+        "pools": client.get_pools,
+        "disks": client.get_disk_summary,
+    }, deadline=20, defaults={"pools": [], "disks": []})
+
+Every name is present in results; a call that raised or missed the deadline
+gets its default (None unless given) and a message in errors.  Calls still
+running at the deadline are abandoned, not interrupted — they finish on their
+own socket timeout in the background.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEADLINE = 20.0
+MAX_WORKERS = 8
+
+
+def gather(calls: Dict[str, Callable[[], Any]], deadline: float = DEFAULT_DEADLINE,
+           defaults: Dict[str, Any] = None,
+           max_workers: int = MAX_WORKERS) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """Run calls concurrently; return ({name: result}, {name: error message})."""
+    defaults = defaults or {}
+    results: Dict[str, Any] = {}
+    errors: Dict[str, str] = {}
+    if not calls:
+        return results, errors
+
+    started = time.monotonic()
+    pool = ThreadPoolExecutor(max_workers=min(max_workers, len(calls)),
+                              thread_name_prefix="fanout")
+    try:
+        futures = {name: pool.submit(fn) for name, fn in calls.items()}
+        wait(futures.values(), timeout=deadline)
+        for name, fut in futures.items():
+            if not fut.done():
+                fut.cancel()
+                errors[name] = f"timed out after {deadline:g}s"
+            elif fut.exception() is not None:
+                errors[name] = str(fut.exception()) or type(fut.exception()).__name__
+            else:
+                results[name] = fut.result()
+                continue
+            results[name] = defaults.get(name)
+    finally:
+        pool.shutdown(wait=False)
+
+    if errors:
+        logger.debug("fanout: %d/%d calls failed in %.2fs: %s", len(errors), len(calls),
+                     time.monotonic() - started, errors)
+    return results, errors
@@ -0,0 +1,397 @@
+"""
+fleet_collector.py — FleetPilot agentless fleet metrics
+
+Collects CPU, RAM, swap, load, filesystem, network and hwmon temperature
+metrics from every managed host in hosts.json.  Each cycle runs ONE compound
+shell command per host over a pooled SSH session (see ssh_pool), parses the
+sectioned output here and stores the result in system_monitor's fleet_samples
+table so managed hosts share the local monitor's schema and retention.
+
+Hosts are polled concurrently; an unreachable host backs off exponentially and
+is skipped before dispatch, so it cannot eat the worker pool on every cycle.
+
+Cycle bound: a host that never answers costs up to _HOST_TIMEOUT (SSH connect
+plus command timeout, 30 s).  The pool is sized from the number of due hosts
+so that even if every one of them times out the cycle finishes within
+_CYCLE_BUDGET (30 s, half the interval) — one worker per due host, up to
+_MAX_WORKERS (128).  Beyond 128 due hosts the worst case grows by
+_HOST_TIMEOUT per further 128 hosts (60 s at 256), and an overrunning
+cycle is logged.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import metrics
+import ssh_pool
+import system_monitor
+from constants import is_localhost
+
+logger = logging.getLogger(__name__)
+
+_DATA_DIR = None
+_poll_thread = None
+_poll_running = False
+_POLL_INTERVAL = 60      # seconds between cycles (matches system_monitor)
+_FIRST_RUN_DELAY = 10    # let the app finish starting before the first cycle
+_MAX_WORKERS = 128       # upper bound on concurrent SSH sessions per cycle
+_CMD_TIMEOUT = 15        # per-host command timeout
+_HOST_TIMEOUT = 30       # worst case per host: ssh_pool connect timeout + _CMD_TIMEOUT
+_CYCLE_BUDGET = 30       # target worst-case cycle duration (half the interval)
+_MAX_BACKOFF = 900       # cap for unreachable hosts
+
+HOST_UP = metrics.gauge("fleetpilot_host_up", "1 if the last SSH poll of the host succeeded",
+                        ("host",))
+
+# Everything is read in one round trip; sections are delimited by "@@name".
+COLLECT_SCRIPT = r"""
+echo @@stat; head -n1 /proc/stat
+echo @@meminfo; cat /proc/meminfo
+echo @@loadavg; cat /proc/loadavg
+echo @@cpufreq; grep -m1 -i 'cpu mhz' /proc/cpuinfo 2>/dev/null
+echo @@df; df -PT -k -x tmpfs -x devtmpfs -x overlay -x squashfs 2>/dev/null || df -P -k 2>/dev/null
+echo @@net; cat /proc/net/dev
+echo @@hwmon
+for d in /sys/class/hwmon/hwmon*; do
+  [ -d "$d" ] || continue
+  n=$(cat "$d/name" 2>/dev/null)
+  for t in "$d"/temp*_input; do
+    [ -r "$t" ] || continue
+    b=${t%_input}
+    echo "$n|$(cat "${b}_label" 2>/dev/null)|$(cat "$t" 2>/dev/null)|$(cat "${b}_max" 2>/dev/null)|$(cat "${b}_crit" 2>/dev/null)"
+  done
+done
+echo @@end
+"""
+
+# host name -> (total_jiffies, idle_jiffies) from the previous cycle
+_prev_cpu: Dict[str, tuple] = {}
+# host name -> {"ok", "error", "ts", "duration_s", "failures", "next_try"}
+_status: Dict[str, Dict] = {}
+_status_lock = threading.Lock()
+_last_cycle: Dict = {}
+
+
+# ── Parsing ──────────────────────────────────────────────────────────────────
+
+def split_sections(output: str) -> Dict[str, List[str]]:
+    sections: Dict[str, List[str]] = {}
+    current = None
+    for line in output.splitlines():
+        if line.startswith("@@"):
+            current = line[2:].strip()
+            sections[current] = []
+        elif current is not None and line.strip():
+            sections[current].append(line)
+    return sections
+
+
+def _parse_cpu(lines: List[str]) -> Optional[tuple]:
+    for line in lines:
+        parts = line.split()
+        if parts and parts[0] == "cpu":
+            vals = [int(v) for v in parts[1:] if v.isdigit()]
+            if len(vals) < 4:
+                return None
+            # idle + iowait count as idle; guest time is already in user/nice
+            idle = vals[3] + (vals[4] if len(vals) > 4 else 0)
+            total = sum(vals[:8])
+            return total, idle
+    return None
+
+
+def _parse_meminfo(lines: List[str]) -> Dict[str, int]:
+    mem = {}
+    for line in lines:
+        key, _, rest = line.partition(":")
+        parts = rest.split()
+        if parts and parts[0].isdigit():
+            mem[key.strip()] = int(parts[0]) * 1024
+    return mem
+
+
+def _parse_df(lines: List[str]) -> List[Dict]:
+    disks = []
+    if not lines:
+        return disks
+    typed = "type" in lines[0].lower()
+    for line in lines[1:]:
+        parts = line.split()
+        min_cols = 7 if typed else 6
+        if len(parts) < min_cols:
+            continue
+        if typed:
+            device, fstype, total, used, free = parts[0], parts[1], parts[2], parts[3], parts[4]
+            mount = " ".join(parts[6:])
+        else:
+            device, fstype, total, used, free = parts[0], "", parts[1], parts[2], parts[3]
+            mount = " ".join(parts[5:])
+        try:
+            total, used, free = int(total) * 1024, int(used) * 1024, int(free) * 1024
+        except ValueError:
+            continue
+        disks.append({
+            'device': device,
+            'mountpoint': mount,
+            'fstype': fstype,
+            'total': total,
+            'used': used,
+            'free': free,
+            'pct': round(used / (used + free) * 100, 1) if (used + free) else 0.0,
+        })
+    return disks
+
+
+def _parse_net(lines: List[str]) -> Dict[str, int]:
+    totals = {'bytes_sent': 0, 'bytes_recv': 0, 'packets_sent': 0, 'packets_recv': 0}
+    for line in lines:
+        if ":" not in line:
+            continue
+        iface, _, rest = line.partition(":")
+        if iface.strip() == "lo":
+            continue
+        vals = rest.split()
+        if len(vals) < 10:
+            continue
+        try:
+            totals['bytes_recv'] += int(vals[0])
+            totals['packets_recv'] += int(vals[1])
+            totals['bytes_sent'] += int(vals[8])
+            totals['packets_sent'] += int(vals[9])
+        except ValueError:
+            continue
+    return totals
+
+
+def _milli(value: str) -> Optional[float]:
+    try:
+        return round(int(value) / 1000.0, 1)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_hwmon(lines: List[str]) -> Dict[str, List[Dict]]:
+    temps: Dict[str, List[Dict]] = {}
+    for line in lines:
+        parts = line.split("|")
+        if len(parts) < 5:
+            continue
+        sensor = parts[0] or "hwmon"
+        current = _milli(parts[2])
+        if current is None:
+            continue
+        temps.setdefault(sensor, []).append({
+            'label': parts[1] or sensor,
+            'current': current,
+            'high': _milli(parts[3]),
+            'critical': _milli(parts[4]),
+        })
+    return temps
+
+
+def parse_output(host: str, output: str, ts: int = None) -> Dict:
+    """
+    Turn the sectioned COLLECT_SCRIPT output into a fleet_samples row.
+    CPU percentage needs two readings, so it is None on a host's first cycle.
+    """
+    ts = int(time.time()) if ts is None else ts
+    sec = split_sections(output)
+
+    cpu_pct = None
+    counters = _parse_cpu(sec.get("stat", []))
+    if counters:
+        prev = _prev_cpu.get(host)
+        _prev_cpu[host] = counters
+        if prev:
+            d_total = counters[0] - prev[0]
+            d_idle = counters[1] - prev[1]
+            if d_total > 0:
+                cpu_pct = round(max(0.0, min(100.0, (d_total - d_idle) / d_total * 100)), 1)
+
+    mem = _parse_meminfo(sec.get("meminfo", []))
+    ram_total = mem.get("MemTotal")
+    ram_avail = mem.get("MemAvailable", mem.get("MemFree"))
+    ram_used = (ram_total - ram_avail) if ram_total is not None and ram_avail is not None else None
+    swap_total = mem.get("SwapTotal")
+    swap_used = (swap_total - mem.get("SwapFree", 0)) if swap_total is not None else None
+
+    load = [None, None, None]
+    for line in sec.get("loadavg", [])[:1]:
+        parts = line.split()
+        try:
+            load = [float(p) for p in parts[:3]]
+        except ValueError:
+            pass
+
+    cpu_freq = None
+    for line in sec.get("cpufreq", [])[:1]:
+        try:
+            cpu_freq = round(float(line.split(":", 1)[1]), 1)
+        except (IndexError, ValueError):
+            pass
+
+    return {
+        'host': host,
+        'ts': ts,
+        'cpu_pct': cpu_pct,
+        'cpu_freq': cpu_freq,
+        'load1': load[0],
+        'load5': load[1],
+        'load15': load[2],
+        'ram_total': ram_total,
+        'ram_used': ram_used,
+        'ram_pct': round(ram_used / ram_total * 100, 1) if ram_total and ram_used is not None else None,
+        'swap_total': swap_total,
+        'swap_used': swap_used,
+        'disk_json': json.dumps(_parse_df(sec.get("df", []))),
+        'net_json': json.dumps(_parse_net(sec.get("net", []))),
+        'temp_json': json.dumps(_parse_hwmon(sec.get("hwmon", []))),
+    }
+
+
+# ── Collection ───────────────────────────────────────────────────────────────
+
+def _load_hosts() -> Dict[str, Dict]:
+    try:
+        with open(os.path.join(_DATA_DIR, "hosts.json"), "r") as f:
+            hosts = json.load(f)
+    except Exception:
+        return {}
+    return {name: h for name, h in hosts.items()
+            if h.get("host") and not is_localhost(h.get("host"))}
+
+
+def _key_path(h: Dict) -> Optional[str]:
+    key = h.get("ssh_key") or ""
+    if key and Path(key).exists():
+        return key
+    default_key = Path.home() / ".ssh" / "id_rsa"
+    return str(default_key) if default_key.exists() else None
+
+
+def collect_host(name: str, h: Dict) -> Optional[Dict]:
+    """Run the collect script on one host. Returns a sample dict or None."""
+    started = time.time()
+    host, port, user = h["host"], int(h.get("port") or 22), h.get("user") or "root"
+    try:
+        out, err, code = ssh_pool.run(host, COLLECT_SCRIPT, port=port, username=user,
+                                      key_path=_key_path(h), timeout=_CMD_TIMEOUT)
+        if "@@end" not in out:
+            raise RuntimeError(err or f"collect script exited with {code}")
+        sample = parse_output(name, out, ts=int(started))
+    except Exception as exc:
+        ssh_pool.discard(host, port, user)
+        _mark(name, False, str(exc), started)
+        return None
+    _mark(name, True, None, started)
+    return sample
+
+
+def _mark(name: str, ok: bool, error: Optional[str], started: float):
+    now = time.time()
+    HOST_UP.set(1 if ok else 0, host=name)
+    metrics.POLL_DURATION.observe(now - started, poller="fleet_collector")
+    if not ok:
+        metrics.POLL_FAILURES.inc(poller="fleet_collector")
+    with _status_lock:
+        st = _status.setdefault(name, {"failures": 0})
+        st["failures"] = 0 if ok else st["failures"] + 1
+        st.update({
+            "ok": ok,
+            "error": error,
+            "ts": int(started),
+            "duration_s": round(now - started, 3),
+            "next_try": now if ok else
+                        now + min(_POLL_INTERVAL * 2 ** (st["failures"] - 1), _MAX_BACKOFF),
+        })
+
+
+def _due(name: str, now: float) -> bool:
+    with _status_lock:
+        st = _status.get(name)
+        return not st or st.get("next_try", 0) <= now
+
+
+def _pool_size(due: int) -> int:
+    """Workers needed for `due` hosts to finish within _CYCLE_BUDGET if all time out."""
+    per_worker = max(1, _CYCLE_BUDGET // _HOST_TIMEOUT)
+    return max(1, min(_MAX_WORKERS, -(-due // per_worker)))
+
+
+def run_cycle(hosts: Dict[str, Dict] = None) -> Dict:
+    """Poll every due host concurrently and store the samples in one transaction."""
+    started = time.time()
+    hosts = _load_hosts() if hosts is None else hosts
+    due = {n: h for n, h in hosts.items() if _due(n, started)}
+    samples = []
+    if due:
+        workers = _pool_size(len(due))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fleet") as pool:
+            for sample in pool.map(lambda item: collect_host(*item), due.items()):
+                if sample:
+                    samples.append(sample)
+        system_monitor.save_fleet_samples(samples)
+
+    # Forget hosts that were removed from hosts.json
+    with _status_lock:
+        for name in [n for n in _status if n not in hosts]:
+            _status.pop(name, None)
+            _prev_cpu.pop(name, None)
+            HOST_UP.remove(host=name)
+
+    duration = round(time.time() - started, 3)
+    _last_cycle.clear()
+    _last_cycle.update({
+        "ts": int(started),
+        "duration_s": duration,
+        "hosts": len(hosts),
+        "polled": len(due),
+        "ok": len(samples),
+        "failed": len(due) - len(samples),
+    })
+    if duration > _POLL_INTERVAL:
+        logger.warning("fleet_collector: cycle took %.1fs (> %ds interval) for %d hosts",
+                       duration, _POLL_INTERVAL, len(due))
+    return dict(_last_cycle)
+
+
+def get_status() -> Dict:
+    with _status_lock:
+        hosts = {n: {k: v for k, v in st.items() if k != "next_try"}
+                 for n, st in _status.items()}
+    return {"cycle": dict(_last_cycle), "hosts": hosts}
+
+
+# ── Background polling thread ─────────────────────────────────────────────────
+
+def _poll_loop():
+    global _poll_running
+    time.sleep(_FIRST_RUN_DELAY)
+    while _poll_running:
+        started = time.time()
+        try:
+            run_cycle()
+        except Exception as exc:
+            logger.warning("fleet_collector poll error: %s", exc)
+        time.sleep(max(1.0, _POLL_INTERVAL - (time.time() - started)))
+
+
+def start_polling(data_dir: str):
+    global _poll_thread, _poll_running, _DATA_DIR
+    _DATA_DIR = data_dir
+    if _poll_thread and _poll_thread.is_alive():
+        return
+    _poll_running = True
+    _poll_thread = threading.Thread(target=_poll_loop, daemon=True, name='fleet-collector')
+    _poll_thread.start()
+    logger.info("fleet_collector polling started (interval=%ds)", _POLL_INTERVAL)
+
+
+def stop_polling():
+    global _poll_running
+    _poll_running = False
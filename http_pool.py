@@ -0,0 +1,211 @@
+"""
+http_pool.py — FleetPilot keep-alive HTTP client for the stdlib API clients
+
+vm_controller and storage_controller talk to Proxmox, Veeam, TrueNAS and
+Unraid with a small urllib helper that built a new SSL context and a new
+TCP + TLS connection for every call.  This module keeps, per endpoint
+(scheme, host, port, verify):
+
+  • a few idle http.client connections that are reused for later calls
+  • a cached SSL context (one verifying, one not)
+  • a semaphore limiting concurrent requests, so a burst of page loads
+    cannot open dozens of sessions against one NAS
+
+Responses are requested with gzip and decoded transparently.  A reused
+connection the server already closed is retried once on a fresh one;
+everything else (timeouts, refused connections, HTTP status codes) is left to
+the caller, so existing retry/backoff logic behaves as before.
+
+Usage:
+    status, body = http_pool.request("GET", url, headers, verify_ssl=False)
+"""
+import gzip
+import http.client
+import logging
+import os
+import ssl
+import threading
+import time
+import zlib
+from typing import Dict, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+logger = logging.getLogger(__name__)
+
+MAX_PER_ENDPOINT = 4        # concurrent requests (and idle connections) per endpoint
+_IDLE_TIMEOUT = 60          # seconds an idle connection is kept
+_MAX_REDIRECTS = 5
+
+_ssl_contexts: Dict[bool, ssl.SSLContext] = {}
+_pools: Dict[Tuple, "_Pool"] = {}
+_lock = threading.Lock()
+_stats = {"requests": 0, "reused": 0, "connects": 0, "stale_retries": 0}
+
+
+def ssl_context(verify: bool) -> ssl.SSLContext:
+    ctx = _ssl_contexts.get(verify)
+    if ctx is None:
+        ctx = ssl.create_default_context()
+        if not verify:
+            ctx.check_hostname = False
+            ctx.verify_mode = ssl.CERT_NONE
+        _ssl_contexts[verify] = ctx
+    return ctx
+
+
+class _Pool:
+    def __init__(self, scheme: str, host: str, port: int, verify: bool):
+        self.scheme, self.host, self.port, self.verify = scheme, host, port, verify
+        self.idle = []              # [(conn, last_used)]
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(MAX_PER_ENDPOINT)
+
+    def get(self, timeout: float, fresh: bool = False):
+        """Return (connection, reused)."""
+        now = time.monotonic()
+        with self.lock:
+            while self.idle and not fresh:
+                conn, last_used = self.idle.pop()
+                if now - last_used < _IDLE_TIMEOUT:
+                    conn.timeout = timeout
+                    if conn.sock is not None:
+                        conn.sock.settimeout(timeout)
+                    return conn, True
+                conn.close()
+        _stats["connects"] += 1
+        if self.scheme == "https":
+            conn = http.client.HTTPSConnection(self.host, self.port, timeout=timeout,
+                                               context=ssl_context(self.verify))
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+        return conn, False
+
+    def put(self, conn):
+        with self.lock:
+            if len(self.idle) < MAX_PER_ENDPOINT:
+                self.idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn, _ in idle:
+            conn.close()
+
+
+def _pool_for(scheme: str, host: str, port: int, verify: bool) -> _Pool:
+    key = (scheme, host.lower(), port, verify)
+    with _lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = _Pool(scheme, host, port, verify)
+        return pool
+
+
+def _decode(resp, body: bytes) -> bytes:
+    encoding = (resp.getheader("Content-Encoding") or "").lower()
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "deflate":
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+
+def _send(pool: _Pool, method: str, target: str, body: Optional[bytes],
+          headers: Dict, timeout: float):
+    conn, reused = pool.get(timeout)
+    try:
+        conn.request(method, target, body=body, headers=headers)
+        resp = conn.getresponse()
+        data = _decode(resp, resp.read())
+    except (http.client.RemoteDisconnected, ConnectionResetError,
+            BrokenPipeError, http.client.CannotSendRequest) as exc:
+        conn.close()
+        if not reused:
+            raise
+        # The server closed our idle keep-alive connection; try a fresh one
+        _stats["stale_retries"] += 1
+        logger.debug("http_pool: stale connection to %s:%s (%s), reconnecting",
+                     pool.host, pool.port, exc)
+        conn, reused = pool.get(timeout, fresh=True)
+        try:
+            conn.request(method, target, body=body, headers=headers)
+            resp = conn.getresponse()
+            data = _decode(resp, resp.read())
+        except BaseException:
+            conn.close()
+            raise
+    except BaseException:
+        conn.close()
+        raise
+    if reused:
+        _stats["reused"] += 1
+    if resp.will_close:
+        conn.close()
+    else:
+        pool.put(conn)
+    return resp, data
+
+
+def request(method: str, url: str, headers: Dict = None, body: bytes = None,
+            verify_ssl: bool = False, timeout: float = 10) -> Tuple[int, bytes]:
+    """
+    Send one request over a pooled keep-alive connection and return
+    (status, body).  Network errors propagate; HTTP error statuses do not
+    raise.  Redirects are followed like urllib does.
+    """
+    hdrs = {"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"}
+    hdrs.update(headers or {})
+    for _ in range(_MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        scheme = parts.scheme or "http"
+        port = parts.port or (443 if scheme == "https" else 80)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        pool = _pool_for(scheme, parts.hostname or "", port, verify_ssl)
+        if not pool.slots.acquire(timeout=timeout):
+            raise TimeoutError(f"timed out waiting for a connection slot to {parts.hostname}")
+        try:
+            _stats["requests"] += 1
+            resp, data = _send(pool, method, target, body, hdrs, timeout)
+        finally:
+            pool.slots.release()
+        location = resp.getheader("Location")
+        if resp.status in (301, 302, 303, 307, 308) and location:
+            url = urljoin(url, location)
+            if resp.status in (301, 302, 303) and method not in ("GET", "HEAD"):
+                method, body = "GET", None
+                hdrs.pop("Content-Type", None)
+            continue
+        return resp.status, data
+    raise http.client.HTTPException(f"too many redirects for {url}")
+
+
+def close_all():
+    with _lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def stats() -> Dict:
+    with _lock:
+        idle = sum(len(p.idle) for p in _pools.values())
+        return dict(_stats, endpoints=len(_pools), idle=idle)
+
+
+def _after_fork():
+    global _lock
+    _lock = threading.Lock()
+    _pools.clear()                  # sockets shared with the parent must not be reused
+    for k in _stats:
+        _stats[k] = 0
+
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,223 @@
+"""
+ingest.py — FleetPilot write-behind queue for background samplers
+
+Pollers in system_monitor, fan_controller, corsair_commander, smart_manager,
+storage_controller and backup_controller used to write their own rows the
+moment a sample arrived.  With many pollers running at once they queued on
+SQLite's single write lock, and a slow disk stalled the polls themselves.
+
+Modules register a sample kind from init_db(), much like retention:
+
+    ingest.register("monitor_sample", db_path, _write_samples)
+
+and pollers hand over samples without touching the database:
+
+    ingest.put("monitor_sample", sample)
+
+One writer thread per database file drains its queue and writes everything
+that arrived within _FLUSH_INTERVAL (or _MAX_BATCH items) in a single
+transaction, calling write_batch(conn, items) once per kind.  If the
+transaction fails, each kind is retried in its own transaction so one bad
+batch does not drop the others.  A full queue drops new samples and counts
+them instead of blocking the poller.
+
+flush() waits until everything queued so far is on disk — used by "refresh
+now" routes that read back what they just polled, and by tests.  It never
+waits longer than its timeout, even when a queue is full.
+
+Writer threads do not survive fork(): a forked child (a Gunicorn worker of the
+preloaded app) forgets the parent's writers and starts its own on first put().
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import db_pool
+
+logger = logging.getLogger(__name__)
+
+_FLUSH_INTERVAL = 0.5       # seconds a sample may wait to be batched with others
+_MAX_BATCH = 1000           # items per write transaction
+_MAX_QUEUE = 20000          # items buffered per database before dropping
+_FLUSH_TIMEOUT = 10.0
+
+# kind -> {"db_path", "write", "on_error"}
+_kinds: Dict[str, Dict] = {}
+# db_path -> _Writer
+_writers: Dict[str, "_Writer"] = {}
+_lock = threading.Lock()
+
+
+class _Writer:
+    """Queue plus the single thread that writes it to one database."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.queue: "queue.Queue" = queue.Queue(maxsize=_MAX_QUEUE)
+        self.metrics = {
+            "written": 0, "failed": 0, "batches": 0, "dropped": 0, "errors": 0,
+            "last_flush_ms": 0.0, "max_flush_ms": 0.0,
+            "last_lag_ms": 0.0, "last_flush": None,
+        }
+        self.thread = threading.Thread(
+            target=self._run, daemon=True,
+            name=f"ingest-{os.path.basename(db_path)}")
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            entry = self.queue.get()
+            batch: List[Tuple] = []
+            waiters: List[threading.Event] = []
+            deadline = time.monotonic() + _FLUSH_INTERVAL
+            while True:
+                if isinstance(entry, threading.Event):
+                    waiters.append(entry)
+                    break                               # flush() wants it now
+                batch.append(entry)
+                if len(batch) >= _MAX_BATCH:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    entry = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+            for ev in waiters:
+                ev.set()
+
+    def _write(self, batch: List[Tuple]):
+        # Group consecutive items by kind, keeping arrival order
+        groups: List[Tuple[str, List[Any]]] = []
+        for kind, item, _ in batch:
+            if groups and groups[-1][0] == kind:
+                groups[-1][1].append(item)
+            else:
+                groups.append((kind, [item]))
+
+        started = time.monotonic()
+        failed = 0
+        conn = db_pool.connect(self.db_path)
+        try:
+            with conn:
+                for kind, items in groups:
+                    _kinds[kind]["write"](conn, items)
+        except Exception as exc:
+            logger.warning("ingest: batch for %s failed (%s); retrying per kind",
+                           os.path.basename(self.db_path), exc)
+            for kind, items in groups:
+                self._notify_error(kind, items)
+                try:
+                    with conn:
+                        _kinds[kind]["write"](conn, items)
+                except Exception as exc2:
+                    self.metrics["errors"] += 1
+                    failed += len(items)
+                    self._notify_error(kind, items)
+                    logger.error("ingest: dropped %d %s item(s): %s", len(items), kind, exc2)
+
+        done = time.monotonic()
+        flush_ms = (done - started) * 1000
+        m = self.metrics
+        m["written"] += len(batch) - failed
+        m["failed"] += failed
+        m["batches"] += 1
+        m["last_flush_ms"] = round(flush_ms, 2)
+        m["max_flush_ms"] = round(max(m["max_flush_ms"], flush_ms), 2)
+        m["last_lag_ms"] = round((done - batch[0][2]) * 1000, 2)
+        m["last_flush"] = time.time()
+
+    @staticmethod
+    def _notify_error(kind: str, items: List[Any]):
+        on_error = _kinds[kind].get("on_error")
+        if on_error:
+            try:
+                on_error(items)
+            except Exception:
+                pass
+
+
+def register(kind: str, db_path, write_batch: Callable[[Any, List[Any]], None],
+             on_error: Optional[Callable[[List[Any]], None]] = None):
+    """
+    Register a sample kind.  write_batch(conn, items) writes a list of items
+    inside the writer's open transaction; on_error(items) is called when a
+    transaction containing those items was rolled back.
+    """
+    with _lock:
+        _kinds[kind] = {"db_path": str(db_path), "write": write_batch, "on_error": on_error}
+
+
+def _writer_for(db_path: str) -> _Writer:
+    with _lock:
+        w = _writers.get(db_path)
+        if w is None:
+            w = _writers[db_path] = _Writer(db_path)
+        return w
+
+
+def put(kind: str, item: Any) -> bool:
+    """Queue item for writing.  Never blocks; returns False if it was dropped."""
+    spec = _kinds.get(kind)
+    if spec is None:
+        raise KeyError(f"Unknown ingest kind: {kind}")
+    w = _writer_for(spec["db_path"])
+    try:
+        w.queue.put_nowait((kind, item, time.monotonic()))
+        return True
+    except queue.Full:
+        w.metrics["dropped"] += 1
+        if w.metrics["dropped"] % 1000 == 1:
+            logger.warning("ingest: queue for %s full, dropping samples",
+                           os.path.basename(spec["db_path"]))
+        return False
+
+
+def flush(timeout: float = _FLUSH_TIMEOUT) -> bool:
+    """
+    Wait until everything queued before this call is written.  Returns False
+    if that did not happen within timeout (including a queue too full to
+    take the flush marker in time).
+    """
+    deadline = time.monotonic() + timeout
+    with _lock:
+        writers = list(_writers.values())
+    events = []
+    for w in writers:
+        ev = threading.Event()
+        try:
+            w.queue.put_nowait(ev)
+        except queue.Full:
+            try:
+                w.queue.put(ev, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                return False
+        events.append(ev)
+    return all(ev.wait(max(0.0, deadline - time.monotonic())) for ev in events)
+
+
+def stats() -> Dict[str, Dict]:
+    """Per-database queue depth, throughput and flush latency."""
+    with _lock:
+        writers = list(_writers.values())
+    return {
+        os.path.basename(w.db_path): dict(w.metrics, depth=w.queue.qsize())
+        for w in writers
+    }
+
+
+def _after_fork():
+    global _lock
+    _lock = threading.Lock()
+    _writers.clear()                # their threads (and queued items) stay with the parent
+
+
+os.register_at_fork(after_in_child=_after_fork)
+atexit.register(flush, 5.0)
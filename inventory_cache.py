@@ -0,0 +1,171 @@
+"""
+inventory_cache.py — FleetPilot stale-while-revalidate cache for live inventory
+
+The VM and storage detail pages used to call the hypervisor or NAS API inside
+the request, so a slow or unreachable box held the page until every retry of
+the HTTP client had run out.  An InventoryCache keeps the last snapshot per
+key (endpoint id, or (endpoint id, node)) and refreshes it in the background:
+
+    overview_cache = InventoryCache("storage_overview", get_storage_overview)
+    snap = overview_cache.get(ep_id)
+    snap["data"], snap["refreshed_at"], snap["error"], snap["refreshing"]
+
+  • get() returns the latest snapshot immediately.  Only the very first read
+    of a key waits (up to first_wait seconds) for data.
+  • a key that has been read is refreshed every `interval` seconds by a
+    PollScheduler, with back-off while the endpoint keeps failing; keys
+    nobody has read for idle_after seconds stop being refreshed
+  • refresh(key) asks for a refresh now, e.g. after a power action or from
+    a "Refresh" button
+  • a failed refresh keeps the previous data and records the error
+
+The scheduler thread is started on first use, so importing a module that
+defines a cache starts nothing.  A forked child (a Gunicorn worker of the
+preloaded app) starts with an empty cache and, on first use, its own
+scheduler.
+"""
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, Hashable
+
+from poll_scheduler import PollScheduler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 60       # seconds between background refreshes of a key
+DEFAULT_IDLE_AFTER = 900    # stop refreshing keys unread for this long
+DEFAULT_FIRST_WAIT = 5.0    # how long the first read of a key waits for data
+
+_caches = weakref.WeakSet()
+
+
+class InventoryCache:
+
+    def __init__(self, name: str, fetch: Callable[[Any], Any],
+                 interval: float = DEFAULT_INTERVAL,
+                 idle_after: float = DEFAULT_IDLE_AFTER,
+                 first_wait: float = DEFAULT_FIRST_WAIT,
+                 max_workers: int = 4, timeout: float = 120):
+        """fetch(key) is called on a worker thread and returns the snapshot data."""
+        self.name = name
+        self._fetch = fetch
+        self._interval = interval
+        self._idle_after = idle_after
+        self._first_wait = first_wait
+        self._entries: Dict[Hashable, Dict] = {}
+        self._cond = threading.Condition()
+        self._scheduler = PollScheduler(name, self._refresh, max_workers=max_workers,
+                                        timeout=timeout, stagger=0)
+        _caches.add(self)
+
+    def _refresh(self, key) -> bool:
+        with self._cond:
+            entry = self._entries.get(key)
+            if entry is None:
+                return True
+            if time.monotonic() - entry["last_read"] > self._idle_after:
+                entry["scheduled"] = False          # nobody is looking any more
+                self._scheduler.remove(key)
+                return True
+            entry["refreshing"] = True
+        started = time.monotonic()
+        try:
+            data, error = self._fetch(key), None
+        except Exception as exc:
+            data, error = None, str(exc) or type(exc).__name__
+        with self._cond:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["refreshing"] = False
+                entry["error"] = error
+                entry["attempted_at"] = time.time()
+                entry["duration"] = round(time.monotonic() - started, 3)
+                if error is None:
+                    entry["data"] = data
+                    entry["refreshed_at"] = entry["attempted_at"]
+            self._cond.notify_all()
+        if error is not None:
+            logger.warning("[%s] refresh of %s failed: %s", self.name, key, error)
+            return False
+        return True
+
+    def _ensure(self, key) -> Dict:
+        """Return key's entry, scheduling background refreshes for it."""
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = {
+                "data": None, "error": None, "refreshed_at": None,
+                "attempted_at": None, "duration": None, "refreshing": False,
+                "last_read": time.monotonic(), "scheduled": False,
+            }
+        if not entry["scheduled"]:
+            entry["scheduled"] = True
+            self._scheduler.start()
+            self._scheduler.upsert(key, key, self._interval)     # due at once
+        return entry
+
+    def get(self, key, wait: float = None) -> Dict:
+        """
+        Latest snapshot for key: {"data", "error", "refreshed_at", "age",
+        "refreshing"}.  data is None until the first successful refresh.
+        """
+        wait = self._first_wait if wait is None else wait
+        with self._cond:
+            entry = self._ensure(key)
+            entry["last_read"] = time.monotonic()
+            if entry["refreshed_at"] is None and entry["attempted_at"] is None:
+                self._cond.wait_for(lambda: entry["attempted_at"] is not None, timeout=wait)
+            return self._snapshot(entry)
+
+    def refresh(self, key, wait: float = 0):
+        """Refresh key now; optionally wait up to `wait` seconds for the result."""
+        with self._cond:
+            entry = self._ensure(key)
+            attempted = entry["attempted_at"]
+            self._scheduler.trigger(key)
+            if wait:
+                self._cond.wait_for(lambda: entry["attempted_at"] != attempted, timeout=wait)
+            return self._snapshot(entry)
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def forget(self, key):
+        """Drop key, e.g. when its endpoint is deleted."""
+        with self._cond:
+            self._entries.pop(key, None)
+        self._scheduler.remove(key)
+
+    def clear(self):
+        with self._cond:
+            keys = list(self._entries)
+            self._entries.clear()
+        for key in keys:
+            self._scheduler.remove(key)
+
+    def stop(self):
+        self._scheduler.stop()
+
+    @staticmethod
+    def _snapshot(entry: Dict) -> Dict:
+        refreshed = entry["refreshed_at"]
+        return {
+            "data": entry["data"],
+            "error": entry["error"],
+            "refreshed_at": refreshed,
+            "age": int(time.time() - refreshed) if refreshed else None,
+            "refreshing": entry["refreshing"],
+        }
+
+
+def _after_fork():
+    # Copied snapshots are never refreshed in the child: start from scratch
+    for cache in list(_caches):
+        cache._cond = threading.Condition()
+        cache._entries.clear()
+
+
+os.register_at_fork(after_in_child=_after_fork)
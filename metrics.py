@@ -0,0 +1,512 @@
+"""
+metrics.py — FleetPilot in-memory metric registry and OpenMetrics exposition
+
+Collectors publish what they ingest into module-level metric families, and
+/metrics renders the registry without touching SQLite:
+
+    DISK_TEMP = metrics.gauge("fleetpilot_disk_temperature_celsius",
+                              "Last SMART temperature", ("disk_id", "source", "device"),
+                              unit="celsius")
+    DISK_TEMP.set(41, disk_id="3", source="local", device="/dev/sda")
+    DISK_TEMP.remove(disk_id="3")          # every series with disk_id="3"
+
+  • gauge / counter / summary families; a summary keeps _count and _sum
+  • each family caches its rendered text and only re-renders after a value
+    actually changed, so a scrape of thousands of unchanged series is a join
+  • register_collector(fn) adds families computed at scrape time from
+    cheap in-process counters (ingest, db_pool, http_pool stats)
+
+Families are process-wide; defining the same name twice returns the first.
+
+Under Gunicorn with preload_app the pollers run in the master while the
+workers answer /metrics, so one process' registry is not enough.  After
+configure(directory) every process writes a snapshot of its registry to
+<directory>/<pid>.json (at most every PUBLISH_INTERVAL seconds, and right
+before it renders), and render() merges the snapshots of all live processes:
+
+  • counters and summaries are added up; a forked child starts from zero,
+    and the totals of processes that exited are folded into retired.json
+  • gauge series are taken from the process that set them last; remove()
+    leaves a tombstone, so a series dropped in one worker is not kept
+    alive by another worker's older copy
+  • collector gauges are added up (queue depths), or take the maximum when
+    the collector says so
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PUBLISH_INTERVAL = 5.0      # seconds between snapshot writes of a process
+
+_lock = threading.Lock()
+_families: Dict[str, "_Family"] = {}
+_collectors: List[Callable[[], Iterable[Tuple]]] = []
+_share: Optional[Path] = None
+_publisher: Optional[threading.Thread] = None
+_published: Optional[str] = None
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_value(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    value = float(value)
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def _fmt_labels(names: Tuple[str, ...], values: Tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class _Family:
+
+    def __init__(self, name: str, kind: str, help_text: str,
+                 labels: Tuple[str, ...] = (), unit: str = None):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.unit = unit
+        self._series: Dict[Tuple, list] = {}
+        self._stamps: Dict[Tuple, float] = {}       # gauges: when each series was last set
+        self._removed: Dict[Tuple, float] = {}      # gauges: ((index, value), ...) -> removed at
+        self._lock = threading.Lock()
+        self._text: Optional[str] = None
+
+    def _key(self, labels: Dict) -> Tuple:
+        try:
+            return tuple(str(labels[n]) for n in self.labels)
+        except KeyError as exc:
+            raise ValueError(f"{self.name}: missing label {exc}") from None
+
+    def set(self, value, **labels):
+        """Gauge: set the series' value."""
+        if value is None:
+            return self.remove(**labels)
+        key = self._key(labels)
+        with self._lock:
+            self._stamps[key] = time.time()
+            self._removed.pop(tuple(enumerate(key)), None)
+            if self._series.get(key) != [value]:
+                self._series[key] = [value]
+                self._text = None
+        _touch()
+
+    def inc(self, amount=1, **labels):
+        """Counter: add amount to the series."""
+        key = self._key(labels)
+        with self._lock:
+            cur = self._series.setdefault(key, [0])
+            cur[0] += amount
+            self._text = None
+        _touch()
+
+    def observe(self, value, **labels):
+        """Summary: count one observation of value."""
+        key = self._key(labels)
+        with self._lock:
+            cur = self._series.setdefault(key, [0, 0.0])
+            cur[0] += 1
+            cur[1] += value
+            self._text = None
+        _touch()
+
+    def remove(self, **match):
+        """Drop every series whose labels include all of match."""
+        items = [(self.labels.index(n), str(v)) for n, v in match.items()]
+        with self._lock:
+            stale = [k for k in self._series if all(k[i] == v for i, v in items)]
+            for k in stale:
+                del self._series[k]
+                self._stamps.pop(k, None)
+            if stale:
+                self._text = None
+            if self.kind == "gauge":
+                # Also when nothing matched here: another process may hold the series
+                self._removed[tuple(sorted(items))] = time.time()
+        _touch()
+
+    def retain(self, label: str, values: Iterable):
+        """Drop every series whose `label` is not one of values."""
+        i = self.labels.index(label)
+        keep = {str(v) for v in values}
+        with self._lock:
+            stale = {k[i] for k in self._series if k[i] not in keep}
+        for v in stale:
+            self.remove(**{label: v})
+
+    def replace(self, series: Iterable[Tuple[Dict, float]], **match):
+        """Make the series matching match exactly `series` ([(labels, value)])."""
+        items = [(self.labels.index(n), str(v)) for n, v in match.items()]
+        wanted = {self._key({**match, **labels}): [value]
+                  for labels, value in series if value is not None}
+        now = time.time()
+        with self._lock:
+            current = {k: v for k, v in self._series.items()
+                       if all(k[i] == v_ for i, v_ in items)}
+            for k in wanted:
+                self._stamps[k] = now
+                self._removed.pop(tuple(enumerate(k)), None)
+            if current != wanted:
+                for k in current:
+                    del self._series[k]
+                    if k not in wanted:
+                        self._stamps.pop(k, None)
+                        self._removed[tuple(enumerate(k))] = now
+                self._series.update(wanted)
+                self._text = None
+        _touch()
+
+    def value(self, **labels):
+        with self._lock:
+            cur = self._series.get(self._key(labels))
+        return None if cur is None else (cur[0] if len(cur) == 1 else tuple(cur))
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+            self._stamps.clear()
+            self._removed.clear()
+            self._text = None
+
+    def _snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "name": self.name, "kind": self.kind, "help": self.help,
+                "labels": list(self.labels), "unit": self.unit,
+                "merge": "latest" if self.kind == "gauge" else "sum",
+                "series": [[list(k), list(v), self._stamps.get(k, 0.0)]
+                           for k, v in self._series.items()],
+                "removed": [[[list(i) for i in m], t] for m, t in self._removed.items()],
+            }
+
+    def render(self) -> str:
+        with self._lock:
+            if self._text is None:
+                self._text = _render(self.name, self.kind, self.help, self.labels,
+                                     self.unit, self._series.items())
+            return self._text
+
+
+def _render(name: str, kind: str, help_text: str, labels: Tuple[str, ...],
+            unit: Optional[str], series) -> str:
+    lines = [f"# TYPE {name} {kind}", f"# HELP {name} {_escape(help_text)}"]
+    if unit:
+        lines.append(f"# UNIT {name} {unit}")
+    for key, cur in sorted(series):
+        lbl = _fmt_labels(labels, key)
+        if kind == "counter":
+            lines.append(f"{name}_total{lbl} {_fmt_value(cur[0])}")
+        elif kind == "summary":
+            lines.append(f"{name}_count{lbl} {_fmt_value(cur[0])}")
+            lines.append(f"{name}_sum{lbl} {_fmt_value(cur[1])}")
+        else:
+            lines.append(f"{name}{lbl} {_fmt_value(cur[0])}")
+    return "\n".join(lines) + "\n"
+
+
+def _family(name: str, kind: str, help_text: str, labels, unit) -> _Family:
+    with _lock:
+        fam = _families.get(name)
+        if fam is None:
+            fam = _families[name] = _Family(name, kind, help_text, labels, unit)
+        return fam
+
+
+def gauge(name: str, help_text: str, labels: Tuple[str, ...] = (), unit: str = None) -> _Family:
+    return _family(name, "gauge", help_text, labels, unit)
+
+
+def counter(name: str, help_text: str, labels: Tuple[str, ...] = (), unit: str = None) -> _Family:
+    return _family(name, "counter", help_text, labels, unit)
+
+
+def summary(name: str, help_text: str, labels: Tuple[str, ...] = (), unit: str = None) -> _Family:
+    return _family(name, "summary", help_text, labels, unit)
+
+
+def register_collector(fn: Callable[[], Iterable[Tuple]]):
+    """
+    fn() is called on every scrape and yields
+    (name, kind, help, label_names, [(label_values, value), ...]), optionally
+    followed by "max" for a gauge that should not be added up across processes.
+    """
+    with _lock:
+        if fn not in _collectors:
+            _collectors.append(fn)
+
+
+def _collect() -> List[Dict]:
+    with _lock:
+        collectors = list(_collectors)
+    out = []
+    for fn in collectors:
+        try:
+            for name, kind, help_text, labels, series, *merge in fn():
+                out.append({
+                    "name": name, "kind": kind, "help": help_text, "labels": list(labels),
+                    "unit": None, "merge": merge[0] if merge else "sum",
+                    "series": [[[str(v) for v in k], [val], 0.0] for k, val in series],
+                })
+        except Exception as exc:
+            logger.warning("metrics: collector %s failed: %s", getattr(fn, "__name__", fn), exc)
+    return out
+
+
+def render() -> str:
+    """The whole registry in OpenMetrics text format."""
+    if _share is not None:
+        return _render_shared()
+    with _lock:
+        families = sorted(_families.values(), key=lambda f: f.name)
+    parts = [f.render() for f in families]
+    for fam in _collect():
+        parts.append(_render(fam["name"], fam["kind"], fam["help"], tuple(fam["labels"]),
+                             None, ((tuple(k), v) for k, v, _ in fam["series"])))
+    parts.append("# EOF\n")
+    return "".join(parts)
+
+
+# ── Cross-process snapshots ──────────────────────────────────────────────────
+
+def configure(directory) -> None:
+    """
+    Share the registry between the processes forked from this one through
+    snapshot files in directory.  Call it once at startup, before forking;
+    snapshots of an earlier run are discarded.
+    """
+    global _share, _published
+    path = Path(directory)
+    path.mkdir(parents=True, exist_ok=True)
+    for old in path.glob("*.json*"):
+        try:
+            old.unlink()
+        except OSError:
+            pass
+    _share, _published = path, None
+    _touch()
+
+
+def _touch():
+    """Make sure this process publishes its snapshot (lazily, once per process)."""
+    global _publisher
+    if _share is None or _publisher is not None:
+        return
+    with _lock:
+        if _publisher is None:
+            _publisher = threading.Thread(target=_publish_loop, name="metrics-publish",
+                                          daemon=True)
+            _publisher.start()
+
+
+def _publish_loop():
+    me = threading.current_thread()
+    while _publisher is me:
+        time.sleep(PUBLISH_INTERVAL)
+        if _publisher is me:
+            _publish()
+
+
+def _snapshot() -> Dict:
+    with _lock:
+        families = list(_families.values())
+    return {"pid": os.getpid(), "families": [f._snapshot() for f in families] + _collect()}
+
+
+def _dumps(snap: Dict) -> str:
+    return json.dumps(snap, separators=(",", ":"), default=float)
+
+
+def _write(path: Path, text: str):
+    tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+def _publish() -> Optional[Dict]:
+    """Write this process' snapshot if it changed; return it."""
+    global _published
+    share = _share
+    if share is None:
+        return None
+    snap = _snapshot()
+    text = _dumps(snap)
+    if text != _published:
+        try:
+            _write(share / f"{snap['pid']}.json", text)
+            _published = text
+        except OSError as exc:
+            logger.warning("metrics: could not publish snapshot to %s: %s", share, exc)
+    return snap
+
+
+def _load(path: Path) -> Optional[Dict]:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _retire(share: Path, dead: List[Path]):
+    """Fold the counters of exited processes into retired.json and drop their files."""
+    with open(share / "retired.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        retired = _load(share / "retired.json") or {"pid": 0, "families": []}
+        snaps = [retired]
+        for path in dead:
+            snap = _load(path)              # None: another process retired it first
+            if snap is not None:
+                snaps.append(snap)
+        if len(snaps) == 1:
+            return
+        families = []
+        for fam in _merge(snaps).values():
+            if fam["kind"] != "gauge":
+                fam["series"] = [[list(k), v, 0.0] for k, (v, _) in fam["series"].items()]
+                fam["removed"] = []
+                families.append(fam)
+        _write(share / "retired.json", _dumps({"pid": 0, "families": families}))
+        for path in dead:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+def _merge(snapshots: Iterable[Dict]) -> Dict[str, Dict]:
+    merged: Dict[str, Dict] = {}
+    for snap in snapshots:
+        for fam in snap.get("families", ()):
+            m = merged.get(fam["name"])
+            if m is None:
+                m = merged[fam["name"]] = dict(fam, series={}, removed={})
+            how = m["merge"]
+            for key, cur, stamp in fam["series"]:
+                key = tuple(key)
+                old = m["series"].get(key)
+                if old is None:
+                    m["series"][key] = (cur, stamp)
+                elif how == "sum":
+                    m["series"][key] = ([a + b for a, b in zip(old[0], cur)], max(old[1], stamp))
+                elif how == "max":
+                    m["series"][key] = (max(old[0], cur), max(old[1], stamp))
+                elif stamp > old[1]:
+                    m["series"][key] = (cur, stamp)
+            for match, stamp in fam.get("removed", ()):
+                match = tuple(tuple(i) for i in match)
+                m["removed"][match] = max(stamp, m["removed"].get(match, 0.0))
+    return merged
+
+
+def _render_shared() -> str:
+    share = _share
+    own = _publish()
+    snaps, dead = [own], []
+    for path in share.glob("*.json"):
+        if path.stem == "retired":
+            continue
+        try:
+            pid = int(path.stem)
+        except ValueError:
+            continue
+        if pid == own["pid"]:
+            continue
+        if not _alive(pid):
+            dead.append(path)
+            continue
+        snap = _load(path)
+        if snap is not None:
+            snaps.append(snap)
+    if dead:
+        try:
+            _retire(share, dead)
+        except OSError as exc:
+            logger.warning("metrics: could not retire snapshots in %s: %s", share, exc)
+    snaps.append(_load(share / "retired.json") or {})
+
+    parts = []
+    for name, fam in sorted(_merge(snaps).items()):
+        removed = fam["removed"].items()
+        series = [(k, v) for k, (v, stamp) in fam["series"].items()
+                  if not any(t >= stamp and all(k[i] == v_ for i, v_ in match)
+                             for match, t in removed)]
+        parts.append(_render(name, fam["kind"], fam["help"], tuple(fam["labels"]),
+                             fam["unit"], series))
+    parts.append("# EOF\n")
+    return "".join(parts)
+
+
+def _after_fork():
+    global _lock, _publisher, _published
+    _lock = threading.Lock()
+    _publisher, _published = None, None
+    for fam in _families.values():
+        fam._lock = threading.Lock()
+        fam.clear()                 # the parent keeps publishing what it collected
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+# ── Shared families ──────────────────────────────────────────────────────────
+
+POLL_DURATION = summary("fleetpilot_poll_duration_seconds",
+                        "Time spent in one poll of a target", ("poller",), unit="seconds")
+POLL_FAILURES = counter("fleetpilot_poll_failures",
+                        "Polls that failed or raised", ("poller",))
+
+
+def _internal_stats():
+    import db_pool
+    import http_pool
+    import ingest
+
+    queues = ingest.stats()
+    yield ("fleetpilot_ingest_queue_depth", "gauge", "Items waiting for the ingest writer",
+           ("db",), [((db,), m["depth"]) for db, m in queues.items()])
+    yield ("fleetpilot_ingest_written", "counter", "Items written by the ingest writer",
+           ("db",), [((db,), m["written"]) for db, m in queues.items()])
+    yield ("fleetpilot_ingest_failed", "counter", "Items lost because their write failed twice",
+           ("db",), [((db,), m["failed"]) for db, m in queues.items()])
+    yield ("fleetpilot_ingest_dropped", "counter", "Items dropped because the queue was full",
+           ("db",), [((db,), m["dropped"]) for db, m in queues.items()])
+    yield ("fleetpilot_ingest_last_flush_milliseconds", "gauge", "Duration of the last batch write",
+           ("db",), [((db,), m["last_flush_ms"]) for db, m in queues.items()], "max")
+    pool = db_pool.stats()
+    yield ("fleetpilot_db_pool_connections", "counter", "SQLite connection pool events",
+           ("event",), [((k,), pool[k]) for k in ("opened", "reused", "reopened")])
+    http = http_pool.stats()
+    yield ("fleetpilot_http_pool", "counter", "Pooled HTTP client events",
+           ("event",), [((k,), http[k]) for k in ("requests", "reused", "connects", "stale_retries")])
+
+
+register_collector(_internal_stats)
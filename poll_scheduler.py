@@ -0,0 +1,481 @@
+"""
+poll_scheduler.py — FleetPilot concurrent per-target poll scheduler
+
+Replaces the "for device in devices: poll(device); sleep(N)" loops used by the
+device pollers.  Every target has its own interval and is dispatched onto a
+worker pool when it falls due, so one slow BMC no longer delays every other
+controller.
+
+  • per-target interval with a little jitter so targets don't synchronise
+  • exponential back-off for targets whose poll fails or raises
+  • max_workers long-lived worker threads take the due polls from a queue,
+    so a poll function keeps its thread-local state (db_pool connections)
+    between polls, and a target is never dispatched twice concurrently
+  • a poll still running after `timeout` seconds is abandoned: it counts as a
+    failure (with back-off) and a fresh worker takes over the stuck one's
+    place in the pool.  The thread itself cannot be killed; it leaves the
+    pool when the hung call returns, the target is not polled again until
+    then, and that late result is discarded
+  • an optional loader is called periodically (and on reload()) and its
+    result is diffed against the current target set — adds, removals and
+    changed intervals take effect without restarting the scheduler.  A
+    target the loader adds after startup is polled at once
+  • with share_dir, the scheduler also works across fork(): the preloaded
+    app starts it in the Gunicorn master, and the workers that serve
+    requests only hold a copy.  On such a copy upsert()/remove()/reload()
+    and trigger() are written to <share_dir>/<name>.cmd, which the running
+    scheduler reads within SHARE_INTERVAL, and status() reads the
+    <name>.status.json the running scheduler keeps up to date
+
+Usage:
+    sched = PollScheduler("fan_controller", poll_fn, loader=_load_targets)
+    sched.start()
+    ...
+    sched.reload()      # after a device was added/updated/deleted
+    sched.trigger(key)  # poll one target as soon as a worker is free
+"""
+import fcntl
+import heapq
+import itertools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import weakref
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MIN_INTERVAL = 2
+SHARE_INTERVAL = 1.0        # seconds between checks of the command file / status writes
+
+_instances = weakref.WeakSet()
+
+
+class PollScheduler:
+
+    def __init__(self, name: str, poll_fn: Callable[[Any], Any],
+                 loader: Callable[[], Dict[Hashable, Tuple[Any, float]]] = None,
+                 max_workers: int = 8, timeout: float = 120,
+                 max_backoff: float = 900, reload_interval: float = 60,
+                 jitter: float = 0.1, stagger: float = 5, share_dir=None):
+        """
+        poll_fn(target) is called on a worker thread; returning False or
+        raising counts as a failure, and so does running longer than timeout.
+        loader() returns {key: (target, interval)}.  The first polls after
+        startup are spread over min(interval, stagger) seconds.  share_dir
+        enables the cross-process hand-off described in the module docstring;
+        keys must then be JSON-serialisable (tuples come back as tuples).
+        """
+        self.name = name
+        self._poll_fn = poll_fn
+        self._loader = loader
+        self._max_workers = max_workers
+        self._timeout = timeout
+        self._max_backoff = max_backoff
+        self._reload_interval = reload_interval
+        self._jitter = jitter
+        self._stagger = stagger
+
+        self._targets: Dict[Hashable, Dict] = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._jobs: Dict[int, Dict] = {}        # running polls holding a worker slot
+        self._queue: "queue.Queue[Optional[Dict]]" = queue.Queue()
+        self._workers = set()                   # pool threads not stuck in a timed-out poll
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self._next_reload = 0.0
+        self._loaded = False
+        self._owner_pid: Optional[int] = None   # process whose thread runs the scheduler
+        self._share = Path(share_dir) if share_dir else None
+        self._version = 0                       # bumped on every change, for status.json
+        self._shared_version = -1
+        self._pending_triggers = []
+        _instances.add(self)
+
+    # ── Target management ────────────────────────────────────────────────────
+
+    def upsert(self, key: Hashable, target: Any, interval: float, delay: float = None):
+        """Add or update a target; a new one is first polled after delay (default: staggered)."""
+        if self._remote:
+            return self._send("reload")
+        interval = max(MIN_INTERVAL, float(interval))
+        with self._cond:
+            now = time.time()
+            st = self._targets.get(key)
+            if st is None:
+                self._targets[key] = {
+                    "target": target, "interval": interval, "gen": 0,
+                    "failures": 0, "running_since": None, "last_ok": None,
+                    "last_error": None, "last_duration": None, "next_due": None,
+                }
+                if delay is None:
+                    delay = random.uniform(0, min(interval, self._stagger))
+                self._schedule(key, now + delay)
+            else:
+                st["target"] = target
+                self._version += 1
+                if interval != st["interval"]:
+                    st["interval"] = interval
+                    if not st["failures"]:
+                        due = min(st["next_due"] or now, now + interval)
+                        self._schedule(key, due)
+            self._cond.notify()
+
+    def remove(self, key: Hashable):
+        if self._remote:
+            return self._send("reload")
+        with self._cond:
+            if self._targets.pop(key, None) is not None:
+                self._version += 1
+
+    def trigger(self, key: Hashable):
+        """Poll key as soon as possible (ignores back-off)."""
+        if self._remote:
+            return self._send("trigger " + json.dumps(key))
+        with self._cond:
+            st = self._targets.get(key)
+            if st is None:
+                return
+            if st["running_since"] is not None:
+                st["rerun"] = True              # poll again as soon as this one ends
+            else:
+                self._schedule(key, time.time())
+            self._cond.notify()
+
+    def reload(self):
+        """Re-run the loader on the next scheduler tick."""
+        if self._remote:
+            return self._send("reload")
+        with self._cond:
+            self._next_reload = 0.0
+            self._cond.notify()
+
+    def _apply_loader(self):
+        try:
+            wanted = self._loader()
+        except Exception as exc:
+            logger.warning("[%s] target loader failed: %s", self.name, exc)
+            return
+        with self._cond:
+            stale = [k for k in self._targets if k not in wanted]
+        for key in stale:
+            self.remove(key)
+        # After the first load a new target is a single add: poll it now
+        delay = 0.0 if self._loaded else None
+        for key, (target, interval) in wanted.items():
+            self.upsert(key, target, interval, delay=delay)
+        self._loaded = True
+
+    def _schedule(self, key, due: float):
+        st = self._targets[key]
+        self._version += 1
+        st["gen"] += 1
+        st["next_due"] = due
+        heapq.heappush(self._heap, (due, next(self._seq), key, st["gen"]))
+
+    # ── Cross-process hand-off ───────────────────────────────────────────────
+
+    @property
+    def _remote(self) -> bool:
+        """True in a forked copy of a scheduler that runs in another process."""
+        return self._owner_pid is not None and self._owner_pid != os.getpid()
+
+    def _path(self, suffix: str) -> Path:
+        return self._share / f"{self.name}{suffix}"
+
+    def _send(self, command: str):
+        if self._share is None:
+            logger.warning("[%s] %s ignored: scheduler runs in process %s",
+                           self.name, command, self._owner_pid)
+            return
+        try:
+            with open(self._path(".cmd"), "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.write(command + "\n")
+        except OSError as exc:
+            logger.warning("[%s] could not hand off %s: %s", self.name, command, exc)
+
+    def _read_commands(self):
+        path = self._path(".cmd")
+        try:
+            if not os.path.getsize(path):
+                return
+            with open(path, "r+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                lines = f.read().splitlines()
+                f.seek(0)
+                f.truncate()
+        except OSError:
+            return
+        for line in lines:
+            cmd, _, arg = line.partition(" ")
+            if cmd == "reload":
+                self._next_reload = 0.0
+            elif cmd == "trigger":
+                try:
+                    key = json.loads(arg)
+                except ValueError:
+                    continue
+                self._pending_triggers.append(tuple(key) if isinstance(key, list) else key)
+
+    def _write_status(self):
+        with self._cond:
+            if self._version == self._shared_version:
+                return
+            version = self._version
+            targets = [[json.dumps(k), {f: st.get(f) for f in _STATUS_FIELDS}]
+                       for k, st in self._targets.items()]
+        path = self._path(".status.json")
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            tmp.write_text(json.dumps({"pid": os.getpid(), "targets": targets}))
+            os.replace(tmp, path)
+            self._shared_version = version
+        except (OSError, TypeError) as exc:
+            logger.warning("[%s] could not write %s: %s", self.name, path, exc)
+
+    def _read_status(self) -> Dict[Hashable, Dict]:
+        if self._share is None:
+            return {}
+        try:
+            data = json.loads(self._path(".status.json").read_text())
+        except (OSError, ValueError):
+            return {}
+        out = {}
+        for raw_key, st in data.get("targets", []):
+            key = json.loads(raw_key)
+            out[tuple(key) if isinstance(key, list) else key] = st
+        return out
+
+    # ── Dispatch ─────────────────────────────────────────────────────────────
+
+    def _run(self):
+        while True:
+            if self._share:
+                self._read_commands()
+            if self._loader and time.time() >= self._next_reload:
+                self._next_reload = time.time() + self._reload_interval
+                self._apply_loader()
+            while self._pending_triggers:
+                self.trigger(self._pending_triggers.pop(0))
+            if self._share:
+                self._write_status()
+            with self._cond:
+                if not self._running:
+                    return
+                now = time.time()
+                wait = self._next_reload - now if self._loader else 60.0
+                if self._share:
+                    wait = min(wait, SHARE_INTERVAL)
+                wait = min(wait, self._expire(now))
+                while self._heap:
+                    due, _, key, gen = self._heap[0]
+                    st = self._targets.get(key)
+                    if st is None or st["gen"] != gen:
+                        heapq.heappop(self._heap)       # removed or rescheduled
+                        continue
+                    if due > now:
+                        wait = min(wait, due - now)
+                        break
+                    if len(self._jobs) >= self._max_workers:
+                        break                           # a finished or expired poll notifies
+                    heapq.heappop(self._heap)
+                    if st["running_since"] is not None:
+                        continue                        # completion reschedules it
+                    if st.get("overrun"):
+                        self._schedule(key, now + st["interval"])   # still hung
+                        continue
+                    self._dispatch(key, st, now)
+                wait = min(wait, self._expire(now))
+                self._cond.wait(max(0.05, wait))
+
+    def _dispatch(self, key, st: Dict, now: float):
+        self._version += 1
+        st["running_since"] = now
+        st["next_due"] = None
+        job = {"key": key, "st": st, "started": now, "thread": None}
+        self._jobs[id(job)] = job
+        self._queue.put(job)
+
+    def _spawn_worker(self):
+        worker = threading.Thread(target=self._work, args=(self._queue,), daemon=True,
+                                  name=f"{self.name}-poll")
+        self._workers.add(worker)
+        worker.start()
+
+    def _work(self, jobs: queue.Queue):
+        me = threading.current_thread()
+        while True:
+            job = jobs.get()
+            if job is None:
+                return                                  # stop()
+            self._execute(job)
+            with self._cond:
+                if me not in self._workers:
+                    return                              # replaced while this poll hung
+
+    def _execute(self, job: Dict):
+        key, st = job["key"], job["st"]
+        with self._cond:
+            if id(job) not in self._jobs:
+                return                                  # expired while queued
+            job["thread"] = threading.current_thread()
+        started = time.time()
+        ok, error = False, None
+        try:
+            ok = self._poll_fn(st["target"]) is not False
+        except Exception as exc:
+            error = str(exc)
+            logger.warning("[%s] poll of %s failed: %s", self.name, key, exc)
+        metrics.POLL_DURATION.observe(time.time() - started, poller=self.name)
+        with self._cond:
+            expired = self._jobs.pop(id(job), None) is None
+            self._cond.notify()
+            if expired:
+                # Already counted as a failure by _expire(); drop the late result
+                if self._targets.get(key) is st:
+                    st.pop("overrun", None)
+                logger.info("[%s] timed-out poll of %s returned after %ds",
+                            self.name, key, int(time.time() - started))
+                return
+            if not ok:
+                metrics.POLL_FAILURES.inc(poller=self.name)
+            if self._targets.get(key) is not st:
+                return                                  # removed (or re-added) meanwhile
+            self._finish(key, st, started, ok, error)
+
+    def _finish(self, key, st: Dict, started: float, ok: bool, error: Optional[str]):
+        now = time.time()
+        st["running_since"] = None
+        st["last_duration"] = round(now - started, 3)
+        if ok:
+            st["failures"] = 0
+            st["last_ok"] = int(now)
+            st["last_error"] = None
+            spread = st["interval"] * self._jitter
+            delay = st["interval"] + random.uniform(-spread, spread)
+        else:
+            st["failures"] += 1
+            st["last_error"] = error or "poll returned failure"
+            delay = min(st["interval"] * 2 ** st["failures"], self._max_backoff)
+            delay = max(delay, st["interval"])
+        # Successful polls keep their cadence from the start time
+        due = max(started + delay, now + MIN_INTERVAL) if ok else now + delay
+        if st.pop("rerun", False):
+            due = now
+        self._schedule(key, due)
+
+    def _expire(self, now: float) -> float:
+        """Abandon polls running longer than timeout; return seconds to the next deadline."""
+        next_deadline = 60.0
+        for job_id, job in list(self._jobs.items()):
+            left = job["started"] + self._timeout - now
+            if left > 0:
+                next_deadline = min(next_deadline, left)
+                continue
+            del self._jobs[job_id]                      # frees the worker slot
+            if job["thread"] in self._workers:
+                self._workers.discard(job["thread"])    # it leaves the pool when it returns
+                if self._running:
+                    self._spawn_worker()
+            key, st = job["key"], job["st"]
+            metrics.POLL_FAILURES.inc(poller=self.name)
+            logger.warning("[%s] poll of %s timed out after %ds; abandoned",
+                           self.name, key, int(now - job["started"]))
+            if self._targets.get(key) is st:
+                st["overrun"] = True
+                self._finish(key, st, job["started"], False,
+                             f"timed out after {self._timeout:g}s")
+        return next_deadline
+
+    # ── Lifecycle / introspection ────────────────────────────────────────────
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._next_reload = 0.0
+            self._owner_pid = os.getpid()
+            while len(self._workers) < self._max_workers:
+                self._spawn_worker()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f"{self.name}-scheduler")
+        self._thread.start()
+
+    def stop(self, wait: bool = False):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+            workers = list(self._workers)
+            self._workers.clear()
+            jobs, self._queue = self._queue, queue.Queue()
+            while not jobs.empty():
+                job = jobs.get_nowait()                 # not started: due again on restart
+                if self._jobs.pop(id(job), None) and self._targets.get(job["key"]) is job["st"]:
+                    job["st"]["running_since"] = None
+                    self._schedule(job["key"], time.time())
+        for _ in workers:
+            jobs.put(None)
+        if wait:
+            for worker in workers:
+                worker.join(self._timeout)
+
+    @property
+    def running(self) -> bool:
+        return self._running and bool(self._thread and self._thread.is_alive())
+
+    def status(self) -> Dict[Hashable, Dict]:
+        now = time.time()
+        if self._remote:
+            targets = self._read_status()
+        else:
+            with self._cond:
+                targets = {key: {f: st.get(f) for f in _STATUS_FIELDS}
+                           for key, st in self._targets.items()}
+        return {
+            key: {
+                "interval": st["interval"],
+                "failures": st["failures"],
+                "last_ok": st["last_ok"],
+                "last_error": st["last_error"],
+                "last_duration": st["last_duration"],
+                "running_s": round(now - st["running_since"], 1)
+                             if st["running_since"] is not None else None,
+                "overrun": bool(st.get("overrun")),
+                "next_in": round(st["next_due"] - now, 1)
+                           if st["next_due"] is not None else None,
+            }
+            for key, st in targets.items()
+        }
+
+
+_STATUS_FIELDS = ("interval", "failures", "last_ok", "last_error", "last_duration",
+                  "running_since", "overrun", "next_due")
+
+
+def _after_fork():
+    # Scheduler threads do not survive fork(); the child's copies are handles
+    # on the parent's schedulers (see _remote) until start() is called here.
+    for sched in list(_instances):
+        sched._cond = threading.Condition()
+        sched._running = False
+        sched._thread = None
+        sched._jobs = {}
+        sched._queue = queue.Queue()
+        sched._workers = set()
+        sched._targets = {}
+        sched._heap = []
+        sched._loaded = False
+
+
+os.register_at_fork(after_in_child=_after_fork)
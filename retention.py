@@ -0,0 +1,239 @@
+"""
+retention.py — FleetPilot time-series retention service
+
+Every module that keeps time-series history (system_monitor, fan_controller,
+corsair_commander, storage_controller, smart_manager) registers its tables
+here from init_db().  A single background thread prunes all of them on a slow
+schedule instead of issuing a DELETE after every sample.
+
+Pruning is done in bounded chunks so the SQLite write lock is only held for a
+few milliseconds at a time.  Databases created through db_pool start out with
+auto_vacuum=INCREMENTAL, so `PRAGMA incremental_vacuum` returns freed pages to
+the filesystem.  Older files keep auto_vacuum=NONE until they are converted
+during a maintenance window, because that needs a full VACUUM which rewrites
+the file under an exclusive lock — never done by the background pass:
+
+    python3 retention.py --convert data/system_monitor.db ...
+"""
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+_PURGE_INTERVAL = 3600      # seconds between retention passes
+_FIRST_RUN_DELAY = 120      # let the app settle before the first pass
+_CHUNK_ROWS = 5000          # rows deleted per write transaction
+_CHUNK_PAUSE = 0.05         # seconds between chunks so other writers get in
+_VACUUM_PAGES = 2000        # pages released per incremental_vacuum call
+
+# (db_path, table) -> policy dict
+_policies: Dict[Tuple[str, str], Dict] = {}
+_policies_lock = threading.Lock()
+_not_incremental: set = set()     # db paths already reported as needing convert()
+
+_thread = None
+_stop_event = threading.Event()
+_last_run: Dict = {}
+
+
+# ── Registration ─────────────────────────────────────────────────────────────
+
+def register(db_path, table: str, ts_column: str = "ts", days: int = 30,
+             ts_format: str = "epoch", key_columns: Tuple[str, ...] = ("rowid",)):
+    """
+    Register a time-series table for pruning.
+
+    ts_format:
+      "epoch"     — ts_column holds integer UNIX seconds
+      "datetime"  — ts_column holds SQLite CURRENT_TIMESTAMP text (UTC)
+
+    key_columns identifies rows for the chunked DELETE; WITHOUT ROWID tables
+    must pass their primary key columns.
+    """
+    if ts_format not in ("epoch", "datetime"):
+        raise ValueError(f"Unknown ts_format: {ts_format}")
+    key = (str(db_path), table)
+    with _policies_lock:
+        _policies[key] = {
+            "db_path": str(db_path),
+            "table": table,
+            "ts_column": ts_column,
+            "days": int(days),
+            "ts_format": ts_format,
+            "key_columns": tuple(key_columns),
+        }
+
+
+def list_policies() -> List[Dict]:
+    with _policies_lock:
+        return [dict(p) for p in _policies.values()]
+
+
+# ── Pruning ──────────────────────────────────────────────────────────────────
+
+def _cutoff(policy: Dict, now: float):
+    ts = now - policy["days"] * 86400
+    if policy["ts_format"] == "epoch":
+        return int(ts)
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _connect(db_path: str):
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _is_incremental(conn) -> bool:
+    return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def convert(db_path: str):
+    """
+    Switch an existing database to auto_vacuum=INCREMENTAL.  Runs a full
+    VACUUM, which rewrites the file under an exclusive lock — a maintenance
+    step to run while FleetPilot is stopped, not from the background pass.
+    """
+    conn = _connect(db_path)
+    try:
+        if not _is_incremental(conn):
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+    _not_incremental.discard(db_path)
+
+
+def purge_table(policy: Dict, now: float = None) -> int:
+    """Delete expired rows from one table in bounded chunks. Returns rows deleted."""
+    now = time.time() if now is None else now
+    cutoff = _cutoff(policy, now)
+    table, col = policy["table"], policy["ts_column"]
+    keys = policy.get("key_columns") or ("rowid",)
+    target = keys[0] if len(keys) == 1 else "(" + ", ".join(keys) + ")"
+    sql = (f"DELETE FROM {table} WHERE {target} IN "
+           f"(SELECT {', '.join(keys)} FROM {table} WHERE {col} < ? LIMIT ?)")
+    deleted = 0
+    conn = _connect(policy["db_path"])
+    try:
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                cur = conn.execute(sql, (cutoff, _CHUNK_ROWS))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            deleted += cur.rowcount
+            if cur.rowcount < _CHUNK_ROWS:
+                break
+            time.sleep(_CHUNK_PAUSE)
+    finally:
+        conn.close()
+    return deleted
+
+
+def reclaim_space(db_path: str) -> int:
+    """
+    Run incremental_vacuum until the freelist is empty. Returns pages freed.
+    Databases without auto_vacuum=INCREMENTAL are left alone (see convert()).
+    """
+    conn = _connect(db_path)
+    freed = 0
+    try:
+        if not _is_incremental(conn):
+            if db_path not in _not_incremental:
+                _not_incremental.add(db_path)
+                logger.info("retention: %s has no incremental auto_vacuum; freed pages "
+                            "are reused but not returned until "
+                            "`python3 retention.py --convert` is run", db_path)
+            return 0
+        while True:
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free:
+                break
+            conn.execute(f"PRAGMA incremental_vacuum({_VACUUM_PAGES})").fetchall()
+            freed += min(free, _VACUUM_PAGES)
+            time.sleep(_CHUNK_PAUSE)
+    finally:
+        conn.close()
+    return freed
+
+
+def run_once(now: float = None) -> Dict:
+    """Prune every registered table, then reclaim space per database."""
+    started = time.time()
+    deleted: Dict[str, int] = {}
+    db_paths = []
+    for policy in list_policies():
+        name = f"{policy['db_path']}:{policy['table']}"
+        try:
+            deleted[name] = purge_table(policy, now=now)
+        except Exception as exc:
+            logger.warning("retention: purge of %s failed: %s", name, exc)
+            continue
+        if policy["db_path"] not in db_paths:
+            db_paths.append(policy["db_path"])
+    pages = 0
+    for db_path in db_paths:
+        try:
+            pages += reclaim_space(db_path)
+        except Exception as exc:
+            logger.warning("retention: incremental_vacuum on %s failed: %s", db_path, exc)
+    result = {
+        "ts": int(started),
+        "duration_s": round(time.time() - started, 3),
+        "deleted": deleted,
+        "pages_freed": pages,
+    }
+    _last_run.clear()
+    _last_run.update(result)
+    total = sum(deleted.values())
+    if total or pages:
+        logger.info("retention: removed %d rows, freed %d pages in %.1fs",
+                    total, pages, result["duration_s"])
+    return result
+
+
+def get_last_run() -> Dict:
+    return dict(_last_run)
+
+
+# ── Background thread ────────────────────────────────────────────────────────
+
+def _loop():
+    if _stop_event.wait(_FIRST_RUN_DELAY):
+        return
+    while not _stop_event.is_set():
+        try:
+            run_once()
+        except Exception as exc:
+            logger.warning("retention: pass failed: %s", exc)
+        _stop_event.wait(_PURGE_INTERVAL)
+
+
+def start():
+    global _thread
+    if _thread and _thread.is_alive():
+        return
+    _stop_event.clear()
+    _thread = threading.Thread(target=_loop, daemon=True, name="retention")
+    _thread.start()
+    logger.info("retention service started (interval=%ds)", _PURGE_INTERVAL)
+
+
+def stop():
+    _stop_event.set()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "--convert":
+        sys.exit("usage: python3 retention.py --convert DB_FILE...")
+    for path in sys.argv[2:]:
+        print(f"converting {path} to auto_vacuum=INCREMENTAL ...")
+        convert(path)
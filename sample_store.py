@@ -0,0 +1,401 @@
+"""
+sample_store.py — FleetPilot compact storage for controller status samples
+
+fan_controller and corsair_commander used to write the whole status dict
+(including the raw command output) as JSON on every poll.  SampleStore keeps
+the same information as typed numeric series instead:
+
+  <prefix>_series   one row per (device, kind, label, field), e.g.
+                    (3, "fans", "CPU Fan", "rpm"); non-numeric item fields
+                    (unit, status, chip, ...) are kept as attrs on the series
+  <prefix>_points   (device_id, series_id, ts) -> REAL, WITHOUT ROWID
+  <prefix>_polls    one row per poll: ts, ok, error
+  <prefix>_raw      the latest raw command output per device, rewritten only
+                    when its content changes
+
+get_latest()/get_history() rebuild the familiar status dict shape
+({"ok", "error", "ts", "temperatures": [...], "fans": [...], ...}) without any
+JSON decoding of history rows.  History entries do not carry "raw"; the raw
+output is only attached to the latest sample.  get_latest_many() returns the
+latest sample of a whole set of devices with a fixed number of queries.
+"""
+import hashlib
+import json
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import ingest
+import retention
+
+logger = logging.getLogger(__name__)
+
+_MIGRATE_BATCH = 2000
+
+
+def _numeric(v) -> bool:
+    return isinstance(v, (int, float)) and not (isinstance(v, float) and v != v)
+
+
+def _vtype(v) -> str:
+    if isinstance(v, bool):
+        return "bool"
+    return "int" if isinstance(v, int) else "float"
+
+
+_CASTERS = {"int": int, "float": float, "bool": bool}
+
+
+class SampleStore:
+
+    def __init__(self, prefix: str, get_db: Callable,
+                 kinds: Sequence[str] = ("temperatures", "fans", "voltages"),
+                 key_fields: Dict[str, str] = None, raw_default=""):
+        """
+        kinds      — list-valued status keys whose items become series
+        key_fields — per-kind item field used as the series label
+                     (default "label", e.g. {"pwm_nodes": "path"})
+        """
+        self.prefix = prefix
+        self._get_db = get_db
+        self.kinds = tuple(kinds)
+        self.key_fields = dict(key_fields or {})
+        self.raw_default = raw_default
+        # (device_id, kind, key, field) -> [series_id, vtype, attrs_json]
+        self._series_cache: Dict[Tuple, List] = {}
+        self._raw_digest: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def tables(self) -> Dict[str, str]:
+        p = self.prefix
+        return {"series": f"{p}_series", "points": f"{p}_points",
+                "polls": f"{p}_polls", "raw": f"{p}_raw"}
+
+    # ── Schema ───────────────────────────────────────────────────────────────
+
+    def init_schema(self, db_path, retention_days: int):
+        t = self.tables
+        with self._get_db() as db:
+            db.executescript(f"""
+            CREATE TABLE IF NOT EXISTS {t['series']} (
+                id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_id   INTEGER NOT NULL,
+                kind        TEXT NOT NULL,
+                label       TEXT NOT NULL,
+                field       TEXT NOT NULL,
+                vtype       TEXT NOT NULL DEFAULT 'float',
+                position    INTEGER NOT NULL DEFAULT 0,
+                attrs       TEXT NOT NULL DEFAULT '{{}}',
+                UNIQUE(device_id, kind, label, field)
+            );
+            CREATE TABLE IF NOT EXISTS {t['points']} (
+                device_id   INTEGER NOT NULL,
+                series_id   INTEGER NOT NULL,
+                ts          INTEGER NOT NULL,
+                value       REAL,
+                PRIMARY KEY (device_id, series_id, ts)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS {t['polls']} (
+                id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_id   INTEGER NOT NULL,
+                ts          INTEGER NOT NULL,
+                ok          INTEGER NOT NULL DEFAULT 0,
+                error       TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_{t['polls']}_dev_ts ON {t['polls']}(device_id, ts);
+            CREATE INDEX IF NOT EXISTS idx_{t['polls']}_ts ON {t['polls']}(ts);
+            CREATE TABLE IF NOT EXISTS {t['raw']} (
+                device_id   INTEGER PRIMARY KEY,
+                ts          INTEGER NOT NULL,
+                digest      TEXT NOT NULL,
+                is_json     INTEGER NOT NULL DEFAULT 0,
+                raw         TEXT NOT NULL
+            );
+            """)
+        retention.register(db_path, t["polls"], days=retention_days)
+        retention.register(db_path, t["points"], days=retention_days,
+                           key_columns=("device_id", "series_id", "ts"))
+        ingest.register(self.ingest_kind, db_path, self._write_batch,
+                        on_error=self._forget_batch)
+
+    # ── Writes ───────────────────────────────────────────────────────────────
+
+    @property
+    def ingest_kind(self) -> str:
+        return f"{self.prefix}_samples"
+
+    def store(self, device_id: int, status: Dict):
+        try:
+            with self._get_db() as db:
+                self._write(db, device_id, status)
+        except Exception:
+            self._forget_cached(device_id)     # series ids may have been rolled back
+            raise
+
+    def enqueue(self, device_id: int, status: Dict) -> bool:
+        """Hand a sample to the ingest writer instead of writing it inline."""
+        return ingest.put(self.ingest_kind, (device_id, status))
+
+    def _write_batch(self, db, items: List[Tuple[int, Dict]]):
+        for device_id, status in items:
+            self._write(db, device_id, status)
+
+    def _forget_batch(self, items: List[Tuple[int, Dict]]):
+        for device_id in {device_id for device_id, _ in items}:
+            self._forget_cached(device_id)
+
+    def _series_id(self, db, device_id, kind, label, field, vtype, position, attrs) -> int:
+        ck = (device_id, kind, label, field)
+        attrs_json = json.dumps(attrs, sort_keys=True)
+        with self._lock:
+            cached = self._series_cache.get(ck)
+        if cached and cached[1] == vtype and cached[2] == attrs_json:
+            return cached[0]
+        t = self.tables["series"]
+        db.execute(
+            f"INSERT INTO {t}(device_id, kind, label, field, vtype, position, attrs) "
+            f"VALUES (?,?,?,?,?,?,?) "
+            f"ON CONFLICT(device_id, kind, label, field) DO UPDATE SET "
+            f"vtype=excluded.vtype, attrs=excluded.attrs",
+            (device_id, kind, label, field, vtype, position, attrs_json))
+        sid = db.execute(
+            f"SELECT id FROM {t} WHERE device_id=? AND kind=? AND label=? AND field=?",
+            (device_id, kind, label, field)).fetchone()[0]
+        with self._lock:
+            self._series_cache[ck] = [sid, vtype, attrs_json]
+        return sid
+
+    def _write(self, db, device_id: int, status: Dict, keep_raw: bool = True):
+        ts = int(status["ts"])
+        points = []
+        for kind in self.kinds:
+            key_field = self.key_fields.get(kind, "label")
+            seen = {}
+            for pos, item in enumerate(status.get(kind) or []):
+                if not isinstance(item, dict):
+                    continue
+                label = str(item.get(key_field, pos))
+                seen[label] = seen.get(label, 0) + 1
+                if seen[label] > 1:                    # keep same-named sensors apart
+                    label = f"{label} #{seen[label]}"
+                attrs = {k: v for k, v in item.items()
+                         if k != key_field and not _numeric(v)}
+                for field, value in item.items():
+                    if field == key_field or not _numeric(value):
+                        continue
+                    sid = self._series_id(db, device_id, kind, label, field,
+                                          _vtype(value), pos, attrs)
+                    points.append((device_id, sid, ts, float(value)))
+        if points:
+            db.executemany(
+                f"INSERT OR REPLACE INTO {self.tables['points']}"
+                f"(device_id, series_id, ts, value) VALUES (?,?,?,?)", points)
+        db.execute(
+            f"INSERT INTO {self.tables['polls']}(device_id, ts, ok, error) VALUES (?,?,?,?)",
+            (device_id, ts, 1 if status.get("ok") else 0, status.get("error")))
+        if keep_raw:
+            self._write_raw(db, device_id, ts, status.get("raw"))
+
+    def _write_raw(self, db, device_id: int, ts: int, raw):
+        if not raw:
+            return
+        is_json = not isinstance(raw, str)
+        text = json.dumps(raw) if is_json else raw
+        digest = hashlib.sha1(text.encode("utf-8", "replace")).hexdigest()
+        if self._raw_digest.get(device_id) == digest:
+            return
+        db.execute(
+            f"INSERT OR REPLACE INTO {self.tables['raw']}"
+            f"(device_id, ts, digest, is_json, raw) VALUES (?,?,?,?,?)",
+            (device_id, ts, digest, 1 if is_json else 0, text))
+        self._raw_digest[device_id] = digest
+
+    def forget_device(self, device_id: int):
+        """Delete all stored data for a removed device."""
+        ingest.flush()                          # don't let queued samples re-add it
+        t = self.tables
+        with self._get_db() as db:
+            for table in (t["points"], t["polls"], t["series"], t["raw"]):
+                db.execute(f"DELETE FROM {table} WHERE device_id=?", (device_id,))
+        self._forget_cached(device_id)
+
+    def _forget_cached(self, device_id: int):
+        with self._lock:
+            for ck in [k for k in self._series_cache if k[0] == device_id]:
+                del self._series_cache[ck]
+            self._raw_digest.pop(device_id, None)
+
+    # ── Reads ────────────────────────────────────────────────────────────────
+
+    def _load_series(self, db, device_id: int) -> List[tuple]:
+        """
+        Return a rebuild plan: one entry per status item, in display order,
+        as (kind, key_field, label, attrs, [(series_id, field, caster), ...]).
+        """
+        return self._load_plans(db, [device_id]).get(device_id, [])
+
+    def _load_plans(self, db, device_ids: Sequence[int]) -> Dict[int, List[tuple]]:
+        marks = ",".join("?" * len(device_ids))
+        rows = db.execute(
+            f"SELECT device_id, id, kind, label, field, vtype, attrs "
+            f"FROM {self.tables['series']} WHERE device_id IN ({marks}) "
+            f"ORDER BY device_id, position, id", list(device_ids)).fetchall()
+        plans: Dict[int, List[tuple]] = {}
+        items: Dict[Tuple[int, str, str], tuple] = {}
+        for device_id, sid, kind, label, field, vtype, attrs_json in rows:
+            plan = plans.setdefault(device_id, [])
+            entry = items.get((device_id, kind, label))
+            if entry is None:
+                try:
+                    attrs = json.loads(attrs_json) if attrs_json and attrs_json != "{}" else {}
+                except ValueError:
+                    attrs = {}
+                entry = (kind, self.key_fields.get(kind, "label"), label, attrs, [])
+                items[(device_id, kind, label)] = entry
+                plan.append(entry)
+            entry[4].append((sid, field, _CASTERS.get(vtype, float)))
+        return plans
+
+    def _build(self, ts, ok, error, plan: List[tuple], values: Dict[int, float]) -> Dict:
+        status = {"ok": bool(ok), "error": error, "ts": ts}
+        for kind in self.kinds:
+            status[kind] = []
+        if not values:
+            return status
+        for kind, key_field, label, attrs, fields in plan:
+            item = None
+            for sid, field, cast in fields:
+                value = values.get(sid)
+                if value is None:
+                    continue
+                if item is None:
+                    item = {key_field: label}
+                    item.update(attrs)
+                    status[kind].append(item)
+                item[field] = cast(value)
+        return status
+
+    def _points_between(self, db, device_id: int, since: int, until: int) -> Dict[int, Dict[int, float]]:
+        rows = db.execute(
+            f"SELECT p.ts, p.series_id, p.value FROM {self.tables['series']} s "
+            f"JOIN {self.tables['points']} p "
+            f"  ON p.device_id = s.device_id AND p.series_id = s.id "
+            f"WHERE s.device_id = ? AND p.ts BETWEEN ? AND ?",
+            (device_id, since, until)).fetchall()
+        by_ts: Dict[int, Dict[int, float]] = {}
+        for ts, sid, value in rows:
+            by_ts.setdefault(ts, {})[sid] = value
+        return by_ts
+
+    def get_latest(self, device_id: int, with_raw: bool = True) -> Optional[Dict]:
+        return self.get_latest_many([device_id], with_raw).get(device_id)
+
+    def get_latest_many(self, device_ids: Sequence[int], with_raw: bool = True) -> Dict[int, Dict]:
+        """
+        Latest status per device as {device_id: status}; devices that were
+        never polled are omitted.  Four queries regardless of the device count:
+        each device's newest poll is an index seek on (device_id, ts) and its
+        points are primary-key lookups on (device_id, series_id, ts).  CROSS
+        JOIN pins that join order; without it the planner may scan all of a
+        device's points.
+        """
+        device_ids = list(dict.fromkeys(int(d) for d in device_ids))
+        if not device_ids:
+            return {}
+        t = self.tables
+        marks = ",".join("(?)" for _ in device_ids)
+        latest_cte = (
+            f"WITH ids(device_id) AS (VALUES {marks}), "
+            f"last AS (SELECT i.device_id, (SELECT MAX(ts) FROM {t['polls']} p "
+            f"         WHERE p.device_id = i.device_id) AS ts FROM ids i) ")
+        with self._get_db() as db:
+            polls = {}
+            for device_id, ts, ok, error in db.execute(
+                    latest_cte +
+                    f"SELECT l.device_id, l.ts, p.ok, p.error FROM last l "
+                    f"CROSS JOIN {t['polls']} p ON p.device_id = l.device_id AND p.ts = l.ts "
+                    f"ORDER BY p.id", device_ids):
+                polls[device_id] = (ts, ok, error)     # last poll at that ts wins
+            if not polls:
+                return {}
+            found = list(polls)
+            plans = self._load_plans(db, found)
+            values: Dict[int, Dict[int, float]] = {}
+            for device_id, sid, value in db.execute(
+                    latest_cte +
+                    f"SELECT s.device_id, s.id, pt.value FROM last l "
+                    f"CROSS JOIN {t['series']} s ON s.device_id = l.device_id "
+                    f"CROSS JOIN {t['points']} pt ON pt.device_id = s.device_id "
+                    f"  AND pt.series_id = s.id AND pt.ts = l.ts", device_ids):
+                values.setdefault(device_id, {})[sid] = value
+            raws = {}
+            if with_raw:
+                raws = {row[0]: row[1:] for row in db.execute(
+                    f"SELECT device_id, is_json, raw FROM {t['raw']} "
+                    f"WHERE device_id IN ({','.join('?' * len(found))})", found)}
+        result = {}
+        for device_id, (ts, ok, error) in polls.items():
+            status = self._build(ts, ok, error, plans.get(device_id, []),
+                                 values.get(device_id, {}))
+            status["raw"] = self.raw_default
+            raw = raws.get(device_id)
+            if raw:
+                try:
+                    status["raw"] = json.loads(raw[1]) if raw[0] else raw[1]
+                except ValueError:
+                    status["raw"] = raw[1]
+            result[device_id] = status
+        return result
+
+    def get_history(self, device_id: int, since: int, limit: int = None) -> List[Dict]:
+        with self._get_db() as db:
+            sql = (f"SELECT ts, ok, error FROM {self.tables['polls']} "
+                   f"WHERE device_id=? AND ts>=? ORDER BY ts ASC")
+            params: list = [device_id, since]
+            if limit:
+                sql += " LIMIT ?"
+                params.append(limit)
+            polls = db.execute(sql, params).fetchall()
+            if not polls:
+                return []
+            plan = self._load_series(db, device_id)
+            by_ts = self._points_between(db, device_id, polls[0][0], polls[-1][0])
+        return [self._build(ts, ok, error, plan, by_ts.get(ts, {}))
+                for ts, ok, error in polls]
+
+    # ── Migration from <prefix>_samples(status_json) ─────────────────────────
+
+    def migrate_json_samples(self, legacy_table: str):
+        """Convert a legacy status_json table into series/points and drop it."""
+        with self._get_db() as db:
+            exists = db.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+                (legacy_table,)).fetchone()
+        if not exists:
+            return
+        converted = 0
+        last_id = 0
+        latest_raw: Dict[int, Dict] = {}
+        while True:
+            with self._get_db() as db:
+                rows = db.execute(
+                    f"SELECT id, device_id, status_json FROM {legacy_table} "
+                    f"WHERE id > ? ORDER BY id LIMIT ?", (last_id, _MIGRATE_BATCH)).fetchall()
+                for row_id, device_id, status_json in rows:
+                    last_id = row_id
+                    try:
+                        status = json.loads(status_json)
+                        if isinstance(status, dict) and "ts" in status:
+                            self._write(db, device_id, status, keep_raw=False)
+                            latest_raw[device_id] = status
+                            converted += 1
+                    except Exception:
+                        continue
+            if len(rows) < _MIGRATE_BATCH:
+                break
+        with self._get_db() as db:
+            for device_id, status in latest_raw.items():
+                self._write_raw(db, device_id, int(status["ts"]), status.get("raw"))
+            db.execute(f"DROP TABLE {legacy_table}")
+        logger.info("%s: migrated %d samples from %s", self.prefix, converted, legacy_table)
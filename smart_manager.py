@@ -15,7 +15,6 @@ Features:
 
 import re
 import json
-import sqlite3
 import logging
 import subprocess
 import threading
@@ -24,6 +23,12 @@ from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple, Any
 
+import db_pool
+import fanout
+import ingest
+import metrics
+import retention
+
 logger = logging.getLogger("fleetpilot.smart_manager")
 
 DB_FILE = Path(__file__).parent / "smart_manager.db"
@@ -59,13 +64,32 @@ TEMP_CRITICAL = 55
 POH_WARNING  = 30_000   # ~3.4 years
 POH_CRITICAL = 50_000   # ~5.7 years
 
+# History retention (days)
+SNAPSHOT_RETENTION_DAYS  = 365
+ATTRIBUTE_RETENTION_DAYS = 180
+
+# Proxmox polling: concurrent API requests per endpoint, and how long one
+# endpoint's SMART collection may take in total (seconds)
+_PVE_CONCURRENCY = 4
+_PVE_SMART_DEADLINE = 120
+
+# ── Metrics (see metrics.py) ─────────────────────────────────────────────────
+HEALTH_CODES = {"GOOD": 0, "WARNING": 1, "CRITICAL": 2, "FAILED": 3}
+_DISK_LABELS = ("disk_id", "source", "device")
+DISK_HEALTH = metrics.gauge("fleetpilot_disk_health",
+                            "SMART health: 0=GOOD 1=WARNING 2=CRITICAL 3=FAILED 4=UNKNOWN",
+                            _DISK_LABELS)
+DISK_TEMP = metrics.gauge("fleetpilot_disk_temperature_celsius",
+                          "Last SMART temperature", _DISK_LABELS, unit="celsius")
+DISK_REALLOCATED = metrics.gauge("fleetpilot_disk_reallocated_sectors",
+                                 "Reallocated sector count", _DISK_LABELS)
+_disk_labels: Dict[int, Dict] = {}      # disk_id -> metric labels, filled by register_disk
+
 
 # ── Database ──────────────────────────────────────────────────────────────────
 
 def get_db():
-    conn = sqlite3.connect(str(DB_FILE))
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db_pool.connect(DB_FILE)
 
 
 def init_db():
@@ -133,7 +157,16 @@ def init_db():
             last_poll       TIMESTAMP
         );
         INSERT OR IGNORE INTO poll_config(id) VALUES(1);
+
+        CREATE INDEX IF NOT EXISTS idx_smart_snapshots_disk_ts ON smart_snapshots(disk_id, ts);
+        CREATE INDEX IF NOT EXISTS idx_smart_snapshots_ts ON smart_snapshots(ts);
+        CREATE INDEX IF NOT EXISTS idx_smart_attributes_ts ON smart_attributes(ts);
         """)
+    retention.register(DB_FILE, "smart_snapshots",
+                       days=SNAPSHOT_RETENTION_DAYS, ts_format="datetime")
+    retention.register(DB_FILE, "smart_attributes",
+                       days=ATTRIBUTE_RETENTION_DAYS, ts_format="datetime")
+    ingest.register("smart_snapshot", DB_FILE, _write_snapshots)
 
 
 # ── Disk registry ─────────────────────────────────────────────────────────────
@@ -153,14 +186,16 @@ def register_disk(source: str, device: str, serial: str = None,
                 "size_gb=COALESCE(?,size_gb), last_seen=CURRENT_TIMESTAMP WHERE id=?",
                 (serial, model, size_gb, existing["id"])
             )
-            return existing["id"]
+            disk_id = existing["id"]
         else:
             cur = db.execute(
                 "INSERT INTO disk_registry(source,source_id,device,serial,model,size_gb) "
                 "VALUES (?,?,?,?,?,?)",
                 (source, source_id, device, serial, model, size_gb)
             )
-            return cur.lastrowid
+            disk_id = cur.lastrowid
+    _disk_labels[disk_id] = {"disk_id": disk_id, "source": source, "device": device}
+    return disk_id
 
 
 def get_all_disks() -> List[Dict]:
@@ -347,9 +382,7 @@ def collect_local_disk(device: str) -> Optional[Dict]:
                 size_gb = round(int(m.group(1).replace(",", "")) / 1e9, 1)
 
     disk_id = register_disk("local", device, serial=serial, model=model, size_gb=size_gb)
-    snapshot_id = _save_snapshot(disk_id, parsed, health)
-    _save_attributes(snapshot_id, disk_id, parsed["attributes"])
-    _check_and_alert(disk_id, health, parsed)
+    _queue_snapshot(disk_id, parsed, health)
 
     return {
         "disk_id": disk_id,
@@ -367,34 +400,66 @@ def collect_local_disk(device: str) -> Optional[Dict]:
     }
 
 
-def _save_snapshot(disk_id: int, parsed: Dict, health: str) -> int:
-    with get_db() as db:
-        cur = db.execute(
-            "INSERT INTO smart_snapshots"
-            "(disk_id,health,overall_status,temp,poh,reallocated,pending,uncorrectable,raw_json) "
-            "VALUES (?,?,?,?,?,?,?,?,?)",
-            (disk_id, health, parsed["overall_status"],
-             parsed["temp"], parsed["poh"],
-             parsed["reallocated"], parsed["pending"], parsed["uncorrectable"],
-             json.dumps(parsed["attributes"]))
-        )
-        return cur.lastrowid
+def _queue_snapshot(disk_id: int, parsed: Dict, health: str, alert: bool = True):
+    """Hand a snapshot (plus its attributes and any alert) to the ingest writer."""
+    ingest.put("smart_snapshot", (disk_id, parsed, health, alert))
+    _publish_disk(disk_id, health, parsed["temp"], parsed["reallocated"])
 
 
-def _save_attributes(snapshot_id: int, disk_id: int, attributes: List[Dict]):
+def _publish_disk(disk_id: int, health: str, temp, reallocated, labels: Dict = None):
+    labels = labels or _disk_labels.get(disk_id) or {"disk_id": disk_id, "source": "", "device": ""}
+    DISK_HEALTH.set(HEALTH_CODES.get(health, 4), **labels)
+    DISK_TEMP.set(temp, **labels)
+    DISK_REALLOCATED.set(reallocated or 0, **labels)
+
+
+def publish_metrics():
+    """Seed the SMART gauges from the latest snapshots, e.g. after a restart."""
     with get_db() as db:
-        for a in attributes:
-            db.execute(
-                "INSERT INTO smart_attributes"
-                "(snapshot_id,disk_id,attr_id,attr_name,value,worst,threshold,raw_value,raw_string) "
-                "VALUES (?,?,?,?,?,?,?,?,?)",
-                (snapshot_id, disk_id, a["id"], a["name"],
-                 a["value"], a["worst"], a["threshold"],
-                 a["raw_value"], a["raw_string"])
-            )
+        rows = db.execute(
+            "SELECT r.id, r.source, r.device, s.health, s.temp, s.reallocated "
+            "FROM disk_registry r JOIN smart_snapshots s ON s.id = ("
+            "  SELECT id FROM smart_snapshots WHERE disk_id=r.id ORDER BY ts DESC, id DESC LIMIT 1)"
+        ).fetchall()
+    for r in rows:
+        labels = {"disk_id": r["id"], "source": r["source"], "device": r["device"]}
+        _disk_labels[r["id"]] = labels
+        _publish_disk(r["id"], r["health"], r["temp"], r["reallocated"], labels)
+
+
+def _write_snapshots(db, items: List[Tuple[int, Dict, str, bool]]):
+    for disk_id, parsed, health, alert in items:
+        snapshot_id = _save_snapshot(db, disk_id, parsed, health)
+        _save_attributes(db, snapshot_id, disk_id, parsed["attributes"])
+        if alert:
+            _check_and_alert(db, disk_id, health, parsed)
+
+
+def _save_snapshot(db, disk_id: int, parsed: Dict, health: str) -> int:
+    cur = db.execute(
+        "INSERT INTO smart_snapshots"
+        "(disk_id,health,overall_status,temp,poh,reallocated,pending,uncorrectable,raw_json) "
+        "VALUES (?,?,?,?,?,?,?,?,?)",
+        (disk_id, health, parsed["overall_status"],
+         parsed["temp"], parsed["poh"],
+         parsed["reallocated"], parsed["pending"], parsed["uncorrectable"],
+         json.dumps(parsed["attributes"]))
+    )
+    return cur.lastrowid
+
+
+def _save_attributes(db, snapshot_id: int, disk_id: int, attributes: List[Dict]):
+    db.executemany(
+        "INSERT INTO smart_attributes"
+        "(snapshot_id,disk_id,attr_id,attr_name,value,worst,threshold,raw_value,raw_string) "
+        "VALUES (?,?,?,?,?,?,?,?,?)",
+        [(snapshot_id, disk_id, a["id"], a["name"],
+          a["value"], a["worst"], a["threshold"],
+          a["raw_value"], a["raw_string"]) for a in attributes]
+    )
 
 
-def _check_and_alert(disk_id: int, health: str, parsed: Dict):
+def _check_and_alert(db, disk_id: int, health: str, parsed: Dict):
     """Create alert entries for WARNING/CRITICAL/FAILED disks."""
     if health == "GOOD":
         return
@@ -411,11 +476,10 @@ def _check_and_alert(disk_id: int, health: str, parsed: Dict):
         messages.append("SMART self-assessment: FAILED")
     if not messages:
         messages.append(f"Health degraded: {health}")
-    with get_db() as db:
-        db.execute(
-            "INSERT INTO disk_alerts(disk_id,level,message) VALUES (?,?,?)",
-            (disk_id, health, "; ".join(messages))
-        )
+    db.execute(
+        "INSERT INTO disk_alerts(disk_id,level,message) VALUES (?,?,?)",
+        (disk_id, health, "; ".join(messages))
+    )
 
 
 # ── SSH-Host disk import ─────────────────────────────────────────────────────
@@ -489,9 +553,7 @@ def collect_ssh_host_disks(host_name: str, host_ip: str, user: str,
 
                 parsed = parse_smartctl_output(smart_out)
                 health = classify_health(parsed)
-                snapshot_id = _save_snapshot(disk_id, parsed, health)
-                _save_attributes(snapshot_id, disk_id, parsed["attributes"])
-                _check_and_alert(disk_id, health, parsed)
+                _queue_snapshot(disk_id, parsed, health)
 
                 results.append({
                     "disk_id": disk_id,
@@ -604,71 +666,117 @@ def collect_remote_storage_disks(ep_id: int):
             parsed = {
                 "overall_status": "PASSED" if health == "GOOD" else "UNKNOWN",
                 "temp": d.get("temp"),
-                "poh": None,
+                "poh": d.get("poh"),
                 "reallocated": 0,
                 "pending": 0,
                 "uncorrectable": 0,
                 "attributes": [],
             }
-            _save_snapshot(disk_id, parsed, health)
-            sc.log_disk_snapshot(ep_id, d)
+            # One change-only history: the SMART snapshot (which carries
+            # nothing but health and temperature here) follows storage_disk_log
+            if sc.log_disk_snapshot(ep_id, d):
+                _queue_snapshot(disk_id, parsed, health, alert=False)
         logger.info("[smart_manager] Collected %d remote disks from %s ep %d",
                     len(disks), platform, ep_id)
     except Exception as exc:
         logger.error("[smart_manager] Remote collection failed for ep %d: %s", ep_id, exc)
 
 
-def collect_proxmox_disks(ep_id: int, node: str):
+def _parse_proxmox_smart(smart_data: Dict) -> Dict:
+    """Map a /nodes/{node}/disks/smart response onto the parsed-SMART dict."""
+    parsed = {
+        "overall_status": smart_data.get("health", "UNKNOWN"),
+        "temp": None, "poh": None,
+        "reallocated": 0, "pending": 0, "uncorrectable": 0,
+        "attributes": [],
+    }
+    for a in smart_data.get("attributes", []) or []:
+        attr_id = a.get("id", 0)
+        raw_val = a.get("raw", 0)
+        parsed["attributes"].append({
+            "id": attr_id,
+            "name": a.get("name", ""),
+            "value": a.get("value", 0),
+            "worst": a.get("worst", 0),
+            "threshold": a.get("threshold", 0),
+            "raw_value": raw_val,
+            "raw_string": str(raw_val),
+        })
+        if attr_id == 194:
+            parsed["temp"] = raw_val
+        elif attr_id == 9:
+            parsed["poh"] = raw_val
+        elif attr_id == 5:
+            parsed["reallocated"] = raw_val
+        elif attr_id == 197:
+            parsed["pending"] = raw_val
+        elif attr_id == 198:
+            parsed["uncorrectable"] = raw_val
+    return parsed
+
+
+def _collect_proxmox(ep_id: int, client, nodes: List[str]) -> int:
+    """
+    List disks on each node and fetch their SMART data with one client.
+    Requests run concurrently, at most _PVE_CONCURRENCY at a time per endpoint.
+    """
+    listings, errors = fanout.gather(
+        {node: (lambda n=node: client.get_disks(n)) for node in nodes},
+        deadline=_PVE_SMART_DEADLINE, max_workers=_PVE_CONCURRENCY,
+        defaults={node: [] for node in nodes})
+    for node, err in errors.items():
+        logger.warning("[smart_manager] Proxmox ep %d node %s: disk list failed: %s",
+                       ep_id, node, err)
+
+    disks = []
+    for node in nodes:
+        for d in listings[node] or []:
+            if d.get("dev", d.get("devpath", "")).lstrip("/dev/"):
+                disks.append((node, d))
+
+    calls = {}
+    for node, d in disks:
+        dev = d.get("dev", "")
+        calls[f"{node}:{dev}"] = lambda n=node, dev=dev: client.get_disk_smart(n, dev)
+    smart, errors = fanout.gather(calls, deadline=_PVE_SMART_DEADLINE,
+                                  max_workers=_PVE_CONCURRENCY)
+    for key, err in errors.items():
+        logger.warning("[smart_manager] Proxmox ep %d %s: SMART failed: %s", ep_id, key, err)
+
+    for node, d in disks:
+        dev_name = d.get("dev", d.get("devpath", "")).lstrip("/dev/")
+        disk_id = register_disk(
+            source="proxmox",
+            device=dev_name,
+            serial=d.get("serial"),
+            model=d.get("model"),
+            size_gb=round(d.get("size", 0) / 1e9, 1) if d.get("size") else None,
+            source_id=str(ep_id)
+        )
+        parsed = _parse_proxmox_smart(smart.get(f"{node}:{d.get('dev', '')}") or {})
+        health = classify_health(parsed)
+        _queue_snapshot(disk_id, parsed, health, alert=False)
+    return len(disks)
+
+
+def collect_proxmox_endpoint(ep_id: int) -> int:
+    """Collect disk SMART data from every node of a Proxmox endpoint."""
+    import vm_controller as vc
+    client = vc.connect(ep_id)
+    nodes = [n["node"] for n in client.get_nodes() if n.get("node")]
+    count = _collect_proxmox(ep_id, client, nodes)
+    logger.info("[smart_manager] Collected %d Proxmox disks from ep %d (%d nodes)",
+                count, ep_id, len(nodes))
+    return count
+
+
+def collect_proxmox_disks(ep_id: int, node: str, client=None):
     """Collect disk SMART data from a Proxmox node."""
     try:
-        import vm_controller as vc
-        disks = vc.get_proxmox_disks(ep_id, node)
-        for d in disks:
-            dev_name = d.get("dev", d.get("devpath", "")).lstrip("/dev/")
-            if not dev_name:
-                continue
-            disk_id = register_disk(
-                source="proxmox",
-                device=dev_name,
-                serial=d.get("serial"),
-                model=d.get("model"),
-                size_gb=round(d.get("size", 0) / 1e9, 1) if d.get("size") else None,
-                source_id=str(ep_id)
-            )
-            # Try to get SMART data from Proxmox API
-            smart_data = vc.get_proxmox_disk_smart(ep_id, node, d.get("dev", ""))
-            attrs_raw = smart_data.get("attributes", [])
-            parsed = {
-                "overall_status": smart_data.get("health", "UNKNOWN"),
-                "temp": None, "poh": None,
-                "reallocated": 0, "pending": 0, "uncorrectable": 0,
-                "attributes": [],
-            }
-            for a in attrs_raw:
-                attr_id = a.get("id", 0)
-                raw_val = a.get("raw", 0)
-                parsed["attributes"].append({
-                    "id": attr_id,
-                    "name": a.get("name", ""),
-                    "value": a.get("value", 0),
-                    "worst": a.get("worst", 0),
-                    "threshold": a.get("threshold", 0),
-                    "raw_value": raw_val,
-                    "raw_string": str(raw_val),
-                })
-                if attr_id == 194:
-                    parsed["temp"] = raw_val
-                elif attr_id == 9:
-                    parsed["poh"] = raw_val
-                elif attr_id == 5:
-                    parsed["reallocated"] = raw_val
-                elif attr_id == 197:
-                    parsed["pending"] = raw_val
-                elif attr_id == 198:
-                    parsed["uncorrectable"] = raw_val
-            health = classify_health(parsed)
-            snapshot_id = _save_snapshot(disk_id, parsed, health)
-            _save_attributes(snapshot_id, disk_id, parsed["attributes"])
+        if client is None:
+            import vm_controller as vc
+            client = vc.connect(ep_id)
+        _collect_proxmox(ep_id, client, [node])
     except Exception as exc:
         logger.error("[smart_manager] Proxmox disk collection failed for ep %d: %s", ep_id, exc)
 
@@ -782,9 +890,7 @@ def _poll_worker():
                     for ep in _vc.list_endpoints():
                         if ep.get("platform") == "proxmox" and ep.get("enabled", 1):
                             try:
-                                client = _vc.connect(ep["id"])
-                                for node in client.get_nodes():
-                                    collect_proxmox_disks(ep["id"], node["node"])
+                                collect_proxmox_endpoint(ep["id"])
                             except Exception as exc:
                                 logger.warning("[smart_manager] Proxmox ep %d poll error: %s", ep["id"], exc)
                 except Exception as exc:
@@ -818,6 +924,10 @@ def start_polling():
     global _poll_thread
     if _poll_thread and _poll_thread.is_alive():
         return
+    try:
+        publish_metrics()
+    except Exception as exc:
+        logger.warning("[smart_manager] could not seed metrics: %s", exc)
     _stop_event.clear()
     _poll_thread = threading.Thread(target=_poll_worker, daemon=True,
                                     name="smart_poll_worker")
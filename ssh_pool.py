@@ -0,0 +1,228 @@
+"""
+ssh_pool.py — FleetPilot shared SSH session pool
+
+Keeps one authenticated paramiko client per (host, port, username,
+credentials) so that pollers can run many commands over a single TCP/SSH session instead of paying
+the TCP + key-exchange + auth cost on every call.  A paramiko Transport
+multiplexes channels, so one pooled client can serve concurrent callers.
+
+Sessions are kept alive with SSH keepalives, reconnected transparently when
+the transport has died, and closed after sitting idle for _IDLE_TIMEOUT.
+The credentials are part of the key (as a digest, like auth_cache.make_key),
+so a caller with a wrong password never rides on another caller's session.
+"""
+import hashlib
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+_KEEPALIVE = 30         # seconds between SSH keepalive packets
+_IDLE_TIMEOUT = 600     # close sessions unused for this long
+_CONNECT_TIMEOUT = 15
+
+# (host, port, username, credential digest) -> {"client", "last_used", "lock"}
+_sessions: Dict[Tuple[str, int, str, str], Dict] = {}
+_sessions_lock = threading.Lock()
+
+
+def _key(host: str, port: int, username: str, password: str = None,
+         key_path: str = None) -> Tuple[str, int, str, str]:
+    secret = f"{password or ''}\0{key_path or ''}"
+    digest = hashlib.sha256(secret.encode()).hexdigest()[:16]
+    return (str(host), int(port or 22), username or "root", digest)
+
+
+def _alive(client) -> bool:
+    transport = client.get_transport() if client else None
+    return bool(transport and transport.is_active())
+
+
+def _connect(host: str, port: int, username: str, password: str = None,
+             key_path: str = None, timeout: int = _CONNECT_TIMEOUT):
+    import paramiko
+    ssh = paramiko.SSHClient()
+    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    kwargs = dict(hostname=host, port=port, username=username, timeout=timeout,
+                  banner_timeout=timeout, auth_timeout=timeout)
+    if key_path and Path(key_path).exists():
+        kwargs["key_filename"] = key_path
+    elif password:
+        kwargs["password"] = password
+        kwargs["look_for_keys"] = False
+        kwargs["allow_agent"] = False
+    ssh.connect(**kwargs)
+    transport = ssh.get_transport()
+    if transport:
+        transport.set_keepalive(_KEEPALIVE)
+    return ssh
+
+
+def _entry(key) -> Dict:
+    with _sessions_lock:
+        entry = _sessions.get(key)
+        if entry is None:
+            entry = {"client": None, "last_used": 0.0, "lock": threading.Lock()}
+            _sessions[key] = entry
+        return entry
+
+
+def acquire(host: str, port: int = 22, username: str = "root",
+            password: str = None, key_path: str = None,
+            timeout: int = _CONNECT_TIMEOUT):
+    """
+    Return a connected SSHClient for host/port/username, reusing the pooled
+    session opened with the same credentials while its transport is active.  Do not close() the result —
+    use discard() if the session should be dropped.
+    """
+    _sweep_idle()
+    key = _key(host, port, username, password, key_path)
+    entry = _entry(key)
+    with entry["lock"]:
+        if not _alive(entry["client"]):
+            if entry["client"] is not None:
+                _close_quietly(entry["client"])
+                logger.debug("ssh_pool: reconnecting %s@%s:%s", key[2], key[0], key[1])
+            entry["client"] = None
+            try:
+                entry["client"] = _connect(key[0], key[1], key[2], password=password,
+                                           key_path=key_path, timeout=timeout)
+            except Exception:
+                with _sessions_lock:            # e.g. wrong credentials: keep no entry
+                    if _sessions.get(key) is entry:
+                        del _sessions[key]
+                raise
+        entry["last_used"] = time.time()
+        return entry["client"]
+
+
+class Session:
+    """
+    Pool-backed stand-in for a paramiko SSHClient.
+
+    exec_command() runs a channel on the shared transport and, if the pooled
+    transport turns out to be dead (host rebooted, NAT timeout), reconnects and
+    retries once.  close() hands the session back to the pool instead of
+    tearing down the TCP connection, so existing try/finally close() code keeps
+    working unchanged.
+    """
+
+    def __init__(self, host: str, port: int = 22, username: str = "root",
+                 password: str = None, key_path: str = None,
+                 timeout: int = _CONNECT_TIMEOUT):
+        self._pool_key = _key(host, port, username, password, key_path)
+        self.host, self.port, self.username = self._pool_key[:3]
+        self._password = password
+        self._key_path = key_path
+        self._timeout = timeout
+        self._client = self._acquire()
+
+    def _acquire(self):
+        return acquire(self.host, self.port, self.username, password=self._password,
+                       key_path=self._key_path, timeout=self._timeout)
+
+    def exec_command(self, cmd: str, timeout: float = None, **kwargs):
+        try:
+            return self._client.exec_command(cmd, timeout=timeout, **kwargs)
+        except Exception:
+            if _alive(self._client):
+                raise
+        _drop([self._pool_key])
+        self._client = self._acquire()
+        return self._client.exec_command(cmd, timeout=timeout, **kwargs)
+
+    def get_transport(self):
+        return self._client.get_transport()
+
+    def close(self):
+        """Release back to the pool; dead transports are dropped."""
+        if self._client is not None and not _alive(self._client):
+            _drop([self._pool_key])
+        self._client = None
+
+
+def run(host: str, cmd: str, port: int = 22, username: str = "root",
+        password: str = None, key_path: str = None,
+        timeout: int = 60) -> Tuple[str, str, int]:
+    """
+    Run cmd over the pooled session, reconnecting once if it has died.
+    Returns (stdout, stderr, exit_code).
+    """
+    ssh = Session(host, port, username, password=password, key_path=key_path)
+    try:
+        _, stdout, stderr = ssh.exec_command(cmd, timeout=timeout)
+        out = stdout.read().decode(errors="replace").strip()
+        err = stderr.read().decode(errors="replace").strip()
+        code = stdout.channel.recv_exit_status()
+        return out, err, code
+    finally:
+        ssh.close()
+
+
+def _drop(keys):
+    with _sessions_lock:
+        entries = [_sessions.pop(k, None) for k in keys]
+    for entry in entries:
+        if entry and entry["client"] is not None:
+            _close_quietly(entry["client"])
+
+
+def discard(host: str, port: int = 22, username: str = "root"):
+    """Close and forget the pooled sessions (after credential changes or errors)."""
+    prefix = _key(host, port, username)[:3]
+    with _sessions_lock:
+        keys = [k for k in _sessions if k[:3] == prefix]
+    _drop(keys)
+
+
+def discard_host(host: str):
+    """Drop every pooled session to host regardless of port/username."""
+    with _sessions_lock:
+        keys = [k for k in _sessions if k[0] == str(host)]
+    _drop(keys)
+
+
+def close_all():
+    with _sessions_lock:
+        entries = list(_sessions.values())
+        _sessions.clear()
+    for entry in entries:
+        if entry["client"] is not None:
+            _close_quietly(entry["client"])
+
+
+def stats() -> Dict:
+    with _sessions_lock:
+        items = list(_sessions.items())
+    now = time.time()
+    return {
+        "sessions": len(items),
+        "active": sum(1 for _, e in items if _alive(e["client"])),
+        "hosts": [
+            {"host": k[0], "port": k[1], "username": k[2],
+             "active": _alive(e["client"]),
+             "idle_s": round(now - e["last_used"], 1) if e["last_used"] else None}
+            for k, e in items
+        ],
+    }
+
+
+def _sweep_idle():
+    cutoff = time.time() - _IDLE_TIMEOUT
+    with _sessions_lock:
+        stale = [k for k, e in _sessions.items()
+                 if e["last_used"] and e["last_used"] < cutoff and not e["lock"].locked()]
+        entries = [_sessions.pop(k) for k in stale]
+    for entry in entries:
+        if entry["client"] is not None:
+            _close_quietly(entry["client"])
+
+
+def _close_quietly(client):
+    try:
+        client.close()
+    except Exception:
+        pass
@@ -5,26 +5,39 @@ Manages NAS/storage systems: Unraid and TrueNAS (SCALE & CORE).
 
 Supported platforms:
   - Unraid 6.x / 7.x  (Unraid API via JSON plugin or built-in API)
-  - TrueNAS SCALE / CORE  (REST API v2.0)
+  - TrueNAS SCALE / CORE  (REST API v2.0, optional live updates over the
+    middleware websocket — see truenas_ws)
 
 All connections are stored in the SQLite database (storage_controller.db).
 """
 
 import os
 import json
-import sqlite3
 import logging
-import urllib.request
-import urllib.error
+import threading
+import time
 import urllib.parse
-import ssl
 from datetime import datetime
 from pathlib import Path
 from typing import Optional, Dict, List, Any
 
+import db_pool
+import fanout
+import http_pool
+import ingest
+import retention
+import truenas_ws
+from inventory_cache import InventoryCache
+
 logger = logging.getLogger("fleetpilot.storage_controller")
 
 DB_FILE = Path(__file__).parent / "storage_controller.db"
+DISK_LOG_RETENTION_DAYS = 180
+# storage_disk_log gets a row when a disk's health or pool changes, its
+# temperature moves by DISK_LOG_TEMP_STEP °C, or DISK_LOG_HEARTBEAT seconds
+# have passed since its last row
+DISK_LOG_HEARTBEAT = 6 * 3600
+DISK_LOG_TEMP_STEP = 2
 
 # ── Encryption (same pattern as vm_controller) ────────────────────────────────
 try:
@@ -47,9 +60,7 @@ except Exception:
 # ── Database ──────────────────────────────────────────────────────────────────
 
 def get_db():
-    conn = sqlite3.connect(str(DB_FILE))
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db_pool.connect(DB_FILE)
 
 
 def init_db():
@@ -65,7 +76,8 @@ def init_db():
             verify_ssl  INTEGER DEFAULT 0,
             enabled     INTEGER DEFAULT 1,
             notes       TEXT DEFAULT '',
-            added_ts    TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            added_ts    TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            live_updates INTEGER DEFAULT 0  -- TrueNAS: keep a websocket subscription
         );
         CREATE TABLE IF NOT EXISTS storage_disk_log (
             id          INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -81,6 +93,9 @@ def init_db():
             pool        TEXT,
             ts          TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
+        CREATE INDEX IF NOT EXISTS idx_storage_disk_log_ts ON storage_disk_log(ts);
+        CREATE INDEX IF NOT EXISTS idx_storage_disk_log_disk
+            ON storage_disk_log(endpoint_id, disk_id, ts);
         CREATE TABLE IF NOT EXISTS storage_events (
             id          INTEGER PRIMARY KEY AUTOINCREMENT,
             endpoint_id INTEGER,
@@ -91,19 +106,33 @@ def init_db():
             ts          TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
         """)
+    # Run migrations
+    with get_db() as db:
+        try:
+            db.execute("ALTER TABLE storage_endpoints ADD COLUMN live_updates INTEGER DEFAULT 0")
+        except Exception:
+            pass
+    retention.register(DB_FILE, "storage_disk_log",
+                       days=DISK_LOG_RETENTION_DAYS, ts_format="datetime")
+    ingest.register("storage_disk", DB_FILE, _write_disk_snapshots,
+                    on_error=_forget_disk_snapshots)
 
 
 # ── Endpoint CRUD ─────────────────────────────────────────────────────────────
 
 def add_endpoint(name: str, platform: str, host: str, port: int,
-                 api_key: str, verify_ssl: bool = False, notes: str = "") -> int:
+                 api_key: str, verify_ssl: bool = False, notes: str = "",
+                 live_updates: bool = False) -> int:
     with get_db() as db:
         cur = db.execute(
-            "INSERT INTO storage_endpoints(name,platform,host,port,api_key,verify_ssl,notes) "
-            "VALUES (?,?,?,?,?,?,?)",
-            (name, platform, host, port, _encrypt(api_key), 1 if verify_ssl else 0, notes)
+            "INSERT INTO storage_endpoints"
+            "(name,platform,host,port,api_key,verify_ssl,notes,live_updates) "
+            "VALUES (?,?,?,?,?,?,?,?)",
+            (name, platform, host, port, _encrypt(api_key), 1 if verify_ssl else 0, notes,
+             1 if live_updates and platform == "truenas" else 0)
         )
-        return cur.lastrowid
+        ep_id = cur.lastrowid
+    return ep_id
 
 
 def list_endpoints() -> List[Dict]:
@@ -114,6 +143,8 @@ def list_endpoints() -> List[Dict]:
         d = dict(r)
         d.pop("api_key", None)
         result.append(d)
+    # Deleted or switched off in another worker: drop this process's model too
+    truenas_ws.retain({d["id"] for d in result if d.get("live_updates")})
     return result
 
 
@@ -133,6 +164,8 @@ def get_endpoint(ep_id: int) -> Optional[Dict]:
 def delete_endpoint(ep_id: int):
     with get_db() as db:
         db.execute("DELETE FROM storage_endpoints WHERE id=?", (ep_id,))
+    truenas_ws.stop(ep_id)
+    overview_cache.forget(ep_id)
 
 
 def log_event(endpoint_id: int, resource: str, action: str,
@@ -155,24 +188,81 @@ def get_events(limit: int = 100) -> List[Dict]:
     return [dict(r) for r in rows]
 
 
-def log_disk_snapshot(endpoint_id: int, disk: Dict):
-    """Persist a disk health snapshot for trend tracking."""
-    with get_db() as db:
-        db.execute(
-            "INSERT INTO storage_disk_log"
-            "(endpoint_id,disk_id,disk_name,model,serial,size_gb,temp,health,smart_status,pool) "
-            "VALUES (?,?,?,?,?,?,?,?,?,?)",
-            (endpoint_id,
-             disk.get("id", ""),
-             disk.get("name", ""),
-             disk.get("model", ""),
-             disk.get("serial", ""),
-             disk.get("size_gb"),
-             disk.get("temp"),
-             disk.get("health", "UNKNOWN"),
-             disk.get("smart_status", ""),
-             disk.get("pool", ""))
-        )
+# (endpoint_id, disk_id) -> (temp, health, pool, logged_at) of the last row written
+_disk_log_state: Dict[tuple, tuple] = {}
+_disk_log_lock = threading.Lock()
+
+
+def _last_logged(endpoint_id: int, disk_id: str) -> Optional[tuple]:
+    key = (endpoint_id, disk_id)
+    state = _disk_log_state.get(key)
+    if state is None:
+        with get_db() as db:
+            row = db.execute(
+                "SELECT temp, health, pool, CAST(strftime('%s', ts) AS INTEGER) AS logged_at "
+                "FROM storage_disk_log WHERE endpoint_id=? AND disk_id=? "
+                "ORDER BY ts DESC LIMIT 1", key
+            ).fetchone()
+        if row:
+            state = _disk_log_state[key] = (row["temp"], row["health"], row["pool"],
+                                            row["logged_at"] or 0)
+    return state
+
+
+def _disk_changed(state: Optional[tuple], temp, health: str, pool: str, now: float) -> bool:
+    if state is None:
+        return True
+    last_temp, last_health, last_pool, logged_at = state
+    if now - logged_at >= DISK_LOG_HEARTBEAT:
+        return True
+    if (health, pool) != (last_health, last_pool or ""):
+        return True
+    if (temp is None) != (last_temp is None):
+        return True
+    return temp is not None and abs(temp - last_temp) >= DISK_LOG_TEMP_STEP
+
+
+def log_disk_snapshot(endpoint_id: int, disk: Dict) -> bool:
+    """
+    Queue a disk health snapshot for trend tracking if the disk changed
+    since its last row (or the heartbeat is due).  Returns True if queued.
+    """
+    disk_id = disk.get("id", "")
+    temp, health, pool = disk.get("temp"), disk.get("health", "UNKNOWN"), disk.get("pool", "")
+    now = time.time()
+    with _disk_log_lock:
+        if not _disk_changed(_last_logged(endpoint_id, disk_id), temp, health, pool, now):
+            return False
+        _disk_log_state[(endpoint_id, disk_id)] = (temp, health, pool, now)
+    if not ingest.put("storage_disk", (endpoint_id, disk)):
+        _forget_disk_snapshots([(endpoint_id, disk)])
+        return False
+    return True
+
+
+def _forget_disk_snapshots(items: List[tuple]):
+    # The rows were not written; compare the next poll against the database again
+    with _disk_log_lock:
+        for endpoint_id, disk in items:
+            _disk_log_state.pop((endpoint_id, disk.get("id", "")), None)
+
+
+def _write_disk_snapshots(db, items: List[tuple]):
+    db.executemany(
+        "INSERT INTO storage_disk_log"
+        "(endpoint_id,disk_id,disk_name,model,serial,size_gb,temp,health,smart_status,pool) "
+        "VALUES (?,?,?,?,?,?,?,?,?,?)",
+        [(endpoint_id,
+          disk.get("id", ""),
+          disk.get("name", ""),
+          disk.get("model", ""),
+          disk.get("serial", ""),
+          disk.get("size_gb"),
+          disk.get("temp"),
+          disk.get("health", "UNKNOWN"),
+          disk.get("smart_status", ""),
+          disk.get("pool", "")) for endpoint_id, disk in items]
+    )
 
 
 def get_disk_history(endpoint_id: int, disk_id: str, limit: int = 50) -> List[Dict]:
@@ -189,10 +279,6 @@ def get_disk_history(endpoint_id: int, disk_id: str, limit: int = 50) -> List[Di
 
 def _http(method: str, url: str, headers: Dict = None,
           body: Any = None, verify_ssl: bool = False, timeout: int = 15) -> Dict:
-    ctx = ssl.create_default_context()
-    if not verify_ssl:
-        ctx.check_hostname = False
-        ctx.verify_mode = ssl.CERT_NONE
     data = None
     if body is not None:
         if isinstance(body, dict):
@@ -201,39 +287,43 @@ def _http(method: str, url: str, headers: Dict = None,
             headers["Content-Type"] = "application/json"
         else:
             data = body if isinstance(body, bytes) else str(body).encode()
-    req = urllib.request.Request(url, data=data, method=method)
-    for k, v in (headers or {}).items():
-        req.add_header(k, v)
     try:
-        with urllib.request.urlopen(req, context=ctx, timeout=timeout) as resp:
-            raw = resp.read().decode("utf-8", errors="replace")
-            try:
-                return {"ok": True, "status": resp.status, "data": json.loads(raw)}
-            except json.JSONDecodeError:
-                return {"ok": True, "status": resp.status, "data": raw}
-    except urllib.error.HTTPError as e:
-        raw = e.read().decode("utf-8", errors="replace")
-        return {"ok": False, "status": e.code, "error": raw}
+        status, payload = http_pool.request(method, url, headers=headers, body=data,
+                                            verify_ssl=verify_ssl, timeout=timeout)
     except Exception as exc:
         return {"ok": False, "status": 0, "error": str(exc)}
+    raw = payload.decode("utf-8", errors="replace")
+    if not 200 <= status < 300:
+        return {"ok": False, "status": status, "error": raw}
+    try:
+        return {"ok": True, "status": status, "data": json.loads(raw)}
+    except json.JSONDecodeError:
+        return {"ok": True, "status": status, "data": raw}
 
 
 # ══════════════════════════════════════════════════════════════════════════════
 # TrueNAS SCALE / CORE Client  (REST API v2.0)
 # ══════════════════════════════════════════════════════════════════════════════
 
+_DISK_SUMMARY_DEADLINE = 18   # inside the overview's 20 s; each call times out at 15
+
+
 class TrueNASClient:
     """TrueNAS SCALE/CORE REST API v2 client."""
 
     def __init__(self, host: str, port: int, api_key: str,
-                 verify_ssl: bool = False):
+                 verify_ssl: bool = False, live: "truenas_ws.TrueNASLive" = None):
         self.base = f"https://{host}:{port}/api/v2.0"
         self.verify_ssl = verify_ssl
+        self.live = live        # pools / disks / alerts come from here while it is in sync
         self._headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json",
         }
 
+    def _live_items(self, collection: str) -> Optional[List[Dict]]:
+        return self.live.items(collection) if self.live else None
+
     def _get(self, path: str, params: str = "") -> Dict:
         url = f"{self.base}{path}"
         if params:
@@ -261,10 +351,16 @@ class TrueNASClient:
     # ── Disks ─────────────────────────────────────────────────────────────────
 
     def get_disks(self) -> List[Dict]:
+        live = self._live_items("disk.query")
+        if live is not None:
+            return live
         r = self._get("/disk")
         return r["data"] if r["ok"] and isinstance(r["data"], list) else []
 
     def get_disk_temperatures(self) -> Dict:
+        live = self.live.temperatures() if self.live else None
+        if live is not None:
+            return live
         r = self._post("/disk/temperatures", body={"names": []})
         return r["data"] if r["ok"] and isinstance(r["data"], dict) else {}
 
@@ -272,6 +368,13 @@ class TrueNASClient:
         r = self._get(f"/smart/test/results/{disk_name}")
         return r["data"] if r["ok"] and isinstance(r["data"], list) else []
 
+    def get_all_smart_results(self) -> Dict[str, List[Dict]]:
+        """SMART self-test results of every disk in one call: {disk name: tests}."""
+        r = self._get("/smart/test/results")
+        if not r["ok"] or not isinstance(r["data"], list):
+            return {}
+        return {e.get("disk"): e.get("tests") or [] for e in r["data"] if isinstance(e, dict)}
+
     def start_smart_test(self, disk_name: str, test_type: str = "SHORT") -> Dict:
         """test_type: SHORT | LONG | CONVEYANCE | OFFLINE"""
         return self._post("/smart/test", body={
@@ -282,6 +385,9 @@ class TrueNASClient:
     # ── Storage Pools ─────────────────────────────────────────────────────────
 
     def get_pools(self) -> List[Dict]:
+        live = self._live_items("pool.query")
+        if live is not None:
+            return live
         r = self._get("/pool")
         return r["data"] if r["ok"] and isinstance(r["data"], list) else []
 
@@ -308,6 +414,9 @@ class TrueNASClient:
     # ── Alerts ────────────────────────────────────────────────────────────────
 
     def get_alerts(self) -> List[Dict]:
+        live = self._live_items("alert.list")
+        if live is not None:
+            return live
         r = self._get("/alert/list")
         return r["data"] if r["ok"] and isinstance(r["data"], list) else []
 
@@ -320,33 +429,96 @@ class TrueNASClient:
     # ── Normalized disk summary ───────────────────────────────────────────────
 
     def get_disk_summary(self) -> List[Dict]:
-        """Return normalized disk dicts for FleetPilot disk manager."""
-        disks = self.get_disks()
-        temps = self.get_disk_temperatures()
+        """
+        Return normalized disk dicts for FleetPilot disk manager.
+        Disks, temperatures, the SMART self-test results of all disks and the
+        pool topology are four concurrent calls, whatever the number of disks.
+        """
+        results, errors = fanout.gather({
+            "disks": self.get_disks,
+            "temps": self.get_disk_temperatures,
+            "smart": self.get_all_smart_results,
+            "pools": self.get_pools,
+        }, deadline=_DISK_SUMMARY_DEADLINE,
+            defaults={"disks": [], "temps": {}, "smart": {}, "pools": []})
+        if errors:
+            logger.warning("[storage_controller] TrueNAS disk summary incomplete: %s", errors)
+        temps = results["temps"] or {}
+        smart = results["smart"] or {}
+        members = _pool_members(results["pools"] or [])
+
         result = []
-        for d in disks:
+        for d in results["disks"] or []:
             name = d.get("name", "")
             size_bytes = d.get("size", 0) or 0
             size_gb = round(size_bytes / 1e9, 1) if size_bytes else None
-            temp = temps.get(name)
-            health = "UNKNOWN"
-            if d.get("hddstandby") == "ALWAYS ON":
-                health = "GOOD"
+            member = members.get(name, {})
+            tests = smart.get(name) or []
+            last_test = tests[0] if tests else {}
             result.append({
                 "id": name,
                 "name": name,
                 "model": d.get("model", ""),
                 "serial": d.get("serial", ""),
                 "size_gb": size_gb,
-                "temp": temp,
-                "health": health,
-                "smart_status": d.get("togglesmart", ""),
-                "pool": d.get("pool", ""),
+                "temp": temps.get(name),
+                "health": _truenas_disk_health(member, last_test),
+                "smart_status": _smart_test_label(last_test),
+                "poh": last_test.get("lifetime"),
+                "pool": member.get("pool") or d.get("pool") or "",
+                "vdev_status": member.get("status", ""),
+                "errors": member.get("errors", 0),
                 "source": "truenas",
             })
         return result
 
 
+def _pool_members(pools: List[Dict]) -> Dict[str, Dict]:
+    """Map disk name -> {"pool", "status", "errors"} from pool topologies."""
+    members: Dict[str, Dict] = {}
+
+    def walk(vdev: Dict, pool_name: str):
+        for child in vdev.get("children") or []:
+            walk(child, pool_name)
+        disk = vdev.get("disk")
+        if disk and vdev.get("type") == "DISK":
+            stats = vdev.get("stats") or {}
+            members[disk] = {
+                "pool": pool_name,
+                "status": vdev.get("status", ""),
+                "errors": sum(stats.get(k, 0) or 0 for k in
+                              ("read_errors", "write_errors", "checksum_errors")),
+            }
+
+    for pool in pools:
+        for vdevs in (pool.get("topology") or {}).values():
+            for vdev in vdevs or []:
+                walk(vdev, pool.get("name", ""))
+    return members
+
+
+def _truenas_disk_health(member: Dict, last_test: Dict) -> str:
+    """Combine the disk's vdev state and its latest SMART self-test."""
+    vdev_status = (member.get("status") or "").upper()
+    test_status = (last_test.get("status") or "").upper()
+    if vdev_status in ("FAULTED", "REMOVED", "UNAVAIL") or test_status == "FAILED":
+        return "FAILED"
+    if vdev_status == "DEGRADED" or last_test.get("lba_of_first_error"):
+        return "CRITICAL"
+    if member.get("errors"):
+        return "WARNING"
+    if test_status == "SUCCESS" or vdev_status == "ONLINE":
+        return "GOOD"
+    return "UNKNOWN"
+
+
+def _smart_test_label(test: Dict) -> str:
+    if not test:
+        return ""
+    label = test.get("status_verbose") or test.get("status") or ""
+    return f"{test.get('description', 'Test')}: {label}".strip()
+
+
 # ══════════════════════════════════════════════════════════════════════════════
 # Unraid Client  (Unraid API via JSON plugin or built-in API)
 # ══════════════════════════════════════════════════════════════════════════════
@@ -530,7 +702,7 @@ def connect(ep_id: int):
     key  = ep["api_key_plain"]
     ssl_ = bool(ep.get("verify_ssl", 0))
     if platform == "truenas":
-        return TrueNASClient(host, port, key, ssl_)
+        return TrueNASClient(host, port, key, ssl_, live=_live_for(ep))
     elif platform == "unraid":
         return UnraidClient(host, port, key, ssl_)
     else:
@@ -552,35 +724,85 @@ def test_connection(ep_id: int) -> Dict:
         return {"ok": False, "message": str(exc)}
 
 
+_OVERVIEW_DEADLINE = 20   # seconds for the whole overview (each call times out at 15)
+
+
 def get_storage_overview(ep_id: int) -> Dict:
-    """Return a full overview dict for the storage dashboard."""
+    """
+    Return a full overview dict for the storage dashboard.
+    The platform calls are independent and run concurrently; a failed or slow
+    call leaves its section empty and is listed in overview["errors"].
+    """
     ep = get_endpoint(ep_id)
     if not ep:
         return {"error": "Endpoint not found"}
     client = connect(ep_id)
     overview: Dict = {"platform": ep["platform"], "endpoint_name": ep["name"]}
-    try:
-        if isinstance(client, TrueNASClient):
-            overview["system_info"] = client.get_system_info()
-            overview["pools"] = client.get_pools()
-            overview["disks"] = client.get_disk_summary()
-            overview["datasets"] = client.get_datasets()
-            overview["smb_shares"] = client.get_smb_shares()
-            overview["nfs_shares"] = client.get_nfs_shares()
-            overview["alerts"] = client.get_alerts()
-        elif isinstance(client, UnraidClient):
-            overview["system_info"] = client.get_system_info()
-            overview["array"] = client.get_array_status()
-            overview["disks"] = client.get_disk_summary()
-            overview["shares"] = client.get_shares()
-            overview["docker"] = client.get_docker_containers()
-            overview["vms"] = client.get_vms()
-            overview["alerts"] = client.get_notifications()
-    except Exception as exc:
-        overview["error"] = str(exc)
+    if isinstance(client, TrueNASClient):
+        calls = {
+            "system_info": client.get_system_info,
+            "pools": client.get_pools,
+            "disks": client.get_disk_summary,
+            "datasets": client.get_datasets,
+            "smb_shares": client.get_smb_shares,
+            "nfs_shares": client.get_nfs_shares,
+            "alerts": client.get_alerts,
+        }
+    elif isinstance(client, UnraidClient):
+        calls = {
+            "system_info": client.get_system_info,
+            "array": client.get_array_status,
+            "disks": client.get_disk_summary,
+            "shares": client.get_shares,
+            "docker": client.get_docker_containers,
+            "vms": client.get_vms,
+            "alerts": client.get_notifications,
+        }
+    else:
+        return overview
+    defaults = {name: {} if name in ("system_info", "array") else [] for name in calls}
+    results, errors = fanout.gather(calls, deadline=_OVERVIEW_DEADLINE, defaults=defaults)
+    overview.update(results)
+    if errors:
+        overview["errors"] = errors
+        overview["error"] = "; ".join(f"{name}: {msg}" for name, msg in errors.items())
     return overview
 
 
+# /storage/<id> renders from this instead of calling the NAS in the request
+overview_cache = InventoryCache("storage_overview", get_storage_overview)
+
+
+# ── Live updates (TrueNAS websocket) ──────────────────────────────────────────
+
+# The subscription is opened on first use by the process that serves the
+# request (like overview_cache's refresh scheduler), so the model, the
+# _on_live_change callback and the cache it refreshes live in one process.
+
+def _on_live_change(ep_id: int, collection: str):
+    # Pools / disks / alerts changed: rebuild the page snapshot from memory
+    if ep_id in overview_cache:
+        overview_cache.refresh(ep_id)
+
+
+def _live_for(ep: Dict) -> Optional["truenas_ws.TrueNASLive"]:
+    """This process's live model of a TrueNAS endpoint, started on first use."""
+    if not ep.get("live_updates") or not ep.get("enabled", 1):
+        truenas_ws.stop(ep["id"])
+        return None
+    # Restarts the model if host, port, key or verify_ssl changed meanwhile
+    return truenas_ws.start(ep["id"], ep["host"], ep["port"], ep["api_key_plain"],
+                            bool(ep.get("verify_ssl", 0)), on_change=_on_live_change)
+
+
+def stop_live_updates():
+    truenas_ws.stop_all()
+
+
+def get_live_status() -> Dict[int, Dict]:
+    return truenas_ws.status()
+
+
 def poll_and_log_disks(ep_id: int):
     """Fetch current disk state and persist to storage_disk_log for trend tracking."""
     try:
@@ -4,12 +4,15 @@ Collects CPU, RAM, disk, network and temperature metrics every 60 seconds.
 Stores history in a SQLite database (DATA_DIR/system_monitor.db).
 """
 import os
-import sqlite3
 import threading
 import time
 import json
 import logging
 
+import db_pool
+import ingest
+import retention
+
 logger = logging.getLogger(__name__)
 
 # DATA_DIR is injected at init time
@@ -23,9 +26,7 @@ _RETENTION_DAYS = 30  # keep 30 days of history
 # ── Database helpers ──────────────────────────────────────────────────────────
 
 def _get_db():
-    conn = sqlite3.connect(_DB_PATH, timeout=10)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db_pool.connect(_DB_PATH)
 
 
 def init_db(data_dir: str):
@@ -48,16 +49,36 @@ def init_db(data_dir: str):
                 temp_json   TEXT
             );
             CREATE INDEX IF NOT EXISTS idx_monitor_ts ON monitor_samples(ts);
+
+            -- Managed hosts, collected over SSH by fleet_collector
+            CREATE TABLE IF NOT EXISTS fleet_samples (
+                id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                host        TEXT NOT NULL,
+                ts          INTEGER NOT NULL,
+                cpu_pct     REAL,
+                cpu_freq    REAL,
+                load1       REAL,
+                load5       REAL,
+                load15      REAL,
+                ram_total   INTEGER,
+                ram_used    INTEGER,
+                ram_pct     REAL,
+                swap_total  INTEGER,
+                swap_used   INTEGER,
+                disk_json   TEXT,
+                net_json    TEXT,
+                temp_json   TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_fleet_host_ts ON fleet_samples(host, ts);
+            CREATE INDEX IF NOT EXISTS idx_fleet_ts ON fleet_samples(ts);
         """)
+    retention.register(_DB_PATH, "monitor_samples", days=_RETENTION_DAYS)
+    retention.register(_DB_PATH, "fleet_samples", days=_RETENTION_DAYS)
+    ingest.register("monitor_sample", _DB_PATH, _write_samples)
+    ingest.register("fleet_sample", _DB_PATH, _write_fleet_samples)
     logger.info("system_monitor DB initialised at %s", _DB_PATH)
 
 
-def _purge_old():
-    cutoff = int(time.time()) - _RETENTION_DAYS * 86400
-    with _get_db() as conn:
-        conn.execute("DELETE FROM monitor_samples WHERE ts < ?", (cutoff,))
-
-
 # ── Metric collection ─────────────────────────────────────────────────────────
 
 def _collect():
@@ -143,15 +164,18 @@ def _collect():
 
 
 def _save(sample: dict):
-    with _get_db() as conn:
-        conn.execute("""
-            INSERT INTO monitor_samples
-              (ts, cpu_pct, cpu_freq, ram_total, ram_used, ram_pct,
-               swap_total, swap_used, disk_json, net_json, temp_json)
-            VALUES
-              (:ts, :cpu_pct, :cpu_freq, :ram_total, :ram_used, :ram_pct,
-               :swap_total, :swap_used, :disk_json, :net_json, :temp_json)
-        """, sample)
+    ingest.put("monitor_sample", sample)
+
+
+def _write_samples(conn, samples):
+    conn.executemany("""
+        INSERT INTO monitor_samples
+          (ts, cpu_pct, cpu_freq, ram_total, ram_used, ram_pct,
+           swap_total, swap_used, disk_json, net_json, temp_json)
+        VALUES
+          (:ts, :cpu_pct, :cpu_freq, :ram_total, :ram_used, :ram_pct,
+           :swap_total, :swap_used, :disk_json, :net_json, :temp_json)
+    """, samples)
 
 
 # ── Background polling thread ─────────────────────────────────────────────────
@@ -163,7 +187,6 @@ def _poll_loop():
             sample = _collect()
             if sample:
                 _save(sample)
-                _purge_old()
         except Exception as exc:
             logger.warning("system_monitor poll error: %s", exc)
         time.sleep(_POLL_INTERVAL)
@@ -226,6 +249,50 @@ def get_log(page: int = 1, per_page: int = 100):
     }
 
 
+# ── Fleet (managed hosts) ─────────────────────────────────────────────────────
+
+def save_fleet_samples(samples):
+    """Queue one cycle's worth of per-host samples for the ingest writer."""
+    for sample in samples or ():
+        ingest.put("fleet_sample", sample)
+
+
+def _write_fleet_samples(conn, samples):
+    conn.executemany("""
+        INSERT INTO fleet_samples
+          (host, ts, cpu_pct, cpu_freq, load1, load5, load15,
+           ram_total, ram_used, ram_pct, swap_total, swap_used,
+           disk_json, net_json, temp_json)
+        VALUES
+          (:host, :ts, :cpu_pct, :cpu_freq, :load1, :load5, :load15,
+           :ram_total, :ram_used, :ram_pct, :swap_total, :swap_used,
+           :disk_json, :net_json, :temp_json)
+    """, samples)
+
+
+def get_fleet_latest():
+    """Return the most recent sample for every host, keyed by host name."""
+    with _get_db() as conn:
+        rows = conn.execute("""
+            SELECT f.* FROM fleet_samples f
+            JOIN (SELECT host, MAX(ts) AS ts FROM fleet_samples GROUP BY host) m
+              ON m.host = f.host AND m.ts = f.ts
+        """).fetchall()
+    return {r['host']: _row_to_dict(r) for r in rows}
+
+
+def get_fleet_history(host: str, hours: int = 24, limit: int = 1440):
+    """Return up to `limit` samples for one host from the last `hours` hours."""
+    since = int(time.time()) - hours * 3600
+    with _get_db() as conn:
+        rows = conn.execute(
+            "SELECT * FROM fleet_samples WHERE host = ? AND ts >= ? "
+            "ORDER BY ts ASC LIMIT ?",
+            (host, since, limit)
+        ).fetchall()
+    return [_row_to_dict(r) for r in rows]
+
+
 def _row_to_dict(row) -> dict:
     d = dict(row)
     for field in ('disk_json', 'net_json', 'temp_json'):
@@ -0,0 +1,100 @@
+"""
+Test suite for the shared credential cache
+Tests reuse, early renewal, failed renewal fallback and invalidation
+"""
+
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import auth_cache
+
+
+class TestAuthCache(unittest.TestCase):
+    """Test cases for auth_cache module"""
+
+    def setUp(self):
+        auth_cache.clear()
+        self.logins = 0
+        self.clock = 1000.0
+        patcher = patch.object(auth_cache.time, "monotonic", lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.key = auth_cache.make_key("pbs", "PBS.local", 8007, "root@pam", "secret")
+
+    def tearDown(self):
+        auth_cache.clear()
+
+    def _login(self):
+        self.logins += 1
+        return f"ticket-{self.logins}"
+
+    def test_credential_is_reused_until_renewal(self):
+        """Test that one login serves calls until the renewal window"""
+        self.assertEqual(auth_cache.get(self.key, self._login, ttl=100), "ticket-1")
+        self.clock += 70
+        self.assertEqual(auth_cache.get(self.key, self._login, ttl=100), "ticket-1")
+        self.clock += 10                                   # inside the last 25 %
+        self.assertEqual(auth_cache.get(self.key, self._login, ttl=100), "ticket-2")
+        self.assertEqual(self.logins, 2)
+
+    def test_failed_renewal_keeps_valid_credential(self):
+        """Test that a failing renewal falls back to the unexpired credential"""
+        auth_cache.get(self.key, self._login, ttl=100)
+        self.clock += 90
+
+        def broken():
+            raise ConnectionError("server busy")
+
+        self.assertEqual(auth_cache.get(self.key, broken, ttl=100), "ticket-1")
+        self.assertEqual(auth_cache.get(self.key, lambda: None, ttl=100), "ticket-1")
+        self.clock += 20                                   # now really expired
+        with self.assertRaises(ConnectionError):
+            auth_cache.get(self.key, broken, ttl=100)
+
+    def test_login_can_set_lifetime_and_invalidate(self):
+        """Test (value, lifetime) results and explicit invalidation"""
+        auth_cache.get(self.key, lambda: ("token", 20), ttl=900)
+        self.clock += 16
+        self.assertEqual(auth_cache.get(self.key, self._login, ttl=900), "ticket-1")
+        auth_cache.invalidate(self.key)
+        self.assertEqual(auth_cache.get(self.key, self._login, ttl=900), "ticket-2")
+
+    def test_secret_is_part_of_key(self):
+        """Test that a changed password does not hit the old credential"""
+        other = auth_cache.make_key("pbs", "pbs.local", 8007, "root@pam", "new-secret")
+        self.assertNotEqual(self.key, other)
+        self.assertEqual(self.key, auth_cache.make_key("pbs", "pbs.local", "8007", "root@pam", "secret"))
+
+    def test_concurrent_callers_share_one_login(self):
+        """Test that simultaneous misses trigger a single login"""
+        gate = threading.Event()
+
+        def slow_login():
+            gate.wait(1)
+            return self._login()
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            auth_cache.get(self.key, slow_login, ttl=100))) for _ in range(5)]
+        for t in threads:
+            t.start()
+        time.sleep(0.05)
+        gate.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, ["ticket-1"] * 5)
+        self.assertEqual(self.logins, 1)
+
+    def test_session_is_pooled_per_key(self):
+        """Test that the same endpoint gets the same keep-alive session"""
+        s1 = auth_cache.session(self.key)
+        self.assertIs(auth_cache.session(self.key, verify=True), s1)
+        self.assertTrue(s1.verify)
+        auth_cache.drop(self.key)
+        self.assertIsNot(auth_cache.session(self.key), s1)
+
+
+if __name__ == '__main__':
+    unittest.main()
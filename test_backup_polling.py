@@ -0,0 +1,96 @@
+"""
+Test suite for backup_controller polling
+Tests per-server intervals, scheduler add/remove on server changes and
+diff-based storage of poll results
+"""
+
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import backup_controller as bc
+import ingest
+
+
+class TestBackupPolling(unittest.TestCase):
+    """Test cases for the backup_controller poll scheduler integration"""
+
+    def setUp(self):
+        # Another test may have imported app.py, which starts the real poller
+        bc.stop_all_polling()
+        bc._scheduler = None
+        self.tmpdir = tempfile.TemporaryDirectory()
+        bc.init_db(self.tmpdir.name)
+
+    def tearDown(self):
+        bc.stop_all_polling()
+        bc._scheduler = None
+        self.tmpdir.cleanup()
+
+    def _add(self, name, **kwargs):
+        return bc.add_server(name, "restic", "10.0.0.1", 8000, "http", **kwargs)
+
+    def test_targets_use_per_server_interval(self):
+        """Test that enabled servers are loaded with their own interval"""
+        a = self._add("a")
+        b = self._add("b", poll_interval=600)
+        c = self._add("c")
+        bc.update_server(c, enabled=0)
+        targets = bc._load_poll_targets()
+        self.assertEqual(set(targets), {a, b})
+        self.assertEqual(targets[a], (a, bc.POLL_INTERVAL))
+        self.assertEqual(targets[b], (b, 600))
+
+    def test_scheduler_follows_server_changes(self):
+        """Test that edits and deletes reach the running scheduler"""
+        a = self._add("a")
+        b = self._add("b")
+        # Drive the loader by hand instead of running the scheduler thread
+        with patch.object(bc.PollScheduler, "start"):
+            bc.start_all_polling()
+            bc._scheduler._apply_loader()
+            self.assertEqual(set(bc.get_poll_status()), {a, b})
+            bc.update_server(a, poll_interval=900)
+            bc.delete_server(b)
+            bc._scheduler._apply_loader()
+            status = bc.get_poll_status()
+        self.assertEqual(set(status), {a})
+        self.assertEqual(status[a]["interval"], 900)
+
+    def test_unchanged_jobs_keep_their_rows(self):
+        """Test that a repeat poll touches only changed jobs and vanished ones"""
+        sid = self._add("a")
+        jobs = [{"job_id": "1", "job_name": "vm-100", "status": "ok"},
+                {"job_id": "2", "job_name": "vm-101", "status": "ok"},
+                {"job_id": "3", "job_name": "vm-102", "status": "ok"}]
+        bc._store_poll(sid, 3, 0, 0, jobs=jobs)
+        ingest.flush()
+        before = {j["job_id"]: j["id"] for j in bc.get_jobs(sid)}
+
+        conn = bc._db()
+        touched = bc._sync_rows(conn, "backup_jobs", sid, bc._JOB_KEY, bc._JOB_COLS,
+                                [dict(jobs[0]), dict(jobs[1], status="error")])
+        conn.commit()
+        conn.close()
+        self.assertEqual(touched, 2)                       # one update, one delete
+        after = {j["job_id"]: j for j in bc.get_jobs(sid)}
+        self.assertEqual(set(after), {"1", "2"})
+        self.assertEqual(after["1"]["id"], before["1"])
+        self.assertEqual(after["2"]["id"], before["2"])
+        self.assertEqual(after["2"]["status"], "error")
+
+    def test_history_only_on_transitions(self):
+        """Test that identical polls do not append history rows"""
+        sid = self._add("a")
+        snaps = [{"repo": "r", "snapshot_id": "abc", "timestamp": "2024-01-01 00:00:00"}]
+        for counts in [(2, 0, 0), (2, 0, 0), (1, 0, 1), (1, 0, 1), (2, 0, 0)]:
+            bc._store_poll(sid, *counts, snapshots=snaps)
+        ingest.flush()
+        history = bc.get_history(sid)
+        self.assertEqual([(h["jobs_ok"], h["jobs_error"]) for h in history],
+                         [(2, 0), (1, 1), (2, 0)])
+        self.assertEqual(len(bc.get_snapshots(sid)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+"""
+Test suite for the precomputed CheckMK payloads
+Tests change-driven rebuilds, stable ETags and conditional GETs
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import checkmk_integration as cmk
+
+
+class _FakeSmart:
+    def __init__(self):
+        self.calls = 0
+        self.disks = [{"device": "/dev/sda", "source": "web1", "health": "GOOD"}]
+
+    def get_all_disks(self):
+        self.calls += 1
+        return self.disks
+
+
+class TestAgentCache(unittest.TestCase):
+    """Test cases for checkmk_integration.AgentCache"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.hosts_file = os.path.join(self.tmp, "hosts.json")
+        self._write_hosts({"web1": {"host": "10.0.0.1", "status": "online"}})
+        self.smart = _FakeSmart()
+        self.cache = cmk.AgentCache(self._load_hosts, smart_manager=self.smart,
+                                    watch=[self.hosts_file], check_interval=0.05)
+        self.addCleanup(self.cache.stop)
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+
+    def _write_hosts(self, hosts):
+        with open(self.hosts_file, "w") as f:
+            json.dump(hosts, f)
+
+    def _load_hosts(self):
+        with open(self.hosts_file) as f:
+            return json.load(f)
+
+    def test_payloads_built_once(self):
+        """Test that reads are served from memory"""
+        agent = self.cache.agent()
+        self.assertIn(b"<<<local>>>", agent["body"])
+        self.assertEqual(self.cache.status()["data"]["summary"]["hosts_total"], 1)
+        self.assertIn(b"<<<<web1>>>>", self.cache.host("web1")["body"])
+        self.assertIsNone(self.cache.host("nope"))
+        builds = self.cache.builds
+        for _ in range(5):
+            self.cache.agent()
+        self.assertEqual(self.cache.builds, builds)
+
+    def test_unchanged_rebuild_keeps_etag(self):
+        """Test that ETag and Last-Modified only move with the content"""
+        with patch.object(cmk.time, "time", return_value=1000.0):
+            status = self.cache.status()
+        self.cache.rebuild()
+        self.assertEqual(self.cache.status()["etag"], status["etag"])
+        self.assertEqual(self.cache.status()["last_modified"], 1000.0)
+
+        self.smart.disks[0]["health"] = "FAILED"
+        self.cache.rebuild()
+        self.assertNotEqual(self.cache.status()["etag"], status["etag"])
+        self.assertEqual(self.cache.status()["data"]["summary"]["disks_failed"], 1)
+
+    def test_file_change_triggers_rebuild(self):
+        """Test that the builder notices a changed watched file"""
+        self.cache.agent()
+        builds = self.cache.builds
+        self._write_hosts({"web1": {"host": "10.0.0.1", "status": "online"},
+                           "db1": {"host": "10.0.0.2", "status": "offline"}})
+        os.utime(self.hosts_file, ns=(1, 1))
+        self.cache._wake.set()
+        for _ in range(100):
+            if self.cache.host("db1") is not None:
+                break
+            self.cache._stop.wait(0.05)
+        self.assertIsNotNone(self.cache.host("db1"))
+        self.assertGreater(self.cache.builds, builds)
+
+
+class TestBulkPiggyback(unittest.TestCase):
+    """Test cases for the one-pass piggyback builder"""
+
+    def test_disks_grouped_by_host(self):
+        """Test that each host gets only its own disks, same device names included"""
+        smart = _FakeSmart()
+        smart.disks = [
+            {"device": "/dev/sda", "source_host": "web1", "health": "GOOD"},
+            {"device": "/dev/sda", "source_host": "db1", "health": "FAILED"},
+            {"device": "/dev/sdb", "source": "db1", "health": "WARNING"},
+        ]
+        hosts = {"web1": {"host": "10.0.0.1", "status": "online"},
+                 "db1": {"host": "10.0.0.2", "status": "online"},
+                 "idle": {"host": "10.0.0.3", "status": "offline"}}
+        sections = cmk.build_all_piggyback(hosts, smart)
+        self.assertEqual(smart.calls, 1)
+        self.assertEqual(sections["web1"].count("FleetPilot Disk"), 1)
+        self.assertIn('2 "FleetPilot Disk /dev/sda"', sections["db1"])
+        self.assertIn('1 "FleetPilot Disk /dev/sdb"', sections["db1"])
+        self.assertNotIn("FleetPilot Disk", sections["idle"])
+        self.assertEqual(sections["db1"],
+                         cmk.build_host_piggyback("db1", hosts["db1"], smart_manager=smart))
+
+    def test_bulk_payload_concatenates_hosts(self):
+        """Test that the bulk payload holds every host section"""
+        smart = _FakeSmart()
+        hosts = {"web1": {"host": "10.0.0.1"}, "db1": {"host": "10.0.0.2"}}
+        cache = cmk.AgentCache(lambda: hosts, smart_manager=smart)
+        body = cache.piggyback()["body"].decode()
+        self.assertIn("<<<<web1>>>>", body)
+        self.assertIn("<<<<db1>>>>", body)
+        self.assertEqual(body.count("<<<<>>>>"), 2)
+        self.assertIn("/api/checkmk/piggyback", cmk.PIGGYBACK_SCRIPT_TEMPLATE)
+        cache.stop()
+
+
+class TestCheckmkRoutes(unittest.TestCase):
+    """Test the conditional GET handling of the CheckMK API routes"""
+
+    def test_agent_returns_304_when_unchanged(self):
+        from app import app, _cmk_cache, _get_or_create_cmk_token
+        token = _get_or_create_cmk_token()
+        with patch.object(_cmk_cache, "agent", return_value=cmk._payload(
+                b"<<<local>>>\n", b"x", "text/plain; charset=utf-8", None)):
+            with app.test_client() as client:
+                first = client.get("/api/checkmk/agent",
+                                   headers={"X-FleetPilot-Token": token})
+                self.assertEqual(first.status_code, 200)
+                etag = first.headers["ETag"]
+                again = client.get("/api/checkmk/agent", headers={
+                    "X-FleetPilot-Token": token, "If-None-Match": etag})
+                self.assertEqual(again.status_code, 304)
+                self.assertEqual(again.data, b"")
+                since = client.get("/api/checkmk/agent", headers={
+                    "X-FleetPilot-Token": token,
+                    "If-Modified-Since": first.headers["Last-Modified"]})
+                self.assertEqual(since.status_code, 304)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+"""
+Test suite for the shared SQLite connection layer
+Tests per-thread reuse, pragmas, close semantics and reopening replaced files
+"""
+
+import os
+import tempfile
+import threading
+import unittest
+
+import db_pool
+
+
+class TestDbPool(unittest.TestCase):
+    """Test cases for db_pool module"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "test.db")
+
+    def tearDown(self):
+        db_pool.close_thread()
+        self.tmpdir.cleanup()
+
+    def test_connection_is_reused_per_thread(self):
+        """Test that one thread gets the same tuned connection back"""
+        conn = db_pool.connect(self.path)
+        self.assertIs(db_pool.connect(self.path), conn)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)   # NORMAL
+        conn.execute("CREATE TABLE t (x)")
+        self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 2)  # INCREMENTAL
+
+        other = []
+        t = threading.Thread(target=lambda: other.append(id(db_pool.connect(self.path))))
+        t.start()
+        t.join()
+        self.assertNotEqual(other[0], id(conn))
+
+    def test_close_rolls_back_but_keeps_connection(self):
+        """Test that close() discards uncommitted work like a real close did"""
+        with db_pool.connect(self.path) as conn:
+            conn.execute("CREATE TABLE t (v INTEGER)")
+        conn = db_pool.connect(self.path)
+        conn.execute("INSERT INTO t VALUES (1)")
+        conn.close()
+        conn = db_pool.connect(self.path)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM t").fetchone()[0], 0)
+        with conn:
+            conn.execute("INSERT INTO t VALUES (2)")
+        self.assertEqual(conn.execute("SELECT v FROM t").fetchone()["v"], 2)
+
+    def test_replaced_file_is_reopened(self):
+        """Test that a deleted and recreated database is not served stale"""
+        with db_pool.connect(self.path) as conn:
+            conn.execute("CREATE TABLE old (v INTEGER)")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+        fresh = db_pool.connect(self.path)
+        self.assertIsNot(fresh, conn)
+        tables = [r[0] for r in fresh.execute("SELECT name FROM sqlite_master")]
+        self.assertEqual(tables, [])
+
+    def test_close_all_retires_connections(self):
+        """Test that close_all() makes every thread reopen"""
+        conn = db_pool.connect(self.path)
+        db_pool.close_all()
+        self.assertIsNot(db_pool.connect(self.path), conn)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+"""
+Test suite for the fan curve engine
+Tests interpolation, hysteresis, rate limiting, write gating and failsafe
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import fan_curve
+from fan_curve import CurveState, evaluate, normalize_points, pick_sensor
+
+POINTS = [[30, 20], [50, 40], [70, 80], [80, 100]]
+
+
+def _curve(**kwargs):
+    curve = {"points": POINTS, "hysteresis": 3, "rate_limit": 0,
+             "min_delta": 2, "failsafe_pct": 100}
+    curve.update(kwargs)
+    return curve
+
+
+class TestCurveMath(unittest.TestCase):
+    """Test cases for curve evaluation and controller state"""
+
+    def test_evaluate_interpolates_and_clamps(self):
+        """Test linear interpolation between points and clamping outside them"""
+        self.assertEqual(evaluate(POINTS, 20), 20)
+        self.assertEqual(evaluate(POINTS, 40), 30)
+        self.assertEqual(evaluate(POINTS, 60), 60)
+        self.assertEqual(evaluate(POINTS, 95), 100)
+
+    def test_normalize_points_validates(self):
+        """Test that points are sorted and bad curves rejected"""
+        self.assertEqual(normalize_points('[[50, 40], [30, 20]]'), [[30, 20], [50, 40]])
+        with self.assertRaises(ValueError):
+            normalize_points([[30, 20]])
+        with self.assertRaises(ValueError):
+            normalize_points([[30, 20], [50, 140]])
+
+    def test_hysteresis_holds_duty_on_small_drops(self):
+        """Test that the duty only falls once the temperature drops past hysteresis"""
+        st = CurveState(_curve())
+        self.assertEqual(st.step(60, 0), 60)
+        st.committed(60)
+        self.assertIsNone(st.step(58, 3))          # within 3 °C: hold
+        self.assertEqual(st.eff_temp, 60)
+        duty = st.step(55, 6)                      # past hysteresis: follow at 58 °C
+        self.assertAlmostEqual(duty, 56)
+
+    def test_rate_limit_and_min_delta(self):
+        """Test that duty ramps at rate_limit and tiny changes are not written"""
+        st = CurveState(_curve(rate_limit=5))
+        st.committed(st.step(30, 0))
+        duty = st.step(80, 2)                      # wants 100, may move 10 %
+        self.assertAlmostEqual(duty, 30)
+        st.committed(duty)
+        self.assertIsNone(st.step(30.5, 2.1))      # no change worth writing
+
+    def test_failsafe_after_missed_reads(self):
+        """Test that missing sensor data drives the fan to failsafe"""
+        st = CurveState(_curve(failsafe_pct=90))
+        st.committed(st.step(40, 0))
+        self.assertIsNone(st.miss(3))
+        self.assertIsNone(st.miss(6))
+        self.assertEqual(st.miss(9), 90)
+
+    def test_pick_sensor(self):
+        """Test exact, substring and hottest-sensor selection"""
+        temps = {"CPU Temp": 55.0, "System Temp": 35.0, "Peripheral": 41.0}
+        self.assertEqual(pick_sensor(temps, "CPU Temp"), 55.0)
+        self.assertEqual(pick_sensor(temps, "system"), 35.0)
+        self.assertEqual(pick_sensor(temps, ""), 55.0)
+        self.assertIsNone(pick_sensor(temps, "GPU"))
+
+
+class TestControlLoop(unittest.TestCase):
+    """Test cases for curve storage and the per-device control tick"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        fan_curve.init_db(self.tmpdir.name)
+        fan_curve._states.clear()
+        self.writes = []
+        self.temps = {"CPU Temp": 60.0}
+        adapter = {
+            "get_device": lambda dev_id: {"id": dev_id, "name": "node1", "enabled": 1},
+            "read": lambda dev: dict(self.temps),
+            "write": lambda dev, channel, duty: self.writes.append((channel, duty)) or {"ok": True},
+        }
+        patcher = patch.dict(fan_curve._ADAPTERS, {"fan_controller": adapter})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        fan_curve._states.clear()
+        self.tmpdir.cleanup()
+
+    def test_tick_writes_only_on_change(self):
+        """Test that a steady temperature produces one write per channel"""
+        fan_curve.add_curve("fan_controller", 1, "0", POINTS, sensor="CPU", rate_limit=0)
+        fan_curve.add_curve("fan_controller", 1, "1", POINTS, rate_limit=0)
+        targets = fan_curve._load_targets()
+        self.assertEqual(list(targets), [("fan_controller", 1)])
+        target, interval = targets[("fan_controller", 1)]
+        self.assertEqual(interval, 3)
+        fan_curve._control_tick(target)
+        fan_curve._control_tick(target)
+        self.assertEqual(sorted(self.writes), [("0", 60), ("1", 60)])
+        self.temps["CPU Temp"] = 75.0
+        fan_curve._control_tick(target)
+        self.assertEqual(self.writes[-1], ("1", 90))
+
+    def test_duplicate_channel_rejected(self):
+        """Test that one channel can only be driven by one curve"""
+        fan_curve.add_curve("fan_controller", 1, "0", POINTS)
+        with self.assertRaises(ValueError):
+            fan_curve.add_curve("fan_controller", 1, "0", POINTS)
+
+    def test_update_reconfigures_running_state(self):
+        """Test that a changed curve reaches the state of a tick that reloads it"""
+        curve_id = fan_curve.add_curve("fan_controller", 1, "0", POINTS, rate_limit=0)
+        target, _ = fan_curve._load_targets()[("fan_controller", 1)]
+        fan_curve._control_tick(target)
+        self.assertEqual(self.writes, [("0", 60)])
+        # As from another process: only the database changes
+        fan_curve.update_curve(curve_id, points=[[30, 50], [80, 100]])
+        target, _ = fan_curve._load_targets()[("fan_controller", 1)]
+        fan_curve._control_tick(target)
+        self.assertEqual(self.writes[-1], ("0", 80))
+        self.assertEqual(fan_curve._states[curve_id].bounds, (50.0, 100.0))
+
+    def test_worker_status_shows_engine_state(self):
+        """Test that a forked worker reports the curve state of the engine in the parent"""
+        from poll_scheduler import PollScheduler
+        sched = PollScheduler("fan_curve", lambda t: True, share_dir=self.tmpdir.name)
+        sched.start()
+        self.addCleanup(sched.stop)
+        patcher = patch.object(fan_curve, "_scheduler", sched)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        curve_id = fan_curve.add_curve("fan_controller", 1, "0", POINTS, rate_limit=0)
+        target, _ = fan_curve._load_targets()[("fan_controller", 1)]
+        fan_curve._control_tick(target)
+
+        go_r, go_w = os.pipe()
+        out_r, out_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(go_w)
+                os.close(out_r)
+                os.read(go_r, 1)
+                status = {"states": len(fan_curve._states), "curves": fan_curve.get_status()["curves"]}
+                os.write(out_w, json.dumps(status).encode())
+            finally:
+                os._exit(0)
+        os.close(go_r)
+        os.close(out_w)
+        self.temps["CPU Temp"] = 75.0           # the engine moves on after the fork
+        fan_curve._control_tick(target)
+        os.write(go_w, b"x")
+        os.close(go_w)
+        with os.fdopen(out_r, "rb") as f:
+            status = json.loads(f.read())
+        os.waitpid(pid, 0)
+        self.assertEqual(status["states"], 0)
+        self.assertEqual(status["curves"][str(curve_id)]["written"], 90)
+        self.assertEqual(status["curves"][str(curve_id)]["temp"], 75.0)
+
+    def test_settings_are_validated(self):
+        """Test that numeric settings are coerced and range-checked on add and update"""
+        curve_id = fan_curve.add_curve("fan_controller", 1, "0", POINTS, interval="5")
+        fan_curve.update_curve(curve_id, hysteresis="1.5", enabled=0)
+        curve = fan_curve.get_curve(curve_id)
+        self.assertEqual((curve["interval"], curve["hysteresis"], curve["enabled"]), (5, 1.5, 0))
+        for bad in ({"hysteresis": "warm"}, {"min_delta": -1}, {"failsafe_pct": 150},
+                    {"rate_limit": float("nan")}):
+            with self.assertRaises(ValueError):
+                fan_curve.update_curve(curve_id, **bad)
+        with self.assertRaises(ValueError):
+            fan_curve.add_curve("fan_controller", 1, "1", POINTS, failsafe_pct=-5)
+        self.assertEqual(fan_curve.get_curve(curve_id)["hysteresis"], 1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
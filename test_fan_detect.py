@@ -0,0 +1,106 @@
+"""
+Test suite for fan controller auto-detection
+Tests parsing of the one-round-trip probe output and batch detection
+"""
+
+import json
+import unittest
+from unittest.mock import patch
+
+import fan_controller
+
+PROBE_OUTPUT = """@@hostname
+node1
+@@os
+PRETTY_NAME="Debian GNU/Linux 12 (bookworm)"
+@@power
+AC
+@@chassis
+23
+@@vendor
+Supermicro
+@@hwmon
+/sys/class/hwmon/hwmon0|acpitz|||1
+/sys/class/hwmon/hwmon2|nct6798| pwm1 pwm2| fan1=1180 fan2=0|7
+@@liquidctl
+liquidctl v1.13.0
+@@liquidctl_list
+%s
+@@sensors
+sensors version 3.6.0 with libsensors version 3.6.0
+@@sensors_out
+nct6798-isa-0290
+fan1:        1180 RPM  (min =    0 RPM)
+CPUTIN:       +41.0°C
+
+coretemp-isa-0000
+Package id 0:  +45.0°C
+@@ipmi
+ipmitool version 1.8.19
+@@ipmi_fans
+FAN1             | 41h | ok  | 29.1 | 1400 RPM
+FAN2             | 42h | ok  | 29.2 | 1400 RPM
+@@end
+""" % json.dumps([{"description": "Corsair Commander Pro", "vendor_id": 6940}])
+
+
+class TestFanDetect(unittest.TestCase):
+    """Test cases for fan_controller detection"""
+
+    def test_parse_probe_output(self):
+        """Test that one probe output yields system info, channels and suggestions"""
+        result = fan_controller.parse_detect_output("10.0.0.5", PROBE_OUTPUT)
+        self.assertTrue(result["ok"])
+        self.assertEqual(result["hostname"], "node1")
+        self.assertEqual(result["os"], "Debian GNU/Linux 12 (bookworm)")
+        self.assertFalse(result["is_laptop"])
+        chip = result["hwmon"][1]
+        self.assertEqual(chip["pwm"], ["/sys/class/hwmon/hwmon2/pwm1",
+                                       "/sys/class/hwmon/hwmon2/pwm2"])
+        self.assertEqual(chip["fans"], {"fan1": 1180, "fan2": 0})
+
+        by_type = {s["controller_type"]: s for s in result["suggestions"]}
+        self.assertEqual(set(by_type), {"liquidctl", "lm_sensors", "pwm_sysfs", "ipmi"})
+        self.assertEqual(by_type["liquidctl"]["extra_config"]["match_str"], "Commander")
+        self.assertEqual(by_type["ipmi"]["extra_config"]["vendor"], "supermicro")
+        self.assertIn("2 fan sensor(s)", by_type["ipmi"]["reason"])
+        self.assertEqual(len(by_type["pwm_sysfs"]["channels"]), 2)
+        # sensors output is shown as-is, blank line between chips included
+        self.assertIn("+41.0°C\n\ncoretemp-isa-0000", by_type["lm_sensors"]["detected_devices"])
+        self.assertIn("2 temp sensor(s)", by_type["lm_sensors"]["reason"])
+        self.assertEqual(result["suggestions"][0]["controller_type"], "liquidctl")
+
+    def test_laptop_without_tools(self):
+        """Test that a bare laptop gets the nbfc install hint"""
+        output = "@@hostname\nlaptop\n@@power\nAC\nBAT0\n@@chassis\n10\n@@hwmon\n@@end\n"
+        result = fan_controller.parse_detect_output("lap", output)
+        self.assertTrue(result["is_laptop"])
+        self.assertEqual([s["controller_type"] for s in result["suggestions"]], ["nbfc"])
+        self.assertEqual(result["suggestions"][0]["confidence"], "low")
+
+    def test_truncated_probe_is_an_error(self):
+        """Test that output cut off before @@end is reported as a failure"""
+        result = fan_controller.parse_detect_output("h", "@@hostname\nh\n@@hwmon\n")
+        self.assertFalse(result["ok"])
+        self.assertEqual(result["suggestions"], [])
+
+    def test_detect_many_keeps_order(self):
+        """Test that batch detection returns one result per host in input order"""
+        seen = []
+
+        def fake_detect(host, port, username, password, ssh_key):
+            seen.append((host, port, username))
+            return {"ok": host != "bad", "host": host}
+
+        with patch.object(fan_controller, "detect_controllers", side_effect=fake_detect):
+            results = fan_controller.detect_many([
+                {"host": "a"}, {"host": "bad", "port": 2222}, {"host": "c", "username": "admin"},
+            ])
+        self.assertEqual([r["host"] for r in results], ["a", "bad", "c"])
+        self.assertEqual([r["ok"] for r in results], [True, False, True])
+        self.assertIn(("bad", 2222, "root"), seen)
+        self.assertIn(("c", 22, "admin"), seen)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+"""
+Test suite for deadline-bounded parallel calls
+Tests result collection, per-call failures and the shared deadline
+"""
+
+import threading
+import time
+import unittest
+
+import fanout
+
+
+class TestFanout(unittest.TestCase):
+    """Test cases for fanout.gather"""
+
+    def test_results_and_errors(self):
+        """Test that failures get their default and an error message"""
+        def boom():
+            raise ValueError("bad gateway")
+
+        results, errors = fanout.gather({
+            "pools": lambda: ["tank"],
+            "shares": boom,
+            "alerts": lambda: None,
+        }, defaults={"shares": []})
+        self.assertEqual(results, {"pools": ["tank"], "shares": [], "alerts": None})
+        self.assertEqual(errors, {"shares": "bad gateway"})
+
+    def test_calls_run_concurrently(self):
+        """Test that latency is the slowest call, not the sum"""
+        barrier = threading.Barrier(4, timeout=2)
+        calls = {str(i): (lambda i=i: barrier.wait() and i or i) for i in range(4)}
+        started = time.monotonic()
+        results, errors = fanout.gather(calls, deadline=5)
+        self.assertEqual(errors, {})
+        self.assertEqual(results, {"0": 0, "1": 1, "2": 2, "3": 3})
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_deadline_abandons_slow_calls(self):
+        """Test that a hung call is reported and does not block the result"""
+        release = threading.Event()
+        self.addCleanup(release.set)
+        started = time.monotonic()
+        results, errors = fanout.gather({
+            "fast": lambda: 1,
+            "hung": lambda: release.wait(5),
+        }, deadline=0.2, defaults={"hung": "n/a"})
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(results, {"fast": 1, "hung": "n/a"})
+        self.assertIn("timed out", errors["hung"])
+
+    def test_empty(self):
+        """Test that no calls means no work"""
+        self.assertEqual(fanout.gather({}), ({}, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
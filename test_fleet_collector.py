@@ -0,0 +1,131 @@
+"""
+Test suite for the fleet collector
+Tests parsing of the compound collect script output and concurrent cycles
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import fleet_collector
+import ingest
+import system_monitor
+
+
+SAMPLE_OUTPUT = """@@stat
+cpu  {user} 0 {system} {idle} 0 0 0 0 0 0
+@@meminfo
+MemTotal:        8000000 kB
+MemFree:         1000000 kB
+MemAvailable:    6000000 kB
+SwapTotal:       2000000 kB
+SwapFree:        1500000 kB
+@@loadavg
+0.52 0.41 0.30 1/123 4567
+@@cpufreq
+cpu MHz		: 2400.123
+@@df
+Filesystem     Type 1024-blocks    Used Available Capacity Mounted on
+/dev/sda1      ext4    10000000 4000000   6000000      40% /
+/dev/sdb1      xfs     20000000 5000000  15000000      25% /srv/data store
+@@net
+Inter-|   Receive                                                |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed
+    lo: 999 9 0 0 0 0 0 0 999 9 0 0 0 0 0 0
+  eth0: 1000 10 0 0 0 0 0 0 2000 20 0 0 0 0 0 0
+@@hwmon
+coretemp|Package id 0|45000|80000|100000
+nvme|Composite|38850||
+@@end
+"""
+
+
+def _output(user, system, idle):
+    return SAMPLE_OUTPUT.format(user=user, system=system, idle=idle)
+
+
+class TestFleetCollector(unittest.TestCase):
+    """Test cases for fleet_collector module"""
+
+    def setUp(self):
+        fleet_collector._prev_cpu.clear()
+        fleet_collector._status.clear()
+
+    def test_parse_output(self):
+        """Test that every section maps onto the fleet_samples columns"""
+        sample = fleet_collector.parse_output("web1", _output(100, 50, 850), ts=1000)
+        self.assertEqual(sample['host'], "web1")
+        self.assertIsNone(sample['cpu_pct'])
+        self.assertEqual(sample['cpu_freq'], 2400.1)
+        self.assertEqual((sample['load1'], sample['load5'], sample['load15']), (0.52, 0.41, 0.30))
+        self.assertEqual(sample['ram_total'], 8000000 * 1024)
+        self.assertEqual(sample['ram_used'], 2000000 * 1024)
+        self.assertEqual(sample['ram_pct'], 25.0)
+        self.assertEqual(sample['swap_used'], 500000 * 1024)
+
+        disks = json.loads(sample['disk_json'])
+        self.assertEqual([d['mountpoint'] for d in disks], ["/", "/srv/data store"])
+        self.assertEqual(disks[0]['fstype'], "ext4")
+        self.assertEqual(disks[0]['pct'], 40.0)
+
+        net = json.loads(sample['net_json'])
+        self.assertEqual(net['bytes_recv'], 1000)
+        self.assertEqual(net['bytes_sent'], 2000)
+
+        temps = json.loads(sample['temp_json'])
+        self.assertEqual(temps['coretemp'][0]['current'], 45.0)
+        self.assertEqual(temps['coretemp'][0]['critical'], 100.0)
+        self.assertIsNone(temps['nvme'][0]['high'])
+
+    def test_cpu_pct_from_counter_delta(self):
+        """Test that CPU usage is computed from consecutive /proc/stat readings"""
+        fleet_collector.parse_output("web1", _output(100, 50, 850))
+        sample = fleet_collector.parse_output("web1", _output(160, 80, 910))
+        # 90 busy jiffies out of 150 elapsed
+        self.assertEqual(sample['cpu_pct'], 60.0)
+
+    def test_run_cycle_stores_samples_and_backs_off(self):
+        """Test that a cycle stores reachable hosts and backs off failed ones"""
+        hosts = {
+            "web1": {"host": "10.0.0.1", "user": "root", "port": 22},
+            "web2": {"host": "10.0.0.2", "user": "root", "port": 22},
+            "down": {"host": "10.0.0.3", "user": "root", "port": 22},
+        }
+
+        def fake_run(host, cmd, **kwargs):
+            if host == "10.0.0.3":
+                raise OSError("timed out")
+            return _output(100, 50, 850), "", 0
+
+        with tempfile.TemporaryDirectory() as tmp:
+            system_monitor.init_db(tmp)
+            with patch.object(fleet_collector.ssh_pool, "run", side_effect=fake_run) as run, \
+                 patch.object(fleet_collector.ssh_pool, "discard"):
+                result = fleet_collector.run_cycle(hosts)
+                self.assertEqual((result['ok'], result['failed']), (2, 1))
+                ingest.flush()
+                self.assertEqual(set(system_monitor.get_fleet_latest()), {"web1", "web2"})
+                self.assertFalse(fleet_collector.get_status()['hosts']['down']['ok'])
+
+                run.reset_mock()
+                result = fleet_collector.run_cycle(hosts)
+                self.assertEqual(result['polled'], 2)
+                self.assertEqual(run.call_count, 2)
+            ingest.flush()
+            self.assertEqual(len(system_monitor.get_fleet_history("web1")), 2)
+
+    def test_pool_is_sized_for_timeouts(self):
+        """Test that all-timeout cycles stay within the budget up to _MAX_WORKERS hosts"""
+        for due in (1, 5, 100, fleet_collector._MAX_WORKERS):
+            workers = fleet_collector._pool_size(due)
+            self.assertLessEqual(workers, due)
+            waves = -(-due // workers)
+            self.assertLessEqual(waves * fleet_collector._HOST_TIMEOUT,
+                                 fleet_collector._CYCLE_BUDGET)
+        self.assertEqual(fleet_collector._pool_size(200), fleet_collector._MAX_WORKERS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Test suite for the keep-alive HTTP pool
+Tests connection reuse, gzip decoding, error statuses and redirects
+"""
+
+import gzip
+import json
+import socket
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import http_pool
+import storage_controller
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"           # keep-alive
+    connections = set()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        _Handler.connections.add(self.client_address)
+        if self.path == "/moved":
+            self._reply(302, b"", {"Location": "/json"})
+        elif self.path == "/missing":
+            self._reply(404, b"no such thing")
+        else:
+            body = json.dumps({"path": self.path}).encode()
+            if "gzip" in self.headers.get("Accept-Encoding", ""):
+                self._reply(200, gzip.compress(body), {"Content-Encoding": "gzip"})
+            else:
+                self._reply(200, body)
+
+    def _reply(self, status, body, headers=None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestHttpPool(unittest.TestCase):
+    """Test cases for http_pool module"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        http_pool.close_all()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        http_pool.close_all()
+        _Handler.connections.clear()
+
+    def test_connection_is_kept_alive(self):
+        """Test that sequential calls share one TCP connection"""
+        for i in range(5):
+            status, body = http_pool.request("GET", f"{self.base}/json?i={i}")
+            self.assertEqual(status, 200)
+            self.assertEqual(json.loads(body), {"path": f"/json?i={i}"})   # gzip decoded
+        self.assertEqual(len(_Handler.connections), 1)
+
+    def test_http_helper_keeps_result_shape(self):
+        """Test that _http still reports data, HTTP errors and redirects as before"""
+        ok = storage_controller._http("GET", f"{self.base}/moved")
+        self.assertEqual(ok, {"ok": True, "status": 200, "data": {"path": "/json"}})
+        err = storage_controller._http("GET", f"{self.base}/missing")
+        self.assertEqual(err, {"ok": False, "status": 404, "error": "no such thing"})
+
+    def test_network_error_propagates(self):
+        """Test that a refused connection surfaces as an exception"""
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]              # nothing listens here now
+        with self.assertRaises(OSError):
+            http_pool.request("GET", f"http://127.0.0.1:{port}/", timeout=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
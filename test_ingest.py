@@ -0,0 +1,106 @@
+"""
+Test suite for the write-behind ingest queue
+Tests batching into one transaction, flush, per-kind retry and metrics
+"""
+
+import os
+import queue
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import db_pool
+import ingest
+
+
+class TestIngest(unittest.TestCase):
+    """Test cases for ingest module"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "ingest.db")
+        with db_pool.connect(self.path) as db:
+            db.execute("CREATE TABLE samples (v INTEGER NOT NULL)")
+        self.batches = []
+        self.errors = []
+
+        def write(conn, items):
+            self.batches.append(list(items))
+            conn.executemany("INSERT INTO samples(v) VALUES (?)", [(v,) for v in items])
+
+        ingest.register("test_sample", self.path, write,
+                        on_error=lambda items: self.errors.append(list(items)))
+
+    def tearDown(self):
+        ingest.flush()
+        db_pool.close_thread()
+        self.tmpdir.cleanup()
+
+    def _rows(self):
+        return [r[0] for r in db_pool.connect(self.path).execute("SELECT v FROM samples ORDER BY rowid")]
+
+    def test_samples_are_batched(self):
+        """Test that samples queued together are written in one batch"""
+        for v in range(50):
+            self.assertTrue(ingest.put("test_sample", v))
+        self.assertTrue(ingest.flush())
+        self.assertEqual(self._rows(), list(range(50)))
+        self.assertLessEqual(len(self.batches), 2)
+
+        stats = ingest.stats()["ingest.db"]
+        self.assertEqual(stats["depth"], 0)
+        self.assertGreaterEqual(stats["written"], 50)
+        self.assertGreaterEqual(stats["last_flush_ms"], 0)
+
+    def test_failing_kind_does_not_drop_others(self):
+        """Test that a failing kind is rolled back without losing other kinds"""
+        def broken(conn, items):
+            conn.execute("INSERT INTO samples(v) VALUES (NULL)")
+
+        ingest.register("broken_sample", self.path, broken)
+        ingest.put("test_sample", 1)
+        ingest.put("broken_sample", "x")
+        ingest.put("test_sample", 2)
+        ingest.flush()
+        self.assertEqual(self._rows(), [1, 2])
+        self.assertTrue(self.errors)                      # first attempt was rolled back
+        stats = ingest.stats()["ingest.db"]
+        self.assertGreaterEqual(stats["errors"], 1)
+        self.assertEqual((stats["written"], stats["failed"]), (2, 1))
+
+    def test_flush_does_not_block_on_full_queue(self):
+        """Test that flush() gives up after its timeout when the queue is full"""
+        ingest.put("test_sample", 1)
+        self.assertTrue(ingest.flush())
+        writer = ingest._writers[self.path]
+        full = queue.Queue(maxsize=1)
+        full.put(("test_sample", 2, time.monotonic()))
+        with patch.object(writer, "queue", full):
+            started = time.monotonic()
+            self.assertFalse(ingest.flush(timeout=0.2))
+        self.assertLess(time.monotonic() - started, 1.0)
+
+    def test_child_process_starts_its_own_writer(self):
+        """Test that a forked child writes through a fresh writer thread"""
+        ingest.put("test_sample", 1)
+        self.assertTrue(ingest.flush())
+        pid = os.fork()
+        if pid == 0:                                      # child
+            try:
+                ok = ingest.put("test_sample", 2) and ingest.flush(5.0)
+                ok = ok and ingest._writers[self.path].thread.is_alive()
+            finally:
+                os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertEqual(self._rows(), [1, 2])
+
+    def test_unknown_kind(self):
+        """Test that an unregistered kind is a programming error"""
+        with self.assertRaises(KeyError):
+            ingest.put("no_such_kind", 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+"""
+Test suite for the stale-while-revalidate inventory cache
+Tests first-read waiting, serving stale data, on-demand refresh and errors
+"""
+
+import os
+import threading
+import unittest
+
+from inventory_cache import InventoryCache
+
+
+class TestInventoryCache(unittest.TestCase):
+    """Test cases for InventoryCache"""
+
+    def setUp(self):
+        self.calls = 0
+        self.fail = False
+        self.gate = threading.Event()
+        self.gate.set()
+        self.cache = InventoryCache("test_inventory", self._fetch, interval=60, first_wait=2)
+        self.addCleanup(self.cache.stop)
+
+    def _fetch(self, key):
+        self.gate.wait(5)
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError("NAS unreachable")
+        return {"key": key, "n": self.calls}
+
+    def test_first_read_waits_for_data(self):
+        """Test that the first get() returns a fetched snapshot"""
+        snap = self.cache.get(1)
+        self.assertEqual(snap["data"], {"key": 1, "n": 1})
+        self.assertIsNone(snap["error"])
+        self.assertEqual(snap["age"], 0)
+        # Later reads are served from the cache
+        self.assertEqual(self.cache.get(1)["data"]["n"], 1)
+        self.assertEqual(self.calls, 1)
+
+    def test_slow_refresh_serves_stale_snapshot(self):
+        """Test that a slow endpoint does not hold up get()"""
+        self.cache.get(1)
+        self.gate.clear()
+        self.cache.refresh(1)
+        snap = self.cache.get(1)
+        self.assertEqual(snap["data"]["n"], 1)
+        self.gate.set()
+        snap = self.cache.refresh(1, wait=2)
+        self.assertEqual(snap["data"]["n"], 2)
+
+    def test_slow_first_read_returns_empty_snapshot(self):
+        """Test that the first read gives up after first_wait"""
+        self.gate.clear()
+        snap = self.cache.get(2, wait=0.1)
+        self.assertIsNone(snap["data"])
+        self.assertIsNone(snap["age"])
+        self.gate.set()
+
+    def test_failed_refresh_keeps_data(self):
+        """Test that an error is reported alongside the previous data"""
+        self.cache.get(1)
+        self.fail = True
+        snap = self.cache.refresh(1, wait=2)
+        self.assertEqual(snap["data"]["n"], 1)
+        self.assertEqual(snap["error"], "NAS unreachable")
+        self.fail = False
+        snap = self.cache.refresh(1, wait=2)
+        self.assertEqual(snap["data"]["n"], 3)
+        self.assertIsNone(snap["error"])
+
+    def test_forget_drops_snapshot(self):
+        """Test that forget() discards the entry"""
+        self.cache.get(1)
+        self.cache.forget(1)
+        self.assertEqual(self.cache.get(1)["data"]["n"], 2)
+
+    def test_forked_child_refreshes_on_its_own(self):
+        """Test that a worker does not serve the parent's frozen snapshot"""
+        self.assertEqual(self.cache.get(1)["data"]["n"], 1)
+        pid = os.fork()
+        if pid == 0:
+            ok = 1 not in self.cache
+            ok = ok and self.cache.get(1)["data"] == {"key": 1, "n": 2}
+            ok = ok and self.cache.refresh(1, wait=2)["data"]["n"] == 3
+            os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertEqual(self.cache.get(1)["data"]["n"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
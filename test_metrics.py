@@ -0,0 +1,193 @@
+"""
+Test suite for the in-memory metric registry
+Tests OpenMetrics rendering, render caching, collector hooks, sharing between
+forked processes and /metrics
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import metrics
+
+
+class TestRegistry(unittest.TestCase):
+    """Test cases for metrics families and render()"""
+
+    def setUp(self):
+        self.gauge = metrics.gauge("test_temperature_celsius", "Test temperature",
+                                   ("disk",), unit="celsius")
+        self.counter = metrics.counter("test_events", "Test events", ("kind",))
+        self.summary = metrics.summary("test_duration_seconds", "Test durations", ("poller",))
+        for fam in (self.gauge, self.counter, self.summary):
+            self.addCleanup(fam.clear)
+
+    def test_openmetrics_format(self):
+        """Test TYPE/HELP/UNIT lines, sample suffixes and # EOF"""
+        self.gauge.set(41, disk="/dev/sda")
+        self.gauge.set(38.5, disk='a"b')
+        self.counter.inc(kind="x")
+        self.counter.inc(2, kind="x")
+        self.summary.observe(0.5, poller="p")
+        self.summary.observe(1.5, poller="p")
+        text = metrics.render()
+        self.assertIn("# TYPE test_temperature_celsius gauge\n", text)
+        self.assertIn("# UNIT test_temperature_celsius celsius\n", text)
+        self.assertIn('test_temperature_celsius{disk="/dev/sda"} 41\n', text)
+        self.assertIn('test_temperature_celsius{disk="a\\"b"} 38.5\n', text)
+        self.assertIn('test_events_total{kind="x"} 3\n', text)
+        self.assertIn('test_duration_seconds_count{poller="p"} 2\n', text)
+        self.assertIn('test_duration_seconds_sum{poller="p"} 2.0\n', text)
+        self.assertTrue(text.endswith("# EOF\n"))
+
+    def test_unchanged_family_is_not_rerendered(self):
+        """Test that setting the same value keeps the cached text"""
+        self.gauge.set(41, disk="sda")
+        first = self.gauge.render()
+        self.gauge.set(41, disk="sda")
+        self.assertIs(self.gauge.render(), first)
+        self.gauge.set(42, disk="sda")
+        self.assertIsNot(self.gauge.render(), first)
+
+    def test_replace_and_remove(self):
+        """Test that replace() drops vanished series and remove() matches subsets"""
+        fans = metrics.gauge("test_fan_rpm", "Test fans", ("device_id", "fan"))
+        self.addCleanup(fans.clear)
+        fans.replace([({"fan": "cpu"}, 900), ({"fan": "sys"}, 700)], device_id=1)
+        fans.replace([({"fan": "cpu"}, 1200)], device_id=2)
+        fans.replace([({"fan": "cpu"}, 950)], device_id=1)
+        self.assertIsNone(fans.value(device_id=1, fan="sys"))
+        self.assertEqual(fans.value(device_id=1, fan="cpu"), 950)
+        fans.remove(device_id=2)
+        self.assertIsNone(fans.value(device_id=2, fan="cpu"))
+        self.assertEqual(fans.value(device_id=1, fan="cpu"), 950)
+        fans.replace([({"fan": "cpu"}, 1200)], device_id=3)
+        fans.retain("device_id", [3])
+        self.assertIsNone(fans.value(device_id=1, fan="cpu"))
+        self.assertEqual(fans.value(device_id=3, fan="cpu"), 1200)
+
+    def test_internal_stats_collector(self):
+        """Test that ingest, db_pool and http_pool counters are exported"""
+        text = metrics.render()
+        self.assertIn("# TYPE fleetpilot_db_pool_connections counter", text)
+        self.assertIn('fleetpilot_http_pool_total{event="requests"}', text)
+
+
+class TestSharedRegistry(unittest.TestCase):
+    """Test that a forked worker renders what the preloaded master collects"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.addCleanup(setattr, metrics, "_published", None)
+        self.addCleanup(setattr, metrics, "_share", metrics._share)
+        metrics.configure(self.tmp)
+        self.up = metrics.gauge("test_shared_up", "Test host up", ("host",))
+        self.events = metrics.counter("test_shared_events", "Test events", ("kind",))
+        for fam in (self.up, self.events):
+            self.addCleanup(fam.clear)
+
+    def test_forked_worker_sees_master_updates(self):
+        self.up.set(1, host="a")
+        self.up.set(1, host="b")
+        self.events.inc(5, kind="x")
+        go_r, go_w = os.pipe()
+        out_r, out_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:                    # the "worker"
+            try:
+                os.close(go_w)
+                os.close(out_r)
+                os.read(go_r, 1)
+                self.events.inc(2, kind="x")
+                self.up.remove(host="b")
+                os.write(out_w, metrics.render().encode())
+            finally:
+                os._exit(0)
+        os.close(go_r)
+        os.close(out_w)
+        # the "master" keeps polling after the fork
+        self.up.set(0, host="a")
+        self.events.inc(kind="x")
+        metrics._publish()
+        os.write(go_w, b"x")
+        os.close(go_w)
+        chunks = []
+        while True:
+            chunk = os.read(out_r, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        os.close(out_r)
+        os.waitpid(pid, 0)
+        text = b"".join(chunks).decode()
+
+        self.assertIn('test_shared_up{host="a"} 0\n', text)
+        self.assertNotIn('test_shared_up{host="b"}', text)
+        self.assertIn('test_shared_events_total{kind="x"} 8\n', text)
+        self.assertTrue(text.endswith("# EOF\n"))
+
+        # the exited worker's counts are kept, once
+        for _ in range(2):
+            self.assertIn('test_shared_events_total{kind="x"} 8\n', metrics.render())
+        self.assertEqual(sorted(os.listdir(self.tmp)),
+                         sorted([f"{os.getpid()}.json", "retired.json", "retired.lock"]))
+
+
+class TestCollectorHooks(unittest.TestCase):
+    """Test that collectors publish while they ingest"""
+
+    def test_poll_scheduler_records_latency(self):
+        from poll_scheduler import PollScheduler
+        sched = PollScheduler("test_metrics_poller", lambda t: t)
+        before = metrics.POLL_DURATION.value(poller="test_metrics_poller") or (0, 0.0)
+        st = {"target": False, "interval": 60, "failures": 0, "running_since": None}
+        sched._targets["k"] = st
+        job = {"key": "k", "st": st, "started": 0}
+        sched._jobs[id(job)] = job
+        with patch.object(sched, "_schedule"):
+            sched._execute(job)
+        self.assertEqual(metrics.POLL_DURATION.value(poller="test_metrics_poller")[0],
+                         before[0] + 1)
+        self.assertGreaterEqual(metrics.POLL_FAILURES.value(poller="test_metrics_poller"), 1)
+
+    def test_fleet_collector_host_up(self):
+        import fleet_collector
+        fleet_collector._mark("metrics-host", False, "timeout", 0)
+        self.assertEqual(fleet_collector.HOST_UP.value(host="metrics-host"), 0)
+        with patch.object(fleet_collector.system_monitor, "save_fleet_samples"):
+            fleet_collector.run_cycle(hosts={})
+        self.assertIsNone(fleet_collector.HOST_UP.value(host="metrics-host"))
+
+    def test_smart_snapshot_publishes_gauges(self):
+        import smart_manager
+        smart_manager._disk_labels[9999] = {"disk_id": 9999, "source": "web1", "device": "/dev/sdz"}
+        with patch.object(smart_manager.ingest, "put"):
+            smart_manager._queue_snapshot(9999, {"temp": 47, "reallocated": 3}, "WARNING")
+        labels = dict(disk_id=9999, source="web1", device="/dev/sdz")
+        self.assertEqual(smart_manager.DISK_HEALTH.value(**labels), 1)
+        self.assertEqual(smart_manager.DISK_TEMP.value(**labels), 47)
+        self.assertEqual(smart_manager.DISK_REALLOCATED.value(**labels), 3)
+        for fam in (smart_manager.DISK_HEALTH, smart_manager.DISK_TEMP,
+                    smart_manager.DISK_REALLOCATED):
+            fam.remove(disk_id=9999)
+
+
+class TestMetricsRoute(unittest.TestCase):
+    """Test the /metrics endpoint"""
+
+    def test_requires_token(self):
+        from app import app, _get_or_create_cmk_token
+        token = _get_or_create_cmk_token()
+        with app.test_client() as client:
+            self.assertEqual(client.get("/metrics").status_code, 401)
+            resp = client.get("/metrics", headers={"Authorization": "Bearer " + token})
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.content_type.startswith("application/openmetrics-text"))
+            self.assertTrue(resp.data.endswith(b"# EOF\n"))
+
+
+if __name__ == '__main__':
+    unittest.main()
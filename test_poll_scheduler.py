@@ -0,0 +1,198 @@
+"""
+Test suite for the poll scheduler
+Tests concurrent per-target intervals, back-off and loader reconciliation
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import db_pool
+import poll_scheduler
+from poll_scheduler import PollScheduler
+
+
+class TestPollScheduler(unittest.TestCase):
+    """Test cases for poll_scheduler module"""
+
+    def setUp(self):
+        patcher = patch.object(poll_scheduler, "MIN_INTERVAL", 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def _record(self, key):
+        with self.lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+    def test_slow_target_does_not_block_fast_target(self):
+        """Test that a hanging poll leaves other targets on schedule"""
+        release = threading.Event()
+
+        def poll(target):
+            self._record(target)
+            if target == "slow":
+                release.wait(5)
+            return True
+
+        sched = PollScheduler("t", poll, max_workers=4, timeout=0.2, jitter=0)
+        sched.upsert("slow", "slow", 0.05)
+        sched.upsert("fast", "fast", 0.05)
+        sched.start()
+        try:
+            time.sleep(0.6)
+            status = sched.status()
+        finally:
+            release.set()
+            sched.stop()
+        self.assertEqual(self.calls["slow"], 1)
+        self.assertGreater(self.calls["fast"], 4)
+        self.assertTrue(status["slow"]["overrun"])
+
+    def test_timeout_frees_the_worker_slot(self):
+        """Test that a hung poll is failed after timeout and stops holding its worker"""
+        release = threading.Event()
+
+        def poll(target):
+            self._record(target)
+            if target == "hung":
+                release.wait(5)
+            return True
+
+        sched = PollScheduler("t", poll, max_workers=1, timeout=0.1, jitter=0, stagger=0)
+        sched.upsert("hung", "hung", 0.05)
+        time.sleep(0.02)
+        sched.upsert("ok", "ok", 0.05)
+        sched.start()
+        try:
+            time.sleep(0.6)
+            status = sched.status()
+            workers = len(sched._workers)
+        finally:
+            release.set()
+            sched.stop(wait=True)
+        self.assertEqual(workers, 1)                    # the stuck worker was replaced
+        self.assertEqual(self.calls["hung"], 1)
+        self.assertGreater(self.calls["ok"], 3)
+        self.assertEqual(status["hung"]["last_error"], "timed out after 0.1s")
+        self.assertTrue(status["hung"]["overrun"])
+        self.assertIsNone(status["hung"]["running_s"])
+
+    def test_polls_reuse_worker_threads(self):
+        """Test that polls run on max_workers long-lived threads and keep their connections"""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        db = os.path.join(tmp.name, "poll.db")
+        threads = set()
+
+        def poll(target):
+            threads.add(threading.get_ident())
+            conn = db_pool.connect(db)
+            conn.execute("SELECT 1").fetchone()
+            conn.close()
+            self._record(target)
+            return True
+
+        sched = PollScheduler("t", poll, max_workers=2, jitter=0, stagger=0)
+        sched.upsert("a", "a", 0.05)
+        sched.upsert("b", "b", 0.05)
+        before = db_pool.stats()["opened"]
+        sched.start()
+        try:
+            time.sleep(0.5)
+        finally:
+            sched.stop(wait=True)
+        self.assertGreater(self.calls["a"] + self.calls["b"], 8)
+        self.assertLessEqual(len(threads), 2)
+        self.assertLessEqual(db_pool.stats()["opened"] - before, 2)
+
+    def test_failures_back_off(self):
+        """Test that failing targets are retried less often"""
+        def poll(target):
+            self._record(target)
+            if target == "down":
+                raise OSError("unreachable")
+            return True
+
+        sched = PollScheduler("t", poll, max_workers=2, jitter=0, max_backoff=10)
+        sched.upsert("down", "down", 0.05)
+        sched.upsert("up", "up", 0.05)
+        sched.start()
+        try:
+            time.sleep(0.5)
+            status = sched.status()
+        finally:
+            sched.stop()
+        self.assertLess(self.calls["down"], 5)
+        self.assertGreater(self.calls["up"], self.calls["down"] * 2)
+        self.assertEqual(status["down"]["last_error"], "unreachable")
+        self.assertIsNone(status["up"]["last_error"])
+
+    def test_loader_adds_and_removes_targets(self):
+        """Test that reload() reconciles the target set with the loader"""
+        wanted = {"a": ("a", 60), "b": ("b", 60)}
+        sched = PollScheduler("t", lambda t: self._record(t),
+                              loader=lambda: dict(wanted), reload_interval=60)
+        sched.start()
+        try:
+            time.sleep(0.1)
+            self.assertEqual(set(sched.status()), {"a", "b"})
+            del wanted["a"]
+            wanted["c"] = ("c", 30)
+            sched.reload()
+            time.sleep(0.1)
+            status = sched.status()
+        finally:
+            sched.stop()
+        self.assertEqual(set(status), {"b", "c"})
+        self.assertEqual(status["c"]["interval"], 30)
+
+    def test_forked_copy_hands_off_to_running_scheduler(self):
+        """Test reload/trigger/status from a forked child reach the parent's scheduler"""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        targets_file = os.path.join(tmp.name, "targets.json")
+        with open(targets_file, "w") as f:
+            json.dump({"a": 60}, f)
+
+        def loader():
+            with open(targets_file) as f:
+                return {k: (k, v) for k, v in json.load(f).items()}
+
+        patcher = patch.object(poll_scheduler, "SHARE_INTERVAL", 0.05)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        sched = PollScheduler("fork_t", lambda t: True, loader=loader, stagger=0,
+                              reload_interval=60, share_dir=tmp.name)
+        sched.start()
+        self.addCleanup(sched.stop)
+        time.sleep(0.2)
+
+        pid = os.fork()
+        if pid == 0:                                      # child: a "Gunicorn worker"
+            code = 1
+            try:
+                with open(targets_file, "w") as f:
+                    json.dump({"a": 60, "b": 60}, f)
+                sched.reload()                            # the copy can only hand off
+                deadline = time.time() + 5
+                while time.time() < deadline:
+                    status = sched.status()
+                    if status.get("b", {}).get("last_ok"):
+                        code = 0 if not sched.running and "a" in status else 2
+                        break
+                    time.sleep(0.05)
+            finally:
+                os._exit(code)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertEqual(set(sched.status()), {"a", "b"})
+
+
+if __name__ == '__main__':
+    unittest.main()
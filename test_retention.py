@@ -0,0 +1,125 @@
+"""
+Test suite for the retention service
+Tests chunked pruning of epoch and datetime tables and space reclamation
+"""
+
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import retention
+
+
+class TestRetention(unittest.TestCase):
+    """Test cases for retention module"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "ts.db")
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript("""
+            CREATE TABLE samples (id INTEGER PRIMARY KEY, ts INTEGER, payload TEXT);
+            CREATE TABLE log (id INTEGER PRIMARY KEY,
+                              ts TIMESTAMP DEFAULT CURRENT_TIMESTAMP, payload TEXT);
+        """)
+        now = int(time.time())
+        old = now - 40 * 86400
+        conn.executemany("INSERT INTO samples(ts, payload) VALUES (?, ?)",
+                         [(old, "x" * 500) for _ in range(120)] +
+                         [(now, "y") for _ in range(5)])
+        conn.executemany("INSERT INTO log(ts, payload) VALUES (?, ?)",
+                         [("2000-01-01 00:00:00", "old")] * 7)
+        conn.execute("INSERT INTO log(payload) VALUES ('new')")
+        conn.commit()
+        conn.close()
+        self._saved = dict(retention._policies)
+        retention._policies.clear()
+
+    def tearDown(self):
+        retention._policies.clear()
+        retention._policies.update(self._saved)
+        retention._not_incremental.discard(self.db_path)
+        self.tmpdir.cleanup()
+
+    def _count(self, table):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_register_rejects_unknown_format(self):
+        """Test that only epoch and datetime formats are accepted"""
+        with self.assertRaises(ValueError):
+            retention.register(self.db_path, "samples", ts_format="iso")
+
+    def test_purge_epoch_table_in_chunks(self):
+        """Test that expired epoch rows are removed across several chunks"""
+        retention.register(self.db_path, "samples", days=30)
+        with patch.object(retention, "_CHUNK_ROWS", 50), \
+             patch.object(retention, "_CHUNK_PAUSE", 0):
+            deleted = retention.purge_table(retention.list_policies()[0])
+        self.assertEqual(deleted, 120)
+        self.assertEqual(self._count("samples"), 5)
+
+    def test_purge_datetime_table(self):
+        """Test that CURRENT_TIMESTAMP-style tables are pruned"""
+        retention.register(self.db_path, "log", days=30, ts_format="datetime")
+        deleted = retention.purge_table(retention.list_policies()[0])
+        self.assertEqual(deleted, 7)
+        self.assertEqual(self._count("log"), 1)
+
+    def test_purge_without_rowid_table(self):
+        """Test that WITHOUT ROWID tables are pruned by their key columns"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE points (series_id INTEGER, ts INTEGER, value REAL, "
+                     "PRIMARY KEY (series_id, ts)) WITHOUT ROWID")
+        now = int(time.time())
+        conn.executemany("INSERT INTO points VALUES (?, ?, 1.0)",
+                         [(s, now - 40 * 86400 + i) for s in (1, 2) for i in range(30)] +
+                         [(1, now)])
+        conn.commit()
+        conn.close()
+        retention.register(self.db_path, "points", days=30,
+                           key_columns=("series_id", "ts"))
+        with patch.object(retention, "_CHUNK_ROWS", 25), \
+             patch.object(retention, "_CHUNK_PAUSE", 0):
+            deleted = retention.purge_table(retention.list_policies()[0])
+        self.assertEqual(deleted, 60)
+        self.assertEqual(self._count("points"), 1)
+
+    def test_run_once_never_vacuums(self):
+        """Test that a pass leaves a non-incremental database's mode alone"""
+        retention.register(self.db_path, "samples", days=30)
+        with patch.object(retention, "_CHUNK_PAUSE", 0):
+            result = retention.run_once()
+        self.assertEqual(result["deleted"][f"{self.db_path}:samples"], 120)
+        self.assertEqual(result["pages_freed"], 0)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 0)
+        finally:
+            conn.close()
+
+    def test_run_once_reclaims_space(self):
+        """Test that a converted database gets its freed pages returned"""
+        retention.convert(self.db_path)
+        retention.register(self.db_path, "samples", days=30)
+        retention.register(self.db_path, "log", days=30, ts_format="datetime")
+        with patch.object(retention, "_CHUNK_PAUSE", 0):
+            result = retention.run_once()
+        self.assertEqual(sum(result["deleted"].values()), 127)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+            self.assertEqual(conn.execute("PRAGMA freelist_count").fetchone()[0], 0)
+        finally:
+            conn.close()
+        self.assertEqual(retention.get_last_run()["deleted"], result["deleted"])
+
+
+if __name__ == '__main__':
+    unittest.main()
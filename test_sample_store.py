@@ -0,0 +1,155 @@
+"""
+Test suite for compact controller sample storage
+Tests status round-trips, raw de-duplication and legacy JSON migration
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import retention
+from sample_store import SampleStore
+
+
+def _status(ts, cpu_temp=45.5, rpm=1200, raw="sensors output"):
+    return {
+        "ok": True,
+        "error": None,
+        "device": "node1",
+        "controller_type": "ipmi",
+        "ts": ts,
+        "temperatures": [
+            {"label": "CPU Temp", "value": cpu_temp, "unit": "°C", "status": "ok"},
+        ],
+        "fans": [
+            {"label": "FAN1", "rpm": rpm, "status": "ok"},
+            {"label": "Fan #0", "rpm": 0, "percent": 40.0, "auto": True},
+        ],
+        "voltages": [],
+        "pwm_nodes": [
+            {"path": "/sys/class/hwmon/hwmon2/pwm1", "value": 128, "percent": 50},
+        ],
+        "raw": raw,
+    }
+
+
+class TestSampleStore(unittest.TestCase):
+    """Test cases for sample_store module"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "fc.db")
+        self._saved = dict(retention._policies)
+        self.store = self._new_store()
+        self.store.init_schema(self.db_path, 30)
+
+    def tearDown(self):
+        retention._policies.clear()
+        retention._policies.update(self._saved)
+        self.tmpdir.cleanup()
+
+    def _get_db(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _new_store(self):
+        return SampleStore("fc", self._get_db,
+                           kinds=("temperatures", "fans", "voltages", "pwm_nodes"),
+                           key_fields={"pwm_nodes": "path"})
+
+    def test_latest_round_trip(self):
+        """Test that the latest sample comes back with types and attrs intact"""
+        self.store.store(1, _status(1000))
+        latest = self.store.get_latest(1)
+        self.assertTrue(latest["ok"])
+        self.assertEqual(latest["ts"], 1000)
+        self.assertEqual(latest["temperatures"],
+                         [{"label": "CPU Temp", "value": 45.5, "unit": "°C", "status": "ok"}])
+        fan0 = latest["fans"][1]
+        self.assertEqual(fan0["rpm"], 0)
+        self.assertIsInstance(fan0["rpm"], int)
+        self.assertIs(fan0["auto"], True)
+        self.assertEqual(latest["pwm_nodes"][0]["path"], "/sys/class/hwmon/hwmon2/pwm1")
+        self.assertEqual(latest["pwm_nodes"][0]["value"], 128)
+        self.assertEqual(latest["raw"], "sensors output")
+        self.assertIsNone(self.store.get_latest(2))
+
+    def test_history_and_failed_polls(self):
+        """Test that history rebuilds each poll, including failures, without raw"""
+        self.store.store(1, _status(1000, cpu_temp=40.0))
+        failed = {"ok": False, "error": "timed out", "ts": 1060,
+                  "temperatures": [], "fans": [], "voltages": [], "raw": ""}
+        self.store.store(1, failed)
+        self.store.store(1, _status(1120, cpu_temp=42.0))
+        history = self.store.get_history(1, since=0)
+        self.assertEqual([h["ts"] for h in history], [1000, 1060, 1120])
+        self.assertEqual(history[0]["temperatures"][0]["value"], 40.0)
+        self.assertEqual(history[1]["error"], "timed out")
+        self.assertEqual(history[1]["fans"], [])
+        self.assertNotIn("raw", history[2])
+        self.assertEqual(len(self.store.get_history(1, since=1001, limit=1)), 1)
+
+    def test_raw_only_rewritten_on_change(self):
+        """Test that identical raw output is not written again"""
+        self.store.store(1, _status(1000, raw="same"))
+        self.store.store(1, _status(1060, raw="same"))
+        with self._get_db() as db:
+            self.assertEqual(db.execute("SELECT ts FROM fc_raw").fetchone()[0], 1000)
+        self.store.store(1, _status(1120, raw="changed"))
+        self.assertEqual(self.store.get_latest(1)["raw"], "changed")
+
+    def test_duplicate_labels_are_kept_apart(self):
+        """Test that two sensors with the same label do not overwrite each other"""
+        status = _status(1000)
+        status["temperatures"].append({"label": "CPU Temp", "value": 50.0, "unit": "°C"})
+        self.store.store(1, status)
+        temps = self.store.get_latest(1)["temperatures"]
+        self.assertEqual([t["value"] for t in temps], [45.5, 50.0])
+
+    def test_migrate_legacy_json_samples(self):
+        """Test that status_json rows are converted and the legacy table dropped"""
+        with self._get_db() as db:
+            db.execute("CREATE TABLE fc_samples (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                       "device_id INTEGER, ts INTEGER, status_json TEXT)")
+            for ts in (1000, 1060, 1120):
+                db.execute("INSERT INTO fc_samples(device_id, ts, status_json) VALUES (?,?,?)",
+                           (7, ts, json.dumps(_status(ts, raw=f"raw {ts}"))))
+        store = self._new_store()
+        store.migrate_json_samples("fc_samples")
+        with self._get_db() as db:
+            self.assertIsNone(db.execute(
+                "SELECT 1 FROM sqlite_master WHERE name='fc_samples'").fetchone())
+        self.assertEqual(len(store.get_history(7, since=0)), 3)
+        self.assertEqual(store.get_latest(7)["raw"], "raw 1120")
+
+    def test_latest_many(self):
+        """Test that the newest sample of several devices is returned in one call"""
+        self.store.store(1, _status(1000, cpu_temp=40.0))
+        self.store.store(1, _status(1060, cpu_temp=41.0, raw="dev1"))
+        self.store.store(2, _status(1030, cpu_temp=50.0, raw="dev2"))
+        self.store.store(3, {"ok": False, "error": "timed out", "ts": 1090,
+                             "temperatures": [], "fans": [], "voltages": [], "raw": ""})
+        latest = self.store.get_latest_many([1, 2, 3, 4])
+        self.assertEqual(set(latest), {1, 2, 3})
+        self.assertEqual(latest[1]["ts"], 1060)
+        self.assertEqual(latest[1]["temperatures"][0]["value"], 41.0)
+        self.assertEqual(latest[1]["raw"], "dev1")
+        self.assertEqual(latest[2]["fans"][0]["rpm"], 1200)
+        self.assertEqual(latest[3]["error"], "timed out")
+        self.assertEqual(latest[1], self.store.get_latest(1))
+        self.assertEqual(self.store.get_latest_many([2], with_raw=False)[2]["raw"], "")
+
+    def test_forget_device(self):
+        """Test that deleting a device removes its stored series"""
+        self.store.store(1, _status(1000))
+        self.store.forget_device(1)
+        self.assertIsNone(self.store.get_latest(1))
+        self.store.store(1, _status(1060))
+        self.assertEqual(len(self.store.get_history(1, since=0)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+Test suite for Proxmox SMART collection
+Tests that one client serves a whole endpoint and SMART calls run concurrently
+"""
+
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import ingest
+import smart_manager
+import vm_controller
+
+
+class FakeProxmoxClient:
+    """Two nodes with three disks each; get_disk_smart is slow"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+        self.smart_calls = 0
+
+    def get_nodes(self):
+        return [{"node": "pve1"}, {"node": "pve2"}]
+
+    def get_disks(self, node):
+        first = "a" if node == "pve1" else "d"
+        return [{"devpath": f"/dev/sd{c}", "dev": f"/dev/sd{c}",
+                 "serial": f"{node}-{c}", "model": "HDD", "size": 4e12}
+                for c in (first, chr(ord(first) + 1), chr(ord(first) + 2))]
+
+    def get_disk_smart(self, node, disk):
+        with self.lock:
+            self.active += 1
+            self.smart_calls += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(0.05)
+        with self.lock:
+            self.active -= 1
+        return {"health": "PASSED",
+                "attributes": [{"id": 194, "name": "Temperature_Celsius", "raw": 35}]}
+
+
+class TestProxmoxSmartCollection(unittest.TestCase):
+    """Test cases for smart_manager.collect_proxmox_endpoint"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.orig_db = smart_manager.DB_FILE
+        smart_manager.DB_FILE = Path(self.tmp) / "smart.db"
+        smart_manager.init_db()
+
+    def tearDown(self):
+        ingest.flush()
+        smart_manager.DB_FILE = self.orig_db
+        smart_manager.init_db()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_endpoint_uses_one_client(self):
+        """Test one connect per endpoint and capped concurrent SMART requests"""
+        client = FakeProxmoxClient()
+        with patch.object(vm_controller, "connect", return_value=client) as connect:
+            count = smart_manager.collect_proxmox_endpoint(7)
+        ingest.flush()
+
+        self.assertEqual(count, 6)
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(client.smart_calls, 6)
+        self.assertGreater(client.peak, 1)
+        self.assertLessEqual(client.peak, smart_manager._PVE_CONCURRENCY)
+
+        disks = smart_manager.get_all_disks()
+        self.assertEqual(len(disks), 6)
+        snaps = smart_manager.get_disk_snapshots(disks[0]["id"])
+        self.assertEqual(snaps[0]["temp"], 35)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Test suite for the shared SSH session pool
+Tests session reuse, transparent reconnect and invalidation
+"""
+
+import unittest
+from unittest.mock import MagicMock, patch
+
+import ssh_pool
+
+
+def _fake_client():
+    client = MagicMock()
+    client.get_transport.return_value.is_active.return_value = True
+    return client
+
+
+class TestSshPool(unittest.TestCase):
+    """Test cases for ssh_pool module"""
+
+    def setUp(self):
+        ssh_pool.close_all()
+        self.clients = []
+
+        def connect(*args, **kwargs):
+            client = _fake_client()
+            self.clients.append(client)
+            return client
+
+        patcher = patch.object(ssh_pool, "_connect", side_effect=connect)
+        self.connect = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(ssh_pool.close_all)
+
+    def test_sessions_are_reused(self):
+        """Test that repeated sessions to one host share a single connection"""
+        for _ in range(3):
+            ssh = ssh_pool.Session("10.0.0.1", 22, "root", password="pw")
+            ssh.exec_command("sensors -j", timeout=5)
+            ssh.close()
+        self.assertEqual(self.connect.call_count, 1)
+        self.assertEqual(self.clients[0].exec_command.call_count, 3)
+        self.clients[0].close.assert_not_called()
+
+    def test_dead_transport_reconnects_once(self):
+        """Test that a command on a dead transport is retried on a new connection"""
+        ssh = ssh_pool.Session("10.0.0.1", 22, "root")
+        first = self.clients[0]
+        first.get_transport.return_value.is_active.return_value = False
+        first.exec_command.side_effect = EOFError()
+        ssh.exec_command("ipmitool sdr", timeout=5)
+        self.assertEqual(self.connect.call_count, 2)
+        self.clients[1].exec_command.assert_called_once_with("ipmitool sdr", timeout=5)
+        first.close.assert_called_once()
+
+    def test_command_error_on_live_transport_is_raised(self):
+        """Test that errors on a healthy session are not retried"""
+        ssh = ssh_pool.Session("10.0.0.1", 22, "root")
+        self.clients[0].exec_command.side_effect = TimeoutError()
+        with self.assertRaises(TimeoutError):
+            ssh.exec_command("liquidctl status", timeout=5)
+        self.assertEqual(self.connect.call_count, 1)
+
+    def test_other_credentials_do_not_share_a_session(self):
+        """Test that a wrong password is not hidden by a pooled session"""
+        ssh_pool.Session("10.0.0.1", 22, "root", password="pw").close()
+        self.connect.side_effect = OSError("Authentication failed")
+        with self.assertRaises(OSError):
+            ssh_pool.Session("10.0.0.1", 22, "root", password="wrong")
+        with self.assertRaises(OSError):
+            ssh_pool.Session("10.0.0.1", 22, "root", key_path="/nonexistent")
+        self.assertEqual(self.connect.call_count, 3)
+        self.assertEqual(ssh_pool.stats()["sessions"], 1)
+        ssh_pool.discard("10.0.0.1", 22, "root")
+        self.clients[0].close.assert_called_once()
+        self.assertEqual(ssh_pool.stats()["sessions"], 0)
+
+    def test_discard_forces_new_connection(self):
+        """Test that discard() closes the pooled session"""
+        ssh_pool.Session("10.0.0.1", 22, "root").close()
+        ssh_pool.discard("10.0.0.1", 22, "root")
+        self.clients[0].close.assert_called_once()
+        ssh_pool.Session("10.0.0.1", 22, "root")
+        self.assertEqual(self.connect.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
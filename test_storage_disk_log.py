@@ -0,0 +1,77 @@
+"""
+Test suite for change-only storage disk logging
+Tests that storage_disk_log only grows on changes and heartbeats
+"""
+
+import shutil
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import ingest
+import storage_controller as sc
+
+
+class TestStorageDiskLog(unittest.TestCase):
+    """Test cases for storage_controller.log_disk_snapshot"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.orig_db = sc.DB_FILE
+        sc.DB_FILE = Path(self.tmp) / "storage.db"
+        sc.init_db()
+        sc._disk_log_state.clear()
+
+    def tearDown(self):
+        ingest.flush()
+        sc._disk_log_state.clear()
+        sc.DB_FILE = self.orig_db
+        sc.init_db()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _disk(self, temp=30, health="GOOD", pool="tank"):
+        return {"id": "sda", "name": "sda", "temp": temp, "health": health, "pool": pool}
+
+    def _rows(self):
+        ingest.flush()
+        return sc.get_disk_history(1, "sda")
+
+    def test_only_changes_are_logged(self):
+        """Test temperature steps, health and pool changes"""
+        self.assertTrue(sc.log_disk_snapshot(1, self._disk()))
+        self.assertFalse(sc.log_disk_snapshot(1, self._disk()))
+        self.assertFalse(sc.log_disk_snapshot(1, self._disk(temp=31)))
+        self.assertTrue(sc.log_disk_snapshot(1, self._disk(temp=32)))
+        self.assertTrue(sc.log_disk_snapshot(1, self._disk(temp=32, health="WARNING")))
+        self.assertTrue(sc.log_disk_snapshot(1, self._disk(temp=32, health="WARNING", pool="")))
+        self.assertEqual(len(self._rows()), 4)
+
+    def test_heartbeat(self):
+        """Test that an unchanged disk is logged again after the heartbeat"""
+        sc.log_disk_snapshot(1, self._disk())
+        later = time.time() + sc.DISK_LOG_HEARTBEAT + 1
+        with patch.object(sc.time, "time", return_value=later):
+            self.assertTrue(sc.log_disk_snapshot(1, self._disk()))
+        self.assertEqual(len(self._rows()), 2)
+
+    def test_state_survives_restart(self):
+        """Test that the last row is read back from the database"""
+        sc.log_disk_snapshot(1, self._disk())
+        self._rows()
+        sc._disk_log_state.clear()
+        self.assertFalse(sc.log_disk_snapshot(1, self._disk()))
+        self.assertTrue(sc.log_disk_snapshot(1, self._disk(health="CRITICAL")))
+
+    def test_composite_index(self):
+        """Test that history lookups use the (endpoint_id, disk_id, ts) index"""
+        with sc.get_db() as db:
+            plan = db.execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM storage_disk_log WHERE endpoint_id=? "
+                "AND disk_id=? ORDER BY ts DESC LIMIT 1", (1, "sda")).fetchall()
+        self.assertIn("idx_storage_disk_log_disk", " ".join(str(tuple(r)) for r in plan))
+
+
+if __name__ == '__main__':
+    unittest.main()
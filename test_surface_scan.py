@@ -0,0 +1,122 @@
+"""
+Test suite for the in-process surface scan
+Scans image files in full and sampled mode, with injected read errors,
+and runs disktool_core.validate_blocks with progress and stop_task
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import disktool_core
+import surface_scan
+
+MiB = 1 << 20
+
+
+class TestSurfaceScan(unittest.TestCase):
+    """Test cases for surface_scan.scan"""
+
+    def setUp(self):
+        # Not /tmp: tmpfs refuses O_DIRECT, a disk-backed directory exercises it
+        self.tmp = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(__file__)))
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.image = os.path.join(self.tmp, "disk.img")
+        with open(self.image, "wb") as f:
+            f.write(os.urandom(8 * MiB + 12345))      # odd tail on purpose
+
+    def test_full_scan(self):
+        """Test that a full scan reads every byte once"""
+        res = surface_scan.scan(self.image, mode="full")
+        self.assertEqual(res["size"], 8 * MiB + 12345)
+        self.assertEqual(res["chunks_total"], 9)
+        self.assertEqual(res["chunks_read"], 9)
+        self.assertEqual(res["bytes_read"], res["size"])
+        self.assertEqual(res["bad_blocks"], [])
+        self.assertEqual(sum(c for _, c in res["latency_ms"]["buckets"]), 9)
+        self.assertNotIn(0, res["regions"])
+        self.assertFalse(res["stopped"])
+
+    def test_buffered_fallback(self):
+        """Test that the scan works without O_DIRECT"""
+        res = surface_scan.scan(self.image, direct=False, chunk_size=64 * 1024)
+        self.assertFalse(res["direct"])
+        self.assertEqual(res["bytes_read"], res["size"])
+
+    def test_sampled_scan_spreads_reads(self):
+        """Test that sample mode reads the requested number of chunks across the surface"""
+        res = surface_scan.scan(self.image, mode="sample", samples=8,
+                                chunk_size=64 * 1024, seed=1)
+        self.assertEqual(res["chunks_planned"], 8)
+        self.assertEqual(res["chunks_read"], 8)
+        self.assertEqual(res["bytes_read"], 8 * 64 * 1024)
+        plan = surface_scan._chunk_plan(res["chunks_total"], "sample", 8, seed=1)
+        self.assertEqual(len(set(p * 8 // res["chunks_total"] for p in plan)), 8)
+
+    def test_read_errors_are_located(self):
+        """Test that a failing chunk is narrowed down to its bad blocks"""
+        real = surface_scan._read_into
+        bad_offset = 3 * MiB + 2 * surface_scan.BLOCK_SIZE
+
+        def flaky(fd, view, offset):
+            if offset <= bad_offset < offset + len(view):
+                raise OSError(5, "Input/output error")
+            return real(fd, view, offset)
+
+        with patch.object(surface_scan, "_read_into", new=flaky):
+            res = surface_scan.scan(self.image)
+        self.assertEqual(res["bad_blocks"], [bad_offset // surface_scan.BLOCK_SIZE])
+        self.assertEqual(res["bad_block_count"], 1)
+        self.assertIn(2, res["regions"])
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            surface_scan.scan(self.image, mode="quick")
+        with self.assertRaises(ValueError):
+            surface_scan.scan(self.image, chunk_size=1000)
+
+
+class TestValidateBlocks(unittest.TestCase):
+    """Test disktool_core.validate_blocks against an image file"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(__file__)))
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.orig_db = disktool_core.DB_FILE
+        disktool_core.DB_FILE = Path(self.tmp) / "disktool.db"
+        self.addCleanup(setattr, disktool_core, "DB_FILE", self.orig_db)
+        disktool_core.init_db()
+        self.image = os.path.join(self.tmp, "disk.img")
+        with open(self.image, "wb") as f:
+            f.write(os.urandom(4 * MiB))
+
+    def test_progress_and_result_in_operations(self):
+        """Test that the operation ends OK with the result stored"""
+        op_id = disktool_core.log_op("loop0", "VALIDATE_FULL")
+        with patch.object(surface_scan, "PROGRESS_INTERVAL", 0):
+            disktool_core.validate_blocks("loop0", "full", op_id, path=self.image)
+        self.assertEqual(disktool_core.get_task_status(op_id), ("OK", 100))
+        result = disktool_core.get_task_result(op_id)
+        self.assertEqual(result["bytes_read"], 4 * MiB)
+        self.assertIn("throughput_mbs", result)
+
+    def test_stop_task_is_honoured(self):
+        """Test that stop_task() ends the scan and keeps STOPPED"""
+        op_id = disktool_core.log_op("loop0", "VALIDATE_FULL")
+        disktool_core.stop_task(op_id)
+        with patch.object(surface_scan, "PROGRESS_INTERVAL", 0):
+            result = disktool_core.validate_blocks("loop0", "full", op_id, path=self.image)
+        self.assertTrue(result["stopped"])
+        self.assertEqual(result["chunks_read"], 1)
+        self.assertEqual(disktool_core.get_task_status(op_id)[0], "STOPPED")
+
+    def test_rejects_unsafe_device_name(self):
+        with self.assertRaises(ValueError):
+            disktool_core.validate_blocks("../etc/passwd")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Test suite for the batched TrueNAS disk summary
+Tests call count and health normalisation from pool topology and SMART tests
+"""
+
+import threading
+import unittest
+from unittest.mock import patch
+
+import storage_controller as sc
+
+
+DISKS = [{"name": n, "model": "HDD", "serial": f"S-{n}", "size": 4e12} for n in
+         ("sda", "sdb", "sdc", "sdd")]
+POOLS = [{
+    "name": "tank",
+    "topology": {
+        "data": [{"type": "MIRROR", "status": "DEGRADED", "children": [
+            {"type": "DISK", "disk": "sda", "status": "ONLINE",
+             "stats": {"read_errors": 0, "write_errors": 0, "checksum_errors": 0}},
+            {"type": "DISK", "disk": "sdb", "status": "FAULTED",
+             "stats": {"read_errors": 3, "write_errors": 0, "checksum_errors": 1}},
+        ]}],
+        "cache": [{"type": "DISK", "disk": "sdc", "status": "ONLINE",
+                   "stats": {"read_errors": 0, "write_errors": 0, "checksum_errors": 2}}],
+    },
+}]
+SMART = [
+    {"disk": "sda", "tests": [{"num": 1, "description": "Short offline", "status": "SUCCESS",
+                               "status_verbose": "Completed without error", "lifetime": 1200}]},
+    {"disk": "sdd", "tests": [{"num": 1, "description": "Extended offline", "status": "FAILED",
+                               "status_verbose": "Completed: read failure", "lifetime": 900}]},
+]
+
+
+class TestTrueNASDiskSummary(unittest.TestCase):
+    """Test cases for TrueNASClient.get_disk_summary"""
+
+    def setUp(self):
+        self.paths = []
+        self.lock = threading.Lock()
+
+    def _fake_http(self, method, url, headers=None, body=None, verify_ssl=False, **kw):
+        path = url.split("/api/v2.0", 1)[1]
+        with self.lock:
+            self.paths.append((method, path))
+        data = {
+            "/disk": DISKS,
+            "/disk/temperatures": {"sda": 30, "sdb": 41},
+            "/smart/test/results": SMART,
+            "/pool": POOLS,
+        }.get(path)
+        if data is None:
+            return {"ok": False, "status": 404, "error": "not found"}
+        return {"ok": True, "status": 200, "data": data}
+
+    def test_summary_is_four_calls(self):
+        """Test that the summary does not make per-disk requests"""
+        client = sc.TrueNASClient("nas.local", 443, "key")
+        with patch.object(sc, "_http", self._fake_http):
+            disks = {d["name"]: d for d in client.get_disk_summary()}
+
+        self.assertEqual(sorted(self.paths), [("GET", "/disk"), ("GET", "/pool"),
+                                              ("GET", "/smart/test/results"),
+                                              ("POST", "/disk/temperatures")])
+        self.assertEqual(disks["sda"]["health"], "GOOD")
+        self.assertEqual(disks["sda"]["pool"], "tank")
+        self.assertEqual(disks["sda"]["poh"], 1200)
+        self.assertEqual(disks["sda"]["temp"], 30)
+        self.assertEqual(disks["sda"]["smart_status"], "Short offline: Completed without error")
+        self.assertEqual(disks["sdb"]["health"], "FAILED")
+        self.assertEqual(disks["sdb"]["errors"], 4)
+        self.assertEqual(disks["sdc"]["health"], "WARNING")
+        self.assertEqual(disks["sdc"]["pool"], "tank")
+        self.assertEqual(disks["sdd"]["health"], "FAILED")
+        self.assertEqual(disks["sdd"]["pool"], "")
+
+    def test_failed_call_leaves_fields_empty(self):
+        """Test that a failing SMART endpoint does not break the summary"""
+        client = sc.TrueNASClient("nas.local", 443, "key")
+        with patch.object(sc, "_http", self._fake_http), \
+                patch.object(sc.TrueNASClient, "get_all_smart_results",
+                             side_effect=RuntimeError("boom")):
+            disks = {d["name"]: d for d in client.get_disk_summary()}
+        self.assertEqual(len(disks), 4)
+        self.assertEqual(disks["sda"]["smart_status"], "")
+        self.assertEqual(disks["sda"]["health"], "GOOD")       # from the vdev state
+
+
+if __name__ == '__main__':
+    unittest.main()
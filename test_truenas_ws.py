@@ -0,0 +1,208 @@
+"""
+Test suite for the TrueNAS live websocket model
+Runs TrueNASLive against a local websocket stand-in for the middleware
+"""
+
+import json
+import os
+import socketserver
+import struct
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import storage_controller
+import truenas_ws
+
+
+POOLS = [{"id": 1, "name": "tank", "status": "ONLINE", "healthy": True}]
+DISKS = [{"identifier": "{serial}S1", "name": "sda", "serial": "S1", "size": 4e12, "pool": "tank"}]
+
+
+class _MiddlewareStandIn(socketserver.BaseRequestHandler):
+    """Speaks just enough of the middleware protocol for TrueNASLive"""
+
+    def setup(self):
+        self.server.handlers.append(self)
+        self.lock = threading.Lock()
+
+    def _read(self, n):
+        data = b""
+        while len(data) < n:
+            chunk = self.request.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError
+            data += chunk
+        return data
+
+    def send(self, obj):
+        payload = json.dumps(obj).encode()
+        header = bytes([0x81])
+        header += bytes([len(payload)]) if len(payload) < 126 else \
+            bytes([126]) + struct.pack("!H", len(payload))
+        with self.lock:
+            self.request.sendall(header + payload)
+
+    def _recv(self):
+        b1, b2 = self._read(2)
+        n = b2 & 0x7F
+        if n == 126:
+            n = struct.unpack("!H", self._read(2))[0]
+        key = self._read(4)
+        payload = truenas_ws._mask(self._read(n), key)
+        if b1 & 0x0F == 0x8:
+            raise ConnectionError
+        return json.loads(payload)
+
+    def handle(self):
+        head = b""
+        while b"\r\n\r\n" not in head:
+            head += self.request.recv(1024)
+        key = [line.split(":", 1)[1].strip() for line in head.decode().split("\r\n")
+               if line.lower().startswith("sec-websocket-key")][0]
+        self.request.sendall((
+            "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+            f"Connection: Upgrade\r\nSec-WebSocket-Accept: {truenas_ws.accept_key(key)}\r\n\r\n"
+        ).encode())
+        results = {
+            "auth.login_with_api_key": True,
+            "pool.query": POOLS,
+            "disk.query": DISKS,
+            "alert.list": [],
+            "disk.temperatures": {"sda": 31},
+        }
+        try:
+            while True:
+                msg = self._recv()
+                if msg["msg"] == "connect":
+                    self.send({"msg": "connected", "session": "s1"})
+                elif msg["msg"] == "method":
+                    self.server.calls.append(msg["method"])
+                    self.send({"msg": "result", "id": msg["id"],
+                               "result": results.get(msg["method"])})
+                elif msg["msg"] == "sub":
+                    self.send({"msg": "ready", "subs": [msg["id"]]})
+        except (ConnectionError, OSError):
+            pass
+
+
+class TestTrueNASLive(unittest.TestCase):
+    """Test cases for truenas_ws.TrueNASLive"""
+
+    def setUp(self):
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _MiddlewareStandIn)
+        self.server.daemon_threads = True
+        self.server.handlers, self.server.calls = [], []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.changes = []
+        url = f"ws://127.0.0.1:{self.server.server_address[1]}/websocket"
+        self.live = truenas_ws.TrueNASLive(1, url, "key", on_change=lambda ep, c: self.changes.append(c))
+        self.live.start()
+        self.assertTrue(self.live.wait_synced(5))
+
+    def tearDown(self):
+        self.live.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _wait(self, predicate, timeout=5):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if predicate():
+                return True
+            time.sleep(0.02)
+        return False
+
+    def test_initial_sync(self):
+        """Test that collections and temperatures are loaded after login"""
+        self.assertEqual(self.live.items("pool.query"), POOLS)
+        self.assertEqual(self.live.items("disk.query")[0]["name"], "sda")
+        self.assertEqual(self.live.items("alert.list"), [])
+        self.assertTrue(self._wait(lambda: self.live.temperatures() == {"sda": 31}))
+        self.assertEqual(self.server.calls[0], "auth.login_with_api_key")
+
+    def test_events_update_model(self):
+        """Test added / changed / removed events"""
+        handler = self.server.handlers[0]
+        handler.send({"msg": "added", "collection": "alert.list", "id": "a1",
+                      "fields": {"uuid": "a1", "level": "CRITICAL", "formatted": "Pool tank degraded"}})
+        handler.send({"msg": "changed", "collection": "pool.query", "id": 1,
+                      "fields": {"status": "DEGRADED", "healthy": False}})
+        self.assertTrue(self._wait(lambda: len(self.live.items("alert.list")) == 1))
+        self.assertTrue(self._wait(lambda: self.live.items("pool.query")[0]["status"] == "DEGRADED"))
+        self.assertEqual(self.live.items("pool.query")[0]["name"], "tank")
+        self.assertIn("alert.list", self.changes)
+
+        handler.send({"msg": "removed", "collection": "alert.list", "id": "a1"})
+        self.assertTrue(self._wait(lambda: self.live.items("alert.list") == []))
+
+    def test_client_reads_live_model_then_falls_back(self):
+        """Test that TrueNASClient skips REST while live and uses it after"""
+        client = storage_controller.TrueNASClient("nas.local", 443, "key", live=self.live)
+        self._wait(lambda: self.live.temperatures() is not None)
+        with patch.object(storage_controller, "_http",
+                          side_effect=AssertionError("REST called")):
+            self.assertEqual(client.get_pools(), POOLS)
+            self.assertEqual(client.get_alerts(), [])
+        # SMART self-test results have no websocket events and stay on REST
+        with patch.object(storage_controller, "_http",
+                          return_value={"ok": True, "status": 200, "data": []}) as http:
+            summary = client.get_disk_summary()
+        self.assertEqual([c.args[1] for c in http.call_args_list],
+                         ["https://nas.local:443/api/v2.0/smart/test/results"])
+        self.assertEqual(summary[0]["temp"], 31)
+
+        self.live.stop()
+        self.server.handlers[0].request.close()
+        self.assertTrue(self._wait(lambda: not self.live.connected))
+        with patch.object(storage_controller, "_http",
+                          return_value={"ok": True, "status": 200, "data": [{"name": "rest"}]}) as http:
+            self.assertEqual(client.get_pools(), [{"name": "rest"}])
+        http.assert_called_once()
+
+
+class TestLiveRegistry(unittest.TestCase):
+    """Test per-process ownership of live models"""
+
+    EP = {"id": 99, "host": "nas.local", "port": 443, "api_key_plain": "key",
+          "verify_ssl": 0, "live_updates": 1}
+
+    def setUp(self):
+        patcher = patch.object(truenas_ws.TrueNASLive, "start")    # no connection
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(truenas_ws.stop, 99)
+
+    def test_model_is_started_on_first_use(self):
+        """Test that connect() starts this process's model and follows settings"""
+        live = storage_controller._live_for(dict(self.EP))
+        self.assertIs(truenas_ws.get(99), live)
+        self.assertIs(storage_controller._live_for(dict(self.EP)), live)
+        rotated = storage_controller._live_for(dict(self.EP, api_key_plain="new"))
+        self.assertIsNot(rotated, live)
+        self.assertIsNone(storage_controller._live_for(dict(self.EP, live_updates=0)))
+        self.assertIsNone(truenas_ws.get(99))
+
+    def test_forked_child_forgets_inherited_models(self):
+        """Test that a worker never trusts a model whose thread stayed in the parent"""
+        live = storage_controller._live_for(dict(self.EP))
+        live.connected = True
+        live._synced = set(truenas_ws.COLLECTIONS)
+        self.assertEqual(live.items("pool.query"), [])
+        pid = os.fork()
+        if pid == 0:
+            ok = truenas_ws.get(99) is None and truenas_ws.status() == {}
+            os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertIs(truenas_ws.get(99), live)
+
+    def test_retain_stops_models_of_removed_endpoints(self):
+        storage_controller._live_for(dict(self.EP))
+        truenas_ws.retain({1, 2})
+        self.assertIsNone(truenas_ws.get(99))
+
+
+if __name__ == '__main__':
+    unittest.main()
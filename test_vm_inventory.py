@@ -0,0 +1,106 @@
+"""
+Test suite for the Proxmox cluster inventory
+Tests that nodes and guests come from one cached /cluster/resources call
+"""
+
+import unittest
+from unittest.mock import patch
+
+import auth_cache
+import vm_controller
+
+
+RESOURCES = [
+    {"id": "node/pve1", "type": "node", "node": "pve1", "status": "online",
+     "cpu": 0.1, "mem": 1, "maxmem": 4},
+    {"id": "node/pve2", "type": "node", "node": "pve2", "status": "online",
+     "cpu": 0.2, "mem": 2, "maxmem": 4},
+    {"id": "qemu/100", "type": "qemu", "vmid": 100, "name": "web", "node": "pve1",
+     "status": "running"},
+    {"id": "lxc/200", "type": "lxc", "vmid": 200, "name": "dns", "node": "pve2",
+     "status": "stopped"},
+    {"id": "storage/pve1/local", "type": "storage", "storage": "local", "node": "pve1",
+     "disk": 10, "maxdisk": 100},
+]
+
+
+class TestProxmoxInventory(unittest.TestCase):
+    """Test cases for ProxmoxClient inventory"""
+
+    def setUp(self):
+        auth_cache.clear()
+        vm_controller._inventory.clear()
+        self.calls = []
+        self.resources_ok = True
+        patcher = patch.object(vm_controller, "_http", self._fake_http)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = vm_controller.ProxmoxClient("pve.local", 8006, "root@pam", "pw")
+
+    def tearDown(self):
+        auth_cache.clear()
+        vm_controller._inventory.clear()
+
+    def _fake_http(self, method, url, headers=None, body=None, verify_ssl=False, **kw):
+        path = url.split("/api2/json", 1)[1]
+        self.calls.append((method, path))
+        if path == "/access/ticket":
+            return {"ok": True, "status": 200,
+                    "data": {"data": {"ticket": "t", "CSRFPreventionToken": "c"}}}
+        if path == "/cluster/resources":
+            if not self.resources_ok:
+                return {"ok": False, "status": 501, "error": "not implemented"}
+            return {"ok": True, "status": 200, "data": {"data": [dict(r) for r in RESOURCES]}}
+        if path == "/nodes":
+            return {"ok": True, "status": 200, "data": {"data": [{"node": "pve1"}]}}
+        if path == "/nodes/pve1/qemu":
+            return {"ok": True, "status": 200, "data": {"data": [{"vmid": 100}]}}
+        if path == "/nodes/pve1/lxc":
+            return {"ok": True, "status": 200, "data": {"data": []}}
+        return {"ok": True, "status": 200, "data": {"data": None}}
+
+    def _gets(self):
+        return [p for m, p in self.calls if m == "GET"]
+
+    def test_inventory_from_one_call(self):
+        """Test that nodes, guests and storage share one cached request"""
+        nodes = self.client.get_nodes()
+        vms = self.client.get_vms()
+        storage = self.client.get_cluster_storage()
+
+        self.assertEqual([n["node"] for n in nodes], ["pve1", "pve2"])
+        self.assertEqual([(v["vmid"], v["type"], v["node"]) for v in vms],
+                         [(100, "qemu", "pve1"), (200, "lxc", "pve2")])
+        self.assertTrue(all(v["platform"] == "proxmox" for v in vms))
+        self.assertEqual(storage[0]["storage"], "local")
+        self.assertEqual(self._gets(), ["/cluster/resources"])
+
+        # A second client for the same endpoint uses the same snapshot
+        other = vm_controller.ProxmoxClient("pve.local", 8006, "root@pam", "pw")
+        other.get_vms()
+        self.assertEqual(self._gets(), ["/cluster/resources"])
+
+    def test_cache_expires_and_invalidates(self):
+        """Test the TTL and invalidation after a power action"""
+        self.client.get_vms()
+        with patch.object(vm_controller._time_mod, "monotonic",
+                          return_value=vm_controller._time_mod.monotonic()
+                          + vm_controller._INVENTORY_TTL + 1):
+            self.client.get_vms()
+        self.assertEqual(self._gets().count("/cluster/resources"), 2)
+
+        self.client.vm_action("pve1", 100, "start")
+        self.client.get_vms()
+        self.assertEqual(self._gets().count("/cluster/resources"), 3)
+
+    def test_falls_back_to_per_node_calls(self):
+        """Test the per-node listing when /cluster/resources is unavailable"""
+        self.resources_ok = False
+        vms = self.client.get_vms()
+        self.assertEqual([(v["vmid"], v["type"], v["node"]) for v in vms],
+                         [(100, "qemu", "pve1")])
+        self.assertIn("/nodes/pve1/qemu", self._gets())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,464 @@
+"""
+truenas_ws.py — FleetPilot live TrueNAS model over the middleware websocket
+
+The TrueNAS REST API has no change notifications, so pools, disks and alerts
+were re-fetched as full lists by every poll and page view.  The middleware
+websocket (wss://<host>/websocket) supports collection subscriptions.  For
+endpoints with live updates enabled, a TrueNASLive keeps one long-lived
+connection that:
+
+  • logs in with the endpoint's API key
+  • subscribes to pool.query, disk.query and alert.list, loads each
+    collection once, then applies added / changed / removed events
+  • asks for disk.temperatures every _TEMP_INTERVAL seconds over the same
+    connection (temperatures have no events)
+  • re-reads every collection every _RESYNC_INTERVAL seconds as a safety
+    net, and reconnects with back-off when the connection drops
+
+TrueNASClient reads from the live model while it is connected and in sync,
+and falls back to REST otherwise (see storage_controller).  Models belong to
+the process that started them: storage_controller starts one on first use in
+the process serving requests, and a forked child (a Gunicorn worker of the
+preloaded app) forgets the models it inherited — their threads stayed with
+the parent, so the copied data would never change again.
+
+The websocket client below is a minimal RFC 6455 implementation on top of
+socket/ssl, in keeping with the stdlib-only API clients.
+"""
+import base64
+import hashlib
+import itertools
+import json
+import logging
+import os
+import select
+import socket
+import struct
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import http_pool
+
+logger = logging.getLogger(__name__)
+
+COLLECTIONS = {             # subscription name -> primary key of its items
+    "pool.query": "id",
+    "disk.query": "identifier",
+    "alert.list": "uuid",
+}
+_TIMEOUT = 15               # connect / call timeout (seconds)
+_TEMP_INTERVAL = 60
+_RESYNC_INTERVAL = 600
+_PING_INTERVAL = 30
+_STALE_AFTER = 90           # no message at all for this long → reconnect
+_RECONNECT_MIN = 5
+_RECONNECT_MAX = 300
+
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Minimal websocket client
+# ══════════════════════════════════════════════════════════════════════════════
+
+def _mask(data: bytes, key: bytes) -> bytes:
+    n = len(data)
+    if not n:
+        return data
+    k = (key * (n // 4 + 1))[:n]
+    return (int.from_bytes(data, "big") ^ int.from_bytes(k, "big")).to_bytes(n, "big")
+
+
+def accept_key(key: str) -> str:
+    """Sec-WebSocket-Accept value for a Sec-WebSocket-Key."""
+    return base64.b64encode(hashlib.sha1((key + _WS_GUID).encode()).digest()).decode()
+
+
+class WebSocket:
+    """Blocking text-message websocket client."""
+
+    def __init__(self, url: str, verify_ssl: bool = False, timeout: float = _TIMEOUT):
+        parts = urlsplit(url)
+        secure = parts.scheme == "wss"
+        port = parts.port or (443 if secure else 80)
+        sock = socket.create_connection((parts.hostname, port), timeout=timeout)
+        if secure:
+            sock = http_pool.ssl_context(verify_ssl).wrap_socket(
+                sock, server_hostname=parts.hostname)
+        self.sock = sock
+        self._buf = b""
+        self._send_lock = threading.Lock()
+
+        key = base64.b64encode(os.urandom(16)).decode()
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        sock.sendall((f"GET {path} HTTP/1.1\r\n"
+                      f"Host: {parts.hostname}:{port}\r\n"
+                      "Upgrade: websocket\r\n"
+                      "Connection: Upgrade\r\n"
+                      f"Sec-WebSocket-Key: {key}\r\n"
+                      "Sec-WebSocket-Version: 13\r\n\r\n").encode())
+        while b"\r\n\r\n" not in self._buf:
+            chunk = sock.recv(4096)
+            if not chunk:
+                raise ConnectionError("connection closed during websocket handshake")
+            self._buf += chunk
+        head, _, self._buf = self._buf.partition(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        if " 101 " not in lines[0] + " ":
+            raise ConnectionError(f"websocket upgrade refused: {lines[0]}")
+        headers = {k.strip().lower(): v.strip()
+                   for k, _, v in (line.partition(":") for line in lines[1:])}
+        if headers.get("sec-websocket-accept") != accept_key(key):
+            raise ConnectionError("invalid Sec-WebSocket-Accept")
+
+    def _read(self, n: int) -> bytes:
+        while len(self._buf) < n:
+            chunk = self.sock.recv(max(4096, n - len(self._buf)))
+            if not chunk:
+                raise ConnectionError("websocket closed by peer")
+            self._buf += chunk
+        data, self._buf = self._buf[:n], self._buf[n:]
+        return data
+
+    def _send_frame(self, opcode: int, payload: bytes):
+        header = bytes([0x80 | opcode])
+        n = len(payload)
+        if n < 126:
+            header += bytes([0x80 | n])
+        elif n < 1 << 16:
+            header += bytes([0x80 | 126]) + struct.pack("!H", n)
+        else:
+            header += bytes([0x80 | 127]) + struct.pack("!Q", n)
+        key = os.urandom(4)
+        with self._send_lock:
+            self.sock.sendall(header + key + _mask(payload, key))
+
+    def _read_frame(self):
+        b1, b2 = self._read(2)
+        n = b2 & 0x7F
+        if n == 126:
+            n = struct.unpack("!H", self._read(2))[0]
+        elif n == 127:
+            n = struct.unpack("!Q", self._read(8))[0]
+        key = self._read(4) if b2 & 0x80 else None
+        payload = self._read(n)
+        return bool(b1 & 0x80), b1 & 0x0F, _mask(payload, key) if key else payload
+
+    def _readable(self, timeout: float) -> bool:
+        if self._buf or (hasattr(self.sock, "pending") and self.sock.pending()):
+            return True
+        return bool(select.select([self.sock], [], [], timeout)[0])
+
+    def send_json(self, obj: Any):
+        self._send_frame(0x1, json.dumps(obj).encode())
+
+    def recv_json(self, timeout: float) -> Optional[Any]:
+        """Next JSON message, or None if nothing arrived within timeout."""
+        if not self._readable(timeout):
+            return None
+        parts: List[bytes] = []
+        while True:
+            fin, opcode, payload = self._read_frame()
+            if opcode == 0x8:
+                raise ConnectionError("websocket closed by peer")
+            if opcode == 0x9:
+                self._send_frame(0xA, payload)          # ping → pong
+                continue
+            if opcode == 0xA:
+                continue
+            parts.append(payload)
+            if fin:
+                return json.loads(b"".join(parts).decode("utf-8"))
+
+    def close(self):
+        try:
+            self._send_frame(0x8, b"")
+        except Exception:
+            pass
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Live model
+# ══════════════════════════════════════════════════════════════════════════════
+
+class TrueNASLive:
+    """In-memory pools / disks / alerts of one TrueNAS, kept current by events."""
+
+    def __init__(self, ep_id: int, url: str, api_key: str, verify_ssl: bool = False,
+                 on_change: Callable[[int, str], None] = None):
+        self.ep_id = ep_id
+        self.url = url
+        self.verify_ssl = verify_ssl
+        self._api_key = api_key
+        self._on_change = on_change
+        self._items: Dict[str, Dict[Any, Dict]] = {name: {} for name in COLLECTIONS}
+        self._synced: set = set()
+        self._unsupported: set = set()
+        self._temps: Optional[Dict] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._ids = itertools.count(1)
+        self._pending: Dict[str, Callable[[Any], None]] = {}
+        self.connected = False
+        self.last_event: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.events = 0
+
+    # ── Public ───────────────────────────────────────────────────────────────
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f"truenas-ws-{self.ep_id}")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def items(self, collection: str) -> Optional[List[Dict]]:
+        """Current items of a collection, or None if it is not live right now."""
+        with self._lock:
+            if not self.connected or collection not in self._synced \
+                    or collection in self._unsupported:
+                return None
+            return [dict(v) for v in self._items[collection].values()]
+
+    def temperatures(self) -> Optional[Dict]:
+        with self._lock:
+            return dict(self._temps) if self.connected and self._temps is not None else None
+
+    def wait_synced(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if self.connected and len(self._synced) == len(COLLECTIONS):
+                    return True
+            time.sleep(0.05)
+        return False
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                "connected": self.connected,
+                "synced": sorted(self._synced),
+                "unsupported": sorted(self._unsupported),
+                "events": self.events,
+                "last_event": self.last_event,
+                "last_error": self.last_error,
+            }
+
+    # ── Connection loop ──────────────────────────────────────────────────────
+
+    def _run(self):
+        delay = _RECONNECT_MIN
+        while not self._stop.is_set():
+            try:
+                self._session()
+                delay = _RECONNECT_MIN
+            except Exception as exc:
+                self.last_error = str(exc) or type(exc).__name__
+                logger.warning("[truenas_ws] endpoint %d: %s", self.ep_id, self.last_error)
+            with self._lock:
+                self.connected = False
+                self._synced.clear()
+                self._pending.clear()
+            if self._stop.wait(delay):
+                break
+            delay = min(delay * 2, _RECONNECT_MAX)
+
+    def _call(self, ws: WebSocket, method: str, params: List, handler: Callable[[Any], None]):
+        call_id = str(next(self._ids))
+        self._pending[call_id] = handler
+        ws.send_json({"id": call_id, "msg": "method", "method": method, "params": params})
+
+    def _wait_result(self, ws: WebSocket, method: str, params: List) -> Any:
+        box = []
+        self._call(ws, method, params, box.append)
+        deadline = time.monotonic() + _TIMEOUT
+        while not box:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"{method} timed out")
+            msg = ws.recv_json(remaining)
+            if msg is not None:
+                self._handle(msg)
+        return box[0]
+
+    def _resync(self, ws: WebSocket):
+        for name, pk in COLLECTIONS.items():
+            self._call(ws, name, [], lambda rows, n=name, k=pk: self._replace(n, k, rows))
+
+    def _request_temps(self, ws: WebSocket):
+        def store(temps):
+            if isinstance(temps, dict):
+                with self._lock:
+                    self._temps = temps
+        self._call(ws, "disk.temperatures", [[]], store)
+
+    def _session(self):
+        ws = WebSocket(self.url, self.verify_ssl, timeout=_TIMEOUT)
+        try:
+            ws.send_json({"msg": "connect", "version": "1", "support": ["1"]})
+            msg = ws.recv_json(_TIMEOUT)
+            if not msg or msg.get("msg") != "connected":
+                raise ConnectionError(f"middleware refused connection: {msg}")
+            if self._wait_result(ws, "auth.login_with_api_key", [self._api_key]) is not True:
+                raise PermissionError("API key rejected")
+            with self._lock:
+                self.connected = True
+                self._unsupported.clear()
+                self.last_error = None
+            for name in COLLECTIONS:
+                ws.send_json({"msg": "sub", "id": f"sub-{name}", "name": name})
+            self._resync(ws)
+            self._request_temps(ws)
+            logger.info("[truenas_ws] endpoint %d: connected to %s", self.ep_id, self.url)
+
+            now = time.monotonic()
+            next_temps, next_resync = now + _TEMP_INTERVAL, now + _RESYNC_INTERVAL
+            next_ping, last_msg = now + _PING_INTERVAL, now
+            while not self._stop.is_set():
+                msg = ws.recv_json(1.0)
+                now = time.monotonic()
+                if msg is not None:
+                    last_msg = now
+                    self._handle(msg)
+                elif now - last_msg > _STALE_AFTER:
+                    raise ConnectionError(f"no messages for {_STALE_AFTER}s")
+                if now >= next_temps:
+                    next_temps = now + _TEMP_INTERVAL
+                    self._request_temps(ws)
+                if now >= next_resync:
+                    next_resync = now + _RESYNC_INTERVAL
+                    self._resync(ws)
+                if now >= next_ping:
+                    next_ping = now + _PING_INTERVAL
+                    ws.send_json({"msg": "ping", "id": f"ping-{next(self._ids)}"})
+        finally:
+            ws.close()
+
+    # ── Messages ─────────────────────────────────────────────────────────────
+
+    def _handle(self, msg: Dict):
+        kind = msg.get("msg")
+        if kind == "result":
+            handler = self._pending.pop(str(msg.get("id")), None)
+            if "error" in msg:
+                logger.warning("[truenas_ws] endpoint %d: call failed: %s",
+                               self.ep_id, msg["error"])
+            elif handler:
+                handler(msg.get("result"))
+        elif kind in ("added", "changed", "removed"):
+            self._apply(kind, msg.get("collection"), msg.get("id"),
+                        msg.get("fields") or {}, msg.get("cleared") or [])
+        elif kind == "nosub":
+            name = str(msg.get("id", "")).replace("sub-", "", 1)
+            logger.info("[truenas_ws] endpoint %d: no subscription for %s, using REST",
+                        self.ep_id, name)
+            with self._lock:
+                self._unsupported.add(name)
+
+    def _replace(self, name: str, pk: str, rows):
+        if not isinstance(rows, list):
+            return
+        with self._lock:
+            self._items[name] = {r.get(pk): r for r in rows if isinstance(r, dict)}
+            self._synced.add(name)
+        self._changed(name)
+
+    def _apply(self, kind: str, name: str, item_id, fields: Dict, cleared: List):
+        if name not in self._items:
+            return
+        with self._lock:
+            items = self._items[name]
+            if kind == "removed":
+                items.pop(item_id, None)
+            else:
+                item = items.setdefault(item_id, {COLLECTIONS[name]: item_id})
+                item.update(fields)
+                for key in cleared:
+                    item.pop(key, None)
+            self.events += 1
+            self.last_event = time.time()
+        self._changed(name)
+
+    def _changed(self, name: str):
+        if self._on_change:
+            try:
+                self._on_change(self.ep_id, name)
+            except Exception as exc:
+                logger.debug("[truenas_ws] on_change failed: %s", exc)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Registry
+# ══════════════════════════════════════════════════════════════════════════════
+
+_live: Dict[int, TrueNASLive] = {}
+_lock = threading.Lock()
+
+
+def start(ep_id: int, host: str, port: int, api_key: str, verify_ssl: bool = False,
+          on_change: Callable[[int, str], None] = None) -> TrueNASLive:
+    """Start (or restart with new settings) the live model for an endpoint."""
+    url = f"wss://{host}:{port}/websocket"
+    with _lock:
+        live = _live.get(ep_id)
+        if live and (live.url, live.verify_ssl, live._api_key) == (url, verify_ssl, api_key):
+            live.start()
+            return live
+        if live:
+            live.stop()
+        live = _live[ep_id] = TrueNASLive(ep_id, url, api_key, verify_ssl, on_change)
+    live.start()
+    return live
+
+
+def stop(ep_id: int):
+    with _lock:
+        live = _live.pop(ep_id, None)
+    if live:
+        live.stop()
+
+
+def get(ep_id: int) -> Optional[TrueNASLive]:
+    return _live.get(ep_id)
+
+
+def stop_all():
+    with _lock:
+        lives = list(_live.values())
+        _live.clear()
+    for live in lives:
+        live.stop()
+
+
+def retain(ep_ids):
+    """Stop every live model whose endpoint is not in ep_ids."""
+    with _lock:
+        gone = [_live.pop(ep_id) for ep_id in list(_live) if ep_id not in ep_ids]
+    for live in gone:
+        live.stop()
+
+
+def status() -> Dict[int, Dict]:
+    with _lock:
+        return {ep_id: live.status() for ep_id, live in _live.items()}
+
+
+def _after_fork():
+    global _lock
+    _lock = threading.Lock()
+    _live.clear()
+
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -10,6 +10,8 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 from flask import session, redirect, url_for, flash, request
 
+import db_pool
+
 # Database file for user management
 # Stored in DATA_DIR (persistent across git-pull updates)
 def _get_data_dir():
@@ -22,9 +24,7 @@ USER_DB_FILE = _get_data_dir() / 'users.db'
 
 def get_user_db():
     """Get database connection for user management."""
-    conn = sqlite3.connect(USER_DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db_pool.connect(USER_DB_FILE)
 
 def init_user_db():
     """Initialize the user management database with required tables."""
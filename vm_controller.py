@@ -13,16 +13,18 @@ Credentials are stored encrypted with Fernet (symmetric key in SECRET_KEY env va
 
 import os
 import json
-import sqlite3
 import logging
 import threading
-import urllib.request
-import urllib.error
-import ssl
 from datetime import datetime
 from pathlib import Path
 from typing import Optional, Dict, List, Any
 
+import auth_cache
+import db_pool
+import http_pool
+import metrics
+from inventory_cache import InventoryCache
+
 logger = logging.getLogger("fleetpilot.vm_controller")
 
 DB_FILE = Path(__file__).parent / "vm_controller.db"
@@ -48,9 +50,7 @@ except Exception:
 # ── Database ──────────────────────────────────────────────────────────────────
 
 def get_db():
-    conn = sqlite3.connect(str(DB_FILE))
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db_pool.connect(DB_FILE)
 
 
 def init_db():
@@ -114,6 +114,7 @@ def list_endpoints() -> List[Dict]:
         d = dict(r)
         d.pop("password", None)   # never expose encrypted password
         result.append(d)
+    VM_COUNT.retain("endpoint_id", [d["id"] for d in result])
     return result
 
 
@@ -133,6 +134,8 @@ def get_endpoint(ep_id: int) -> Optional[Dict]:
 def delete_endpoint(ep_id: int):
     with get_db() as db:
         db.execute("DELETE FROM vm_endpoints WHERE id=?", (ep_id,))
+    inventory.forget(ep_id)
+    VM_COUNT.remove(endpoint_id=ep_id)
 
 
 def log_event(endpoint_id: int, vm_id: str, vm_name: str,
@@ -166,7 +169,7 @@ _RETRYABLE_ERRORS = (TimeoutError, ConnectionResetError, ConnectionRefusedError)
 def _http(method: str, url: str, headers: Dict = None,
           body: Any = None, verify_ssl: bool = False,
           timeout: int = 10, retries: int = 3, backoff: float = 1.0) -> Dict:
-    """Minimal HTTP client using stdlib only.
+    """Minimal HTTP client using stdlib only, over pooled keep-alive connections.
 
     Automatically retries on transient network errors (timeout, connection
     reset, connection refused) with exponential back-off.  HTTP-level errors
@@ -178,11 +181,6 @@ def _http(method: str, url: str, headers: Dict = None,
         backoff:  Base delay in seconds between retries; doubles each attempt
                   (1 s → 2 s → 4 s by default).
     """
-    ctx = ssl.create_default_context()
-    if not verify_ssl:
-        ctx.check_hostname = False
-        ctx.verify_mode = ssl.CERT_NONE
-
     data = None
     if body is not None:
         if isinstance(body, dict):
@@ -192,24 +190,20 @@ def _http(method: str, url: str, headers: Dict = None,
         else:
             data = body if isinstance(body, bytes) else str(body).encode()
 
-    req = urllib.request.Request(url, data=data, method=method)
-    for k, v in (headers or {}).items():
-        req.add_header(k, v)
-
     last_error: str = ""
     attempt = 0
     while attempt <= retries:
         try:
-            with urllib.request.urlopen(req, context=ctx, timeout=timeout) as resp:
-                raw = resp.read().decode("utf-8", errors="replace")
-                try:
-                    return {"ok": True, "status": resp.status, "data": json.loads(raw)}
-                except json.JSONDecodeError:
-                    return {"ok": True, "status": resp.status, "data": raw}
-        except urllib.error.HTTPError as e:
-            # HTTP errors are definitive — do not retry
-            raw = e.read().decode("utf-8", errors="replace")
-            return {"ok": False, "status": e.code, "error": raw}
+            status, payload = http_pool.request(method, url, headers=headers, body=data,
+                                                 verify_ssl=verify_ssl, timeout=timeout)
+            raw = payload.decode("utf-8", errors="replace")
+            if not 200 <= status < 300:
+                # HTTP errors are definitive — do not retry
+                return {"ok": False, "status": status, "error": raw}
+            try:
+                return {"ok": True, "status": status, "data": json.loads(raw)}
+            except json.JSONDecodeError:
+                return {"ok": True, "status": status, "data": raw}
         except Exception as exc:
             last_error = str(exc)
             # Only retry on transient network/timeout errors
@@ -239,8 +233,18 @@ def _http(method: str, url: str, headers: Dict = None,
 # Proxmox VE Client
 # ══════════════════════════════════════════════════════════════════════════════
 
+# PVE tickets are valid for 2 h; auth_cache renews them in the last quarter.
+_PVE_TICKET_TTL = 7200
+_VEEAM_TOKEN_TTL = 900     # used when the token response has no expires_in
+
+# /cluster/resources snapshots per endpoint and user: auth key -> (fetched_at, items)
+_INVENTORY_TTL = 10
+_inventory: Dict[str, tuple] = {}
+_inventory_lock = threading.Lock()
+
+
 class ProxmoxClient:
-    """Proxmox VE REST API v2 client."""
+    """Proxmox VE REST API v2 client.  Tickets are shared via auth_cache."""
 
     def __init__(self, host: str, port: int, username: str, password: str,
                  verify_ssl: bool = False):
@@ -248,42 +252,102 @@ class ProxmoxClient:
         self.verify_ssl = verify_ssl
         self._ticket = None
         self._csrf = None
+        self._creds = (username, password)
+        self._auth_key = auth_cache.make_key("pve", host, port, username, password)
         self._login(username, password)
 
-    def _login(self, username: str, password: str):
-        resp = _http("POST", f"{self.base}/access/ticket",
-                     body=f"username={urllib.parse.quote(username)}&password={urllib.parse.quote(password)}",
-                     headers={"Content-Type": "application/x-www-form-urlencoded"},
-                     verify_ssl=self.verify_ssl)
-        if resp["ok"] and isinstance(resp["data"], dict):
-            d = resp["data"].get("data", {})
-            self._ticket = d.get("ticket")
-            self._csrf = d.get("CSRFPreventionToken")
-        else:
+    def _login(self, username: str, password: str, fresh: bool = False):
+        def _do_login():
+            resp = _http("POST", f"{self.base}/access/ticket",
+                         body=f"username={urllib.parse.quote(username)}&password={urllib.parse.quote(password)}",
+                         headers={"Content-Type": "application/x-www-form-urlencoded"},
+                         verify_ssl=self.verify_ssl)
+            if resp["ok"] and isinstance(resp["data"], dict):
+                return resp["data"].get("data", {})
             raise ConnectionError(f"Proxmox login failed: {resp.get('error', resp)}")
 
+        if fresh:
+            auth_cache.invalidate(self._auth_key)
+        d = auth_cache.get(self._auth_key, _do_login, ttl=_PVE_TICKET_TTL)
+        self._ticket = d.get("ticket")
+        self._csrf = d.get("CSRFPreventionToken")
+
     def _headers(self, write: bool = False) -> Dict:
         h = {"Cookie": f"PVEAuthCookie={self._ticket}"}
         if write:
             h["CSRFPreventionToken"] = self._csrf
         return h
 
+    def _request(self, method: str, path: str, body: Any = None, write: bool = False) -> Dict:
+        r = _http(method, f"{self.base}{path}", headers=self._headers(write=write),
+                  body=body, verify_ssl=self.verify_ssl)
+        if r.get("status") == 401:
+            # Cached ticket was revoked (e.g. PVE restarted) — log in once more
+            self._login(*self._creds, fresh=True)
+            r = _http(method, f"{self.base}{path}", headers=self._headers(write=write),
+                      body=body, verify_ssl=self.verify_ssl)
+        return r
+
     def _get(self, path: str) -> Dict:
-        return _http("GET", f"{self.base}{path}", headers=self._headers(),
-                     verify_ssl=self.verify_ssl)
+        return self._request("GET", path)
 
     def _post(self, path: str, body: Any = None) -> Dict:
-        return _http("POST", f"{self.base}{path}", headers=self._headers(write=True),
-                     body=body, verify_ssl=self.verify_ssl)
+        return self._request("POST", path, body=body, write=True)
+
+    # ── Inventory ─────────────────────────────────────────────────────────────
+    # Nodes, guests and storage for the whole cluster come from one
+    # /cluster/resources call, shared by all clients of the endpoint for
+    # _INVENTORY_TTL seconds.  Per-node endpoints are for detail views only.
+
+    def get_cluster_resources(self, fresh: bool = False) -> List[Dict]:
+        now = _time_mod.monotonic()
+        if not fresh:
+            cached = _inventory.get(self._auth_key)
+            if cached and now - cached[0] < _INVENTORY_TTL:
+                return cached[1]
+        r = self._get("/cluster/resources")
+        if not r["ok"] or not isinstance(r.get("data"), dict):
+            return []
+        items = r["data"].get("data", [])
+        with _inventory_lock:
+            _inventory[self._auth_key] = (now, items)
+        return items
+
+    def invalidate_inventory(self):
+        """Forget the cached inventory, e.g. after a power action."""
+        with _inventory_lock:
+            _inventory.pop(self._auth_key, None)
+
+    def get_inventory(self, fresh: bool = False) -> Dict[str, List[Dict]]:
+        """{"nodes", "vms", "storage"} for the whole cluster."""
+        inv = {"nodes": [], "vms": [], "storage": []}
+        for item in self.get_cluster_resources(fresh=fresh):
+            rtype = item.get("type")
+            if rtype == "node":
+                inv["nodes"].append(dict(item))
+            elif rtype in ("qemu", "lxc"):
+                inv["vms"].append(dict(item, platform="proxmox"))
+            elif rtype == "storage":
+                inv["storage"].append(dict(item))
+        return inv
 
     def get_nodes(self) -> List[Dict]:
-        r = self._get("/nodes")
+        nodes = self.get_inventory()["nodes"]
+        if nodes:
+            return nodes
+        r = self._get("/nodes")          # /cluster/resources unavailable
         if r["ok"]:
             return r["data"].get("data", [])
         return []
 
     def get_vms(self) -> List[Dict]:
         """Return all VMs and LXC containers across all nodes."""
+        inv = self.get_inventory()
+        if inv["nodes"]:
+            return inv["vms"]
+        return self._get_vms_per_node()
+
+    def _get_vms_per_node(self) -> List[Dict]:
         vms = []
         for node in self.get_nodes():
             n = node["node"]
@@ -297,6 +361,10 @@ class ProxmoxClient:
                         vms.append(vm)
         return vms
 
+    def get_cluster_storage(self) -> List[Dict]:
+        """Storage of every node with usage, from the cached inventory."""
+        return self.get_inventory()["storage"]
+
     def get_vm_status(self, node: str, vmid: int, rtype: str = "qemu") -> Dict:
         r = self._get(f"/nodes/{node}/{rtype}/{vmid}/status/current")
         return r["data"].get("data", {}) if r["ok"] else {}
@@ -304,7 +372,9 @@ class ProxmoxClient:
     def vm_action(self, node: str, vmid: int, action: str,
                   rtype: str = "qemu") -> Dict:
         """action: start | stop | shutdown | reboot | suspend | resume"""
-        return self._post(f"/nodes/{node}/{rtype}/{vmid}/status/{action}")
+        r = self._post(f"/nodes/{node}/{rtype}/{vmid}/status/{action}")
+        self.invalidate_inventory()
+        return r
 
     def get_snapshots(self, node: str, vmid: int, rtype: str = "qemu") -> List[Dict]:
         r = self._get(f"/nodes/{node}/{rtype}/{vmid}/snapshot")
@@ -330,9 +400,6 @@ class ProxmoxClient:
         r = self._get(f"/nodes/{node}/disks/smart?disk={urllib.parse.quote(disk)}")
         return r["data"].get("data", {}) if r["ok"] else {}
 
-    def get_cluster_resources(self) -> List[Dict]:
-        r = self._get("/cluster/resources")
-        return r["data"].get("data", []) if r["ok"] else []
 
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -340,43 +407,56 @@ class ProxmoxClient:
 # ══════════════════════════════════════════════════════════════════════════════
 
 class VeeamClient:
-    """Veeam Backup & Replication REST API v1.2 client."""
+    """Veeam Backup & Replication REST API v1.2 client.  Tokens are shared via auth_cache."""
 
     def __init__(self, host: str, port: int, username: str, password: str,
                  verify_ssl: bool = False):
         self.base = f"https://{host}:{port}/api/v1"
         self.verify_ssl = verify_ssl
         self._token = None
+        self._creds = (username, password)
+        self._auth_key = auth_cache.make_key("veeam", host, port, username, password)
         self._login(username, password)
 
-    def _login(self, username: str, password: str):
-        import base64
-        creds = base64.b64encode(f"{username}:{password}".encode()).decode()
-        resp = _http("POST", f"{self.base}/token",
-                     headers={"Authorization": f"Basic {creds}",
-                               "Content-Type": "application/x-www-form-urlencoded",
-                               "x-api-version": "1.2-rev0"},
-                     body="grant_type=password",
-                     verify_ssl=self.verify_ssl)
-        if resp["ok"] and isinstance(resp["data"], dict):
-            self._token = resp["data"].get("access_token")
-        else:
+    def _login(self, username: str, password: str, fresh: bool = False):
+        def _do_login():
+            import base64
+            creds = base64.b64encode(f"{username}:{password}".encode()).decode()
+            resp = _http("POST", f"{self.base}/token",
+                         headers={"Authorization": f"Basic {creds}",
+                                   "Content-Type": "application/x-www-form-urlencoded",
+                                   "x-api-version": "1.2-rev0"},
+                         body="grant_type=password",
+                         verify_ssl=self.verify_ssl)
+            if resp["ok"] and isinstance(resp["data"], dict):
+                data = resp["data"]
+                return data.get("access_token"), data.get("expires_in") or _VEEAM_TOKEN_TTL
             raise ConnectionError(f"Veeam login failed: {resp.get('error', resp)}")
 
+        if fresh:
+            auth_cache.invalidate(self._auth_key)
+        self._token = auth_cache.get(self._auth_key, _do_login, ttl=_VEEAM_TOKEN_TTL)
+
     def _headers(self) -> Dict:
         return {"Authorization": f"Bearer {self._token}",
                 "x-api-version": "1.2-rev0",
                 "Accept": "application/json"}
 
+    def _request(self, method: str, url: str, body: Any = None) -> Dict:
+        r = _http(method, url, headers=self._headers(), body=body, verify_ssl=self.verify_ssl)
+        if r.get("status") == 401:
+            self._login(*self._creds, fresh=True)
+            r = _http(method, url, headers=self._headers(), body=body, verify_ssl=self.verify_ssl)
+        return r
+
     def _get(self, path: str, params: str = "") -> Dict:
         url = f"{self.base}{path}"
         if params:
             url += "?" + params
-        return _http("GET", url, headers=self._headers(), verify_ssl=self.verify_ssl)
+        return self._request("GET", url)
 
     def _post(self, path: str, body: Any = None) -> Dict:
-        return _http("POST", f"{self.base}{path}", headers=self._headers(),
-                     body=body, verify_ssl=self.verify_ssl)
+        return self._request("POST", f"{self.base}{path}", body=body)
 
     def get_jobs(self) -> List[Dict]:
         r = self._get("/jobs")
@@ -421,8 +501,11 @@ import urllib.parse
 
 # ── High-level API used by Flask routes ──────────────────────────────────────
 
-def connect(ep_id: int):
-    """Return a connected client for the given endpoint, or raise."""
+def connect(ep_id: int, fresh: bool = False):
+    """
+    Return a connected client for the given endpoint, or raise.
+    The login ticket/token is reused from auth_cache unless fresh=True.
+    """
     ep = get_endpoint(ep_id)
     if not ep:
         raise ValueError(f"Endpoint {ep_id} not found")
@@ -432,6 +515,9 @@ def connect(ep_id: int):
     user = ep["username"]
     pwd  = ep["password_plain"]
     ssl_ = bool(ep.get("verify_ssl", 0))
+    if fresh:
+        kind = "pve" if platform == "proxmox" else platform
+        auth_cache.invalidate(auth_cache.make_key(kind, host, port, user, pwd))
     if platform == "proxmox":
         return ProxmoxClient(host, port, user, pwd, ssl_)
     elif platform == "veeam":
@@ -443,8 +529,9 @@ def connect(ep_id: int):
 def test_connection(ep_id: int) -> Dict:
     """Try to connect and return a status dict."""
     try:
-        client = connect(ep_id)
+        client = connect(ep_id, fresh=True)
         if isinstance(client, ProxmoxClient):
+            client.invalidate_inventory()
             nodes = client.get_nodes()
             return {"ok": True, "message": f"Connected — {len(nodes)} node(s) found"}
         elif isinstance(client, VeeamClient):
@@ -484,6 +571,7 @@ def vm_power_action(ep_id: int, node: str, vmid: int, action: str,
     status = "ok" if result.get("ok") else "error"
     log_event(ep_id, str(vmid), f"{node}/{vmid}", action.upper(), status,
               result.get("error", ""))
+    inventory.refresh(ep_id)
     return result
 
 
@@ -501,3 +589,30 @@ def get_proxmox_disk_smart(ep_id: int, node: str, disk: str) -> Dict:
     if isinstance(client, ProxmoxClient):
         return client.get_disk_smart(node, disk)
     return {}
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# Page snapshots
+# ══════════════════════════════════════════════════════════════════════════════
+# The /vm pages render from these caches instead of calling the endpoint
+# inside the request; see inventory_cache.
+
+VM_COUNT = metrics.gauge("fleetpilot_vms", "VMs and containers by power state",
+                         ("endpoint_id", "status"))
+
+
+def _load_inventory(ep_id: int) -> Dict:
+    client = connect(ep_id)
+    if isinstance(client, ProxmoxClient):
+        vms = client.get_vms()
+        counts: Dict[str, int] = {}
+        for vm in vms:
+            status = vm.get("status") or "unknown"
+            counts[status] = counts.get(status, 0) + 1
+        VM_COUNT.replace([({"status": s}, n) for s, n in counts.items()], endpoint_id=ep_id)
+        return {"nodes": client.get_nodes(), "vms": vms, "jobs": []}
+    return {"nodes": [], "vms": [], "jobs": get_all_jobs(ep_id)}
+
+
+inventory = InventoryCache("vm_inventory", _load_inventory)
+node_disks = InventoryCache("vm_node_disks", lambda key: get_proxmox_disks(*key))